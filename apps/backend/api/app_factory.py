@@ -7,33 +7,53 @@ Minimal medical AI backend: MedGemma inference + Ollama proxy + health check.
 import logging
 import os
 import signal
+import time
 import uuid as uuid_lib
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator
 from contextlib import asynccontextmanager
 from datetime import UTC, datetime
-from typing import Any, Dict
+from typing import Any
 
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 logger = logging.getLogger(__name__)
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-    """Application lifespan context manager."""
-    logger.info("Starting MedStation API...")
+def _install_shutdown_handlers() -> None:
+    """
+    Log SIGTERM/SIGINT, then hand them to the server's own handlers.
+
+    uvicorn's handlers stop the serve loop and let the lifespan shutdown
+    below run, so bulk jobs stop cleanly and clients are closed. Without
+    a server handler to defer to (SIG_DFL/SIG_IGN), exit immediately.
+    """
+    previous = {}
 
     def handle_shutdown(signum, frame):
         sig_name = signal.Signals(signum).name
         logger.warning(f"Received {sig_name} - shutting down")
-        os._exit(0)
+        handler = previous[signum]
+        if callable(handler):
+            handler(signum, frame)
+        else:
+            os._exit(0)
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous[sig] = signal.signal(sig, handle_shutdown)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    """Application lifespan context manager."""
+    logger.info("Starting MedStation API...")
 
-    signal.signal(signal.SIGTERM, handle_shutdown)
-    signal.signal(signal.SIGINT, handle_shutdown)
+    _install_shutdown_handlers()
 
     # Register routers
     from api.router_registry import register_routers
+
     services_loaded, services_failed = register_routers(app)
 
     if services_loaded:
@@ -41,9 +61,60 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     if services_failed:
         logger.warning(f"Failed: {', '.join(services_failed)}")
 
+    # Pooled keep-alive client for the Ollama proxy; preload configured models
+    from api.services.ollama import close_client, get_residency, open_client
+
+    await open_client()
+    get_residency().start_preload()
+
+    # Start loading MedGemma now so the first request doesn't pay for it;
+    # the model manager unloads variants left idle past their TTL
+    from api.services.medgemma import get_medgemma
+    from api.services.model_manager import get_model_manager
+
+    app.state.medgemma_load = get_medgemma().start_background_load()
+    get_model_manager().start()
+
     logger.info("MedStation API ready")
     yield
     logger.info("Shutting down MedStation API")
+    from api.services.bulk_triage import get_bulk_jobs
+
+    await get_bulk_jobs().stop()
+    await get_residency().stop()
+    await close_client()
+    from api.services.backend_router import close_router
+
+    await close_router()
+    await get_model_manager().stop()
+
+
+def _route_template(scope: dict[str, Any]) -> str:
+    """Path template of the matched route (e.g. ``/api/v1/chat/ollama/status``)."""
+    # Routes of included routers keep their own path; newer FastAPI versions
+    # record the prefixed one in the effective route context
+    effective = scope.get("fastapi", {}).get("effective_route_context")
+    if effective is not None and getattr(effective, "path", None):
+        return effective.path
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+async def _finish_trace(body: AsyncIterator[bytes], trace, streaming: bool) -> AsyncIterator[bytes]:
+    """Relay the response body, then close the trace and hand it to the span sink."""
+    from api.services.tracing import get_sink
+
+    headers_sent = time.perf_counter()
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        if streaming:
+            trace.add("stream", headers_sent, time.perf_counter())
+        trace.finish()
+        sink = get_sink()
+        if sink is not None:
+            await sink.write_async(trace)
 
 
 def create_app() -> FastAPI:
@@ -71,21 +142,51 @@ def create_app() -> FastAPI:
         allow_headers=["Content-Type", "X-Request-ID"],
     )
 
-    # Request ID middleware
+    # Request ID and span tracing (api/services/tracing.py)
     @app.middleware("http")
     async def add_request_id(request: Request, call_next) -> Response:
-        request_id = request.headers.get("X-Request-ID", str(uuid_lib.uuid4()))
+        from api.services.tracing import REQUEST_ID_HEADER, start_trace
+
+        request_id = request.headers.get(REQUEST_ID_HEADER) or str(uuid_lib.uuid4())
+        trace = start_trace(request_id, request.method, request.url.path)
+        response = await call_next(request)
+        trace.route = _route_template(request.scope)
+        trace.status = response.status_code
+        response.headers[REQUEST_ID_HEADER] = request_id
+        response.headers["Server-Timing"] = trace.server_timing()
+        streaming = response.headers.get("content-type", "").startswith("application/x-ndjson")
+        response.body_iterator = _finish_trace(response.body_iterator, trace, streaming)
+        return response
+
+    # Request latency by route template (not raw path, to bound label cardinality)
+    @app.middleware("http")
+    async def record_latency(request: Request, call_next) -> Response:
+        from api.services.metrics import HTTP_REQUEST_SECONDS
+
+        started = time.perf_counter()
         response = await call_next(request)
-        response.headers["X-Request-ID"] = request_id
+        HTTP_REQUEST_SECONDS.labels(
+            method=request.method,
+            route=_route_template(request.scope),
+            status=str(response.status_code),
+        ).observe(time.perf_counter() - started)
         return response
 
     # Health endpoint
     @app.get("/health")
     @app.get("/api/health")
-    async def health_check() -> Dict[str, Any]:
+    async def health_check() -> dict[str, Any]:
         """Health check endpoint"""
         return {"status": "ok", "timestamp": datetime.now(UTC).isoformat()}
 
+    # Prometheus scrape endpoint
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics() -> PlainTextResponse:
+        """Inference, proxy and HTTP metrics in the Prometheus text format"""
+        from api.services.metrics import CONTENT_TYPE, render
+
+        return PlainTextResponse(render(), media_type=CONTENT_TYPE)
+
     return app
 
 
@@ -14,13 +14,18 @@ sys.path.insert(0, str(Path(__file__).parent.parent))  # apps/backend
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s %(levelname)-8s %(name)s: %(message)s",
+    format="%(asctime)s %(levelname)-8s %(name)s [%(request_id)s]: %(message)s",
 )
 
+from api.services.tracing import install_log_filter  # noqa: E402
+
+install_log_filter()
+
 from api.app_factory import app  # noqa: E402
 
 __all__ = ["app"]
 
 if __name__ == "__main__":
     import uvicorn
+
     uvicorn.run(app, host="127.0.0.1", port=8000)
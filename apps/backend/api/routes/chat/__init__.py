@@ -1,14 +1,15 @@
 """
 Chat routes package for MedStation.
 
-Only includes MedGemma inference and Ollama proxy (fallback).
+Only includes MedGemma inference, Ollama proxy (fallback) and routed
+generation across both.
 """
 
 __all__ = ["router", "public_router"]
 
 from fastapi import APIRouter
 
-from . import ollama_proxy, medgemma
+from . import dispatch, medgemma, ollama_proxy
 
 # Authenticated router (unused for now, kept for structure)
 router = APIRouter(
@@ -17,13 +18,13 @@ router = APIRouter(
 )
 
 # Public router (native app calls directly)
-public_router = APIRouter(
-    prefix="/api/v1/chat",
-    tags=["chat-public"]
-)
+public_router = APIRouter(prefix="/api/v1/chat", tags=["chat-public"])
 
 # Ollama proxy is public (native app calls directly)
 public_router.include_router(ollama_proxy.router)
 
 # MedGemma routes (public — native app calls directly)
 public_router.include_router(medgemma.router)
+
+# Routed generation across MedGemma backends (public)
+public_router.include_router(dispatch.router)
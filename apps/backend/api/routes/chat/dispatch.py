@@ -0,0 +1,149 @@
+"""
+Routed generation: /generate picks a MedGemma backend for the client.
+
+The backend router (api/services/backend_router.py) chooses between the
+in-process model and configured Ollama hosts by live load and measured
+latency, and fails over if a backend errors or stalls. Requests it sends
+to the in-process model are admitted like /medgemma ones.
+"""
+
+import json
+import logging
+import time
+from contextlib import aclosing
+from typing import Literal
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+from api.routes.chat.medgemma import _CLIENT_CLOSED_REQUEST, _busy, _cancel_on_disconnect
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+class RoutedGenerateRequest(BaseModel):
+    prompt: str = Field(..., min_length=1, max_length=10000)
+    system: str | None = "You are an expert medical AI assistant."
+    max_tokens: int | None = Field(1024, ge=1, le=4096)
+    temperature: float | None = Field(0.3, ge=0.0, le=2.0)
+    stream: bool | None = False
+    # Admission priority class if served locally; None screens the prompt for emergency keywords
+    priority: Literal["emergency", "urgent", "normal", "low"] | None = None
+
+
+@router.post("/generate")
+async def routed_generate(req: RoutedGenerateRequest, request: Request):
+    """Generate on the least-loaded healthy MedGemma backend (text only)."""
+    from api.services.admission import AdmissionRejected
+    from api.services.backend_router import NoBackendAvailable, get_router
+
+    backend_router = get_router()
+    admit = _local_admission(request, req)
+
+    if req.stream:
+        lines = _stream_routed(backend_router, req, admit)
+        # Hold the response until the first line, so a full local queue is still a 429
+        try:
+            first = await _cancel_on_disconnect(request, lines.__anext__())
+        except AdmissionRejected as e:
+            return _busy(e)
+        if first is None:
+            await lines.aclose()
+            return JSONResponse({"error": "Client closed request"}, status_code=_CLIENT_CLOSED_REQUEST)
+        # The background close releases a local ticket if the body never starts
+        return StreamingResponse(
+            _prepend(first, lines), media_type="application/x-ndjson", background=BackgroundTask(lines.aclose)
+        )
+
+    async def _collect():
+        chunks, served_by = [], None
+        async with aclosing(_routed_chunks(backend_router, req, admit)) as stream:
+            async for backend, chunk in stream:
+                served_by = backend
+                chunks.append(chunk)
+        return served_by, "".join(chunks)
+
+    try:
+        result = await _cancel_on_disconnect(request, _collect())
+    except AdmissionRejected as e:
+        return _busy(e)
+    except NoBackendAvailable as e:
+        return JSONResponse({"error": "No backend available", "detail": str(e)}, status_code=503)
+    except Exception as e:
+        logger.error(f"Routed generate failed: {e}", exc_info=True)
+        return JSONResponse({"error": "Generation failed", "detail": str(e)}, status_code=502)
+
+    if result is None:
+        return JSONResponse({"error": "Client closed request"}, status_code=_CLIENT_CLOSED_REQUEST)
+    backend, text = result
+    return {"response": text, "model": backend.model if backend else None, "backend": backend.name if backend else None}
+
+
+@router.get("/backends")
+async def routed_backends():
+    """Load, latency and health of each routing candidate."""
+    from api.services.backend_router import get_router
+
+    return get_router().stats()
+
+
+def _local_admission(request: Request, req: RoutedGenerateRequest):
+    """Acquires the admission ticket the router takes if it picks the in-process model."""
+    from api.services.admission import client_id, get_admission, request_priority
+    from api.services.tracing import add_span
+
+    client = client_id(request)
+    priority = request_priority(req.priority, req.prompt)
+
+    async def admit():
+        started = time.perf_counter()
+        ticket = await get_admission().acquire(client, priority)
+        add_span("admission", started)
+        return ticket
+
+    return admit
+
+
+def _routed_chunks(backend_router, req: RoutedGenerateRequest, admit):
+    return backend_router.stream(
+        prompt=req.prompt,
+        system_prompt=req.system,
+        max_new_tokens=req.max_tokens,
+        temperature=req.temperature,
+        admit=admit,
+    )
+
+
+async def _prepend(first: str, lines):
+    yield first
+    async with aclosing(lines):
+        async for line in lines:
+            yield line
+
+
+async def _stream_routed(backend_router, req: RoutedGenerateRequest, admit):
+    """
+    Stream tokens as NDJSON; the final line names the backend that served them.
+
+    ``AdmissionRejected`` is raised rather than streamed. It can only
+    happen before the first token.
+    """
+    from api.services.admission import AdmissionRejected
+
+    served_by = None
+    try:
+        async with aclosing(_routed_chunks(backend_router, req, admit)) as stream:
+            async for backend, chunk in stream:
+                served_by = backend
+                yield json.dumps({"token": chunk}) + "\n"
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error(f"Routed stream failed: {e}", exc_info=True)
+        yield json.dumps({"error": str(e)}) + "\n"
+        return
+    yield json.dumps({"done": True, "backend": served_by.name if served_by else None}) + "\n"
@@ -1,37 +1,106 @@
 """
 MedGemma inference routes.
 
-Provides /medgemma/generate and /medgemma/status endpoints for the
-native app to call MedGemma directly via HuggingFace Transformers.
+Provides /medgemma/generate, /medgemma/generate/upload, /medgemma/workflow,
+/medgemma/jobs, /medgemma/status and /medgemma/models endpoints for the
+native app to call MedGemma directly via HuggingFace Transformers. Requests may name a model
+variant in ``model`` (see model_manager.py); the default is the 4B model.
+Generation requests pass admission control first (see admission.py) and
+get 429 with Retry-After when MedGemma is saturated.
 """
 
+import asyncio
 import json
 import logging
-import base64
-from io import BytesIO
-from typing import Optional
+import time
+from contextlib import aclosing
+from typing import Literal
 
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse, JSONResponse
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from starlette.background import BackgroundTask
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/medgemma")
 
+# How often a non-streaming generate checks whether its client is still connected
+_DISCONNECT_POLL_S = 0.1
+
+# Status for responses abandoned by the client (nginx convention; never delivered)
+_CLIENT_CLOSED_REQUEST = 499
+
+# Allowance for multipart framing and the JSON request part on top of the image limit
+_UPLOAD_OVERHEAD = 256 * 1024
+
 
 class GenerateRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=10000)
-    system: Optional[str] = "You are an expert medical AI assistant."
-    image_base64: Optional[str] = None
-    max_tokens: Optional[int] = Field(1024, ge=1, le=4096)
-    temperature: Optional[float] = Field(0.3, ge=0.0, le=2.0)
-    stream: Optional[bool] = False
+    system: str | None = "You are an expert medical AI assistant."
+    image_base64: str | None = None
+    max_tokens: int | None = Field(1024, ge=1, le=4096)
+    temperature: float | None = Field(0.3, ge=0.0, le=2.0)
+    stream: bool | None = False
+    model: str | None = Field(None, max_length=200)
+    # Speculative decoding mode; None uses the server default (MEDSTATION_SPECULATIVE)
+    speculative: Literal["off", "prompt_lookup", "draft"] | None = None
+    # Admission priority class; None screens the prompt for emergency keywords
+    priority: Literal["emergency", "urgent", "normal", "low"] | None = None
+
+
+class WorkflowRequest(BaseModel):
+    """Patient intake for the 5-step triage workflow.
+
+    Send either a pre-formatted ``context`` (as built by the native app) or
+    the intake fields, which are formatted server-side like spaces/app.py.
+    """
+
+    context: str | None = Field(None, min_length=1, max_length=20000)
+    chief_complaint: str | None = Field(None, min_length=1, max_length=2000)
+    symptoms: str | None = Field(None, max_length=2000)
+    age: str | None = Field(None, max_length=10)
+    sex: str | None = Field(None, max_length=20)
+    hr: str | None = Field(None, max_length=10)
+    bp: str | None = Field(None, max_length=20)
+    temp: str | None = Field(None, max_length=10)
+    rr: str | None = Field(None, max_length=10)
+    spo2: str | None = Field(None, max_length=10)
+    history: str | None = Field(None, max_length=2000)
+    medications: str | None = Field(None, max_length=2000)
+    allergies: str | None = Field(None, max_length=2000)
+    system: str | None = "You are an expert medical AI assistant."
+    max_tokens: int | None = Field(512, ge=1, le=4096)
+    temperature: float | None = Field(0.3, ge=0.0, le=2.0)
+    stream_tokens: bool | None = True
+    model: str | None = Field(None, max_length=200)
+    priority: Literal["emergency", "urgent", "normal", "low"] | None = None
+
+    @model_validator(mode="after")
+    def _require_context_or_complaint(self):
+        if not self.context and not self.chief_complaint:
+            raise ValueError("Provide either context or chief_complaint")
+        return self
+
+
+class BulkJobRequest(BaseModel):
+    """A bulk triage job over an intake file in MEDSTATION_JOBS_DIR (see bulk_triage.py)."""
+
+    input_path: str = Field(..., min_length=1, max_length=4096)
+    output_path: str | None = Field(None, min_length=1, max_length=4096)
+    model: str | None = Field(None, max_length=200)
+    system: str | None = "You are an expert medical AI assistant."
+    max_tokens: int | None = Field(512, ge=1, le=4096)
+    # Greedy by default, so re-runs are reproducible and hit the response cache
+    temperature: float | None = Field(0.0, ge=0.0, le=2.0)
+    concurrency: int | None = Field(None, ge=1, le=256)
 
 
 @router.get("/status")
 async def medgemma_status():
     """Check if MedGemma model is loaded and ready."""
+    from api.services.admission import get_admission
     from api.services.medgemma import get_medgemma
 
     svc = get_medgemma()
@@ -39,15 +108,25 @@ async def medgemma_status():
         "loaded": svc.loaded,
         "device": svc.device if svc.loaded else None,
         "model": "google/medgemma-1.5-4b-it",
+        **svc.runtime_stats(),
+        "admission": get_admission().stats(),
     }
 
 
-@router.post("/load")
-async def medgemma_load():
-    """Explicitly load the MedGemma model into memory."""
-    from api.services.medgemma import get_medgemma
+@router.get("/models")
+async def medgemma_models():
+    """Configured model variants, their load state and the memory budget."""
+    from api.services.model_manager import get_model_manager
 
-    svc = get_medgemma()
+    return get_model_manager().stats()
+
+
+@router.post("/load")
+async def medgemma_load(model: str | None = None):
+    """Explicitly load a MedGemma model (the default variant if none is named)."""
+    svc = _service(model)
+    if isinstance(svc, JSONResponse):
+        return svc
     ok = await svc.load()
     if ok:
         return {"status": "loaded", "device": svc.device}
@@ -57,66 +136,399 @@ async def medgemma_load():
     )
 
 
+@router.post("/unload")
+async def medgemma_unload(model: str | None = None):
+    """Unload a MedGemma model to free its memory (refused while it is busy)."""
+    svc = _service(model)
+    if isinstance(svc, JSONResponse):
+        return svc
+    if not svc.loaded:
+        return {"status": "unloaded"}
+    if await svc.unload():
+        return {"status": "unloaded"}
+    return JSONResponse({"status": "busy", "message": "Model is serving requests"}, status_code=409)
+
+
+@router.post("/jobs", status_code=202)
+async def medgemma_create_job(req: BulkJobRequest):
+    """
+    Start a bulk triage job; re-running the same input and output resumes from its checkpoint.
+
+    Both paths are resolved in the jobs directory, and anything outside it is rejected.
+    """
+    from api.services.bulk_triage import BulkJobConflict, BulkTriageJob, get_bulk_jobs, resolve_job_path
+
+    try:
+        input_path = resolve_job_path(req.input_path)
+        output_path = resolve_job_path(req.output_path) if req.output_path else None
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not input_path.is_file():
+        return JSONResponse({"error": f"Intake file not found: {req.input_path}"}, status_code=400)
+    svc = _service(req.model)
+    if isinstance(svc, JSONResponse):
+        return svc
+
+    try:
+        job = BulkTriageJob(
+            input_path,
+            output_path,
+            model=req.model,
+            system_prompt=req.system,
+            max_new_tokens=req.max_tokens,
+            temperature=req.temperature,
+            concurrency=req.concurrency or 0,
+        )
+        get_bulk_jobs().start(job)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except BulkJobConflict as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return job.stats()
+
+
+@router.get("/jobs")
+async def medgemma_jobs():
+    """Bulk triage jobs started since the server came up, with their progress."""
+    from api.services.bulk_triage import get_bulk_jobs
+
+    return {"jobs": [job.stats() for job in get_bulk_jobs().list()]}
+
+
+@router.get("/jobs/{job_id}")
+async def medgemma_job(job_id: str):
+    """Progress of one bulk triage job."""
+    from api.services.bulk_triage import get_bulk_jobs
+
+    job = get_bulk_jobs().get(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job '{job_id}'"}, status_code=404)
+    return job.stats()
+
+
+@router.delete("/jobs/{job_id}")
+async def medgemma_cancel_job(job_id: str):
+    """Stop a bulk triage job; finished cases stay in its checkpoint."""
+    from api.services.bulk_triage import get_bulk_jobs
+
+    jobs = get_bulk_jobs()
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": f"Unknown job '{job_id}'"}, status_code=404)
+    await jobs.cancel(job_id)
+    return job.stats()
+
+
 @router.post("/generate")
-async def medgemma_generate(req: GenerateRequest):
+async def medgemma_generate(req: GenerateRequest, request: Request):
     """Generate a response from MedGemma."""
-    from api.services.medgemma import get_medgemma
+    from api.services.imaging import MAX_IMAGE_BYTES, ImageTooLarge, decode_base64_image, run_in_decode_pool
+    from api.services.metrics import IMAGE_DECODE_SECONDS
+    from api.services.tracing import add_span, mark
 
-    svc = get_medgemma()
+    mark("validate")
+    svc = _service(req.model)
+    if isinstance(svc, JSONResponse):
+        return svc
 
     # Early check: return 503 if model can't load
-    if not svc.loaded:
-        ok = await svc.load()
-        if not ok:
-            return JSONResponse(
-                {"error": "MedGemma model not loaded", "detail": "Model failed to load. Check server logs."},
-                status_code=503,
-            )
+    unavailable = await _ensure_loaded(svc)
+    if unavailable is not None:
+        return unavailable
 
     # Decode image if provided
     image = None
     if req.image_base64:
+        if len(req.image_base64) > (MAX_IMAGE_BYTES + 2) // 3 * 4:
+            return JSONResponse({"error": f"Image exceeds {MAX_IMAGE_BYTES} bytes"}, status_code=413)
+        started = time.perf_counter()
         try:
-            from PIL import Image
+            image = await run_in_decode_pool(decode_base64_image, req.image_base64, target_size=svc.image_input_size())
+        except ImageTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
+        except Exception as e:
+            return JSONResponse({"error": f"Invalid image: {e}"}, status_code=400)
+        IMAGE_DECODE_SECONDS.labels(source="base64").observe(time.perf_counter() - started)
+        add_span("image_decode", started)
+
+    return await _generate(svc, req, image, request)
 
-            img_bytes = base64.b64decode(req.image_base64)
-            image = Image.open(BytesIO(img_bytes)).convert("RGB")
+
+@router.post("/generate/upload")
+async def medgemma_generate_upload(request: Request):
+    """Generate from a multipart upload: a ``request`` JSON part and a binary ``image`` part.
+
+    Same parameters and response as /generate, without base64-encoding the
+    image. The body is streamed into a bounded buffer, so oversized uploads
+    are rejected with 413 as soon as they cross the limit.
+    """
+    from api.services.imaging import MAX_IMAGE_BYTES, ImageTooLarge, decode_image, run_in_decode_pool
+    from api.services.metrics import IMAGE_DECODE_SECONDS
+    from api.services.tracing import add_span, mark
+    from api.services.uploads import InvalidUpload, UploadTooLarge, read_multipart
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES + _UPLOAD_OVERHEAD:
+        return JSONResponse({"error": f"Upload exceeds {MAX_IMAGE_BYTES} bytes"}, status_code=413)
+
+    try:
+        fields, upload = await read_multipart(
+            request.headers.get("content-type", ""),
+            request.stream(),
+            file_field="image",
+            max_file_bytes=MAX_IMAGE_BYTES,
+        )
+    except UploadTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except InvalidUpload as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        req = GenerateRequest.model_validate_json(fields.get("request", ""))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False, include_context=False))
+    if req.image_base64:
+        return JSONResponse({"error": "Send the image as the 'image' part, not image_base64"}, status_code=400)
+    mark("validate")
+
+    svc = _service(req.model)
+    if isinstance(svc, JSONResponse):
+        return svc
+    unavailable = await _ensure_loaded(svc)
+    if unavailable is not None:
+        return unavailable
+
+    image = None
+    if upload is not None and upload.getbuffer().nbytes:
+        started = time.perf_counter()
+        try:
+            image = await run_in_decode_pool(decode_image, upload, target_size=svc.image_input_size())
+        except ImageTooLarge as e:
+            return JSONResponse({"error": str(e)}, status_code=413)
         except Exception as e:
-            return JSONResponse(
-                {"error": f"Invalid image: {e}"}, status_code=400
-            )
+            return JSONResponse({"error": f"Invalid image: {e}"}, status_code=400)
+        finally:
+            upload.close()
+        IMAGE_DECODE_SECONDS.labels(source="upload").observe(time.perf_counter() - started)
+        add_span("image_decode", started)
+
+    return await _generate(svc, req, image, request)
+
+
+def _service(model: str | None):
+    """The service for a requested model variant, or a 404 response if it isn't configured."""
+    from api.services.medgemma import get_medgemma
+    from api.services.model_manager import UnknownModelError
+
+    try:
+        return get_medgemma(model)
+    except UnknownModelError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+
+
+async def _ensure_loaded(svc) -> JSONResponse | None:
+    """Load the model on demand; returns a 503 response if it can't be loaded."""
+    if svc.loaded:
+        return None
+    ok = await svc.load()
+    if ok:
+        return None
+    return JSONResponse(
+        {"error": "MedGemma model not loaded", "detail": "Model failed to load. Check server logs."},
+        status_code=503,
+    )
+
+
+async def _generate(svc, req: GenerateRequest, image, request: Request):
+    """Run a generate request, streaming NDJSON if requested.
+
+    Streams stop when the client disconnects (Starlette cancels the body
+    iterator); non-streaming generation is raced against a disconnect poll.
+    """
+    from api.services.admission import request_priority
+
+    ticket, busy = await _admit(request, request_priority(req.priority, req.prompt))
+    if busy is not None:
+        return busy
 
     if req.stream:
-        return StreamingResponse(
-            _stream_response(svc, req, image),
-            media_type="application/x-ndjson",
-        )
+        return _held_stream(_stream_response(svc, req, image), ticket)
 
+    metadata = {}
     try:
-        response = await svc.generate(
-            prompt=req.prompt,
-            system_prompt=req.system,
-            image=image,
-            max_new_tokens=req.max_tokens,
-            temperature=req.temperature,
+        response = await _cancel_on_disconnect(
+            request,
+            svc.generate(
+                prompt=req.prompt,
+                system_prompt=req.system,
+                image=image,
+                max_new_tokens=req.max_tokens,
+                temperature=req.temperature,
+                speculative=req.speculative,
+                metadata=metadata,
+            ),
         )
-        return {"response": response, "model": "medgemma-1.5-4b-it"}
+        if response is None:
+            logger.info("Client disconnected; MedGemma generation cancelled")
+            return JSONResponse({"error": "Client closed request"}, status_code=_CLIENT_CLOSED_REQUEST)
+        return {"response": response, "model": req.model or "medgemma-1.5-4b-it", **metadata}
     except Exception as e:
         logger.error(f"MedGemma generate failed: {e}", exc_info=True)
         return JSONResponse(
             {"error": "Generation failed", "detail": str(e)},
             status_code=500,
         )
+    finally:
+        ticket.release()
+
+
+async def _admit(request: Request, priority: str):
+    """
+    Wait for an inference slot.
+
+    Returns:
+        (ticket, None) once admitted, or (None, 429 response) if rejected
+    """
+    from api.services.admission import AdmissionRejected, client_id, get_admission
+    from api.services.tracing import add_span
+
+    started = time.perf_counter()
+    try:
+        ticket = await get_admission().acquire(client_id(request), priority)
+    except AdmissionRejected as e:
+        return None, _busy(e)
+    add_span("admission", started)
+    return ticket, None
+
+
+def _busy(rejected) -> JSONResponse:
+    """429 for an ``AdmissionRejected``, with its Retry-After estimate."""
+    return JSONResponse(
+        {"error": "MedGemma is busy", "detail": str(rejected), "retry_after": rejected.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(rejected.retry_after)},
+    )
+
+
+def _held_stream(body, ticket) -> StreamingResponse:
+    """NDJSON response that holds the admission ticket until the stream ends."""
+
+    async def _body():
+        try:
+            async with aclosing(body):
+                async for line in body:
+                    yield line
+        finally:
+            ticket.release()
+
+    # The background release covers a body that never started (client gone before the first chunk)
+    return StreamingResponse(_body(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release))
+
+
+async def _cancel_on_disconnect(request: Request, coro):
+    """
+    Await ``coro`` unless the client disconnects first.
+
+    Returns:
+        The coroutine's result, or None if the client went away (the
+        coroutine is cancelled, which cancels its generation)
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
 
 
 async def _stream_response(svc, req: GenerateRequest, image):
-    """Stream tokens as newline-delimited JSON."""
-    async for token in svc.stream_generate(
-        prompt=req.prompt,
-        system_prompt=req.system,
-        image=image,
-        max_new_tokens=req.max_tokens,
-        temperature=req.temperature,
-    ):
-        yield json.dumps({"token": token}) + "\n"
-    yield json.dumps({"done": True}) + "\n"
+    """Stream tokens as newline-delimited JSON; the final line carries generation metadata and timings."""
+    from api.services.tracing import trailer
+
+    metadata = {}
+    # aclosing: if the client disconnects, close the token stream right away
+    # so the scheduler drops the sequence instead of waiting for GC
+    async with aclosing(
+        svc.stream_generate(
+            prompt=req.prompt,
+            system_prompt=req.system,
+            image=image,
+            max_new_tokens=req.max_tokens,
+            temperature=req.temperature,
+            speculative=req.speculative,
+            metadata=metadata,
+        )
+    ) as tokens:
+        async for token in tokens:
+            yield json.dumps({"token": token}) + "\n"
+    yield json.dumps({"done": True, **metadata, **trailer()}) + "\n"
+
+
+@router.post("/workflow")
+async def medgemma_workflow(req: WorkflowRequest, request: Request):
+    """Run the full triage workflow, streaming NDJSON step and token events."""
+    from api.services.admission import request_priority
+    from api.services.tracing import mark
+    from api.services.triage_workflow import format_context
+
+    mark("validate")
+
+    svc = _service(req.model)
+    if isinstance(svc, JSONResponse):
+        return svc
+
+    unavailable = await _ensure_loaded(svc)
+    if unavailable is not None:
+        return unavailable
+
+    context = req.context or format_context(
+        req.chief_complaint,
+        req.symptoms,
+        req.age,
+        req.sex,
+        req.hr,
+        req.bp,
+        req.temp,
+        req.rr,
+        req.spo2,
+        req.history,
+        req.medications,
+        req.allergies,
+    )
+
+    ticket, busy = await _admit(request, request_priority(req.priority, context))
+    if busy is not None:
+        return busy
+    return _held_stream(_stream_workflow(svc, req, context), ticket)
+
+
+async def _stream_workflow(svc, req: WorkflowRequest, context: str):
+    """Serialize workflow events as newline-delimited JSON; the result event carries timings."""
+    from api.services.tracing import trailer
+    from api.services.triage_workflow import run_workflow
+
+    try:
+        # aclosing: a disconnect cancels the in-flight steps immediately
+        async with aclosing(
+            run_workflow(
+                svc,
+                context,
+                system_prompt=req.system,
+                max_new_tokens=req.max_tokens,
+                temperature=req.temperature,
+                stream_tokens=req.stream_tokens,
+                safety_inputs={"medications": req.medications, "hr": req.hr, "spo2": req.spo2, "temp": req.temp},
+            )
+        ) as events:
+            async for event in events:
+                if event["event"] == "result":
+                    event = {**event, **trailer()}
+                yield json.dumps(event) + "\n"
+    except Exception as e:
+        logger.error(f"MedGemma workflow failed: {e}", exc_info=True)
+        yield json.dumps({"event": "error", "detail": str(e)}) + "\n"
@@ -1,68 +1,152 @@
 """
 Ollama proxy routes for MedStation native app.
 
-Forwards /ollama/generate and /ollama/models to the local Ollama server.
+Forwards /ollama/generate and /ollama/models to the Ollama server at
+OLLAMA_HOST over the shared pooled client in api/services/ollama.py.
 """
 
+import json
 import logging
+import time
+from collections.abc import AsyncIterator
 
 import httpx
 from fastapi import APIRouter, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from api.services.metrics import OLLAMA_REQUEST_SECONDS, OLLAMA_STREAM_SECONDS
+from api.services.ollama import GENERATE_TIMEOUT, get_client, get_residency
+from api.services.tracing import add_span, outgoing_headers
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/ollama")
 
-OLLAMA_BASE = "http://localhost:11434"
+
+def _observe_upstream(endpoint: str, started: float, status_code: int | None) -> None:
+    """Record one upstream call's latency to response headers (metrics and trace span)."""
+    add_span("upstream", started)
+    outcome = "unreachable" if status_code is None else "ok" if status_code < 400 else "error"
+    OLLAMA_REQUEST_SECONDS.labels(endpoint=endpoint, outcome=outcome).observe(time.perf_counter() - started)
+
+
+async def _timed_stream(chunks: AsyncIterator[bytes], started: float) -> AsyncIterator[bytes]:
+    """Relay upstream bytes, recording the total duration once the last one is sent."""
+    async for chunk in chunks:
+        yield chunk
+    OLLAMA_STREAM_SECONDS.observe(time.perf_counter() - started)
 
 
 @router.get("/models")
 async def list_models():
-    """Proxy Ollama /api/tags to list available models."""
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            resp = await client.get(f"{OLLAMA_BASE}/api/tags")
-            data = resp.json()
-            # Return the models array directly (native app expects [OllamaModelInfo])
-            return data.get("models", [])
-        except Exception as e:
-            logger.warning(f"Ollama unreachable: {e}")
-            return JSONResponse([], status_code=200)
+    """Proxy Ollama /api/tags to list available models (cached briefly)."""
+    try:
+        # Return the models array directly (native app expects [OllamaModelInfo])
+        return await get_residency().tags()
+    except Exception as e:
+        logger.warning(f"Ollama unreachable: {e}")
+        return JSONResponse([], status_code=200)
 
 
 @router.post("/generate")
 async def generate(request: Request):
-    """Proxy Ollama /api/generate for medical inference."""
-    body = await request.json()
+    """Proxy Ollama /api/generate for medical inference.
+
+    The request body is forwarded as received (plus ``stream``/``keep_alive``
+    defaults) and upstream responses are passed through without re-parsing;
+    streams are relayed as raw bytes. Responses for a model that was not
+    resident carry ``X-Ollama-Cold-Start: true``.
+    """
+    raw = await request.body()
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        return JSONResponse({"error": "Request body must be JSON"}, status_code=400)
+    if not isinstance(body, dict):
+        return JSONResponse({"error": "Request body must be a JSON object"}, status_code=400)
+
     stream = body.get("stream", False)
+    model = body.get("model")
+    defaults = {}
+    if "stream" not in body:
+        # Ollama streams by default; this proxy historically does not
+        defaults["stream"] = False
+
+    headers = {}
+    if isinstance(model, str) and model:
+        residency = get_residency()
+        if await residency.is_resident(model) is False:
+            residency.cold_starts += 1
+            headers["X-Ollama-Cold-Start"] = "true"
+            logger.info(f"Ollama model {model} is not resident; request will pay its load")
+        residency.record_use(model)
+        if "keep_alive" not in body:
+            defaults["keep_alive"] = residency.keep_alive_for(model)
+    if defaults:
+        raw = json.dumps({**body, **defaults}).encode()
+
+    client = get_client()
+    upstream_request = client.build_request(
+        "POST",
+        "/api/generate",
+        content=raw,
+        headers={"Content-Type": "application/json", **outgoing_headers()},
+        timeout=GENERATE_TIMEOUT,
+    )
+    started = time.perf_counter()
+    try:
+        upstream = await client.send(upstream_request, stream=stream)
+    except httpx.HTTPError as e:
+        _observe_upstream("generate", started, None)
+        logger.warning(f"Ollama generate failed: {e}")
+        return JSONResponse({"error": "Ollama unreachable", "detail": str(e)}, status_code=502)
+    _observe_upstream("generate", started, upstream.status_code)
 
     if stream:
+        # Raw bytes are relayed still encoded, so their encoding goes with them
+        if "content-encoding" in upstream.headers:
+            headers["Content-Encoding"] = upstream.headers["content-encoding"]
         return StreamingResponse(
-            _stream_generate(body),
+            _timed_stream(upstream.aiter_raw(), started),
+            status_code=upstream.status_code,
+            headers=headers,
             media_type="application/x-ndjson",
+            background=BackgroundTask(upstream.aclose),
         )
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        resp = await client.post(f"{OLLAMA_BASE}/api/generate", json=body)
-        return resp.json()
+    # ``content`` is already decoded by httpx, so no Content-Encoding here
+    return Response(
+        content=upstream.content,
+        status_code=upstream.status_code,
+        headers=headers,
+        media_type=upstream.headers.get("content-type", "application/json"),
+    )
 
 
-async def _stream_generate(body: dict):
-    """Stream tokens from Ollama generate endpoint."""
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        async with client.stream("POST", f"{OLLAMA_BASE}/api/generate", json=body) as resp:
-            async for line in resp.aiter_lines():
-                if line:
-                    yield line + "\n"
+@router.get("/status")
+async def ollama_status():
+    """Resident models, usage and keep_alive choices of the residency manager."""
+    residency = get_residency()
+    try:
+        await residency.resident(max_age=0)
+        reachable = True
+    except httpx.HTTPError:
+        reachable = False
+    return {"reachable": reachable, **residency.stats()}
 
 
 @router.get("/version")
 async def ollama_version():
     """Proxy Ollama version check."""
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            resp = await client.get(f"{OLLAMA_BASE}/api/version")
-            return resp.json()
-        except Exception as e:
-            return JSONResponse({"error": str(e)}, status_code=503)
+    started = time.perf_counter()
+    try:
+        resp = await get_client().get("/api/version", timeout=5.0, headers=outgoing_headers())
+    except Exception as e:
+        _observe_upstream("version", started, None)
+        return JSONResponse({"error": str(e)}, status_code=503)
+    _observe_upstream("version", started, resp.status_code)
+    try:
+        return resp.json()
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
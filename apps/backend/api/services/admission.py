@@ -0,0 +1,299 @@
+"""
+Admission control for MedGemma inference.
+
+Every /medgemma generate and workflow request must hold an admission
+ticket while it runs, as must /generate requests routed to the
+in-process model. At most MEDSTATION_ADMISSION_MAX_ACTIVE requests
+hold one at a time. The rest wait in a bounded queue, ordered by
+priority class:
+
+    emergency > urgent > normal > low
+
+A request may set its class. Otherwise it is "emergency" when its text
+contains one of the workflow's EMERGENCY_KEYWORDS, and "normal" if not.
+"low" requests (bulk triage jobs) never take the last
+MEDSTATION_ADMISSION_RESERVED slots, so a long batch can't occupy every
+slot while interactive requests wait.
+Within a class, the next free slot goes to the client with the fewest
+requests running. One busy client can use idle capacity, but it cannot
+keep others waiting behind its backlog. A client may only have
+MEDSTATION_ADMISSION_MAX_QUEUED_PER_CLIENT requests waiting, whatever
+their class. A client at that limit can only queue a more urgent request
+by giving up its own newest lower-priority waiter.
+
+Requests that can't be queued get ``AdmissionRejected``, which routes
+turn into 429 with a Retry-After estimate. That happens when the queue
+or the client's share is full, or when the wait exceeds
+MEDSTATION_ADMISSION_QUEUE_TIMEOUT_S. An urgent request arriving at a
+full queue takes the place of the newest lowest-priority waiter, which
+is rejected instead.
+"""
+
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+from typing import Optional
+
+from api.services.metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+from api.services.triage_workflow import EMERGENCY_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("emergency", "urgent", "normal", "low")
+_RANK = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+# Requests generating at once (0 disables admission control)
+_MAX_ACTIVE = int(os.environ.get("MEDSTATION_ADMISSION_MAX_ACTIVE", "16"))
+
+# Slots "low" requests can't take, kept free for interactive ones
+_RESERVED = int(os.environ.get("MEDSTATION_ADMISSION_RESERVED", "4"))
+
+# Requests waiting for a slot, and per client
+_MAX_QUEUE = int(os.environ.get("MEDSTATION_ADMISSION_MAX_QUEUE", "64"))
+_MAX_QUEUED_PER_CLIENT = int(os.environ.get("MEDSTATION_ADMISSION_MAX_QUEUED_PER_CLIENT", "16"))
+
+# Longest wait for a slot before a queued request is rejected (0 = no limit)
+_QUEUE_TIMEOUT_S = float(os.environ.get("MEDSTATION_ADMISSION_QUEUE_TIMEOUT_S", "30"))
+
+# Header that identifies a client for fair sharing (falls back to the peer address)
+CLIENT_HEADER = "x-client-id"
+
+# Assumed request duration until one has completed, for Retry-After
+_DEFAULT_HOLD_S = 5.0
+
+
+class AdmissionRejected(Exception):
+    """
+    A request was not admitted.
+
+    Attributes:
+        reason: "queue_full", "client_queue_full", "queue_timeout" or "preempted"
+        retry_after: Suggested seconds before retrying
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"MedGemma is at capacity ({reason.replace('_', ' ')}); retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def request_priority(requested: str | None, *texts: str | None) -> str:
+    """The priority class to admit a request under: as requested, else screened from its text."""
+    if requested:
+        return requested
+    text = " ".join(t for t in texts if t).lower()
+    if any(keyword in text for keyword in EMERGENCY_KEYWORDS):
+        return "emergency"
+    return "normal"
+
+
+def client_id(request) -> str:
+    """Identify the client for fair sharing: X-Client-ID, else the peer address."""
+    header = (request.headers.get(CLIENT_HEADER) or "").strip()
+    if header:
+        return header[:128]
+    return request.client.host if request.client else "unknown"
+
+
+class Ticket:
+    """An admitted request's slot. ``release`` is idempotent."""
+
+    def __init__(self, controller: Optional["AdmissionController"], client: str, priority: str):
+        self._controller = controller
+        self.client = client
+        self.priority = priority
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        if self._controller is not None:
+            self._controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, client: str, priority: str, order: int, future: asyncio.Future):
+        self.client = client
+        self.priority = priority
+        self.rank = _RANK[priority]
+        self.order = order
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class AdmissionController:
+    """
+    Bounded, priority-ordered admission with per-client fair sharing.
+
+    Runs on the event loop; not thread-safe.
+
+    Args:
+        max_active: Requests admitted at once (0 = admit everything)
+        max_queue: Requests waiting for a slot
+        max_queued_per_client: Waiting requests per client, of any priority
+        queue_timeout: Seconds a request may wait before it is rejected (0 = no limit)
+        reserved: Slots "low" requests can't take (at most ``max_active - 1``)
+    """
+
+    def __init__(
+        self,
+        max_active: int = _MAX_ACTIVE,
+        max_queue: int = _MAX_QUEUE,
+        max_queued_per_client: int = _MAX_QUEUED_PER_CLIENT,
+        queue_timeout: float = _QUEUE_TIMEOUT_S,
+        reserved: int = _RESERVED,
+    ):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_queued_per_client = max_queued_per_client
+        self.queue_timeout = queue_timeout
+        self.reserved = max(0, min(reserved, max_active - 1))
+        self._active = 0
+        self._active_by_client: dict[str, int] = {}
+        self._waiters: list[_Waiter] = []
+        self._order = itertools.count()
+        self._hold_s: float | None = None
+        self._admitted = 0
+        self._rejected: dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_active > 0
+
+    async def acquire(self, client: str, priority: str = "normal") -> Ticket:
+        """
+        Wait for a slot.
+
+        Raises:
+            AdmissionRejected: The queue is full or the wait timed out
+            ValueError: Unknown priority class
+        """
+        if priority not in _RANK:
+            raise ValueError(f"Unknown priority '{priority}'; expected {', '.join(PRIORITIES)}")
+        if not self.enabled:
+            return Ticket(None, client, priority)
+        rank = _RANK[priority]
+        if self._has_slot(priority) and not any(w.rank <= rank for w in self._waiters):
+            ADMISSION_WAIT_SECONDS.labels(priority=priority).observe(0.0)
+            return self._admit(client, priority)
+
+        self._make_room(client, priority)
+        waiter = _Waiter(client, priority, next(self._order), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout or None)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not waiter.future.done():
+            self._abandon(waiter)
+            raise self._reject("queue_timeout", priority)
+        return waiter.future.result()
+
+    def stats(self) -> dict[str, object]:
+        queued = dict.fromkeys(PRIORITIES, 0)
+        for waiter in self._waiters:
+            queued[waiter.priority] += 1
+        return {
+            "enabled": self.enabled,
+            "active": self._active,
+            "max_active": self.max_active,
+            "reserved": self.reserved,
+            "queued": len(self._waiters),
+            "queued_by_priority": queued,
+            "max_queue": self.max_queue,
+            "clients": len(self._active_by_client),
+            "admitted": self._admitted,
+            "rejected": dict(self._rejected),
+            "retry_after_s": self.retry_after(),
+        }
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, from the queue depth and recent request durations."""
+        hold = self._hold_s if self._hold_s is not None else _DEFAULT_HOLD_S
+        return max(1, min(300, math.ceil(hold * (len(self._waiters) + 1) / max(1, self.max_active))))
+
+    # -- Internals ------------------------------------------------------------
+
+    def _has_slot(self, priority: str) -> bool:
+        limit = self.max_active - self.reserved if priority == "low" else self.max_active
+        return self._active < limit
+
+    def _admit(self, client: str, priority: str) -> Ticket:
+        self._active += 1
+        self._active_by_client[client] = self._active_by_client.get(client, 0) + 1
+        self._admitted += 1
+        return Ticket(self, client, priority)
+
+    def _release(self, ticket: Ticket) -> None:
+        self._active -= 1
+        remaining = self._active_by_client.get(ticket.client, 1) - 1
+        if remaining > 0:
+            self._active_by_client[ticket.client] = remaining
+        else:
+            self._active_by_client.pop(ticket.client, None)
+        held = time.monotonic() - ticket.admitted_at
+        self._hold_s = held if self._hold_s is None else 0.8 * self._hold_s + 0.2 * held
+        self._grant()
+
+    def _grant(self) -> None:
+        """Hand free slots to waiters: highest priority, then the client with the fewest running."""
+        while True:
+            eligible = [w for w in self._waiters if self._has_slot(w.priority)]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (w.rank, self._active_by_client.get(w.client, 0), w.order))
+            self._waiters.remove(waiter)
+            ADMISSION_WAIT_SECONDS.labels(priority=waiter.priority).observe(time.perf_counter() - waiter.enqueued_at)
+            waiter.future.set_result(self._admit(waiter.client, waiter.priority))
+
+    def _make_room(self, client: str, priority: str) -> None:
+        """Check queue limits for a new waiter, preempting a lower-priority one if the queue is full."""
+        if self.max_queued_per_client > 0:
+            own = [w for w in self._waiters if w.client == client]
+            if len(own) >= self.max_queued_per_client:
+                # Priority reorders a client's own backlog; it never grows its share
+                self._displace(own, priority, "client_queue_full")
+                return
+        if len(self._waiters) < self.max_queue:
+            return
+        self._displace(self._waiters, priority, "queue_full")
+
+    def _displace(self, candidates: list[_Waiter], priority: str, reason: str) -> None:
+        """Reject the newest lowest-priority candidate below ``priority``, or raise ``reason``."""
+        victim = max(candidates, key=lambda w: (w.rank, w.order), default=None)
+        if victim is None or victim.rank <= _RANK[priority]:
+            raise self._reject(reason, priority)
+        self._waiters.remove(victim)
+        logger.info(f"Admission {reason}: {priority} request displaced a queued {victim.priority} request")
+        victim.future.set_exception(self._reject("preempted", victim.priority))
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """Clean up after a waiter that stopped waiting (timeout or cancellation)."""
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            waiter.future.cancel()
+        elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+            # Admitted just as the caller gave up
+            waiter.future.result().release()
+
+    def _reject(self, reason: str, priority: str) -> AdmissionRejected:
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        ADMISSION_REJECTIONS.labels(priority=priority, reason=reason).inc()
+        return AdmissionRejected(reason, self.retry_after())
+
+
+_controller: AdmissionController | None = None
+
+
+def get_admission() -> AdmissionController:
+    """The process-wide admission controller."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,430 @@
+"""
+Latency-aware routing of generate requests across MedGemma backends.
+
+Candidates are the in-process ``MedGemmaService`` and any number of Ollama
+hosts serving a MedGemma build. Each request goes to the backend with the
+lowest expected completion time, estimated from:
+
+  - live load (requests in flight, plus the local scheduler's queue)
+  - rolling (EWMA) time-to-first-token and decode tokens/second
+
+A backend that errors, or stalls before its first token or between
+tokens, is put on a cooldown that doubles with each consecutive failure.
+If no output has been sent yet, the request fails over to the next best
+backend. Adding Ollama boxes therefore scales throughput horizontally
+without the client choosing a backend.
+
+Requests routed to the in-process model take a MedGemma admission ticket
+(see admission.py) for as long as they stream, like the /medgemma routes.
+When the local model has no free slot, the request tries the other
+backends before it is rejected.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextlib import aclosing
+from typing import Any
+
+import httpx
+
+from api.services.admission import AdmissionRejected, Ticket
+from api.services.ollama import CONNECT_TIMEOUT_S
+from api.services.tracing import outgoing_headers
+
+logger = logging.getLogger(__name__)
+
+# Ollama hosts to route to: "http://box1:11434,http://box2:11434=medgemma:27b"
+# (an optional "=model" overrides the default model for that host)
+_OLLAMA_HOSTS = os.environ.get("MEDSTATION_ROUTER_OLLAMA_HOSTS", "")
+_OLLAMA_MODEL = os.environ.get("MEDSTATION_ROUTER_OLLAMA_MODEL", "medgemma")
+# Requests one Ollama host decodes concurrently (its OLLAMA_NUM_PARALLEL)
+_OLLAMA_PARALLEL = int(os.environ.get("MEDSTATION_ROUTER_OLLAMA_PARALLEL", "1"))
+_INCLUDE_LOCAL = os.environ.get("MEDSTATION_ROUTER_LOCAL", "1") != "0"
+
+# Stall detection and failure cooldown
+_FIRST_TOKEN_TIMEOUT_S = float(os.environ.get("MEDSTATION_ROUTER_FIRST_TOKEN_TIMEOUT_S", "60"))
+_STALL_TIMEOUT_S = float(os.environ.get("MEDSTATION_ROUTER_STALL_TIMEOUT_S", "15"))
+_COOLDOWN_S = 10.0
+_MAX_COOLDOWN_S = 300.0
+
+# Rolling-average weight of the newest measurement
+_EWMA_ALPHA = 0.3
+
+# Optimistic priors for backends that haven't been measured yet
+_PRIOR_TTFT_S = 0.5
+_PRIOR_TOKENS_PER_S = 20.0
+
+
+class NoBackendAvailable(Exception):
+    """Every backend is unhealthy, cooling down, or has already failed this request."""
+
+
+class BackendError(Exception):
+    """A backend returned an error instead of tokens."""
+
+
+class Backend:
+    """
+    One generation target with live load and latency statistics.
+
+    Subclasses implement ``_stream`` and may override ``available`` and
+    ``queue_depth``.
+
+    Args:
+        name: Identifier reported in responses and status
+        model: Model name reported in responses
+        capacity: Requests the backend decodes concurrently
+    """
+
+    kind = "backend"
+    # Requests must hold a MedGemma admission ticket while this backend serves them
+    needs_admission = False
+
+    def __init__(self, name: str, model: str, capacity: int = 1):
+        self.name = name
+        self.model = model
+        self.capacity = max(1, capacity)
+
+        self.inflight = 0
+        self.ttft_s: float | None = None
+        self.tokens_per_s: float | None = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def queue_depth(self) -> int:
+        """Requests waiting or running on this backend (including ours)."""
+        return self.inflight
+
+    def expected_latency(self, max_new_tokens: int) -> float:
+        """Estimated seconds to complete a request of ``max_new_tokens`` if sent now."""
+        ttft = self.ttft_s if self.ttft_s is not None else _PRIOR_TTFT_S
+        tps = self.tokens_per_s if self.tokens_per_s is not None else _PRIOR_TOKENS_PER_S
+        # Beyond `capacity` concurrent requests, each extra one waits its turn
+        contention = max(1.0, (self.queue_depth() + 1) / self.capacity)
+        return contention * (ttft + max_new_tokens / max(tps, 1e-3))
+
+    def record_success(self, ttft: float, tokens: int, decode_s: float) -> None:
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.ttft_s = _ewma(self.ttft_s, ttft)
+        if tokens > 1 and decode_s > 0:
+            self.tokens_per_s = _ewma(self.tokens_per_s, (tokens - 1) / decode_s)
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        cooldown = min(_COOLDOWN_S * 2 ** (self.consecutive_failures - 1), _MAX_COOLDOWN_S)
+        self.cooldown_until = time.monotonic() + cooldown
+
+    def stream(
+        self, prompt: str, system_prompt: str, max_new_tokens: int, temperature: float
+    ) -> AsyncGenerator[str, None]:
+        return self._stream(prompt, system_prompt, max_new_tokens, temperature)
+
+    async def _stream(self, prompt, system_prompt, max_new_tokens, temperature) -> AsyncGenerator[str, None]:
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "model": self.model,
+            "available": self.available(),
+            "queue_depth": self.queue_depth(),
+            "capacity": self.capacity,
+            "ttft_ms": round(self.ttft_s * 1000, 1) if self.ttft_s is not None else None,
+            "tokens_per_s": round(self.tokens_per_s, 1) if self.tokens_per_s is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+def _ewma(current: float | None, sample: float) -> float:
+    return sample if current is None else (1 - _EWMA_ALPHA) * current + _EWMA_ALPHA * sample
+
+
+class LocalMedGemmaBackend(Backend):
+    """The in-process MedGemma service (only routed to once its model is loaded)."""
+
+    kind = "local"
+    needs_admission = True
+
+    def __init__(self, svc):
+        super().__init__("local", svc.model_id, capacity=svc.max_batch_size)
+        self.svc = svc
+
+    def available(self) -> bool:
+        return bool(self.svc.loaded) and super().available()
+
+    def queue_depth(self) -> int:
+        scheduler_stats = (self.svc.runtime_stats() or {}).get("scheduler") or {}
+        # The scheduler already counts our in-flight requests once they are submitted
+        return max(self.inflight, scheduler_stats.get("active", 0) + scheduler_stats.get("queued", 0))
+
+    async def _stream(self, prompt, system_prompt, max_new_tokens, temperature):
+        # aclosing: a stalled or abandoned stream cancels its scheduler sequence now
+        async with aclosing(
+            self.svc.stream_generate(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+            )
+        ) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+
+class OllamaBackend(Backend):
+    """
+    An Ollama host serving a MedGemma build.
+
+    Args:
+        base_url: Ollama server URL
+        model: Ollama model tag to generate with
+        capacity: The host's OLLAMA_NUM_PARALLEL
+        transport: Optional transport override (tests)
+    """
+
+    kind = "ollama"
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        capacity: int = 1,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        super().__init__(base_url, model, capacity)
+        self.base_url = base_url
+        self._transport = transport
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(None, connect=CONNECT_TIMEOUT_S),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def _stream(self, prompt, system_prompt, max_new_tokens, temperature):
+        body = {
+            "model": self.model,
+            "prompt": prompt,
+            "system": system_prompt,
+            "stream": True,
+            "options": {"num_predict": max_new_tokens, "temperature": temperature},
+        }
+        async with self._get_client().stream("POST", "/api/generate", json=body, headers=outgoing_headers()) as resp:
+            if resp.status_code != 200:
+                detail = (await resp.aread()).decode("utf-8", errors="replace")[:200]
+                raise BackendError(f"HTTP {resp.status_code}: {detail}")
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise BackendError(data["error"])
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    return
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class BackendRouter:
+    """
+    Dispatches generate requests to the backend expected to finish first.
+
+    Args:
+        backends: Candidate backends
+        first_token_timeout: Seconds to wait for a backend's first chunk
+        stall_timeout: Seconds allowed between chunks once streaming
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        first_token_timeout: float = _FIRST_TOKEN_TIMEOUT_S,
+        stall_timeout: float = _STALL_TIMEOUT_S,
+    ):
+        self.backends = backends
+        self.first_token_timeout = first_token_timeout
+        self.stall_timeout = stall_timeout
+        self.failovers = 0
+
+    def pick(self, max_new_tokens: int, exclude: set[str] = frozenset()) -> Backend | None:
+        """The available backend with the lowest expected latency, or None."""
+        candidates = [b for b in self.backends if b.name not in exclude and b.available()]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: b.expected_latency(max_new_tokens))
+
+    async def stream(
+        self,
+        prompt: str,
+        system_prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        admit: Callable[[], Awaitable[Ticket]] | None = None,
+    ) -> AsyncGenerator[tuple[Backend, str], None]:
+        """
+        Generate on the best backend, failing over while nothing has been sent.
+
+        Args:
+            admit: Acquires the admission ticket held while a backend with
+                ``needs_admission`` serves the request (None skips admission)
+
+        Yields:
+            (backend, text chunk) pairs
+
+        Raises:
+            AdmissionRejected: The local model had no free slot and no other
+                backend could serve the request
+            NoBackendAvailable: No backend could serve the request
+            BackendError / TimeoutError: The chosen backend failed
+                after output had already been yielded
+        """
+        tried: set[str] = set()
+        last_error: BaseException | None = None
+        rejected: AdmissionRejected | None = None
+        while True:
+            backend = self.pick(max_new_tokens, exclude=tried)
+            if backend is None:
+                if rejected is not None:
+                    raise rejected
+                detail = f": {last_error}" if last_error else ""
+                raise NoBackendAvailable(f"No MedGemma backend available{detail}")
+            tried.add(backend.name)
+
+            ticket = None
+            if admit is not None and backend.needs_admission:
+                try:
+                    ticket = await admit()
+                except AdmissionRejected as e:
+                    rejected = e
+                    logger.info(f"Backend {backend.name} is at capacity; trying the others")
+                    continue
+
+            emitted = False
+            try:
+                async for chunk in self._run(backend, prompt, system_prompt, max_new_tokens, temperature):
+                    emitted = True
+                    yield backend, chunk
+                return
+            except Exception as e:
+                if emitted:
+                    raise
+                last_error = e
+                self.failovers += 1
+                logger.warning(f"Backend {backend.name} failed before output ({e!r}); failing over")
+            finally:
+                if ticket is not None:
+                    ticket.release()
+
+    async def _run(self, backend: Backend, prompt, system_prompt, max_new_tokens, temperature):
+        """Stream from one backend, enforcing stall timeouts and recording latency."""
+        backend.inflight += 1
+        started = time.perf_counter()
+        first_at: float | None = None
+        chunks = 0
+        agen = backend.stream(prompt, system_prompt, max_new_tokens, temperature)
+        try:
+            while True:
+                timeout = self.first_token_timeout if first_at is None else self.stall_timeout
+                try:
+                    chunk = await asyncio.wait_for(agen.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                if first_at is None:
+                    first_at = time.perf_counter()
+                chunks += 1
+                yield chunk
+        except TimeoutError:
+            backend.record_failure()
+            stage = "first token" if first_at is None else "next token"
+            raise TimeoutError(f"{backend.name} stalled waiting for {stage}")
+        except Exception:
+            backend.record_failure()
+            raise
+        else:
+            done = time.perf_counter()
+            backend.record_success(
+                ttft=(first_at or done) - started,
+                tokens=chunks,
+                decode_s=done - first_at if first_at is not None else 0.0,
+            )
+        finally:
+            backend.inflight -= 1
+            await agen.aclose()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backends": [b.stats() for b in self.backends],
+            "failovers": self.failovers,
+        }
+
+    async def close(self) -> None:
+        for backend in self.backends:
+            await backend.close()
+
+
+def parse_ollama_hosts(value: str, default_model: str) -> list[tuple[str, str]]:
+    """Parse "url[=model],url[=model]" into (url, model) pairs."""
+    hosts = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url, _, model = entry.partition("=")
+        url = url.strip().rstrip("/")
+        if "://" not in url:
+            url = f"http://{url}"
+        hosts.append((url, model.strip() or default_model))
+    return hosts
+
+
+_router: BackendRouter | None = None
+
+
+def get_router() -> BackendRouter:
+    """The process-wide router, built from MEDSTATION_ROUTER_* settings."""
+    global _router
+    if _router is None:
+        backends: list[Backend] = []
+        if _INCLUDE_LOCAL:
+            from api.services.medgemma import get_medgemma
+
+            backends.append(LocalMedGemmaBackend(get_medgemma()))
+        for url, model in parse_ollama_hosts(_OLLAMA_HOSTS, _OLLAMA_MODEL):
+            backends.append(OllamaBackend(url, model, capacity=_OLLAMA_PARALLEL))
+        _router = BackendRouter(backends)
+        logger.info(f"Backend router: {', '.join(b.name for b in backends) or 'no backends'}")
+    return _router
+
+
+async def close_router() -> None:
+    global _router
+    if _router is not None:
+        await _router.close()
+        _router = None
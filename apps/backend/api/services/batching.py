@@ -0,0 +1,457 @@
+"""
+Continuous batching scheduler for MedGemma inference.
+
+Generation requests are collected into a single decode loop running on a
+dedicated thread. Each new request is prefilled on its own and then joins
+the running batch; every decode step is one forward pass over all active
+sequences. Sequences leave the batch as soon as they finish and queued
+requests take their place between steps, so aggregate throughput scales
+with the number of concurrent users instead of staying flat.
+
+Streaming output is backpressured: each stream buffers a bounded number of
+undelivered chunks. A sequence whose consumer falls behind is parked — its
+KV state is detached from the batch and generation pauses — until the
+consumer drains half of its buffer, so a slow client throttles its own
+generation instead of growing an unbounded queue.
+
+Cancelled sequences (client disconnected) are dropped before the next
+decode step, releasing their batch slot and KV state.
+
+The scheduler itself is framework-agnostic: all tensor work lives behind
+the ``DecodeEngine`` protocol (see ``transformers_engine.py``).
+"""
+
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncGenerator, Callable
+from typing import Any, Protocol
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class GenerationCancelled(Exception):
+    """The request was cancelled before generation finished."""
+
+
+class DecodeEngine(Protocol):
+    """Model-side operations the scheduler drives from its worker thread."""
+
+    eos_token_ids: set[int]
+
+    def prefill(self, seq: "ScheduledSequence") -> int:
+        """Run the prompt forward pass for one sequence and return its first token."""
+        ...
+
+    def decode(self, seqs: list["ScheduledSequence"]) -> list[int]:
+        """Run one batched decode step and return the next token for each sequence."""
+        ...
+
+    def detach(self, seqs: list["ScheduledSequence"]) -> None:
+        """Remove sequences from the batch, keeping their KV state on the sequences."""
+        ...
+
+    def clear(self) -> None:
+        """Drop any batch state (called when the batch drains or fails)."""
+        ...
+
+    def detokenize(self, token_ids: list[int]) -> str:
+        """Decode token ids to text, skipping special tokens."""
+        ...
+
+
+class _IncrementalDetokenizer:
+    """
+    Turns a growing list of token ids into text deltas.
+
+    Decodes a small window of recent tokens rather than the whole sequence,
+    and holds back output while the window ends in an incomplete UTF-8
+    character, so streamed chunks concatenate to the final decoded text.
+    """
+
+    def __init__(self, detokenize: Callable[[list[int]], str]):
+        self._detokenize = detokenize
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def step(self, token_ids: list[int]) -> str:
+        prefix_text = self._detokenize(token_ids[self._prefix_offset : self._read_offset])
+        new_text = self._detokenize(token_ids[self._prefix_offset :])
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(token_ids)
+            return new_text[len(prefix_text) :]
+        return ""
+
+    def flush(self, token_ids: list[int]) -> str:
+        prefix_text = self._detokenize(token_ids[self._prefix_offset : self._read_offset])
+        new_text = self._detokenize(token_ids[self._prefix_offset :])
+        self._prefix_offset = self._read_offset = len(token_ids)
+        return new_text[len(prefix_text) :]
+
+
+class ScheduledSequence:
+    """
+    One generation request tracked by the scheduler.
+
+    Created on the event loop by ``BatchScheduler.submit``; mutated only by
+    the scheduler thread afterwards. Results are handed back to the loop
+    with ``call_soon_threadsafe``.
+    """
+
+    def __init__(
+        self,
+        inputs: Any,
+        max_new_tokens: int,
+        temperature: float,
+        stream: bool,
+        loop: asyncio.AbstractEventLoop,
+        max_buffered: int = 64,
+    ):
+        self.inputs = inputs
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.stream = stream
+        self.max_buffered = max(1, max_buffered)
+        self.token_ids: list[int] = []
+        self.finished = False
+        self.parked = False
+        self.cancelled = False
+        self.error: BaseException | None = None
+
+        # Engine-owned per-sequence state (KV cache, position, drafting, ...)
+        self.kv: Any = None
+        self.kv_mask: Any = None
+        self.position = 0
+        self.draft: Any = None
+        # Engine-reported counters (e.g. speculative acceptance)
+        self.stats: dict[str, Any] = {}
+
+        self.submitted_at = time.perf_counter()
+        self.prefill_started_at: float | None = None
+        self.first_token_at: float | None = None
+        self.finished_at: float | None = None
+
+        self._loop = loop
+        self._future: asyncio.Future = loop.create_future()
+        self._queue: asyncio.Queue | None = asyncio.Queue() if stream else None
+        self._detokenizer: _IncrementalDetokenizer | None = None
+
+        # Undelivered stream chunks; guarded by _buffer_lock since the
+        # scheduler thread adds and the event loop removes
+        self._buffered = 0
+        self._buffer_lock = threading.Lock()
+        self._wake_scheduler: Callable[[], None] | None = None
+
+    async def result(self) -> str:
+        """Wait for the full generated text."""
+        return await self._future
+
+    async def stream_text(self) -> AsyncGenerator[str, None]:
+        """Yield text chunks as tokens are generated."""
+        if self._queue is None:
+            raise RuntimeError("Sequence was not submitted with stream=True")
+        while True:
+            item = await self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            with self._buffer_lock:
+                self._buffered -= 1
+                wake = self.parked and self._buffered <= self.max_buffered // 2
+            if wake and self._wake_scheduler is not None:
+                self._wake_scheduler()
+            yield item
+
+    def cancel(self) -> None:
+        """Stop generating for this sequence; a no-op once it has finished."""
+        if self.finished or self.cancelled:
+            return
+        self.cancelled = True
+        if self._wake_scheduler is not None:
+            self._wake_scheduler()
+
+    def _drained(self) -> bool:
+        with self._buffer_lock:
+            return self._buffered <= self.max_buffered // 2
+
+    # -- Called from the scheduler thread ---------------------------------
+
+    def _call_in_loop(self, fn, *args) -> None:
+        # RuntimeError: the event loop is already closed, nobody is listening any more
+        with contextlib.suppress(RuntimeError):
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _push_text(self, text: str) -> None:
+        if text and self._queue is not None:
+            with self._buffer_lock:
+                self._buffered += 1
+            self._call_in_loop(self._queue.put_nowait, text)
+
+    def _park_if_backlogged(self) -> bool:
+        """Mark the sequence parked if its consumer has fallen a full buffer behind."""
+        with self._buffer_lock:
+            if self.stream and self._buffered >= self.max_buffered:
+                self.parked = True
+            return self.parked
+
+    def _complete(self, text: str) -> None:
+        self.finished = True
+        self.finished_at = time.perf_counter()
+        self.kv = self.kv_mask = self.draft = None
+        self._call_in_loop(_set_result, self._future, text)
+        if self._queue is not None:
+            self._call_in_loop(self._queue.put_nowait, _DONE)
+
+    def _fail(self, exc: BaseException) -> None:
+        self.finished = True
+        self.error = exc
+        self.finished_at = time.perf_counter()
+        self.kv = self.kv_mask = self.draft = None
+        if self._queue is not None:
+            # Streaming consumers read errors from the queue, not the future
+            self._call_in_loop(self._queue.put_nowait, exc)
+        else:
+            self._call_in_loop(_set_exception, self._future, exc)
+
+
+def _set_result(future: asyncio.Future, value: Any) -> None:
+    if not future.done():
+        future.set_result(value)
+
+
+def _set_exception(future: asyncio.Future, exc: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exc)
+
+
+class BatchScheduler:
+    """
+    Shared decode loop with iteration-level (continuous) batching.
+
+    Args:
+        engine: Model backend implementing ``DecodeEngine``
+        max_batch_size: Maximum number of sequences decoded together
+        max_prefills_per_step: Cap on new sequences admitted between two
+            decode steps, so a burst of arrivals can't stall running streams
+        max_buffered_chunks: Undelivered chunks a stream may hold before its
+            sequence is parked until the consumer catches up
+    """
+
+    def __init__(
+        self,
+        engine: DecodeEngine,
+        max_batch_size: int = 8,
+        max_prefills_per_step: int = 2,
+        max_buffered_chunks: int = 64,
+    ):
+        self.engine = engine
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_prefills_per_step = max(1, max_prefills_per_step)
+        self.max_buffered_chunks = max(1, max_buffered_chunks)
+
+        self._pending: deque[ScheduledSequence] = deque()
+        self._active: list[ScheduledSequence] = []
+        self._parked: list[ScheduledSequence] = []
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+
+        self._decode_steps = 0
+        self._tokens_generated = 0
+        self._batch_size_sum = 0
+        self._cancelled = 0
+
+    def submit(
+        self,
+        inputs: Any,
+        max_new_tokens: int,
+        temperature: float,
+        stream: bool = False,
+    ) -> ScheduledSequence:
+        """Queue a request for the decode loop. Must be called from the event loop."""
+        seq = ScheduledSequence(
+            inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            stream=stream,
+            loop=asyncio.get_running_loop(),
+            max_buffered=self.max_buffered_chunks,
+        )
+        seq._wake_scheduler = self._wake
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Scheduler is stopped")
+            self._pending.append(seq)
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="medgemma-scheduler", daemon=True)
+                self._thread.start()
+        return seq
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the decode loop and fail anything still queued or running."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def stats(self) -> dict[str, Any]:
+        """Snapshot of scheduler load for status reporting."""
+        with self._cond:
+            queued = len(self._pending)
+            parked = len(self._parked)
+        steps = self._decode_steps
+        return {
+            "active": len(self._active),
+            "queued": queued,
+            "parked": parked,
+            "max_batch_size": self.max_batch_size,
+            "decode_steps": steps,
+            "tokens_generated": self._tokens_generated,
+            "cancelled": self._cancelled,
+            "mean_batch_size": round(self._batch_size_sum / steps, 2) if steps else 0.0,
+        }
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify()
+
+    # -- Scheduler thread -------------------------------------------------
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    self._drop_cancelled()
+                    if self._pending or self._active or self._stopped or self._resumable():
+                        break
+                    self._cond.wait()
+                if self._stopped:
+                    break
+                # Parked streams whose consumers caught up rejoin before new work
+                free = self.max_batch_size - len(self._active)
+                resumed = self._resumable()[:free]
+                for seq in resumed:
+                    self._parked.remove(seq)
+                    with seq._buffer_lock:
+                        seq.parked = False
+                free -= len(resumed)
+                admitted = []
+                while self._pending and len(admitted) < min(free, self.max_prefills_per_step):
+                    admitted.append(self._pending.popleft())
+
+            self._active.extend(resumed)
+            for seq in admitted:
+                self._prefill(seq)
+
+            if self._active:
+                self._decode_step()
+
+        self._shutdown()
+
+    def _prefill(self, seq: ScheduledSequence) -> None:
+        seq.prefill_started_at = time.perf_counter()
+        try:
+            token = self.engine.prefill(seq)
+        except Exception as e:
+            logger.error(f"Prefill failed: {e}", exc_info=True)
+            seq._fail(e)
+            return
+        seq.first_token_at = time.perf_counter()
+        self._emit(seq, token)
+        if not seq.finished:
+            self._active.append(seq)
+
+    def _decode_step(self) -> None:
+        batch = list(self._active)
+        try:
+            tokens = self.engine.decode(batch)
+        except Exception as e:
+            logger.error(f"Decode step failed for batch of {len(batch)}: {e}", exc_info=True)
+            for seq in batch:
+                seq._fail(e)
+            self._active.clear()
+            self.engine.clear()
+            return
+
+        self._decode_steps += 1
+        self._batch_size_sum += len(batch)
+        for seq, token in zip(batch, tokens, strict=True):
+            self._emit(seq, token)
+
+        backlogged = [seq for seq in self._active if not seq.finished and seq._park_if_backlogged()]
+        if backlogged:
+            self.engine.detach(backlogged)
+            with self._cond:
+                self._parked.extend(backlogged)
+
+        self._active = [seq for seq in self._active if not seq.finished and not seq.parked]
+        if not self._active:
+            self.engine.clear()
+
+    def _resumable(self) -> list[ScheduledSequence]:
+        return [seq for seq in self._parked if seq._drained()]
+
+    def _drop_cancelled(self) -> None:
+        """Remove cancelled sequences from every stage (called with the lock held)."""
+        dropped = [seq for seq in self._pending if seq.cancelled]
+        if dropped:
+            self._pending = deque(seq for seq in self._pending if not seq.cancelled)
+        for stage in (self._parked, self._active):
+            cancelled = [seq for seq in stage if seq.cancelled]
+            if cancelled:
+                dropped.extend(cancelled)
+                stage[:] = [seq for seq in stage if not seq.cancelled]
+                if stage is self._active and not self._active:
+                    self.engine.clear()
+
+        for seq in dropped:
+            self._cancelled += 1
+            seq._fail(GenerationCancelled("Generation cancelled"))
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} cancelled sequence(s)")
+
+    def _emit(self, seq: ScheduledSequence, token: int) -> None:
+        """Record one generated token and finish the sequence if it hit a stop condition."""
+        if token in self.engine.eos_token_ids:
+            self._finish(seq)
+            return
+
+        seq.token_ids.append(token)
+        self._tokens_generated += 1
+        if seq.stream:
+            if seq._detokenizer is None:
+                seq._detokenizer = _IncrementalDetokenizer(self.engine.detokenize)
+            seq._push_text(seq._detokenizer.step(seq.token_ids))
+
+        if len(seq.token_ids) >= seq.max_new_tokens:
+            self._finish(seq)
+
+    def _finish(self, seq: ScheduledSequence) -> None:
+        try:
+            if seq.stream and seq._detokenizer is not None:
+                seq._push_text(seq._detokenizer.flush(seq.token_ids))
+            text = self.engine.detokenize(seq.token_ids)
+        except Exception as e:
+            seq._fail(e)
+            return
+        seq._complete(text)
+
+    def _shutdown(self) -> None:
+        with self._cond:
+            leftover = list(self._pending) + self._active + self._parked
+            self._pending.clear()
+            self._parked.clear()
+        self._active = []
+        for seq in leftover:
+            seq._fail(RuntimeError("Scheduler stopped"))
+        self.engine.clear()
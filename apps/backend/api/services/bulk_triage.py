@@ -0,0 +1,581 @@
+"""
+Bulk triage jobs: the 5-step workflow over a file of intakes.
+
+    cd apps/backend
+    python -m api.services.bulk_triage intakes.csv --out results.parquet
+
+or POST /api/v1/chat/medgemma/jobs with paths inside MEDSTATION_JOBS_DIR
+(see ``resolve_job_path``). The input is CSV, JSONL or Parquet with one
+intake per row. Rows hold the
+``format_context`` fields (chief_complaint, symptoms, age, ...) or a
+pre-formatted ``context``, and optionally a ``case_id``; the row number
+is used when it is missing.
+
+Many cases run at once so the batch scheduler decodes steps of different
+cases together. A case has at most two steps ready at a time, so by
+default twice the model's batch size are in flight. Each case holds a
+"low" priority admission ticket. Low tickets can't take the last
+MEDSTATION_ADMISSION_RESERVED slots, so however many cases a job runs,
+interactive requests to the same server still find room.
+
+Each case is appended to ``<out>.checkpoint.jsonl`` as soon as it
+finishes. Running the same input and output again skips those cases, so
+an interrupted job resumes where it stopped. Cases that failed, ended
+partially, or whose intake or settings changed run again. Once every
+case has run, the results are written to the output. The format follows
+the suffix: Parquet (.parquet), a DuckDB ``triage_results`` table
+(.duckdb) or JSON lines (.jsonl). Each row is one case with its triage
+level, parsed differential, safety alerts, step outputs and per-step
+timings.
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import aclosing, suppress
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from api.services.triage_workflow import (
+    DEFAULT_SYSTEM_PROMPT,
+    STEPS,
+    extract_differential,
+    format_context,
+    run_workflow,
+)
+
+logger = logging.getLogger(__name__)
+
+# Intake columns, in ``format_context`` argument order
+INTAKE_FIELDS = (
+    "chief_complaint",
+    "symptoms",
+    "age",
+    "sex",
+    "hr",
+    "bp",
+    "temp",
+    "rr",
+    "spo2",
+    "history",
+    "medications",
+    "allergies",
+)
+SAFETY_FIELDS = ("medications", "hr", "spo2", "temp")
+
+INPUT_FORMATS = (".csv", ".jsonl", ".parquet")
+OUTPUT_FORMATS = (".parquet", ".duckdb", ".jsonl")
+
+# Table written to .duckdb outputs
+RESULTS_TABLE = "triage_results"
+
+# Result column per workflow step ("Triage Assessment" -> "triage_assessment")
+STEP_COLUMNS = {title: title.lower().replace(" ", "_") for title, _, _ in STEPS}
+
+# Cases in flight per job (0 = twice the model's batch size)
+_BULK_CONCURRENCY = int(os.environ.get("MEDSTATION_BULK_CONCURRENCY", "0"))
+
+# The only directory /medgemma/jobs may read intakes from and write results to
+_JOBS_DIR = Path(os.environ.get("MEDSTATION_JOBS_DIR") or Path(__file__).resolve().parents[4] / ".jobs")
+
+# Seconds between progress log lines
+_PROGRESS_LOG_S = 10.0
+
+
+class BulkJobConflict(Exception):
+    """Another running job is writing the same output."""
+
+
+def resolve_job_path(path: str, jobs_dir: Path | None = None) -> Path:
+    """
+    Resolve a client-supplied job path inside the jobs directory.
+
+    Relative paths are taken from the jobs directory. Absolute paths, and
+    paths that leave it through ``..`` or a symlink, must still end up
+    inside it.
+
+    Raises:
+        ValueError: The path resolves outside the jobs directory
+    """
+    root = (jobs_dir or _JOBS_DIR).expanduser().resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root):
+        raise ValueError(f"Job paths must be inside the jobs directory: {path}")
+    return resolved
+
+
+def _text(value: Any) -> str | None:
+    """Intake value as text; blanks and nulls become None, whole floats (72.0) lose the ".0"."""
+    if value is None or value != value:  # None or NaN
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def read_intakes(path: Path) -> list[dict[str, str | None]]:
+    """
+    Read intake rows from a CSV, JSONL or Parquet file.
+
+    Returns:
+        One dict per case: ``case_id``, ``context`` and the intake fields
+
+    Raises:
+        ValueError: Unsupported format, a row with neither context nor
+            chief_complaint, or a repeated case_id
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        with path.open(newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+    elif suffix == ".jsonl":
+        with path.open(encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    elif suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        rows = pq.read_table(path).to_pylist()
+    else:
+        raise ValueError(f"Unsupported intake file '{path.name}'; expected {', '.join(INPUT_FORMATS)}")
+
+    intakes = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        case_id = _text(row.get("case_id")) or str(number)
+        if case_id in seen:
+            raise ValueError(f"Duplicate case_id '{case_id}' in {path.name}")
+        seen.add(case_id)
+        intake = {"case_id": case_id, "context": _text(row.get("context"))}
+        intake.update({field: _text(row.get(field)) for field in INTAKE_FIELDS})
+        if not intake["context"] and not intake["chief_complaint"]:
+            raise ValueError(f"Row {number} of {path.name} has neither context nor chief_complaint")
+        intakes.append(intake)
+    return intakes
+
+
+def result_row(
+    case_id: str,
+    result: dict[str, Any] | None,
+    error: str | None = None,
+    model: str | None = None,
+) -> dict[str, Any]:
+    """Flatten a workflow ``result`` event into one output row (``result`` is None if the case failed)."""
+    result = result or {}
+    steps = result.get("steps", {})
+    durations = result.get("step_durations_ms", {})
+    row = {
+        "case_id": case_id,
+        "model": model,
+        "triage": result.get("triage"),
+        "differential": extract_differential(steps.get("Differential Diagnosis", "")),
+        "safety_alerts": result.get("safety_alerts", []),
+    }
+    for title, column in STEP_COLUMNS.items():
+        row[column] = steps.get(title)
+    for title, column in STEP_COLUMNS.items():
+        row[f"{column}_ms"] = durations.get(title)
+    row["total_ms"] = result.get("total_ms")
+    row["partial"] = bool(result.get("partial")) or error is not None
+    row["error"] = error or result.get("incomplete_reason")
+    row["completed_at"] = datetime.now(UTC).isoformat()
+    return row
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    fields = [
+        ("case_id", pa.string()),
+        ("model", pa.string()),
+        ("triage", pa.string()),
+        (
+            "differential",
+            pa.list_(
+                pa.struct(
+                    [
+                        ("rank", pa.int32()),
+                        ("condition", pa.string()),
+                        ("likelihood", pa.string()),
+                    ]
+                )
+            ),
+        ),
+        ("safety_alerts", pa.list_(pa.struct([("type", pa.string()), ("message", pa.string())]))),
+    ]
+    fields += [(column, pa.string()) for column in STEP_COLUMNS.values()]
+    fields += [(f"{column}_ms", pa.float64()) for column in STEP_COLUMNS.values()]
+    fields += [
+        ("total_ms", pa.float64()),
+        ("partial", pa.bool_()),
+        ("error", pa.string()),
+        ("completed_at", pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+def write_results(rows: list[dict[str, Any]], path: Path) -> None:
+    """
+    Write result rows to Parquet, DuckDB or JSONL, chosen by the file suffix.
+
+    The file is written next to ``path`` and moved into place, so readers
+    never see a half-written output.
+
+    Raises:
+        ValueError: Unsupported output format
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output file '{path.name}'; expected {', '.join(OUTPUT_FORMATS)}")
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.unlink(missing_ok=True)
+
+    if suffix == ".jsonl":
+        with tmp.open("w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+    else:
+        import pyarrow as pa
+
+        table = pa.Table.from_pylist(rows, schema=_arrow_schema())
+        if suffix == ".parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            import duckdb
+
+            con = duckdb.connect(str(tmp))
+            try:
+                con.register("results", table)
+                con.execute(f"CREATE TABLE {RESULTS_TABLE} AS SELECT * FROM results")
+            finally:
+                con.close()
+    os.replace(tmp, path)
+
+
+class Checkpoint:
+    """Append-only JSONL of finished cases, keyed by case_id."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        """Rows recorded so far (a line cut short by a crash is ignored)."""
+        rows = {}
+        if not self.path.exists():
+            return rows
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                rows[row["case_id"]] = row
+        return rows
+
+    def append(self, row: dict[str, Any]) -> None:
+        """Record a finished case durably (runs in a worker thread)."""
+        line = json.dumps(row) + "\n"
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BulkTriageJob:
+    """
+    One bulk run: intake file → checkpoint → results file.
+
+    Args:
+        input_path: CSV, JSONL or Parquet intakes
+        output_path: Results file, .parquet, .duckdb or .jsonl (default
+            ``<input>.triage.parquet``)
+        model: Model variant (None = the default model)
+        system_prompt, max_new_tokens, temperature: Workflow generation settings
+        concurrency: Cases in flight (0 = MEDSTATION_BULK_CONCURRENCY, else
+            twice the model's batch size)
+
+    Raises:
+        ValueError: Unsupported input or output format
+    """
+
+    def __init__(
+        self,
+        input_path: Path,
+        output_path: Path | None = None,
+        model: str | None = None,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        max_new_tokens: int = 512,
+        temperature: float = 0.0,
+        concurrency: int = 0,
+    ):
+        self.input_path = Path(input_path)
+        self.output_path = (
+            Path(output_path) if output_path else self.input_path.with_name(f"{self.input_path.stem}.triage.parquet")
+        )
+        if self.input_path.suffix.lower() not in INPUT_FORMATS:
+            raise ValueError(f"Unsupported intake file '{self.input_path.name}'; expected {', '.join(INPUT_FORMATS)}")
+        if self.output_path.suffix.lower() not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output file '{self.output_path.name}'; expected {', '.join(OUTPUT_FORMATS)}")
+        self.checkpoint = Checkpoint(self.output_path.with_name(f"{self.output_path.name}.checkpoint.jsonl"))
+        self.model = model
+        self.system_prompt = system_prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.concurrency = concurrency or _BULK_CONCURRENCY
+        self.id = uuid.uuid4().hex[:12]
+        self.state = "pending"
+        self.error: str | None = None
+        self.total = 0
+        self.done = 0
+        self.resumed = 0
+        self.failed = 0
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._last_progress_log = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.state in ("pending", "running")
+
+    def stats(self) -> dict[str, Any]:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "id": self.id,
+            "state": self.state,
+            "input": str(self.input_path),
+            "output": str(self.output_path),
+            "model": self.model,
+            "concurrency": self.concurrency or None,
+            "total": self.total,
+            "done": self.done,
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "elapsed_s": round(elapsed, 1),
+            "cases_per_s": round((self.done - self.resumed) / elapsed, 3) if elapsed > 0 else None,
+            "error": self.error,
+        }
+
+    async def run(self) -> dict[str, Any]:
+        """Run every case not already in the checkpoint, then write the results; returns ``stats()``."""
+        from api.services.medgemma import get_medgemma
+
+        self.state = "running"
+        self.started_at = time.time()
+        try:
+            intakes = await asyncio.to_thread(read_intakes, self.input_path)
+            self.total = len(intakes)
+            svc = get_medgemma(self.model)
+            if not svc.loaded and not await svc.load():
+                raise RuntimeError("MedGemma model failed to load")
+            if not self.concurrency:
+                self.concurrency = 2 * max(1, svc.max_batch_size)
+
+            finished = await asyncio.to_thread(self.checkpoint.load)
+            rows: dict[str, dict[str, Any]] = {}
+            todo = []
+            for intake in intakes:
+                context = intake["context"] or format_context(*(intake[field] for field in INTAKE_FIELDS))
+                digest = self._digest(context)
+                row = finished.get(intake["case_id"])
+                if row is not None and row.pop("_digest", None) == digest:
+                    rows[intake["case_id"]] = row
+                else:
+                    todo.append((intake, context, digest))
+            self.done = self.resumed = len(rows)
+            if self.resumed:
+                logger.info(f"Bulk job {self.id}: resuming, {self.resumed}/{self.total} cases already done")
+
+            # Workers share one iterator, so each case runs once
+            cases = iter(todo)
+
+            async def _worker():
+                for intake, context, digest in cases:
+                    rows[intake["case_id"]] = await self._run_case(svc, intake, context, digest)
+                    self._log_progress()
+
+            await asyncio.gather(*(_worker() for _ in range(min(self.concurrency, len(todo)))))
+
+            await asyncio.to_thread(write_results, [rows[i["case_id"]] for i in intakes], self.output_path)
+            self.state = "completed"
+            logger.info(
+                f"Bulk job {self.id}: {self.done}/{self.total} cases triaged "
+                f"({self.resumed} resumed, {self.failed} failed) -> {self.output_path}"
+            )
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"Bulk job {self.id} failed: {e}", exc_info=True)
+        finally:
+            self.finished_at = time.time()
+        return self.stats()
+
+    def _digest(self, context: str) -> str:
+        """Identifies a case's inputs, so a resumed job re-runs cases whose intake or settings changed."""
+        key = json.dumps([context, self.model, self.system_prompt, self.max_new_tokens, self.temperature])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    async def _run_case(self, svc, intake: dict[str, str | None], context: str, digest: str) -> dict[str, Any]:
+        """Run one case's workflow; complete cases are checkpointed, failed ones retried on the next run."""
+        ticket = await self._admit()
+        result = None
+        error = None
+        try:
+            async with aclosing(
+                run_workflow(
+                    svc,
+                    context,
+                    system_prompt=self.system_prompt,
+                    max_new_tokens=self.max_new_tokens,
+                    temperature=self.temperature,
+                    stream_tokens=False,
+                    safety_inputs={field: intake[field] for field in SAFETY_FIELDS},
+                )
+            ) as events:
+                async for event in events:
+                    if event["event"] == "result":
+                        result = event
+        except Exception as e:
+            logger.warning(f"Bulk job {self.id}: case {intake['case_id']} failed: {e}")
+            error = str(e)
+        finally:
+            ticket.release()
+
+        row = result_row(intake["case_id"], result, error, self.model)
+        if row["partial"]:
+            self.failed += 1
+        else:
+            await asyncio.to_thread(self.checkpoint.append, {**row, "_digest": digest})
+            self.done += 1
+        return row
+
+    async def _admit(self):
+        """Wait for a low-priority admission slot, backing off while the server is saturated."""
+        from api.services.admission import AdmissionRejected, get_admission
+
+        while True:
+            try:
+                return await get_admission().acquire(f"bulk-{self.id}", "low")
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+    def _log_progress(self) -> None:
+        now = time.monotonic()
+        if now - self._last_progress_log >= _PROGRESS_LOG_S:
+            self._last_progress_log = now
+            stats = self.stats()
+            logger.info(
+                f"Bulk job {self.id}: {stats['done']}/{stats['total']} done, {stats['failed']} failed, "
+                f"{stats['cases_per_s']} cases/s"
+            )
+
+
+class BulkJobs:
+    """Bulk jobs started through the API, by id."""
+
+    def __init__(self):
+        self._jobs: dict[str, BulkTriageJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def start(self, job: BulkTriageJob) -> BulkTriageJob:
+        """
+        Run a job in the background.
+
+        Raises:
+            BulkJobConflict: A running job already writes the same output
+        """
+        for other in self._jobs.values():
+            if other.running and other.output_path.resolve() == job.output_path.resolve():
+                raise BulkJobConflict(f"Job {other.id} is already writing {job.output_path}")
+        self._jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(job.run())
+        return job
+
+    def get(self, job_id: str) -> BulkTriageJob | None:
+        return self._jobs.get(job_id)
+
+    def list(self) -> list[BulkTriageJob]:
+        return list(self._jobs.values())
+
+    async def cancel(self, job_id: str) -> bool:
+        """Stop a running job; its checkpoint keeps the finished cases. False if it isn't running."""
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        return True
+
+    async def stop(self) -> None:
+        """Cancel running jobs at shutdown."""
+        for job_id in list(self._tasks):
+            await self.cancel(job_id)
+
+
+_jobs: BulkJobs | None = None
+
+
+def get_bulk_jobs() -> BulkJobs:
+    """The process-wide bulk job registry."""
+    global _jobs
+    if _jobs is None:
+        _jobs = BulkJobs()
+    return _jobs
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the triage workflow over a file of intakes")
+    parser.add_argument("input", type=Path, help=f"intake file ({', '.join(INPUT_FORMATS)})")
+    parser.add_argument(
+        "--out",
+        type=Path,
+        default=None,
+        help=f"results file ({', '.join(OUTPUT_FORMATS)}; default <input>.triage.parquet)",
+    )
+    parser.add_argument("--model", default=None, help="model variant (default: the 4B model)")
+    parser.add_argument("--max-tokens", type=int, default=512, help="max new tokens per step")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=0, help="cases in flight (0 = twice the batch size)")
+    args = parser.parse_args(argv)
+
+    if not args.input.is_file():
+        parser.error(f"{args.input} not found")
+    try:
+        job = BulkTriageJob(
+            args.input,
+            args.out,
+            model=args.model,
+            max_new_tokens=args.max_tokens,
+            temperature=args.temperature,
+            concurrency=args.concurrency,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s %(name)s: %(message)s")
+    stats = asyncio.run(job.run())
+
+    print(json.dumps(stats, indent=2))
+    return 0 if stats["state"] == "completed" and not stats["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+llama.cpp decode engine for the batching scheduler.
+
+Implements ``DecodeEngine`` on a ``llama_cpp.Llama`` loaded from a GGUF
+file. A llama.cpp context holds the KV cache of one sequence, so the GGUF
+service runs the scheduler with a batch size of 1. Queued requests wait
+for the running one, and a stream parked for backpressure saves its
+context state on the sequence and gets it back when it resumes.
+
+A new prompt reuses the context's KV cache for the tokens it shares with
+whatever the context last held, which is usually the system prompt.
+
+The engine only calls methods on the ``Llama`` object it is given and
+never imports llama_cpp itself.
+"""
+
+import logging
+from pathlib import Path
+
+from api.services.batching import ScheduledSequence
+
+logger = logging.getLogger(__name__)
+
+# MedGemma's sampling defaults (generation_config.json of the HF snapshot)
+_TOP_K = 64
+_TOP_P = 0.95
+
+
+def find_gguf(path: Path, pattern: str = "*.gguf") -> Path:
+    """
+    The GGUF weights file for a variant: ``path`` itself, or the first match in it.
+
+    Multimodal projector files (``mmproj*``) are skipped.
+
+    Raises:
+        FileNotFoundError: No GGUF file matches
+    """
+    path = Path(path)
+    if path.is_file():
+        return path
+    candidates = sorted(f for f in path.glob(pattern) if f.is_file() and not f.name.startswith("mmproj"))
+    if not candidates:
+        raise FileNotFoundError(f"No GGUF file matching '{pattern}' in {path}")
+    return candidates[0]
+
+
+def gemma_prompt(messages: list) -> str:
+    """
+    Render chat messages with the Gemma 3 / MedGemma turn template.
+
+    Gemma has no system role: system text is prepended to the first user
+    turn. The BOS token is left to the tokenizer.
+    """
+    system = ""
+    turns = []
+    for message in messages:
+        text = "".join(part["text"] for part in message["content"] if part["type"] == "text").strip()
+        if message["role"] == "system":
+            system = text
+            continue
+        role = "model" if message["role"] == "assistant" else message["role"]
+        if system and role == "user":
+            text = f"{system}\n\n{text}"
+            system = ""
+        turns.append(f"<start_of_turn>{role}\n{text}<end_of_turn>\n")
+    turns.append("<start_of_turn>model\n")
+    return "".join(turns)
+
+
+class GgufEngine:
+    """
+    Prefill/decode on a single llama.cpp context.
+
+    Args:
+        llama: Loaded ``llama_cpp.Llama``
+        top_k: Top-k cutoff for sampled (temperature > 0) requests
+        top_p: Nucleus cutoff for sampled requests
+    """
+
+    def __init__(self, llama, top_k: int = _TOP_K, top_p: float = _TOP_P):
+        self.llama = llama
+        self.top_k = top_k
+        self.top_p = top_p
+        end_of_turn = llama.tokenize(b"<end_of_turn>", add_bos=False, special=True)
+        self.eos_token_ids = {llama.token_eos(), *end_of_turn}
+        # Sequence whose KV state is in the context
+        self._active: ScheduledSequence | None = None
+
+    # -- DecodeEngine -------------------------------------------------------
+
+    def prefill(self, seq: ScheduledSequence) -> int:
+        tokens: list[int] = list(seq.inputs["input_ids"])
+        if self._active is not None and self._active is not seq:
+            # Not expected with a batch size of 1, but never overwrite live state
+            self.detach([self._active])
+
+        # Keep the KV cache for the shared prefix; always run at least one token
+        reused = 0
+        held = self.llama.input_ids[: self.llama.n_tokens]
+        # The held and new prompts differ in length; the prefix ends at the shorter
+        for a, b in zip(held, tokens[:-1], strict=False):
+            if a != b:
+                break
+            reused += 1
+        if reused == 0:
+            self.llama.reset()
+        self.llama.n_tokens = reused
+        self.llama.eval(tokens[reused:])
+        if reused:
+            seq.stats["reused_prefix_tokens"] = reused
+
+        self._active = seq
+        seq.position = len(tokens)
+        seq.inputs = None
+        return self._sample(seq)
+
+    def decode(self, seqs: list[ScheduledSequence]) -> list[int]:
+        tokens = []
+        for seq in seqs:
+            self._activate(seq)
+            self.llama.eval([seq.token_ids[-1]])
+            seq.position += 1
+            tokens.append(self._sample(seq))
+        return tokens
+
+    def detach(self, seqs: list[ScheduledSequence]) -> None:
+        for seq in seqs:
+            if seq is self._active:
+                seq.kv = self.llama.save_state()
+                self._active = None
+
+    def clear(self) -> None:
+        # The context keeps its KV state for prefix reuse by the next prompt
+        self._active = None
+
+    def detokenize(self, token_ids: list[int]) -> str:
+        # "replace" marks a split UTF-8 character, which streaming holds back
+        return self.llama.detokenize(token_ids).decode("utf-8", errors="replace")
+
+    # -- Internals ------------------------------------------------------------
+
+    def _activate(self, seq: ScheduledSequence) -> None:
+        """Make ``seq``'s KV state the context's, restoring a saved state if needed."""
+        if seq is self._active:
+            return
+        if self._active is not None:
+            self.detach([self._active])
+        if seq.kv is None:
+            raise RuntimeError("Sequence has no saved llama.cpp state to resume from")
+        self.llama.load_state(seq.kv)
+        seq.kv = None
+        self._active = seq
+
+    def _sample(self, seq: ScheduledSequence) -> int:
+        """Next token from the last logits: greedy for temperature 0, else top-k/top-p."""
+        return int(
+            self.llama.sample(
+                temp=seq.temperature,
+                top_k=self.top_k,
+                top_p=self.top_p,
+                min_p=0.0,
+                repeat_penalty=1.0,
+            )
+        )
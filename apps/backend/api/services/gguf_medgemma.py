@@ -0,0 +1,112 @@
+"""
+MedGemma on llama.cpp, from GGUF weights.
+
+Selected with MEDSTATION_INFERENCE_BACKEND=gguf, or per variant by
+pointing a MEDSTATION_MODEL_VARIANTS entry at a ``.gguf`` file. Runs
+4-bit and 8-bit quantized builds on CPU in-process, with no Ollama
+daemon. Weights are memory-mapped, so loading is fast and the page
+cache holds a single copy. Prompts use the MedGemma chat template
+(gguf_engine.py). Requests go through the shared ``MedGemmaService``
+code: batch scheduler, response cache, streaming, metrics and tracing.
+
+A llama.cpp context holds one sequence, so requests are decoded one at a
+time (see gguf_engine.py). Image input, speculative decoding and forked
+replicas need the transformers backend.
+"""
+
+import asyncio
+import os
+import re
+from pathlib import Path
+from typing import Any
+
+from api.services.medgemma import MedGemmaService
+
+# Weights file to load when a variant points at a directory
+_GGUF_FILE = os.environ.get("MEDSTATION_GGUF_FILE", "*.gguf")
+
+# Decode threads (0 = llama.cpp default, half the logical cores)
+_GGUF_THREADS = int(os.environ.get("MEDSTATION_GGUF_THREADS", "0"))
+
+# Context window in tokens (prompt + generated)
+_GGUF_CONTEXT = int(os.environ.get("MEDSTATION_GGUF_CONTEXT", "8192"))
+
+# Prompt tokens evaluated per llama.cpp batch during prefill
+_GGUF_BATCH = int(os.environ.get("MEDSTATION_GGUF_BATCH", "512"))
+
+# Quantization type in GGUF file names, e.g. medgemma-4b-it-Q4_K_M.gguf
+_QUANT_RE = re.compile(r"[-_.]((?:I?Q\d\w*)|BF16|F16|F32)$", re.IGNORECASE)
+
+
+class GgufMedGemmaService(MedGemmaService):
+    """
+    MedGemma inference for one model variant on llama.cpp (CPU).
+
+    Takes the same arguments as ``MedGemmaService``. ``model_dir`` may be a
+    ``.gguf`` file or a directory holding one (see MEDSTATION_GGUF_FILE).
+    ``cpu_precision`` is unused because the file sets the quantization.
+    """
+
+    backend = "gguf"
+    supports_speculative = False
+    supports_replicas = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # One llama.cpp context = one sequence's KV cache
+        self.max_batch_size = 1
+
+    async def _load_model(self, model_path: Path) -> None:
+        from api.services.gguf_engine import find_gguf
+
+        def _import():
+            from llama_cpp import Llama
+
+            return Llama
+
+        with self._timed("import"):
+            Llama = await asyncio.to_thread(_import)
+
+        gguf_path = find_gguf(model_path, _GGUF_FILE)
+        self.device = "cpu"
+        if self.manager is not None:
+            # Unload idle variants first if this one would exceed the memory budget
+            await self.manager.make_room(self, self.weight_bytes or gguf_path.stat().st_size)
+
+        def _load_weights():
+            kwargs = {"n_threads": _GGUF_THREADS} if _GGUF_THREADS > 0 else {}
+            self.model = Llama(
+                model_path=str(gguf_path),
+                n_ctx=_GGUF_CONTEXT,
+                n_batch=_GGUF_BATCH,
+                use_mmap=True,
+                verbose=False,
+                **kwargs,
+            )
+
+        with self._timed("weights"):
+            await asyncio.to_thread(_load_weights)
+
+        quant = _QUANT_RE.search(gguf_path.stem)
+        # Namespaces response-cache entries apart from other builds of the model
+        self.precision = f"gguf-{quant.group(1).upper()}" if quant else "gguf"
+        self.weight_bytes = gguf_path.stat().st_size
+
+    def _prepare_inputs(self, messages: list, image_digest: str | None = None) -> dict[str, Any]:
+        """
+        Render the chat template and tokenize it (runs in a worker thread).
+
+        Raises:
+            ValueError: The request has an image
+        """
+        from api.services.gguf_engine import gemma_prompt
+
+        if image_digest is not None:
+            raise ValueError("Image input is not supported on the GGUF backend")
+        prompt = gemma_prompt(messages)
+        return {"input_ids": self.model.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)}
+
+    def _make_engine(self):
+        from api.services.gguf_engine import GgufEngine
+
+        return GgufEngine(self.model)
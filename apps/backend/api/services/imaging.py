@@ -0,0 +1,107 @@
+"""
+Image helpers for MedGemma multimodal requests.
+
+Request images are decoded in a small dedicated thread pool so a large
+upload never blocks the event loop, and never competes with tokenization
+work in the default executor. Decoding is reduced to the model's input
+resolution as early as the format allows: JPEGs are decoded in draft mode
+(DCT scaling), and everything else is downscaled before RGB conversion.
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import BinaryIO
+
+# Upload limits for request images (encoded bytes and decoded pixels)
+MAX_IMAGE_BYTES = int(os.environ.get("MEDSTATION_MAX_IMAGE_MB", "32")) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get("MEDSTATION_MAX_IMAGE_PIXELS", "50000000"))
+
+# Concurrent image decodes (each can hold a full-resolution frame)
+_DECODE_WORKERS = int(os.environ.get("MEDSTATION_IMAGE_DECODE_WORKERS", "2"))
+
+_decode_pool: ThreadPoolExecutor | None = None
+
+
+class ImageTooLarge(ValueError):
+    """Image dimensions exceed the decoded pixel limit."""
+
+
+def image_digest(image) -> str:
+    """Content hash of a decoded PIL image (mode, size and pixel data)."""
+    h = hashlib.sha256()
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def decode_image(
+    source: BinaryIO,
+    max_pixels: int | None = None,
+    target_size: int | None = None,
+):
+    """
+    Decode an encoded image into an RGB PIL image.
+
+    Dimensions are read from the header and checked before any pixel data
+    is decoded, so oversized images are rejected without allocating them.
+
+    Args:
+        source: Binary stream holding the encoded image
+        max_pixels: Decoded size limit (defaults to MAX_IMAGE_PIXELS)
+        target_size: Model input resolution; the shorter side is reduced to
+            this (never below it) before conversion
+
+    Raises:
+        ImageTooLarge: width * height exceeds the pixel limit
+    """
+    from PIL import Image
+
+    if max_pixels is None:
+        max_pixels = MAX_IMAGE_PIXELS
+
+    try:
+        image = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height}; limit is {max_pixels} pixels")
+
+    if target_size and min(width, height) > target_size:
+        if image.format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, staying >= target
+            image.draft("RGB", (target_size, target_size))
+            width, height = image.size
+        scale = target_size / min(width, height)
+        if scale < 1:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=3.0)
+    return image.convert("RGB")
+
+
+def decode_base64_image(
+    data: str,
+    max_pixels: int | None = None,
+    target_size: int | None = None,
+):
+    """Decode a base64-encoded image (see ``decode_image``)."""
+    return decode_image(BytesIO(base64.b64decode(data)), max_pixels, target_size)
+
+
+def _get_decode_pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ThreadPoolExecutor(max_workers=max(1, _DECODE_WORKERS), thread_name_prefix="image-decode")
+    return _decode_pool
+
+
+async def run_in_decode_pool(fn, *args, **kwargs):
+    """Run an image decode function in the dedicated decode pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_decode_pool(), functools.partial(fn, *args, **kwargs))
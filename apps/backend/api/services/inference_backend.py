@@ -0,0 +1,114 @@
+"""
+Inference backends behind ``get_medgemma()``.
+
+Routes, the model manager and the backend router only use the interface
+below, so the runtime that executes MedGemma is a deployment choice:
+
+    transformers  PyTorch + HF Transformers on MPS, CUDA or CPU (default; medgemma.py)
+    onnx          ONNX Runtime on CPU, from an exported snapshot (onnx_medgemma.py)
+    gguf          llama.cpp on CPU, from quantized GGUF weights (gguf_medgemma.py)
+
+MEDSTATION_INFERENCE_BACKEND selects one for every model variant. A
+variant configured as a ``.gguf`` file always uses gguf, so quantized
+builds can be served next to the default model. All backends share the
+service code above the decode engine (batching, caches, streaming,
+metrics), so routes behave the same on each.
+"""
+
+import os
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any, Protocol
+
+INFERENCE_BACKENDS = ("transformers", "onnx", "gguf")
+
+_INFERENCE_BACKEND = os.environ.get("MEDSTATION_INFERENCE_BACKEND", "transformers")
+
+
+class InferenceBackend(Protocol):
+    """What the API needs from a MedGemma runtime serving one model variant."""
+
+    backend: str
+    variant: str
+    model_id: str
+    device: str
+    loaded: bool
+    state: str
+    max_batch_size: int
+
+    async def load(self, model_dir: str | None = None) -> bool:
+        """Load the model (safe to call repeatedly); False if it can't be loaded."""
+        ...
+
+    async def unload(self) -> bool:
+        """Release the model; False if it is busy."""
+        ...
+
+    def start_background_load(self) -> Any:
+        """Begin loading at server start (returns the task, or None)."""
+        ...
+
+    async def generate(
+        self,
+        prompt: str,
+        system_prompt: str = ...,
+        image=None,
+        max_new_tokens: int = 1024,
+        temperature: float = 0.3,
+        speculative: str | None = None,
+        metadata: dict[str, Any] | None = None,
+    ) -> str:
+        """Generate a complete response."""
+        ...
+
+    def stream_generate(
+        self,
+        prompt: str,
+        system_prompt: str = ...,
+        image=None,
+        max_new_tokens: int = 1024,
+        temperature: float = 0.3,
+        speculative: str | None = None,
+        metadata: dict[str, Any] | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """Stream response text chunks as they are decoded."""
+        ...
+
+    def image_input_size(self) -> int | None:
+        """Resolution images are resized to, or None if unknown."""
+        ...
+
+    def runtime_stats(self) -> dict[str, Any]:
+        """Load state, scheduler and cache statistics for status reporting."""
+        ...
+
+
+def backend_class(name: str | None = None) -> type:
+    """
+    Service class implementing an inference backend.
+
+    Args:
+        name: Backend name (defaults to MEDSTATION_INFERENCE_BACKEND)
+
+    Raises:
+        ValueError: Unknown backend
+    """
+    name = name or _INFERENCE_BACKEND
+    if name == "transformers":
+        from api.services.medgemma import MedGemmaService
+
+        return MedGemmaService
+    if name == "onnx":
+        from api.services.onnx_medgemma import OnnxMedGemmaService
+
+        return OnnxMedGemmaService
+    if name == "gguf":
+        from api.services.gguf_medgemma import GgufMedGemmaService
+
+        return GgufMedGemmaService
+    raise ValueError(f"Unknown inference backend '{name}'; expected {', '.join(INFERENCE_BACKENDS)}")
+
+
+def backend_for_path(path: Path) -> type:
+    """Service class for a variant's weights: ``.gguf`` files use gguf, anything else the configured backend."""
+    return backend_class("gguf" if Path(path).suffix.lower() == ".gguf" else None)
@@ -3,135 +3,382 @@ MedGemma inference service.
 
 Loads google/medgemma-1.5-4b-it from a local snapshot and runs inference
 on Apple Silicon (MPS) or CPU. Supports both text-only and multimodal
-(text + image) queries.
+(text + image) queries. Concurrent requests are decoded together by a
+continuous batching scheduler (see batching.py), and prompts that share a
+prefix with earlier ones reuse its KV state (see prefix_cache.py). On CPU
+hosts, MEDSTATION_INFERENCE_WORKERS > 1 forks replicas that share the
+loaded weights (see replicas.py). Several model variants can be served
+side by side; model_manager.py loads and unloads them.
+
+This is the transformers inference backend; inference_backend.py selects
+between it and ONNX Runtime (onnx_medgemma.py), which reuses everything
+here above the decode engine.
 """
 
-import logging
 import asyncio
+import gc
+import logging
+import os
+import sys
+import time
+from collections.abc import AsyncGenerator
+from contextlib import aclosing, contextmanager
 from pathlib import Path
-from typing import Optional, AsyncGenerator
+from typing import Any, Optional
+
+from api.services.batching import BatchScheduler
+from api.services.imaging import image_digest
+from api.services.inference_backend import InferenceBackend, backend_class
+from api.services.metrics import RESPONSE_CACHE_HITS, observe_replica_request, observe_sequence
+from api.services.prefix_cache import PrefixCache
+from api.services.quantization import load_dtype, model_bytes, quantize_int8, resolve_cpu_precision
+from api.services.replicas import ReplicaPool
+from api.services.response_cache import ResponseCache, cache_key, split_chunks
+from api.services.speculative import SPECULATIVE_MODES, SpeculativeScheduler, speculative_stats
+from api.services.tracing import add_span, record_sequence, span
+from api.services.vision_cache import VisionCache
 
 logger = logging.getLogger(__name__)
 
+MODEL_ID = "google/medgemma-1.5-4b-it"
+
 # Default local model path (downloaded via huggingface_hub.snapshot_download)
 _DEFAULT_MODEL_DIR = Path(__file__).resolve().parents[4] / ".models" / "medgemma-1.5-4b-it"
+DEFAULT_VARIANT = _DEFAULT_MODEL_DIR.name
+
+# Maximum number of sequences decoded together by the batch scheduler
+_MAX_BATCH_SIZE = int(os.environ.get("MEDSTATION_MAX_BATCH_SIZE", "8"))
+
+# CPU weight precision: fp32, bf16 (native bf16 CPUs only) or int8 (see quantization.py)
+_CPU_PRECISION = os.environ.get("MEDSTATION_CPU_PRECISION", "fp32")
+
+# Load the model in the background at server start, then run a short warmup
+_EAGER_LOAD = os.environ.get("MEDSTATION_EAGER_LOAD", "1") != "0"
+_WARMUP_TOKENS = int(os.environ.get("MEDSTATION_WARMUP_TOKENS", "8"))
+_WARMUP_PROMPT = os.environ.get("MEDSTATION_WARMUP_PROMPT", "List three red-flag symptoms of chest pain.")
+
+# Forked inference processes sharing the weights (CPU only; 1 = in-process)
+_INFERENCE_WORKERS = int(os.environ.get("MEDSTATION_INFERENCE_WORKERS", "1"))
+
+# Undelivered chunks a stream may buffer before its generation pauses
+_STREAM_BUFFER_CHUNKS = int(os.environ.get("MEDSTATION_STREAM_BUFFER_CHUNKS", "64"))
+
+# Memory budget for reusable prompt-prefix KV states (0 disables prefix caching)
+_PREFIX_CACHE_MB = int(os.environ.get("MEDSTATION_PREFIX_CACHE_MB", "1024"))
+
+# Greedy (temperature 0) response cache: in-memory entries, optional SQLite file and its row cap
+_RESPONSE_CACHE_SIZE = int(os.environ.get("MEDSTATION_RESPONSE_CACHE_SIZE", "256"))
+_RESPONSE_CACHE_PATH = os.environ.get("MEDSTATION_RESPONSE_CACHE_PATH") or None
+_RESPONSE_CACHE_DISK_ENTRIES = int(os.environ.get("MEDSTATION_RESPONSE_CACHE_DISK_ENTRIES", "10000"))
+
+# Speculative decoding: default mode ("off", "prompt_lookup" or "draft"), the
+# draft model snapshot, tokens drafted per step, n-gram length and concurrency
+_SPECULATIVE = os.environ.get("MEDSTATION_SPECULATIVE", "off")
+_DRAFT_MODEL_DIR = os.environ.get("MEDSTATION_DRAFT_MODEL_DIR") or None
+_SPECULATIVE_TOKENS = int(os.environ.get("MEDSTATION_SPECULATIVE_TOKENS", "10"))
+_SPECULATIVE_NGRAM = int(os.environ.get("MEDSTATION_SPECULATIVE_NGRAM", "3"))
+_SPECULATIVE_MAX_ACTIVE = int(os.environ.get("MEDSTATION_SPECULATIVE_MAX_ACTIVE", "4"))
+
+# Memory budget for cached vision-encoder outputs (0 disables)
+_VISION_CACHE_MB = int(os.environ.get("MEDSTATION_VISION_CACHE_MB", "256"))
 
 
 class ModelNotLoadedError(Exception):
     """Raised when MedGemma model fails to load or is unavailable."""
+
     pass
 
 
 class MedGemmaService:
-    """Singleton service for MedGemma inference."""
+    """
+    MedGemma inference for one model variant.
+
+    The default variant is a singleton (``MedGemmaService.get()``); other
+    variants are created by the model manager.
+
+    Args:
+        model_dir: Local snapshot to load (defaults to the 4B instruct model)
+        variant: Name requests use to select this model
+        response_cache: Cache to share with other variants (entries are
+            keyed by ``model_id``); a new one is created if omitted
+        cpu_precision: fp32, bf16 or int8 for CPU inference
+            (defaults to MEDSTATION_CPU_PRECISION)
+    """
 
     _instance: Optional["MedGemmaService"] = None
+    # Name of this implementation in MEDSTATION_INFERENCE_BACKEND (see inference_backend.py)
+    backend = "transformers"
+    # Speculative decoding and forked replicas need the transformers engine
+    supports_speculative = True
+    supports_replicas = True
 
-    def __init__(self):
+    def __init__(
+        self,
+        model_dir: Path | None = None,
+        variant: str = DEFAULT_VARIANT,
+        response_cache: ResponseCache | None = None,
+        cpu_precision: str | None = None,
+    ):
         self.model = None
         self.processor = None
         self.device: str = "cpu"
         self.loaded = False
-        self._loading = False
+        self.model_dir = Path(model_dir) if model_dir else _DEFAULT_MODEL_DIR
+        self.variant = variant
+        self.cpu_precision = cpu_precision or _CPU_PRECISION
+        # Precision actually loaded ("fp16"/"bf16"/"fp32"/"int8"), set by load()
+        self.precision: str | None = None
+        self._load_future: asyncio.Future | None = None
+        # "idle" -> "loading" -> "warming" -> "ready" -> "unloaded", or "failed"
+        self.state = "idle"
+        self.load_timings: dict[str, float] = {}
+        # Usage, for idle eviction by the model manager
+        self.inflight = 0
+        self.last_used = time.monotonic()
+        self.weight_bytes = 0
+        self.manager = None
+        self._scheduler: BatchScheduler | None = None
+        self._spec_scheduler: SpeculativeScheduler | None = None
+        self.speculative = _SPECULATIVE
+        self.draft_model = None
+        self._draft_future: asyncio.Future | None = None
+        self._replicas: ReplicaPool | None = None
+        self.model_id = MODEL_ID if variant == DEFAULT_VARIANT else f"{MODEL_ID}:{variant}"
+        self.max_batch_size = _MAX_BATCH_SIZE
+        self.prefix_cache = PrefixCache(max_bytes=_PREFIX_CACHE_MB * 1024 * 1024)
+        self.response_cache = response_cache or ResponseCache(
+            max_entries=_RESPONSE_CACHE_SIZE,
+            db_path=_RESPONSE_CACHE_PATH,
+            max_disk_entries=_RESPONSE_CACHE_DISK_ENTRIES,
+        )
+        self.vision_cache = VisionCache(max_bytes=_VISION_CACHE_MB * 1024 * 1024)
 
     @classmethod
     def get(cls) -> "MedGemmaService":
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
+        """The default variant's service, created with the configured inference backend."""
+        if MedGemmaService._instance is None:
+            MedGemmaService._instance = backend_class()()
+        return MedGemmaService._instance
+
+    @property
+    def loading(self) -> bool:
+        return self._load_future is not None and not self._load_future.done()
 
-    async def load(self, model_dir: Optional[str] = None) -> bool:
-        """Load model and processor. Safe to call multiple times."""
+    async def load(self, model_dir: str | None = None) -> bool:
+        """
+        Load model and processor. Safe to call multiple times.
+
+        Concurrent callers await the same load; a caller that is cancelled
+        while waiting does not cancel the load for the others.
+        """
         if self.loaded:
             return True
-        if self._loading:
-            # Another coroutine is already loading
-            while self._loading:
-                await asyncio.sleep(0.5)
-            return self.loaded
-
-        self._loading = True
+        if self._load_future is None or self._load_future.done():
+            self._load_future = asyncio.ensure_future(self._load(model_dir))
+        return await asyncio.shield(self._load_future)
+
+    async def _load(self, model_dir: str | None = None) -> bool:
+        self.state = "loading"
+        self.load_timings = {}
+        started = time.perf_counter()
         try:
-            model_path = Path(model_dir) if model_dir else _DEFAULT_MODEL_DIR
+            model_path = Path(model_dir) if model_dir else self.model_dir
 
             if not model_path.exists():
                 logger.error(f"Model directory not found: {model_path}")
-                logger.error("Download with: huggingface-cli download google/medgemma-1.5-4b-it --local-dir .models/medgemma-1.5-4b-it")
-                return False
-
-            logger.info(f"Loading MedGemma from {model_path}...")
-
-            # Import here to avoid slow startup (torch takes ~10s on cold start)
-            import torch
-            from transformers import AutoProcessor, AutoModelForImageTextToText
-
-            # Determine device
-            if torch.backends.mps.is_available():
-                self.device = "mps"
-            elif torch.cuda.is_available():
-                self.device = "cuda"
-            else:
-                self.device = "cpu"
-
-            logger.info(f"Using device: {self.device}")
-
-            # float32 on MPS — float16 causes NaN in softmax during sampling
-            # (known PyTorch MPS numerical instability with half-precision LLMs)
-            if self.device == "mps":
-                dtype = torch.float32
-            elif self.device == "cuda":
-                dtype = torch.bfloat16
-            else:
-                dtype = torch.float32
-
-            # Load in a thread to avoid blocking the event loop
-            def _load():
-                self.processor = AutoProcessor.from_pretrained(str(model_path))
-                self.model = AutoModelForImageTextToText.from_pretrained(
-                    str(model_path),
-                    torch_dtype=dtype,
-                    device_map=self.device,
+                logger.error(
+                    "Download with: huggingface-cli download google/medgemma-1.5-4b-it --local-dir .models/medgemma-1.5-4b-it"
                 )
+                self.state = "failed"
+                return False
 
-            await asyncio.to_thread(_load)
-
+            logger.info(f"Loading MedGemma from {model_path} ({self.backend} backend)...")
+            await self._load_model(model_path)
             self.loaded = True
-            logger.info(f"MedGemma loaded on {self.device}")
+            self.state = "ready"
+            self.last_used = time.monotonic()
+            if _INFERENCE_WORKERS > 1:
+                with self._timed("replicas"):
+                    self.start_replicas(_INFERENCE_WORKERS)
+            self.load_timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(
+                f"MedGemma loaded on {self.device} in {self.load_timings['total'] / 1000:.1f}s ({self.load_timings})"
+            )
             return True
 
         except Exception as e:
             logger.error(f"Failed to load MedGemma: {e}", exc_info=True)
+            self.model = None
+            self.processor = None
+            self.state = "failed"
             return False
-        finally:
-            self._loading = False
 
-    async def generate(
-        self,
-        prompt: str,
-        system_prompt: str = "You are an expert medical AI assistant.",
-        image=None,
-        max_new_tokens: int = 1024,
-        temperature: float = 0.3,
-    ) -> str:
+    async def _load_model(self, model_path: Path) -> None:
         """
-        Generate a response from MedGemma.
+        Pick the device and precision, then load the processor and weights.
 
-        Args:
-            prompt: User's medical query
-            system_prompt: System instruction
-            image: Optional PIL Image for multimodal queries
-            max_new_tokens: Maximum tokens to generate
-            temperature: Sampling temperature (0 = greedy)
+        Sets ``processor``, ``model``, ``device``, ``precision`` and
+        ``weight_bytes``. Other backends override this (see onnx_medgemma.py).
         """
-        if not self.loaded:
-            ok = await self.load()
-            if not ok:
-                raise ModelNotLoadedError("MedGemma model not loaded. Please check the model directory.")
 
-        # Clamp temperature to safe range (negative values crash torch)
-        temperature = max(0.0, min(temperature, 2.0))
+        # Import here to avoid slow startup (torch takes ~10s on cold start)
+        def _import():
+            import torch
+            from transformers import AutoModelForImageTextToText, AutoProcessor
+
+            return torch, AutoProcessor, AutoModelForImageTextToText
+
+        with self._timed("import"):
+            torch, AutoProcessor, AutoModelForImageTextToText = await asyncio.to_thread(_import)
+
+        # Determine device
+        if torch.backends.mps.is_available():
+            self.device = "mps"
+        elif torch.cuda.is_available():
+            self.device = "cuda"
+        else:
+            self.device = "cpu"
+
+        logger.info(f"Using device: {self.device}")
+
+        # float32 on MPS — float16 causes NaN in softmax during sampling
+        # (known PyTorch MPS numerical instability with half-precision LLMs)
+        if self.device == "mps":
+            precision, dtype = "fp32", torch.float32
+        elif self.device == "cuda":
+            precision, dtype = "bf16", torch.bfloat16
+        else:
+            precision = resolve_cpu_precision(self.cpu_precision)
+            dtype = load_dtype(torch, precision)
+
+        if self.manager is not None:
+            # Unload idle variants first if this one would exceed the memory budget
+            await self.manager.make_room(self, self.weight_bytes or checkpoint_bytes(model_path))
+
+        # Load in a thread to avoid blocking the event loop
+        def _load_processor():
+            self.processor = AutoProcessor.from_pretrained(str(model_path))
+
+        def _load_weights():
+            # Safetensors shards are memory-mapped and copied straight into
+            # the final tensors: no random init and no second full copy
+            self.model = AutoModelForImageTextToText.from_pretrained(
+                str(model_path),
+                torch_dtype=dtype,
+                device_map=self.device,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
+            self.model.eval()
+
+        with self._timed("processor"):
+            await asyncio.to_thread(_load_processor)
+        with self._timed("weights"):
+            await asyncio.to_thread(_load_weights)
+        if precision == "int8":
+            with self._timed("quantize"):
+                await asyncio.to_thread(quantize_int8, self.model)
+            gc.collect()
+        self.precision = precision
+
+        self.weight_bytes = model_bytes(self.model)
+
+    async def unload(self) -> bool:
+        """
+        Release the model, its replicas and its KV caches.
+
+        Refused (returns False) while the model is loading or serving
+        requests. The next request loads it again.
+        """
+        if not self.loaded or self.loading or self.inflight:
+            return False
 
-        # Build messages in chat format
+        self.loaded = False
+        self.state = "unloaded"
+        # Detach everything before the first await: a load may start while
+        # the schedulers stop, and what it sets up must survive
+        schedulers = [s for s in (self._scheduler, self._spec_scheduler) if s is not None]
+        self._scheduler = self._spec_scheduler = None
+        self.model = None
+        self.draft_model = None
+        self._draft_future = None
+        self.processor = None
+        self.prefix_cache.clear()
+        self.vision_cache.clear()
+        self.stop_replicas()
+        for scheduler in schedulers:
+            await asyncio.to_thread(scheduler.stop)
+        del schedulers
+
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and self.device == "cuda":
+            torch.cuda.empty_cache()
+        elif torch is not None and self.device == "mps":
+            torch.mps.empty_cache()
+        logger.info(f"MedGemma variant {self.variant} unloaded")
+        return True
+
+    @contextmanager
+    def _in_use(self):
+        """Count a request against this model so it isn't unloaded under it."""
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self.last_used = time.monotonic()
+
+    @contextmanager
+    def _timed(self, phase: str):
+        """Record the duration of a load phase in ``load_timings`` (ms)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.load_timings[phase] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def warmup(self, max_new_tokens: int = _WARMUP_TOKENS) -> None:
+        """
+        Run a short generation so kernels, allocator pools and caches are hot.
+
+        With replicas, every worker gets one warmup request. Sampled (not
+        greedy) so the warmup answer never lands in the response cache.
+        """
+        if not self.loaded or max_new_tokens <= 0:
+            return
+        self.state = "warming"
+        workers = self._replicas.num_workers if self._replicas is not None else 1
+        try:
+            with self._timed("warmup"):
+                await asyncio.gather(
+                    *[
+                        self.generate(prompt=_WARMUP_PROMPT, max_new_tokens=max_new_tokens, temperature=0.3)
+                        for _ in range(workers)
+                    ]
+                )
+            logger.info(f"MedGemma warmup done in {self.load_timings['warmup']:.0f}ms")
+        except Exception as e:
+            logger.warning(f"MedGemma warmup failed: {e}")
+        finally:
+            self.state = "ready"
+
+    async def load_and_warmup(self) -> bool:
+        """Eager startup path: load, then warm up (run as a background task)."""
+        ok = await self.load()
+        if ok:
+            await self.warmup()
+        return ok
+
+    def start_background_load(self) -> asyncio.Task | None:
+        """Begin loading at server start if MEDSTATION_EAGER_LOAD is on."""
+        if not _EAGER_LOAD or self.loaded:
+            return None
+        logger.info("Loading MedGemma in the background")
+        return asyncio.create_task(self.load_and_warmup())
+
+    def _build_messages(self, prompt: str, system_prompt: str, image=None) -> list:
+        """Build the chat-format message list for a single-turn query."""
         messages = [
             {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
         ]
@@ -142,95 +389,450 @@ class MedGemmaService:
         user_content.append({"type": "text", "text": prompt})
 
         messages.append({"role": "user", "content": user_content})
+        return messages
 
-        def _infer():
-            import torch
+    def _prepare_inputs(self, messages: list, image_digest: str | None = None):
+        """
+        Apply the chat template and move tensors to the model device (runs in a worker thread).
+
+        If the image's encoder outputs are cached, its placeholder is expanded
+        directly and the processor's image preprocessing is skipped; the
+        engine injects the cached features instead of running the vision tower.
+        """
+        features = None
+        if image_digest is not None and self.vision_cache.enabled and self._can_expand_image_tokens():
+            features = self.vision_cache.get(image_digest)
+
+        if features is not None:
+            inputs = self._tokenize_with_image_tokens(messages)
+        else:
             inputs = self.processor.apply_chat_template(
                 messages,
                 add_generation_prompt=True,
                 tokenize=True,
                 return_dict=True,
                 return_tensors="pt",
-            ).to(self.model.device, dtype=self.model.dtype)
+            )
+        inputs = inputs.to(self.model.device, dtype=self.model.dtype)
+
+        if image_digest is not None:
+            inputs["image_digest"] = image_digest
+        if features is not None:
+            inputs["image_features"] = features
+        return inputs
+
+    def _can_expand_image_tokens(self) -> bool:
+        return all(hasattr(self.processor, attr) for attr in ("boi_token", "full_image_sequence", "image_token_id"))
+
+    def _tokenize_with_image_tokens(self, messages: list):
+        """Tokenize a multimodal prompt without preprocessing its image (Gemma 3 processor layout)."""
+        from transformers import BatchFeature
+
+        text = self.processor.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        text = text.replace(self.processor.boi_token, self.processor.full_image_sequence)
+        encoded = self.processor.tokenizer(text, return_tensors="pt", add_special_tokens=False)
+        data = dict(encoded)
+        data["token_type_ids"] = (encoded["input_ids"] == self.processor.image_token_id).long()
+        return BatchFeature(data=data)
+
+    def _make_engine(self):
+        from api.services.transformers_engine import TransformersEngine
+
+        return TransformersEngine(
+            self.model,
+            self.processor,
+            prefix_cache=self.prefix_cache,
+            vision_cache=self.vision_cache,
+        )
+
+    def _get_scheduler(self) -> BatchScheduler:
+        """Create the shared decode loop on first use (requires a loaded model)."""
+        if self._scheduler is None:
+            self._scheduler = BatchScheduler(
+                self._make_engine(),
+                max_batch_size=self.max_batch_size,
+                max_buffered_chunks=_STREAM_BUFFER_CHUNKS,
+            )
+            logger.info(f"MedGemma batch scheduler started (max batch size {self.max_batch_size})")
+        return self._scheduler
+
+    def _make_speculative_engine(self):
+        from api.services.transformers_engine import SpeculativeEngine
+
+        return SpeculativeEngine(
+            self.model,
+            self.processor,
+            prefix_cache=self.prefix_cache,
+            vision_cache=self.vision_cache,
+            draft_model=self.draft_model,
+            num_draft_tokens=_SPECULATIVE_TOKENS,
+            max_ngram=_SPECULATIVE_NGRAM,
+        )
+
+    def _get_speculative_scheduler(self) -> SpeculativeScheduler:
+        """Create the speculative decode loop on first use (requires a loaded model)."""
+        if self._spec_scheduler is None:
+            self._spec_scheduler = SpeculativeScheduler(
+                self._make_speculative_engine(),
+                max_active=_SPECULATIVE_MAX_ACTIVE,
+                max_buffered_chunks=_STREAM_BUFFER_CHUNKS,
+            )
+            logger.info(f"MedGemma speculative scheduler started ({_SPECULATIVE_TOKENS} draft tokens per step)")
+        return self._spec_scheduler
+
+    def _speculative_mode(self, requested: str | None) -> str | None:
+        """
+        Resolve a request's speculative mode (None = plain batched decoding).
+
+        Raises:
+            ValueError: Unknown mode
+        """
+        mode = requested or self.speculative or "off"
+        if mode == "off":
+            return None
+        if mode not in SPECULATIVE_MODES:
+            raise ValueError(f"Unknown speculative mode '{mode}'; expected off, {', '.join(SPECULATIVE_MODES)}")
+        if not self.supports_speculative:
+            logger.debug(f"Speculative decoding is not available on the {self.backend} backend; decoding normally")
+            return None
+        return mode
+
+    async def _ensure_draft_model(self) -> bool:
+        """Load the draft model once (shared by concurrent callers); False if unavailable."""
+        if self.draft_model is not None:
+            return True
+        if not _DRAFT_MODEL_DIR:
+            return False
+        if self._draft_future is None:
+            self._draft_future = asyncio.ensure_future(
+                asyncio.to_thread(self._load_draft_model, Path(_DRAFT_MODEL_DIR))
+            )
+        try:
+            self.draft_model = await asyncio.shield(self._draft_future)
+        except Exception as e:
+            logger.error(f"Draft model unavailable, using prompt lookup: {e}")
+            return False
+        if self._spec_scheduler is not None:
+            self._spec_scheduler.engine.draft_model = self.draft_model
+        return True
+
+    def _load_draft_model(self, path: Path):
+        """Load the draft LM, checking that it shares the target's vocabulary (worker thread)."""
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        vocab = AutoTokenizer.from_pretrained(str(path)).get_vocab()
+        if vocab != self.processor.tokenizer.get_vocab():
+            raise ValueError(f"{path} does not use MedGemma's tokenizer")
+        model = AutoModelForCausalLM.from_pretrained(
+            str(path), torch_dtype=self.model.dtype, device_map=self.device, low_cpu_mem_usage=True
+        )
+        model.eval()
+        logger.info(f"Draft model loaded from {path}")
+        return model
+
+    async def _submit(self, inputs, max_new_tokens: int, temperature: float, stream: bool, mode: str | None):
+        """Queue a request on the batch scheduler, or the speculative one when ``mode`` is set."""
+        if mode is None:
+            return self._get_scheduler().submit(
+                inputs, max_new_tokens=max_new_tokens, temperature=temperature, stream=stream
+            )
+        if mode == "draft":
+            await self._ensure_draft_model()
+        inputs["speculative"] = mode
+        return self._get_speculative_scheduler().submit(
+            inputs, max_new_tokens=max_new_tokens, temperature=temperature, stream=stream
+        )
 
-            input_len = inputs["input_ids"].shape[-1]
+    def start_replicas(self, num_workers: int) -> bool:
+        """
+        Fork ``num_workers`` inference processes that share the loaded weights.
+
+        Must run before this process starts decoding (the workers need a
+        clean scheduler state). Returns False if replicas aren't supported
+        here, in which case requests keep running in-process.
+        """
+        import multiprocessing
 
-            with torch.inference_mode():
-                output = self.model.generate(
-                    **inputs,
+        if not self.supports_replicas:
+            logger.warning(f"MedGemma replicas are not supported on the {self.backend} backend; staying in-process")
+            return False
+        if self.device != "cpu":
+            logger.warning(f"MedGemma replicas need CPU inference (device is {self.device}); staying in-process")
+            return False
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning("MedGemma replicas need the fork start method; staying in-process")
+            return False
+        if self._scheduler is not None or self._spec_scheduler is not None:
+            logger.warning("MedGemma already decoding in-process; not starting replicas")
+            return False
+
+        self._replicas = ReplicaPool(self, num_workers)
+        self._replicas.start()
+        return True
+
+    def stop_replicas(self) -> None:
+        if self._replicas is not None:
+            self._replicas.stop()
+            self._replicas = None
+
+    def _replica_stream(self, prompt, system_prompt, image, max_new_tokens, temperature, speculative):
+        """A replica's chunk stream, closed (and cancelled in the worker) on exit."""
+        return aclosing(
+            _observed_replica(
+                self._replicas.stream(
+                    prompt=prompt,
+                    system_prompt=system_prompt,
+                    image=image,
                     max_new_tokens=max_new_tokens,
-                    do_sample=temperature > 0,
-                    temperature=temperature if temperature > 0 else None,
+                    temperature=temperature,
+                    speculative=speculative or "off",
                 )
+            )
+        )
 
-            generated = output[0][input_len:]
-            return self.processor.decode(generated, skip_special_tokens=True)
+    def reset_after_fork(self) -> None:
+        """Prepare an inherited service for use in a forked replica."""
+        self._scheduler = None
+        self._spec_scheduler = None
+        self._replicas = None
+        self._load_future = None
+        self._draft_future = None
+        self.manager = None
+        # The parent answers from the response cache; its SQLite handle must not be shared
+        self.response_cache = ResponseCache(max_entries=0)
+
+    def image_input_size(self) -> int | None:
+        """Resolution the processor resizes images to, or None if unknown."""
+        size = getattr(getattr(self.processor, "image_processor", None), "size", None)
+        if isinstance(size, dict):
+            sides = [v for k, v in size.items() if k in ("height", "width", "shortest_edge")]
+            return max(sides) if sides else None
+        return None
+
+    def runtime_stats(self) -> dict[str, Any]:
+        """Batch scheduler load and prefix cache usage for status reporting."""
+        return {
+            "variant": self.variant,
+            "backend": self.backend,
+            "state": self.state,
+            "precision": self.precision,
+            "load_timings_ms": self.load_timings,
+            "scheduler": self._scheduler.stats() if self._scheduler is not None else None,
+            "speculative": self._spec_scheduler.stats() if self._spec_scheduler is not None else None,
+            "replicas": self._replicas.stats() if self._replicas is not None else None,
+            "prefix_cache": self.prefix_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+            "vision_cache": self.vision_cache.stats(),
+        }
 
-        return await asyncio.to_thread(_infer)
+    def _cache_model_id(self) -> str:
+        """Response-cache namespace; reduced-precision CPU modes answer differently from fp32."""
+        if self.device == "cpu" and self.precision not in (None, "fp32"):
+            return f"{self.model_id}@{self.precision}"
+        return self.model_id
 
-    async def stream_generate(
+    async def _cached_response(
+        self,
+        prompt: str,
+        system_prompt: str,
+        digest: str | None,
+        max_new_tokens: int,
+        temperature: float,
+    ) -> tuple[str | None, list[str] | None]:
+        """
+        Look up a greedy request in the response cache.
+
+        Returns:
+            (key, chunks) — key is None when the request is not cacheable,
+            chunks is None on a miss
+        """
+        if temperature > 0 or not self.response_cache.enabled:
+            return None, None
+
+        key = cache_key(self._cache_model_id(), system_prompt, prompt, digest, max_new_tokens)
+        return key, await asyncio.to_thread(self.response_cache.get, key)
+
+    async def generate(
         self,
         prompt: str,
         system_prompt: str = "You are an expert medical AI assistant.",
         image=None,
         max_new_tokens: int = 1024,
         temperature: float = 0.3,
-    ) -> AsyncGenerator[str, None]:
-        """
-        Stream tokens from MedGemma using TextIteratorStreamer.
+        speculative: str | None = None,
+        metadata: dict[str, Any] | None = None,
+    ) -> str:
         """
-        if not self.loaded:
-            ok = await self.load()
-            if not ok:
-                raise ModelNotLoadedError("MedGemma model not loaded.")
-
-        from transformers import TextIteratorStreamer
-        import threading
-
-        messages = [
-            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
-        ]
-        user_content = []
-        if image is not None:
-            user_content.append({"type": "image", "image": image})
-        user_content.append({"type": "text", "text": prompt})
-        messages.append({"role": "user", "content": user_content})
-
-        inputs = self.processor.apply_chat_template(
-            messages,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
-        ).to(self.model.device, dtype=self.model.dtype)
-
-        streamer = TextIteratorStreamer(
-            self.processor.tokenizer,
-            skip_prompt=True,
-            skip_special_tokens=True,
-        )
-
-        gen_kwargs = {
-            **inputs,
-            "max_new_tokens": max_new_tokens,
-            "do_sample": temperature > 0,
-            "streamer": streamer,
-        }
-        if temperature > 0:
-            gen_kwargs["temperature"] = temperature
-
-        thread = threading.Thread(
-            target=lambda: self.model.generate(**gen_kwargs),
-            daemon=True,
-        )
-        thread.start()
+        Generate a response from MedGemma.
 
-        for token in streamer:
-            yield token
+        Concurrent calls share forward passes through the batch scheduler;
+        greedy (temperature 0) requests are served from the response cache
+        when an identical request was answered before.
 
-        thread.join(timeout=5)
+        Args:
+            prompt: User's medical query
+            system_prompt: System instruction
+            image: Optional PIL Image for multimodal queries
+            max_new_tokens: Maximum tokens to generate
+            temperature: Sampling temperature (0 = greedy)
+            speculative: "prompt_lookup", "draft" or "off" (defaults to
+                MEDSTATION_SPECULATIVE); see speculative.py
+            metadata: If given, filled with generation metadata: ``cached``
+                for response-cache hits, ``speculative`` acceptance stats
+        """
+        with self._in_use():
+            if not self.loaded:
+                ok = await self.load()
+                if not ok:
+                    raise ModelNotLoadedError("MedGemma model not loaded. Please check the model directory.")
+
+            # Clamp temperature to safe range (negative values crash torch)
+            temperature = max(0.0, min(temperature, 2.0))
+            mode = self._speculative_mode(speculative)
+
+            digest = await asyncio.to_thread(image_digest, image) if image is not None else None
+
+            key, cached = await self._cached_response(prompt, system_prompt, digest, max_new_tokens, temperature)
+            if cached is not None:
+                RESPONSE_CACHE_HITS.inc()
+                if metadata is not None:
+                    metadata["cached"] = True
+                return "".join(cached)
+
+            if self._replicas is not None:
+                chunks = []
+                async with self._replica_stream(
+                    prompt, system_prompt, image, max_new_tokens, temperature, mode
+                ) as stream:
+                    async for chunk in stream:
+                        chunks.append(chunk)
+                if key is not None:
+                    await asyncio.to_thread(self.response_cache.put, key, chunks)
+                return "".join(chunks)
+
+            messages = self._build_messages(prompt, system_prompt, image)
+            with span("tokenize"):
+                inputs = await asyncio.to_thread(self._prepare_inputs, messages, digest)
+
+            seq = await self._submit(inputs, max_new_tokens, temperature, stream=False, mode=mode)
+            try:
+                text = await seq.result()
+            except asyncio.CancelledError:
+                # Caller went away (e.g. client disconnect) — free the batch slot
+                seq.cancel()
+                raise
+            finally:
+                observe_sequence(seq, mode or "batch")
+                record_sequence(seq)
+            if metadata is not None and mode is not None:
+                metadata["speculative"] = speculative_stats(seq)
+
+            if key is not None:
+                await asyncio.to_thread(self.response_cache.put, key, split_chunks(text))
+            return text
 
+    async def stream_generate(
+        self,
+        prompt: str,
+        system_prompt: str = "You are an expert medical AI assistant.",
+        image=None,
+        max_new_tokens: int = 1024,
+        temperature: float = 0.3,
+        speculative: str | None = None,
+        metadata: dict[str, Any] | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream text chunks from MedGemma as the batch scheduler decodes them.
 
-def get_medgemma() -> MedGemmaService:
-    """Get the MedGemma singleton."""
-    return MedGemmaService.get()
+        Greedy requests found in the response cache replay their stored chunks.
+        Closing the generator early cancels the underlying generation.
+        ``speculative`` and ``metadata`` are as for ``generate``; metadata is
+        filled in once the stream is exhausted.
+        """
+        with self._in_use():
+            if not self.loaded:
+                ok = await self.load()
+                if not ok:
+                    raise ModelNotLoadedError("MedGemma model not loaded.")
+
+            temperature = max(0.0, min(temperature, 2.0))
+            mode = self._speculative_mode(speculative)
+
+            digest = await asyncio.to_thread(image_digest, image) if image is not None else None
+
+            key, cached = await self._cached_response(prompt, system_prompt, digest, max_new_tokens, temperature)
+            if cached is not None:
+                RESPONSE_CACHE_HITS.inc()
+                if metadata is not None:
+                    metadata["cached"] = True
+                for chunk in cached:
+                    yield chunk
+                return
+
+            if self._replicas is not None:
+                chunks = []
+                async with self._replica_stream(
+                    prompt, system_prompt, image, max_new_tokens, temperature, mode
+                ) as stream:
+                    async for chunk in stream:
+                        chunks.append(chunk)
+                        yield chunk
+                if key is not None:
+                    await asyncio.to_thread(self.response_cache.put, key, chunks)
+                return
+
+            messages = self._build_messages(prompt, system_prompt, image)
+            with span("tokenize"):
+                inputs = await asyncio.to_thread(self._prepare_inputs, messages, digest)
+
+            seq = await self._submit(inputs, max_new_tokens, temperature, stream=True, mode=mode)
+            chunks = []
+            try:
+                async for chunk in seq.stream_text():
+                    chunks.append(chunk)
+                    yield chunk
+            finally:
+                # Runs when the consumer stops early or is cancelled; no-op once finished
+                seq.cancel()
+                observe_sequence(seq, mode or "batch")
+                record_sequence(seq)
+            if metadata is not None and mode is not None:
+                metadata["speculative"] = speculative_stats(seq)
+
+            if key is not None:
+                await asyncio.to_thread(self.response_cache.put, key, chunks)
+
+
+async def _observed_replica(stream: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    """Pass a replica's chunks through, recording the request in the metrics."""
+    started, first_chunk_at, outcome = time.perf_counter(), None, "cancelled"
+    try:
+        async with aclosing(stream):
+            async for chunk in stream:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                yield chunk
+        outcome = "completed"
+    except Exception:
+        outcome = "failed"
+        raise
+    finally:
+        observe_replica_request(started, first_chunk_at, outcome)
+        add_span("replica", started)
+
+
+def checkpoint_bytes(model_dir: Path) -> int:
+    """Size of a snapshot's weight files (an estimate of its loaded size)."""
+    return sum(f.stat().st_size for pattern in ("*.safetensors", "*.bin") for f in Path(model_dir).glob(pattern))
+
+
+def get_medgemma(variant: str | None = None) -> InferenceBackend:
+    """
+    Get the service for a model variant (the default MedGemma singleton if None).
+
+    Raises:
+        UnknownModelError: ``variant`` is not configured
+    """
+    from api.services.model_manager import get_model_manager
+
+    return get_model_manager().get(variant)
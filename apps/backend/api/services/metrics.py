@@ -0,0 +1,386 @@
+"""
+Inference metrics in the Prometheus text exposition format.
+
+A small dependency-free registry of counters and histograms, served at
+``GET /metrics``. Observations are taken once per request or per
+upstream call, never per token. The per-token scheduler loop is not
+touched; per-request timings come from the timestamps each
+``ScheduledSequence`` already records. Live values such as queue depths
+and cache hit counts are read from the services' ``stats()`` at scrape
+time through collector callbacks.
+
+    from api.services.metrics import IMAGE_DECODE_SECONDS
+    IMAGE_DECODE_SECONDS.labels(source="upload").observe(elapsed)
+"""
+
+import bisect
+import logging
+import threading
+from collections.abc import Callable, Iterable, Sequence
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets (seconds) — from sub-millisecond cache hits to multi-minute generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+Sample = tuple[str, dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+    suffix = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], _Metric] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels: str):
+        """The child series for one label combination (created on first use)."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _series(self) -> Iterable[tuple[dict[str, str], "_Metric"]]:
+        if not self.labelnames:
+            yield {}, self
+            return
+        for key, child in list(self._children.items()):
+            yield dict(zip(self.labelnames, key, strict=True)), child
+
+    def samples(self) -> list[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+    suffix = "_total"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def samples(self) -> list[Sample]:
+        return [(self.name + self.suffix, labels, child._value) for labels, child in self._series()]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observations with a running sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def samples(self) -> list[Sample]:
+        out: list[Sample] = []
+        for labels, child in self._series():
+            with child._lock:
+                counts, total = list(child._counts), child._sum
+            cumulative = 0
+            for bound, count in zip(child.buckets + (float("inf"),), counts, strict=True):
+                cumulative += count
+                out.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            out.append((f"{self.name}_sum", labels, total))
+            out.append((f"{self.name}_count", labels, cumulative))
+        return out
+
+
+class Registry:
+    """Metrics plus scrape-time collectors, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], Iterable[tuple[str, str, str, list[Sample]]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple[str, str, str, list[Sample]]]]) -> None:
+        """
+        Register a scrape-time callback.
+
+        It yields ``(name, type, help, samples)`` families, e.g. gauges read
+        from a service's ``stats()``.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        def _family(name: str, kind: str, documentation: str, samples: list[Sample]) -> None:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+
+        for metric in self._metrics:
+            _family(metric.name + metric.suffix, metric.kind, metric.documentation, metric.samples())
+        for collector in self._collectors:
+            try:
+                for family in collector():
+                    _family(*family)
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# -- MedGemma inference ------------------------------------------------------
+
+REQUESTS = REGISTRY.counter(
+    "medstation_medgemma_requests", "MedGemma generation requests by decode path and outcome", ("mode", "outcome")
+)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "medstation_medgemma_queue_wait_seconds", "Time from submission until prefill starts", ("mode",)
+)
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "medstation_medgemma_time_to_first_token_seconds", "Time from submission to the first generated token", ("mode",)
+)
+PREFILL_SECONDS = REGISTRY.histogram(
+    "medstation_medgemma_prefill_seconds", "Prompt prefill time (including image encoding)", ("mode",)
+)
+DECODE_SECONDS = REGISTRY.histogram(
+    "medstation_medgemma_decode_seconds", "Time from the first token to the end of generation", ("mode",)
+)
+DECODE_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "medstation_medgemma_decode_tokens_per_second", "Per-request decode rate", ("mode",), buckets=RATE_BUCKETS
+)
+GENERATED_TOKENS = REGISTRY.counter("medstation_medgemma_generated_tokens", "Tokens generated", ("mode",))
+RESPONSE_CACHE_HITS = REGISTRY.counter(
+    "medstation_medgemma_response_cache_served", "Requests answered from the response cache"
+)
+IMAGE_DECODE_SECONDS = REGISTRY.histogram(
+    "medstation_image_decode_seconds", "Request image decode and downscale time", ("source",)
+)
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "medstation_admission_wait_seconds", "Time admitted requests waited for an inference slot", ("priority",)
+)
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "medstation_admission_rejections", "Requests turned away with 429 by admission control", ("priority", "reason")
+)
+
+# -- HTTP and Ollama ---------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "medstation_http_request_duration_seconds",
+    "Time until response headers are sent, by route template",
+    ("method", "route", "status"),
+)
+OLLAMA_REQUEST_SECONDS = REGISTRY.histogram(
+    "medstation_ollama_request_seconds",
+    "Ollama proxy upstream latency (to response headers) by endpoint and outcome",
+    ("endpoint", "outcome"),
+)
+OLLAMA_STREAM_SECONDS = REGISTRY.histogram(
+    "medstation_ollama_stream_seconds", "Ollama proxy generate duration until the last byte is relayed"
+)
+
+
+def observe_sequence(seq, mode: str) -> None:
+    """
+    Record one finished scheduler sequence.
+
+    Reads the timestamps the scheduler stores on the sequence; called once
+    per request from the event loop.
+    """
+    if seq.cancelled:
+        REQUESTS.labels(mode=mode, outcome="cancelled").inc()
+        return
+    if seq.error is not None or seq.first_token_at is None or seq.finished_at is None:
+        REQUESTS.labels(mode=mode, outcome="failed").inc()
+        return
+
+    REQUESTS.labels(mode=mode, outcome="completed").inc()
+    prefill_started = seq.prefill_started_at or seq.submitted_at
+    QUEUE_WAIT_SECONDS.labels(mode=mode).observe(prefill_started - seq.submitted_at)
+    PREFILL_SECONDS.labels(mode=mode).observe(seq.first_token_at - prefill_started)
+    TIME_TO_FIRST_TOKEN_SECONDS.labels(mode=mode).observe(seq.first_token_at - seq.submitted_at)
+
+    decode = seq.finished_at - seq.first_token_at
+    tokens = len(seq.token_ids)
+    DECODE_SECONDS.labels(mode=mode).observe(decode)
+    GENERATED_TOKENS.labels(mode=mode).inc(tokens)
+    if tokens > 1 and decode > 0:
+        DECODE_TOKENS_PER_SECOND.labels(mode=mode).observe((tokens - 1) / decode)
+
+
+def observe_replica_request(submitted_at: float, first_chunk_at: float | None, outcome: str) -> None:
+    """
+    Record one request served by a forked replica.
+
+    Only the parent's view is available: the outcome and the time until the
+    first text chunk arrived over the pipe.
+    """
+    REQUESTS.labels(mode="replica", outcome=outcome).inc()
+    if first_chunk_at is not None and outcome == "completed":
+        TIME_TO_FIRST_TOKEN_SECONDS.labels(mode="replica").observe(first_chunk_at - submitted_at)
+
+
+class GaugeSet:
+    """Collects gauge samples during a scrape, grouped into one family per name."""
+
+    def __init__(self):
+        self._families: dict[str, tuple[str, list[Sample]]] = {}
+
+    def set(self, name: str, documentation: str, value: float | None, **labels: str) -> None:
+        if not isinstance(value, (int, float)):
+            return
+        _, samples = self._families.setdefault(name, (documentation, []))
+        samples.append((name, labels, float(value)))
+
+    def families(self) -> list[tuple[str, str, str, list[Sample]]]:
+        return [(name, "gauge", doc, samples) for name, (doc, samples) in self._families.items()]
+
+
+def _medgemma_gauges():
+    """Scheduler depth, cache and lifecycle gauges for every MedGemma variant."""
+    from api.services.model_manager import get_model_manager
+
+    gauges = GaugeSet()
+    for svc in get_model_manager().services():
+        stats = svc.runtime_stats()
+        variant = svc.variant
+        gauges.set(
+            "medstation_medgemma_loaded", "Whether the model variant is loaded", int(svc.loaded), variant=variant
+        )
+        gauges.set("medstation_medgemma_inflight", "Requests in progress", svc.inflight, variant=variant)
+        for scheduler in ("scheduler", "speculative"):
+            sched = stats.get(scheduler) or {}
+            for field, doc in (
+                ("active", "Sequences being decoded"),
+                ("queued", "Sequences waiting for prefill"),
+                ("parked", "Streams paused for slow consumers"),
+            ):
+                gauges.set(f"medstation_medgemma_{field}", doc, sched.get(field), variant=variant, scheduler=scheduler)
+        for cache in ("prefix_cache", "vision_cache"):
+            cache_stats = stats.get(cache) or {}
+            label = cache.replace("_", " ")
+            gauges.set(
+                f"medstation_{cache}_bytes", f"Memory held by the {label}", cache_stats.get("bytes"), variant=variant
+            )
+            gauges.set(
+                f"medstation_{cache}_hits", f"Lookups served by the {label}", cache_stats.get("hits"), variant=variant
+            )
+            gauges.set(
+                f"medstation_{cache}_misses",
+                f"Lookups missed by the {label}",
+                cache_stats.get("misses"),
+                variant=variant,
+            )
+        gauges.set(
+            "medstation_model_weight_bytes",
+            "Loaded weight memory",
+            svc.weight_bytes if svc.loaded else 0,
+            variant=variant,
+        )
+    return gauges.families()
+
+
+def _ollama_gauges():
+    from api.services import ollama
+
+    gauges = GaugeSet()
+    if ollama._residency is not None:
+        stats = ollama._residency.stats()
+        gauges.set(
+            "medstation_ollama_cold_starts", "Proxied generates that had to load their model", stats["cold_starts"]
+        )
+        gauges.set(
+            "medstation_ollama_resident_models", "Ollama models believed to be in memory", len(stats["resident"])
+        )
+    return gauges.families()
+
+
+def _admission_gauges():
+    from api.services import admission
+
+    gauges = GaugeSet()
+    if admission._controller is not None:
+        stats = admission._controller.stats()
+        gauges.set("medstation_admission_active", "Requests holding an inference slot", stats["active"])
+        for priority, queued in stats["queued_by_priority"].items():
+            gauges.set(
+                "medstation_admission_queued", "Requests waiting for an inference slot", queued, priority=priority
+            )
+    return gauges.families()
+
+
+REGISTRY.add_collector(_medgemma_gauges)
+REGISTRY.add_collector(_admission_gauges)
+REGISTRY.add_collector(_ollama_gauges)
+
+
+def render() -> str:
+    """The full exposition for ``/metrics``."""
+    return REGISTRY.render()
@@ -0,0 +1,229 @@
+"""
+Lifecycle management for MedGemma model variants.
+
+The server can serve several MedGemma builds side by side: the 4B instruct
+model, a quantized build, or a fine-tuned snapshot. Requests pick one by
+name. Each variant is a ``MedGemmaService`` (of the configured inference
+backend, see inference_backend.py) that loads on first use.
+The manager keeps the variants that are loaded at the same time within
+a memory budget by unloading the least recently used idle ones, and it
+unloads any variant left idle longer than the idle TTL.
+
+Variants are configured as ``name=path`` pairs in MEDSTATION_MODEL_VARIANTS.
+A bare name or a relative path resolves under ``.models/``, next to the
+default snapshot. A ``.gguf`` path is served by llama.cpp:
+
+    MEDSTATION_MODEL_VARIANTS="medgemma-int8,ft-2026-09=/data/models/ft-2026-09,q4=medgemma-4b-it-Q4_K_M.gguf"
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from api.services.inference_backend import backend_for_path
+from api.services.medgemma import _DEFAULT_MODEL_DIR, DEFAULT_VARIANT, MedGemmaService
+
+logger = logging.getLogger(__name__)
+
+# Extra model variants served next to the default one
+_VARIANTS = os.environ.get("MEDSTATION_MODEL_VARIANTS", "")
+
+# Memory budget for loaded model weights across variants (0 = unlimited)
+_MEMORY_BUDGET_MB = int(os.environ.get("MEDSTATION_MODEL_MEMORY_MB", "0"))
+
+# Unload a variant after this many idle seconds (0 = keep loaded)
+_IDLE_TTL_S = float(os.environ.get("MEDSTATION_MODEL_IDLE_TTL_S", "0"))
+
+
+class UnknownModelError(ValueError):
+    """The requested model variant is not configured."""
+
+
+def parse_variants(value: str, models_dir: Path = _DEFAULT_MODEL_DIR.parent) -> dict[str, Path]:
+    """Parse ``name=path`` pairs (a bare name is a directory under ``models_dir``)."""
+    variants: dict[str, Path] = {}
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, path = entry.partition("=")
+        name = name.strip()
+        path = Path(path.strip() or name).expanduser()
+        variants[name] = path if path.is_absolute() else models_dir / path
+    return variants
+
+
+class ModelManager:
+    """
+    Loads, tracks and evicts MedGemma variants.
+
+    Args:
+        variants: Variant name -> snapshot directory (the default variant
+            is always included and served by the ``MedGemmaService`` singleton)
+        memory_budget: Byte budget for loaded weights across variants (0 = unlimited)
+        idle_ttl: Seconds a variant may sit unused before it is unloaded (0 = never)
+        service_factory: Creates the service for a non-default variant (tests)
+    """
+
+    def __init__(
+        self,
+        variants: dict[str, Path] | None = None,
+        memory_budget: int = 0,
+        idle_ttl: float = 0.0,
+        service_factory: Callable[[str, Path], MedGemmaService] | None = None,
+    ):
+        self.variants: dict[str, Path] = {DEFAULT_VARIANT: _DEFAULT_MODEL_DIR, **(variants or {})}
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self._factory = service_factory or self._create_service
+        self._services: dict[str, MedGemmaService] = {}
+        self._evict_lock = asyncio.Lock()
+        self._reaper: asyncio.Task | None = None
+
+        self.evictions = 0
+        self.idle_unloads = 0
+
+    def names(self) -> list[str]:
+        return list(self.variants)
+
+    def get(self, variant: str | None = None) -> MedGemmaService:
+        """
+        The service for ``variant`` (created, not loaded, on first use).
+
+        Raises:
+            UnknownModelError: ``variant`` is not configured
+        """
+        name = variant or DEFAULT_VARIANT
+        if name == DEFAULT_VARIANT:
+            svc = MedGemmaService.get()
+        else:
+            svc = self._services.get(name)
+            if svc is None:
+                if name not in self.variants:
+                    raise UnknownModelError(f"Unknown model '{name}'; available: {', '.join(self.variants)}")
+                svc = self._services[name] = self._factory(name, self.variants[name])
+        svc.manager = self
+        return svc
+
+    def services(self) -> list[MedGemmaService]:
+        """Services created so far (the default singleton included once it exists)."""
+        services = list(self._services.values())
+        if MedGemmaService._instance is not None:
+            services.insert(0, self.get())
+        return services
+
+    def _create_service(self, name: str, path: Path) -> MedGemmaService:
+        # Variants share the default's response cache; entries are keyed by model_id
+        return backend_for_path(path)(model_dir=path, variant=name, response_cache=self.get().response_cache)
+
+    def loaded_bytes(self, exclude: MedGemmaService | None = None) -> int:
+        return sum(s.weight_bytes for s in self.services() if s.loaded and s is not exclude)
+
+    async def make_room(self, svc: MedGemmaService, needed: int) -> None:
+        """
+        Unload least recently used idle variants until ``needed`` bytes fit.
+
+        Called by ``svc`` before it loads its weights. Variants with requests
+        in flight are never unloaded; if the budget still can't be met the
+        load goes ahead over budget.
+        """
+        if self.memory_budget <= 0:
+            return
+        async with self._evict_lock:
+            while self.loaded_bytes(exclude=svc) + needed > self.memory_budget:
+                candidates = [
+                    s for s in self.services() if s is not svc and s.loaded and not s.inflight and not s.loading
+                ]
+                if not candidates:
+                    logger.warning(
+                        f"Loading {svc.variant} exceeds the model memory budget "
+                        f"({(self.loaded_bytes(exclude=svc) + needed) >> 20} MB > {self.memory_budget >> 20} MB); "
+                        f"every other variant is busy"
+                    )
+                    return
+                victim = min(candidates, key=lambda s: s.last_used)
+                logger.info(f"Unloading {victim.variant} to make room for {svc.variant}")
+                if not await victim.unload():
+                    return
+                self.evictions += 1
+
+    async def unload_idle(self, now: float | None = None) -> list[str]:
+        """Unload variants unused for longer than the idle TTL; returns their names."""
+        if self.idle_ttl <= 0:
+            return []
+        now = time.monotonic() if now is None else now
+        unloaded = []
+        for svc in self.services():
+            idle = svc.loaded and not svc.inflight and now - svc.last_used > self.idle_ttl
+            if idle and await svc.unload():
+                self.idle_unloads += 1
+                unloaded.append(svc.variant)
+        return unloaded
+
+    def start(self) -> asyncio.Task | None:
+        """Start the idle reaper (no-op without an idle TTL)."""
+        if self.idle_ttl <= 0 or self._reaper is not None:
+            return None
+        interval = max(1.0, min(30.0, self.idle_ttl / 2))
+
+        async def _reap():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    for name in await self.unload_idle():
+                        logger.info(f"Unloaded idle model variant {name}")
+                except Exception as e:
+                    logger.error(f"Idle model reaper failed: {e}", exc_info=True)
+
+        self._reaper = asyncio.create_task(_reap())
+        return self._reaper
+
+    async def stop(self) -> None:
+        """Stop the reaper and every variant's replica processes."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reaper
+            self._reaper = None
+        for svc in self.services():
+            svc.stop_replicas()
+
+    def stats(self) -> dict[str, Any]:
+        services = {svc.variant: svc for svc in self.services()}
+        return {
+            "default": DEFAULT_VARIANT,
+            "memory_budget": self.memory_budget,
+            "loaded_bytes": self.loaded_bytes(),
+            "idle_ttl_s": self.idle_ttl,
+            "evictions": self.evictions,
+            "idle_unloads": self.idle_unloads,
+            "variants": {
+                name: {
+                    "path": str(path),
+                    "state": services[name].state if name in services else "idle",
+                    "weight_bytes": services[name].weight_bytes if name in services else 0,
+                    "inflight": services[name].inflight if name in services else 0,
+                }
+                for name, path in self.variants.items()
+            },
+        }
+
+
+_manager: ModelManager | None = None
+
+
+def get_model_manager() -> ModelManager:
+    """The process-wide model manager, built from MEDSTATION_MODEL_* settings."""
+    global _manager
+    if _manager is None:
+        _manager = ModelManager(
+            variants=parse_variants(_VARIANTS),
+            memory_budget=_MEMORY_BUDGET_MB * 1024 * 1024,
+            idle_ttl=_IDLE_TTL_S,
+        )
+    return _manager
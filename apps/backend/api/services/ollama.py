@@ -0,0 +1,253 @@
+"""
+Shared HTTP client and model residency tracking for the Ollama proxy.
+
+One keep-alive connection pool per process, opened and closed by the app
+lifespan, so proxied calls reuse warm connections instead of paying
+connection setup on every request. Routes call ``get_client()``, which
+also creates the pool lazily when the lifespan did not run (tests).
+
+``OllamaResidency`` knows which models Ollama has in memory (``/api/ps``),
+caches the tag list, preloads configured models at startup and picks a
+``keep_alive`` per model from how often it is used, so frequently used
+models stay warm.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def _ollama_base(value: str) -> str:
+    """Normalize OLLAMA_HOST, which Ollama itself accepts without a scheme."""
+    value = value.strip().rstrip("/")
+    if "://" not in value:
+        value = f"http://{value}"
+    return value
+
+
+OLLAMA_BASE = _ollama_base(os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
+
+# Connection pool limits
+_MAX_CONNECTIONS = int(os.environ.get("MEDSTATION_OLLAMA_MAX_CONNECTIONS", "32"))
+_MAX_KEEPALIVE = int(os.environ.get("MEDSTATION_OLLAMA_MAX_KEEPALIVE", "16"))
+_KEEPALIVE_EXPIRY_S = float(os.environ.get("MEDSTATION_OLLAMA_KEEPALIVE_S", "60"))
+
+# Residency: cache lifetimes, startup preloads and usage-based keep_alive
+_TAGS_TTL_S = float(os.environ.get("MEDSTATION_OLLAMA_TAGS_TTL_S", "30"))
+_PS_TTL_S = 2.0
+_PRELOAD_MODELS = [m.strip() for m in os.environ.get("MEDSTATION_OLLAMA_PRELOAD", "").split(",") if m.strip()]
+_USAGE_WINDOW_S = 3600.0
+
+# (minimum uses in the last hour, keep_alive) — first match wins
+_KEEP_ALIVE_TIERS = ((20, "2h"), (5, "30m"))
+_DEFAULT_KEEP_ALIVE = "5m"  # Ollama's own default
+# Preloaded models never unload. Ollama parses string durations with Go's
+# time.ParseDuration, which rejects a bare "-1", so this must be a number
+_PINNED_KEEP_ALIVE = -1
+
+# Default timeouts; generate calls override the read timeout
+CONNECT_TIMEOUT_S = 5.0
+GENERATE_TIMEOUT = httpx.Timeout(120.0, connect=CONNECT_TIMEOUT_S)
+
+_client: httpx.AsyncClient | None = None
+
+
+def _create_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=OLLAMA_BASE,
+        timeout=httpx.Timeout(10.0, connect=CONNECT_TIMEOUT_S),
+        limits=httpx.Limits(
+            max_connections=_MAX_CONNECTIONS,
+            max_keepalive_connections=_MAX_KEEPALIVE,
+            keepalive_expiry=_KEEPALIVE_EXPIRY_S,
+        ),
+        transport=transport,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared Ollama client (created on first use if the lifespan didn't)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+async def open_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    """Create the shared client (called from the app lifespan).
+
+    Args:
+        transport: Optional transport override (tests use ``httpx.MockTransport``)
+    """
+    global _client
+    await close_client()
+    _client = _create_client(transport)
+    logger.info(f"Ollama client ready for {OLLAMA_BASE} (max {_MAX_CONNECTIONS} connections)")
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def model_key(name: str) -> str:
+    """Canonical model name (Ollama treats ``medgemma`` as ``medgemma:latest``)."""
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaResidency:
+    """
+    Tracks which Ollama models are resident and how often each is used.
+
+    Args:
+        preload: Models loaded at startup and pinned in memory
+        tags_ttl: Seconds the /api/tags listing is cached
+        clock: Monotonic time source (injectable for tests)
+    """
+
+    def __init__(
+        self,
+        preload: list[str] | None = None,
+        tags_ttl: float = _TAGS_TTL_S,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.preload_models = [model_key(m) for m in (preload or [])]
+        self.tags_ttl = tags_ttl
+        self._clock = clock
+
+        self._tags: list[dict[str, Any]] | None = None
+        self._tags_at = 0.0
+        self._resident: set[str] = set()
+        self._ps_at: float | None = None
+        self._uses: dict[str, deque[float]] = {}
+        self._lock = asyncio.Lock()
+        self._preload_task: asyncio.Task | None = None
+
+        self.cold_starts = 0
+
+    async def tags(self) -> list[dict[str, Any]]:
+        """Installed models from /api/tags, cached for ``tags_ttl`` seconds."""
+        now = self._clock()
+        if self._tags is not None and now - self._tags_at < self.tags_ttl:
+            return self._tags
+        async with self._lock:
+            if self._tags is None or self._clock() - self._tags_at >= self.tags_ttl:
+                resp = await get_client().get("/api/tags", timeout=10.0)
+                resp.raise_for_status()
+                self._tags = resp.json().get("models", [])
+                self._tags_at = self._clock()
+        return self._tags
+
+    async def resident(self, max_age: float = _PS_TTL_S) -> set[str]:
+        """Models currently loaded in Ollama, from /api/ps (briefly cached)."""
+        if self._ps_at is not None and self._clock() - self._ps_at < max_age:
+            return self._resident
+        resp = await get_client().get("/api/ps", timeout=5.0)
+        resp.raise_for_status()
+        self._resident = {model_key(m.get("name") or m.get("model", "")) for m in resp.json().get("models", [])}
+        self._ps_at = self._clock()
+        return self._resident
+
+    async def is_resident(self, model: str) -> bool | None:
+        """Whether ``model`` is loaded, or None if Ollama can't be asked."""
+        try:
+            return model_key(model) in await self.resident()
+        except httpx.HTTPError as e:
+            logger.debug(f"Ollama /api/ps unavailable: {e}")
+            return None
+
+    def record_use(self, model: str) -> None:
+        """Count a request for ``model`` (drives its keep_alive)."""
+        key = model_key(model)
+        now = self._clock()
+        uses = self._uses.setdefault(key, deque())
+        uses.append(now)
+        while uses and now - uses[0] > _USAGE_WINDOW_S:
+            uses.popleft()
+        # The request is about to load it if it wasn't resident
+        self._resident.add(key)
+
+    def uses_last_hour(self, model: str) -> int:
+        uses = self._uses.get(model_key(model))
+        if not uses:
+            return 0
+        cutoff = self._clock() - _USAGE_WINDOW_S
+        return sum(1 for t in uses if t >= cutoff)
+
+    def keep_alive_for(self, model: str) -> int | str:
+        """keep_alive to send with a request: pinned, usage tier, or Ollama's default."""
+        key = model_key(model)
+        if key in self.preload_models:
+            return _PINNED_KEEP_ALIVE
+        uses = self.uses_last_hour(key)
+        for min_uses, keep_alive in _KEEP_ALIVE_TIERS:
+            if uses >= min_uses:
+                return keep_alive
+        return _DEFAULT_KEEP_ALIVE
+
+    async def preload(self, model: str) -> bool:
+        """Load ``model`` into Ollama memory (a generate call with no prompt)."""
+        try:
+            resp = await get_client().post(
+                "/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive_for(model), "stream": False},
+                timeout=GENERATE_TIMEOUT,
+            )
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Ollama preload of {model} failed: {e}")
+            return False
+        self._resident.add(model_key(model))
+        logger.info(f"Ollama model {model} preloaded")
+        return True
+
+    def start_preload(self) -> asyncio.Task | None:
+        """Preload configured models in the background (startup isn't blocked)."""
+        if not self.preload_models:
+            return None
+
+        async def _run():
+            for model in self.preload_models:
+                await self.preload(model)
+
+        self._preload_task = asyncio.create_task(_run())
+        return self._preload_task
+
+    async def stop(self) -> None:
+        if self._preload_task is not None and not self._preload_task.done():
+            self._preload_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._preload_task
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "resident": sorted(self._resident),
+            "preload": self.preload_models,
+            "cold_starts": self.cold_starts,
+            "usage_last_hour": {m: self.uses_last_hour(m) for m in sorted(self._uses)},
+            "keep_alive": {m: self.keep_alive_for(m) for m in sorted(set(self._uses) | set(self.preload_models))},
+        }
+
+
+_residency: OllamaResidency | None = None
+
+
+def get_residency() -> OllamaResidency:
+    """The process-wide residency tracker."""
+    global _residency
+    if _residency is None:
+        _residency = OllamaResidency(preload=_PRELOAD_MODELS)
+    return _residency
@@ -0,0 +1,284 @@
+"""
+ONNX Runtime decode engine for the batching scheduler.
+
+Runs a MedGemma export split into three graphs, the layout Optimum and
+transformers.js produce for Gemma 3 (``_<suffix>`` for quantized builds,
+e.g. ``decoder_model_merged_q4.onnx``):
+
+    embed_tokens.onnx           input_ids -> inputs_embeds
+    vision_encoder.onnx         pixel_values -> image_features (projected)
+    decoder_model_merged.onnx   inputs_embeds + past_key_values.* -> logits + present.*
+
+Each sequence keeps its KV cache as ONNX Runtime ``OrtValue``s. A step
+binds them as the decoder's ``past_key_values`` inputs through I/O binding
+and keeps the ``present`` outputs as the next step's cache, so the cache
+never round-trips through numpy. The exported decoder takes one
+attention layout per run, so sequences are stepped one at a time; the
+scheduler still interleaves them and admits new ones between steps.
+
+Image features come from the ``VisionCache`` when the same image was
+encoded before. Prefix KV reuse is transformers-only.
+
+Only imported after the model has loaded, so onnxruntime and numpy are hard
+dependencies.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import onnxruntime as ort
+
+from api.services.batching import ScheduledSequence
+from api.services.vision_cache import VisionCache
+
+logger = logging.getLogger(__name__)
+
+GRAPHS = ("embed_tokens", "vision_encoder", "decoder_model_merged")
+
+# ONNX tensor element types the exported graphs use
+_NP_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+}
+
+_PAST_PREFIX = "past_key_values."
+_PRESENT_PREFIX = "present."
+
+
+def graph_path(onnx_dir: Path, name: str, suffix: str = "") -> Path:
+    """File of one exported graph (``suffix`` selects a quantized build)."""
+    return Path(onnx_dir) / (f"{name}_{suffix}.onnx" if suffix else f"{name}.onnx")
+
+
+def onnx_bytes(onnx_dir: Path, suffix: str = "") -> int:
+    """Size of an export's graphs, including external weight files (``*.onnx_data``)."""
+    total = 0
+    for name in GRAPHS:
+        path = graph_path(onnx_dir, name, suffix)
+        total += sum(f.stat().st_size for f in path.parent.glob(f"{path.name}*") if f.is_file())
+    return total
+
+
+def _read_json(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+class OnnxModel:
+    """
+    Inference sessions and config for an exported MedGemma snapshot.
+
+    Args:
+        model_dir: Snapshot root (config.json, generation_config.json)
+        onnx_dir: Directory holding the exported graphs
+        suffix: Graph file suffix of a quantized export ("" for full precision)
+        threads: Intra-op threads per session (0 = ONNX Runtime default)
+
+    Raises:
+        FileNotFoundError: The embedding or decoder graph is missing
+    """
+
+    def __init__(self, model_dir: Path, onnx_dir: Path, suffix: str = "", threads: int = 0):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+
+        def _session(name: str, required: bool = True) -> ort.InferenceSession | None:
+            path = graph_path(onnx_dir, name, suffix)
+            if not path.exists():
+                if required:
+                    raise FileNotFoundError(f"ONNX graph not found: {path}")
+                return None
+            return ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+        self.embed = _session("embed_tokens")
+        # Text-only exports have no vision graph
+        self.vision = _session("vision_encoder", required=False)
+        self.decoder = _session("decoder_model_merged")
+        self.nbytes = onnx_bytes(onnx_dir, suffix)
+
+        config = _read_json(Path(model_dir) / "config.json")
+        text_config = config.get("text_config", config)
+        self.image_token_id: int | None = config.get("image_token_index", config.get("image_token_id"))
+        self.generation_config = _read_json(Path(model_dir) / "generation_config.json")
+
+        inputs = {i.name: i for i in self.decoder.get_inputs()}
+        self.input_names = set(inputs)
+        self.past_names = [n for n in inputs if n.startswith(_PAST_PREFIX)]
+        self.present_names = [_PRESENT_PREFIX + n[len(_PAST_PREFIX) :] for n in self.past_names]
+        self.embeds_dtype = _NP_DTYPES.get(inputs["inputs_embeds"].type, np.float32)
+        if self.vision is not None:
+            self.pixel_dtype = _NP_DTYPES.get(self.vision.get_inputs()[0].type, np.float32)
+
+        # Shape of an empty cache entry: (batch, kv heads, 0, head dim)
+        past = inputs[self.past_names[0]]
+        heads, head_dim = past.shape[1], past.shape[3]
+        if not isinstance(heads, int):
+            heads = text_config["num_key_value_heads"]
+        if not isinstance(head_dim, int):
+            head_dim = text_config.get("head_dim") or text_config["hidden_size"] // text_config["num_attention_heads"]
+        self._empty_past = np.zeros((1, heads, 0, head_dim), dtype=_NP_DTYPES.get(past.type, np.float32))
+
+    def empty_past(self) -> list[Any]:
+        """A fresh per-layer KV cache (one ``OrtValue`` per past input)."""
+        return [ort.OrtValue.ortvalue_from_numpy(self._empty_past) for _ in self.past_names]
+
+
+class OnnxEngine:
+    """
+    Prefill/decode over ``OnnxModel`` sessions, one sequence per decoder run.
+
+    Args:
+        model: Loaded ONNX sessions
+        processor: Matching processor (tokenizer is used for detokenization)
+        vision_cache: Optional image-feature cache keyed by image digest
+    """
+
+    def __init__(self, model: OnnxModel, processor, vision_cache: VisionCache | None = None):
+        self.model = model
+        self.tokenizer = processor.tokenizer
+        self.vision_cache = vision_cache if vision_cache is not None and vision_cache.enabled else None
+
+        gen_cfg = model.generation_config
+        eos = gen_cfg.get("eos_token_id")
+        if eos is None:
+            eos = self.tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+
+        # Match model.generate's sampling defaults for do_sample=True
+        self.top_k: int | None = gen_cfg.get("top_k")
+        self.top_p: float | None = gen_cfg.get("top_p")
+        self._rng = np.random.default_rng()
+
+    # -- DecodeEngine -------------------------------------------------------
+
+    def prefill(self, seq: ScheduledSequence) -> int:
+        inputs = seq.inputs
+        input_ids = np.asarray(inputs["input_ids"], dtype=np.int64)
+        length = int(input_ids.shape[-1])
+
+        embeds = self._embed(input_ids)
+        features = inputs.get("image_features")
+        if features is None and "pixel_values" in inputs:
+            features = self._encode_image(inputs["pixel_values"], inputs.get("image_digest"))
+        if features is not None:
+            embeds = self._inject_features(input_ids, embeds, features)
+
+        extra = {}
+        if "token_type_ids" in inputs and "token_type_ids" in self.model.input_names:
+            extra["token_type_ids"] = np.asarray(inputs["token_type_ids"], dtype=np.int64)
+
+        seq.kv = self.model.empty_past()
+        logits = self._run(seq, embeds, np.arange(length, dtype=np.int64)[None, :], length, extra)
+        seq.position = length
+        seq.inputs = None  # pixel arrays are no longer needed
+        return self.sample(logits, seq.temperature)
+
+    def decode(self, seqs: list[ScheduledSequence]) -> list[int]:
+        tokens = []
+        for seq in seqs:
+            embeds = self._embed(np.array([[seq.token_ids[-1]]], dtype=np.int64))
+            logits = self._run(seq, embeds, np.array([[seq.position]], dtype=np.int64), seq.position + 1)
+            seq.position += 1
+            tokens.append(self.sample(logits, seq.temperature))
+        return tokens
+
+    def detach(self, seqs: list[ScheduledSequence]) -> None:
+        # KV state already lives on each sequence
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def detokenize(self, token_ids: list[int]) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    # -- Graph runs ---------------------------------------------------------
+
+    def _embed(self, input_ids: np.ndarray) -> np.ndarray:
+        return self.model.embed.run(None, {"input_ids": input_ids})[0]
+
+    def _encode_image(self, pixel_values, digest: str | None) -> np.ndarray:
+        """Run the vision encoder and remember the result for this image."""
+        if self.model.vision is None:
+            raise ValueError("This ONNX export has no vision encoder; image input is not supported")
+        pixels = np.asarray(pixel_values, dtype=self.model.pixel_dtype)
+        features = self.model.vision.run(None, {"pixel_values": pixels})[0]
+        if digest is not None and self.vision_cache is not None:
+            self.vision_cache.put(digest, features, features.nbytes)
+        return features
+
+    def _inject_features(self, input_ids: np.ndarray, embeds: np.ndarray, features: np.ndarray) -> np.ndarray:
+        """Token embeddings with image placeholder positions replaced by image features."""
+        image_mask = input_ids[0] == self.model.image_token_id
+        count = int(image_mask.sum())
+        if not count:
+            return embeds
+        embeds = embeds.copy()
+        embeds[0, image_mask] = features.reshape(-1, embeds.shape[-1])[:count].astype(embeds.dtype)
+        return embeds
+
+    def _run(
+        self,
+        seq: ScheduledSequence,
+        embeds: np.ndarray,
+        position_ids: np.ndarray,
+        total_length: int,
+        extra: dict[str, np.ndarray] | None = None,
+    ) -> np.ndarray:
+        """
+        One decoder pass for a sequence: bind its KV cache, keep the new one.
+
+        Returns:
+            Next-token logits (vocab,) for the last position
+        """
+        names = self.model.input_names
+        binding = self.model.decoder.io_binding()
+        binding.bind_cpu_input("inputs_embeds", np.ascontiguousarray(embeds, dtype=self.model.embeds_dtype))
+        binding.bind_cpu_input("attention_mask", np.ones((1, total_length), dtype=np.int64))
+        if "position_ids" in names:
+            binding.bind_cpu_input("position_ids", position_ids)
+        for name in ("num_logits_to_keep", "logits_to_keep"):
+            if name in names:
+                # Skip full-vocabulary logits for every prompt position
+                binding.bind_cpu_input(name, np.array(1, dtype=np.int64))
+        for name, value in (extra or {}).items():
+            binding.bind_cpu_input(name, value)
+        for name, value in zip(self.model.past_names, seq.kv, strict=True):
+            binding.bind_ortvalue_input(name, value)
+
+        binding.bind_output("logits", "cpu")
+        for name in self.model.present_names:
+            binding.bind_output(name, "cpu")
+        self.model.decoder.run_with_iobinding(binding)
+
+        outputs = binding.get_outputs()
+        seq.kv = outputs[1:]
+        return outputs[0].numpy()[0, -1]
+
+    # -- Sampling -------------------------------------------------------------
+
+    def sample(self, logits: np.ndarray, temperature: float) -> int:
+        """Pick the next token: greedy for temperature 0, else top-k/top-p sampling."""
+        if temperature <= 0:
+            return int(np.argmax(logits))
+
+        scaled = logits.astype(np.float64) / max(temperature, 1e-5)
+        if self.top_k and self.top_k < scaled.shape[-1]:
+            kth = np.partition(scaled, -self.top_k)[-self.top_k]
+            scaled[scaled < kth] = -np.inf
+        if self.top_p is not None and self.top_p < 1.0:
+            order = np.argsort(-scaled)
+            probs = _softmax(scaled[order])
+            remove = (np.cumsum(probs) - probs) > self.top_p
+            scaled[order[remove]] = -np.inf
+        return int(self._rng.choice(scaled.shape[-1], p=_softmax(scaled)))
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    e = np.exp(x - np.max(x))
+    return e / e.sum()
@@ -0,0 +1,107 @@
+"""
+MedGemma on ONNX Runtime.
+
+Selected with MEDSTATION_INFERENCE_BACKEND=onnx. Loads exported graphs
+from the snapshot's ``onnx/`` directory (see onnx_engine.py) instead of
+the safetensors weights, so inference needs onnxruntime and numpy but not
+torch; the processor still comes from transformers. Everything above the
+decode engine (batch scheduling, response and vision caches, streaming,
+metrics, tracing) is the shared ``MedGemmaService`` code.
+
+Speculative decoding and forked replicas are transformers-only: requests
+asking for speculation decode normally, and MEDSTATION_INFERENCE_WORKERS
+is ignored (raise MEDSTATION_ONNX_THREADS instead).
+"""
+
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Any
+
+from api.services.medgemma import MedGemmaService
+
+logger = logging.getLogger(__name__)
+
+# Exported graphs, relative to the variant's snapshot directory
+_ONNX_SUBDIR = os.environ.get("MEDSTATION_ONNX_SUBDIR", "onnx")
+
+# Graph file suffix of a quantized export ("q4" -> decoder_model_merged_q4.onnx; empty = full precision)
+_ONNX_SUFFIX = os.environ.get("MEDSTATION_ONNX_SUFFIX", "")
+
+# Intra-op threads per ONNX Runtime session (0 = one per physical core)
+_ONNX_THREADS = int(os.environ.get("MEDSTATION_ONNX_THREADS", "0"))
+
+
+class OnnxMedGemmaService(MedGemmaService):
+    """
+    MedGemma inference for one model variant on ONNX Runtime (CPU).
+
+    Takes the same arguments as ``MedGemmaService``; ``cpu_precision`` is
+    unused because precision is fixed by the export (see MEDSTATION_ONNX_SUFFIX).
+    """
+
+    backend = "onnx"
+    supports_speculative = False
+    supports_replicas = False
+
+    async def _load_model(self, model_path: Path) -> None:
+        def _import():
+            from transformers import AutoProcessor
+
+            from api.services.onnx_engine import OnnxModel, onnx_bytes
+
+            return AutoProcessor, OnnxModel, onnx_bytes
+
+        with self._timed("import"):
+            AutoProcessor, OnnxModel, onnx_bytes = await asyncio.to_thread(_import)
+
+        self.device = "cpu"
+        onnx_dir = model_path / _ONNX_SUBDIR
+        if self.manager is not None:
+            # Unload idle variants first if this one would exceed the memory budget
+            await self.manager.make_room(self, self.weight_bytes or onnx_bytes(onnx_dir, _ONNX_SUFFIX))
+
+        def _load_processor():
+            self.processor = AutoProcessor.from_pretrained(str(model_path))
+
+        def _load_sessions():
+            self.model = OnnxModel(model_path, onnx_dir, suffix=_ONNX_SUFFIX, threads=_ONNX_THREADS)
+
+        with self._timed("processor"):
+            await asyncio.to_thread(_load_processor)
+        with self._timed("sessions"):
+            await asyncio.to_thread(_load_sessions)
+
+        # Namespaces response-cache entries apart from the transformers backend
+        self.precision = f"onnx-{_ONNX_SUFFIX}" if _ONNX_SUFFIX else "onnx"
+        self.weight_bytes = self.model.nbytes
+
+    def _prepare_inputs(self, messages: list, image_digest: str | None = None) -> dict[str, Any]:
+        """
+        Apply the chat template to numpy arrays (runs in a worker thread).
+
+        When the image's encoder outputs are cached, its pixel values are
+        dropped and the engine injects the cached features instead.
+        """
+        inputs = dict(
+            self.processor.apply_chat_template(
+                messages,
+                add_generation_prompt=True,
+                tokenize=True,
+                return_dict=True,
+                return_tensors="np",
+            )
+        )
+        if image_digest is not None:
+            inputs["image_digest"] = image_digest
+            features = self.vision_cache.get(image_digest) if self.vision_cache.enabled else None
+            if features is not None:
+                inputs.pop("pixel_values", None)
+                inputs["image_features"] = features
+        return inputs
+
+    def _make_engine(self):
+        from api.services.onnx_engine import OnnxEngine
+
+        return OnnxEngine(self.model, self.processor, vision_cache=self.vision_cache)
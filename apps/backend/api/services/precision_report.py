@@ -0,0 +1,225 @@
+"""
+Accuracy/latency comparison of MedGemma CPU precision modes.
+
+Runs a fixed set of triage prompts through each mode and reports load
+time, weight memory, latency, throughput and how closely each mode's
+answers agree with the first (baseline) mode:
+
+    cd apps/backend
+    python -m api.services.precision_report --modes fp32,bf16,int8 --max-tokens 128 --out report.json
+
+Modes run one after another in this process. Each mode loads the model,
+runs one warmup, then answers the prompts one at a time with greedy
+decoding, so the timings are not affected by batching or sampling. The
+model is unloaded before the next mode loads. ``weight_mb`` is measured
+from the loaded tensors. ``rss_mb`` is the whole process and can include
+memory the allocator kept from earlier modes.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are an expert medical AI assistant."
+
+# Fixed prompt set: short triage questions covering the workflow's step types
+PROMPTS = [
+    "A 58-year-old man has crushing chest pain radiating to the left arm for 30 minutes. What is the triage level?",
+    "List the red-flag symptoms in a child with fever and a non-blanching rash.",
+    "A 24-year-old woman has sudden severe headache, 'worst of her life', with neck stiffness. Give a differential diagnosis.",
+    "An elderly patient on warfarin fell and hit their head but feels fine. What are the risks and next steps?",
+    "Summarize first aid for a second-degree burn on the forearm.",
+    "A diabetic patient has blood glucose of 45 mg/dL and is confused. What immediate actions are needed?",
+]
+
+
+def agreement(a: str, b: str) -> float:
+    """Word-level similarity of two answers (1.0 = identical)."""
+    return SequenceMatcher(None, a.split(), b.split(), autojunk=False).ratio()
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # Peak rather than current RSS (bytes on macOS, KiB on Linux)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _count_tokens(svc, text: str) -> int:
+    tokenizer = getattr(getattr(svc, "processor", None), "tokenizer", None)
+    if tokenizer is None:
+        return len(text.split())
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+async def run_mode(svc, prompts: list[str], max_new_tokens: int) -> dict[str, Any]:
+    """Load ``svc``, answer every prompt greedily and collect timings and outputs."""
+    started = time.perf_counter()
+    if not await svc.load():
+        raise RuntimeError(f"Model failed to load in {svc.cpu_precision} mode")
+    load_s = time.perf_counter() - started
+
+    await svc.generate(prompt=prompts[0], system_prompt=SYSTEM_PROMPT, max_new_tokens=8, temperature=0.0)
+
+    outputs, first_chunk_ms, latency_s, tokens = [], [], [], 0
+    for prompt in prompts:
+        chunks = []
+        started = time.perf_counter()
+        first = None
+        async for chunk in svc.stream_generate(
+            prompt=prompt, system_prompt=SYSTEM_PROMPT, max_new_tokens=max_new_tokens, temperature=0.0
+        ):
+            if first is None:
+                first = time.perf_counter() - started
+            chunks.append(chunk)
+        elapsed = time.perf_counter() - started
+        text = "".join(chunks)
+        outputs.append(text)
+        first_chunk_ms.append((first if first is not None else elapsed) * 1000)
+        latency_s.append(elapsed)
+        tokens += _count_tokens(svc, text)
+
+    result = {
+        "mode": svc.cpu_precision,
+        "precision": svc.precision,
+        "load_s": round(load_s, 2),
+        "weight_mb": round(svc.weight_bytes / 2**20),
+        "rss_mb": round(_rss_bytes() / 2**20),
+        "first_chunk_ms": round(statistics.mean(first_chunk_ms), 1),
+        "latency_s": round(statistics.mean(latency_s), 2),
+        "tokens_per_s": round(tokens / sum(latency_s), 2) if sum(latency_s) else 0.0,
+        "outputs": outputs,
+    }
+    await svc.unload()
+    return result
+
+
+def _default_factory(model_dir: Path | None) -> Callable[[str], Any]:
+    from api.services.medgemma import MedGemmaService
+    from api.services.response_cache import ResponseCache
+
+    def _make(mode: str):
+        # No response cache: every mode must actually generate
+        return MedGemmaService(
+            model_dir=model_dir,
+            variant=f"report-{mode}",
+            response_cache=ResponseCache(max_entries=0),
+            cpu_precision=mode,
+        )
+
+    return _make
+
+
+async def compare(
+    modes: list[str],
+    prompts: list[str] = PROMPTS,
+    max_new_tokens: int = 128,
+    service_factory: Callable[[str], Any] | None = None,
+    model_dir: Path | None = None,
+) -> dict[str, Any]:
+    """
+    Run ``prompts`` through each precision mode and compare against the first.
+
+    Args:
+        modes: CPU precisions to compare; the first is the baseline
+        prompts: Prompt set (the same for every mode)
+        max_new_tokens: Generation length per prompt
+        service_factory: Builds the service for a mode (defaults to MedGemmaService)
+        model_dir: Snapshot to load (defaults to the 4B model)
+    """
+    factory = service_factory or _default_factory(model_dir)
+    results = []
+    for mode in modes:
+        logger.info(f"Running {len(prompts)} prompts in {mode} mode")
+        results.append(await run_mode(factory(mode), prompts, max_new_tokens))
+
+    baseline = results[0]["outputs"]
+    for result in results:
+        scores = [agreement(a, b) for a, b in zip(baseline, result["outputs"], strict=True)]
+        result["agreement"] = round(statistics.mean(scores), 3)
+        result["exact_match"] = round(
+            sum(a == b for a, b in zip(baseline, result["outputs"], strict=True)) / len(prompts), 3
+        )
+
+    return {
+        "baseline": modes[0],
+        "prompts": prompts,
+        "max_new_tokens": max_new_tokens,
+        "modes": results,
+    }
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """Render a comparison as a fixed-width table."""
+    columns = [
+        ("mode", "mode"),
+        ("loaded as", "precision"),
+        ("load s", "load_s"),
+        ("weights MB", "weight_mb"),
+        ("RSS MB", "rss_mb"),
+        ("1st chunk ms", "first_chunk_ms"),
+        ("latency s", "latency_s"),
+        ("tok/s", "tokens_per_s"),
+        ("agreement", "agreement"),
+        ("exact", "exact_match"),
+    ]
+    rows = [[title for title, _ in columns]]
+    rows += [[str(result.get(key)) for _, key in columns] for result in report["modes"]]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    lines = ["  ".join(cell.rjust(width) for cell, width in zip(row, widths, strict=True)) for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    lines.append("")
+    lines.append(
+        f"{len(report['prompts'])} prompts, {report['max_new_tokens']} max new tokens, greedy; "
+        f"agreement is word-level similarity to {report['baseline']}"
+    )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    from api.services.quantization import CPU_PRECISIONS
+
+    parser = argparse.ArgumentParser(description="Compare MedGemma CPU precision modes")
+    parser.add_argument(
+        "--modes", default="fp32,int8", help=f"comma-separated, baseline first ({', '.join(CPU_PRECISIONS)})"
+    )
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--model-dir", type=Path, default=None)
+    parser.add_argument("--out", type=Path, default=None, help="write the full report (with outputs) as JSON")
+    args = parser.parse_args(argv)
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in CPU_PRECISIONS]
+    if not modes or unknown:
+        parser.error(f"--modes must be a list of {', '.join(CPU_PRECISIONS)}")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s %(name)s: %(message)s")
+    os.environ.setdefault("MEDSTATION_INFERENCE_WORKERS", "1")
+    report = asyncio.run(compare(modes, max_new_tokens=args.max_tokens, model_dir=args.model_dir))
+
+    print(format_report(report))
+    if args.out is not None:
+        args.out.write_text(json.dumps(report, indent=2))
+        print(f"Full report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Shared-prefix KV cache for MedGemma prefill.
+
+Keeps the past_key_values computed for recent prompts in a memory-bounded
+LRU, keyed by their token ids. A new prompt is matched against the stored
+entries by longest common token prefix, so requests that share the system
+prompt, or the ``Patient Context`` block repeated across triage workflow
+steps, only prefill the tokens after the shared part.
+
+Entries are opaque to this module; the engine decides how to store and
+crop KV tensors and reports each entry's size in bytes.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Any
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    """Number of leading tokens shared by two id sequences."""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class _Entry:
+    __slots__ = ("token_ids", "kv", "nbytes", "croppable")
+
+    def __init__(self, token_ids: tuple[int, ...], kv: Any, nbytes: int, croppable: bool):
+        self.token_ids = token_ids
+        self.kv = kv
+        self.nbytes = nbytes
+        self.croppable = croppable
+
+
+class PrefixCache:
+    """
+    LRU of prompt KV states with longest-common-prefix lookup.
+
+    Args:
+        max_bytes: Memory budget; least recently used entries are evicted
+            once the total size of stored KV tensors exceeds it
+        min_match: Shortest shared prefix worth reusing (shorter matches,
+            like a bare ``<bos>`` turn header, are treated as misses)
+    """
+
+    def __init__(self, max_bytes: int, min_match: int = 16):
+        self.max_bytes = max_bytes
+        self.min_match = min_match
+        self._entries: OrderedDict[tuple[int, ...], _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def lookup(self, token_ids: Sequence[int]) -> tuple[int, Any] | None:
+        """
+        Find the stored entry sharing the longest prefix with ``token_ids``.
+
+        Returns:
+            (match_length, kv) — the caller must use only the first
+            ``match_length`` positions of ``kv`` — or None on a miss
+        """
+        best: _Entry | None = None
+        best_len = 0
+        with self._lock:
+            for entry in self._entries.values():
+                n = common_prefix_length(entry.token_ids, token_ids)
+                if n < len(entry.token_ids) and not entry.croppable:
+                    # Sliding-window layers no longer hold the earlier positions
+                    continue
+                if n > best_len:
+                    best, best_len = entry, n
+
+            if best is None or best_len < self.min_match:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best.token_ids)
+            self.hits += 1
+            self.tokens_reused += best_len
+            return best_len, best.kv
+
+    def insert(self, token_ids: Sequence[int], kv: Any, nbytes: int, croppable: bool = True) -> None:
+        """
+        Store the KV state for a prompt.
+
+        Args:
+            token_ids: Token ids the KV state covers
+            kv: Engine-specific KV state (must not be mutated afterwards)
+            nbytes: Size of the KV tensors, counted against the budget
+            croppable: Whether the state can serve a shorter prefix of
+                ``token_ids`` (False when some layers were truncated)
+        """
+        key = tuple(token_ids)
+        if not self.enabled or len(key) < self.min_match or nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            if croppable:
+                # A croppable entry serves every prefix of itself; drop entries it covers
+                for other in [e for e in self._entries.values() if len(e.token_ids) < len(key)]:
+                    if key[: len(other.token_ids)] == other.token_ids:
+                        self._remove(other)
+
+            self._entries[key] = _Entry(key, kv, nbytes, croppable)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries.values())))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "tokens_reused": self.tokens_reused,
+            }
+
+    def _remove(self, entry: _Entry) -> None:
+        del self._entries[entry.token_ids]
+        self._bytes -= entry.nbytes
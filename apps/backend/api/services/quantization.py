@@ -0,0 +1,122 @@
+"""
+CPU precision modes for MedGemma inference.
+
+float32 is the safe default on CPU but holds ~16 GB of weights for the 4B
+model and runs the slowest matmuls. Two reduced-precision modes are
+selectable at load time (MEDSTATION_CPU_PRECISION):
+
+    fp32  float32 weights and activations (default)
+    bf16  bfloat16 weights; only used where the CPU has native bf16
+          instructions (AVX512-BF16 / AMX on x86, FEAT_BF16 on Arm),
+          otherwise falls back to fp32
+    int8  float32 load, then dynamic int8 quantization of the language
+          model's Linear layers (weights int8, activations quantized per
+          batch). The vision tower and projector stay float32.
+
+Use ``python -m api.services.precision_report`` to compare modes on a
+fixed prompt set before choosing one.
+"""
+
+import logging
+import platform
+import subprocess
+from functools import lru_cache
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+CPU_PRECISIONS = ("fp32", "bf16", "int8")
+
+# Submodules left in float32 by int8 quantization (image path accuracy)
+_FLOAT_MODULES = ("vision", "multi_modal_projector")
+
+
+@lru_cache(maxsize=1)
+def cpu_supports_bf16() -> bool:
+    """Whether this CPU executes bfloat16 matmuls natively."""
+    system = platform.system()
+    if system == "Linux":
+        try:
+            with open("/proc/cpuinfo") as f:
+                flags = f.read()
+        except OSError:
+            return False
+        return any(flag in flags for flag in ("avx512_bf16", "amx_bf16", " bf16"))
+    if system == "Darwin" and platform.machine() == "arm64":
+        try:
+            out = subprocess.run(
+                ["sysctl", "-n", "hw.optional.arm.FEAT_BF16"], capture_output=True, text=True, timeout=2
+            )
+        except (OSError, subprocess.SubprocessError):
+            return False
+        return out.stdout.strip() == "1"
+    return False
+
+
+def resolve_cpu_precision(requested: str) -> str:
+    """
+    The precision to load with on CPU.
+
+    Raises:
+        ValueError: ``requested`` is not one of CPU_PRECISIONS
+    """
+    precision = requested.strip().lower()
+    if precision not in CPU_PRECISIONS:
+        raise ValueError(f"Unknown CPU precision '{requested}'; expected one of {', '.join(CPU_PRECISIONS)}")
+    if precision == "bf16" and not cpu_supports_bf16():
+        logger.warning("CPU has no native bfloat16 support; loading MedGemma in fp32 instead")
+        return "fp32"
+    return precision
+
+
+def load_dtype(torch, precision: str):
+    """torch dtype to load weights in for a resolved CPU precision."""
+    return torch.bfloat16 if precision == "bf16" else torch.float32
+
+
+def model_bytes(model) -> int:
+    """Memory held by a model's weights, including packed int8 Linear weights."""
+    import torch
+
+    seen = set()
+
+    def _size(value) -> int:
+        if isinstance(value, torch.Tensor):
+            # Tied weights (embeddings / lm_head) share storage; count them once
+            key = None if value.is_quantized else value.data_ptr()
+            if key is not None and key in seen:
+                return 0
+            seen.add(key)
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(_size(v) for v in value)
+        return 0
+
+    return sum(_size(v) for v in model.state_dict().values())
+
+
+def quantizable_linears(model) -> list[str]:
+    """Names of the Linear layers int8 mode quantizes (language model only)."""
+    import torch
+
+    return [
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and not any(part in name for part in _FLOAT_MODULES)
+    ]
+
+
+def quantize_int8(model) -> Any:
+    """
+    Replace the language model's Linear layers with dynamic int8 ones, in place.
+
+    Weights are quantized per output channel once; activations are
+    quantized on the fly per batch, so no calibration data is needed.
+    """
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    names = quantizable_linears(model)
+    quantize_dynamic(model, qconfig_spec=set(names), dtype=torch.qint8, inplace=True)
+    logger.info(f"Quantized {len(names)} Linear layers to int8")
+    return model
@@ -0,0 +1,255 @@
+"""
+Multi-process MedGemma replicas sharing one copy of the weights.
+
+The API process loads the model once and then forks N inference workers.
+Forked children inherit the parent's memory copy-on-write, and inference
+never writes to weight tensors, so every worker reads the same physical
+pages: N workers cost roughly one model's RAM plus per-worker KV caches
+and activations.
+
+Each worker runs its own event loop and batch scheduler and handles its
+own request stream, with torch's intra-op threads divided among workers.
+The API process keeps HTTP handling and the response cache, and
+dispatches each request to the worker with the fewest in flight over a
+pair of one-way pipes:
+
+    parent -> worker:  ("generate", id, kwargs) | ("cancel", id, None) | ("stop", None, None)
+    worker -> parent:  ("chunk", id, text) | ("done", id, None) | ("error", id, message)
+
+Only available where ``fork`` is (Linux, macOS) and for CPU inference:
+CUDA and MPS contexts do not survive a fork.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from collections.abc import AsyncGenerator
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaError(Exception):
+    """A replica failed the request or exited while it was in flight."""
+
+
+class _Replica:
+    """Parent-side handle for one worker process."""
+
+    def __init__(self, index: int, process, requests, results):
+        self.index = index
+        self.process = process
+        self.requests = requests  # parent -> worker
+        self.results = results  # worker -> parent
+        self.inflight = 0
+        self.served = 0
+        self.alive = True
+        self.send_lock = threading.Lock()
+        self.reader: threading.Thread | None = None
+
+    def send(self, message: tuple[str, Any, Any]) -> None:
+        with self.send_lock:
+            self.requests.send(message)
+
+
+class ReplicaPool:
+    """
+    Forked inference workers behind an in-process dispatcher.
+
+    Args:
+        svc: Loaded ``MedGemmaService`` whose model the workers inherit
+        num_workers: Number of worker processes
+        threads_per_worker: torch intra-op threads per worker
+            (defaults to the CPU count divided among workers)
+    """
+
+    def __init__(self, svc, num_workers: int, threads_per_worker: int | None = None):
+        self.svc = svc
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+
+        self._replicas: list[_Replica] = []
+        self._pending: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Queue, _Replica]] = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def start(self) -> None:
+        """Fork the workers. Call from the parent after the model is loaded."""
+        ctx = multiprocessing.get_context("fork")
+        for index in range(self.num_workers):
+            req_recv, req_send = ctx.Pipe(duplex=False)
+            res_recv, res_send = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_replica_main,
+                args=(self.svc, req_recv, res_send, index, self.threads_per_worker),
+                name=f"medgemma-replica-{index}",
+                daemon=True,
+            )
+            process.start()
+            # The parent keeps only its ends of the pipes
+            req_recv.close()
+            res_send.close()
+
+            replica = _Replica(index, process, req_send, res_recv)
+            replica.reader = threading.Thread(
+                target=self._read_results, args=(replica,), name=f"replica-reader-{index}", daemon=True
+            )
+            replica.reader.start()
+            self._replicas.append(replica)
+
+        logger.info(
+            f"Started {self.num_workers} MedGemma replicas ({self.threads_per_worker} threads each, shared weights)"
+        )
+
+    def stop(self, timeout: float = 5.0) -> None:
+        for replica in self._replicas:
+            if replica.alive:
+                with contextlib.suppress(OSError, ValueError):
+                    replica.send(("stop", None, None))
+        for replica in self._replicas:
+            replica.process.join(timeout=timeout)
+            if replica.process.is_alive():
+                replica.process.terminate()
+            replica.alive = False
+        self._replicas = []
+
+    async def stream(self, **kwargs) -> AsyncGenerator[str, None]:
+        """
+        Run ``stream_generate(**kwargs)`` on the least-busy replica.
+
+        Closing the generator early cancels the request in the worker.
+        """
+        replica = self._pick()
+        req_id = next(self._ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._pending_lock:
+            self._pending[req_id] = (asyncio.get_running_loop(), queue, replica)
+        replica.inflight += 1
+
+        finished = False
+        try:
+            replica.send(("generate", req_id, kwargs))
+            while True:
+                kind, value = await queue.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "done":
+                    finished = True
+                    replica.served += 1
+                    return
+                else:
+                    finished = True
+                    raise ReplicaError(value)
+        finally:
+            replica.inflight -= 1
+            with self._pending_lock:
+                self._pending.pop(req_id, None)
+            if not finished and replica.alive:
+                with contextlib.suppress(OSError, ValueError):
+                    replica.send(("cancel", req_id, None))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": [
+                {
+                    "index": r.index,
+                    "pid": r.process.pid,
+                    "alive": r.alive,
+                    "inflight": r.inflight,
+                    "served": r.served,
+                }
+                for r in self._replicas
+            ],
+            "threads_per_worker": self.threads_per_worker,
+        }
+
+    def _pick(self) -> _Replica:
+        alive = [r for r in self._replicas if r.alive]
+        if not alive:
+            raise ReplicaError("No MedGemma replicas are running")
+        return min(alive, key=lambda r: r.inflight)
+
+    # -- Reader threads ----------------------------------------------------
+
+    def _read_results(self, replica: _Replica) -> None:
+        while True:
+            try:
+                kind, req_id, value = replica.results.recv()
+            except (EOFError, OSError):
+                break
+            self._deliver(req_id, (kind, value))
+
+        replica.alive = False
+        logger.error(f"MedGemma replica {replica.index} exited")
+        with self._pending_lock:
+            orphaned = [req_id for req_id, (_, _, r) in self._pending.items() if r is replica]
+        for req_id in orphaned:
+            self._deliver(req_id, ("error", f"Replica {replica.index} exited"))
+
+    def _deliver(self, req_id: int, item: tuple[str, Any]) -> None:
+        with self._pending_lock:
+            entry = self._pending.get(req_id)
+        if entry is None:
+            return  # cancelled by the caller
+        loop, queue, _ = entry
+        # RuntimeError: the caller's event loop is gone
+        with contextlib.suppress(RuntimeError):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+
+# -- Worker process ---------------------------------------------------------
+
+
+def _replica_main(svc, requests, results, index: int, num_threads: int) -> None:
+    """Entry point of a forked worker: serve requests with the inherited model."""
+    try:
+        import torch
+
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+
+    svc.reset_after_fork()
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(_serve(svc, requests, results))
+
+
+async def _serve(svc, requests, results) -> None:
+    loop = asyncio.get_running_loop()
+    tasks: dict[int, asyncio.Task] = {}
+
+    def _recv():
+        try:
+            return requests.recv()
+        except (EOFError, OSError):
+            return ("stop", None, None)
+
+    async def _generate(req_id: int, kwargs: dict[str, Any]) -> None:
+        try:
+            async for chunk in svc.stream_generate(**kwargs):
+                results.send(("chunk", req_id, chunk))
+            results.send(("done", req_id, None))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Replica request {req_id} failed: {e}", exc_info=True)
+            results.send(("error", req_id, str(e)))
+        finally:
+            tasks.pop(req_id, None)
+
+    while True:
+        kind, req_id, payload = await loop.run_in_executor(None, _recv)
+        if kind == "stop":
+            break
+        if kind == "generate":
+            tasks[req_id] = asyncio.create_task(_generate(req_id, payload))
+        elif kind == "cancel" and req_id in tasks:
+            tasks[req_id].cancel()
+
+    for task in list(tasks.values()):
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,176 @@
+"""
+Response cache for deterministic (temperature 0) MedGemma generations.
+
+Greedy decoding is deterministic for a given model and input, so repeated
+protocol questions and re-runs of the same case after a UI refresh can be
+answered from cache instead of paying full inference cost.
+
+Two tiers:
+  - In-memory LRU (always on unless the size is 0)
+  - Optional SQLite file that survives restarts, capped at a number of
+    entries (oldest written are evicted first)
+
+Entries store the generated text as the chunks it was streamed in, so
+``stream: true`` hits replay a token stream rather than one large chunk.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_WORD_CHUNK = re.compile(r"\s*\S+|\s+$")
+
+
+def cache_key(
+    model_id: str,
+    system_prompt: str,
+    prompt: str,
+    image_digest: str | None,
+    max_new_tokens: int,
+) -> str:
+    """Stable key for a greedy generation request."""
+    payload = json.dumps(
+        [model_id, system_prompt, prompt, image_digest, max_new_tokens],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def split_chunks(text: str) -> list[str]:
+    """Split text into word-sized chunks for replaying a non-streamed entry."""
+    return _WORD_CHUNK.findall(text) or [text]
+
+
+class ResponseCache:
+    """
+    Two-tier LRU cache of generated responses.
+
+    Args:
+        max_entries: In-memory LRU capacity (0 disables the cache entirely)
+        db_path: Optional SQLite file for the persistent tier
+        max_disk_entries: Rows kept in the SQLite file (0 = unlimited)
+    """
+
+    def __init__(self, max_entries: int = 256, db_path: str | None = None, max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: OrderedDict[str, list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.disk_evictions = 0
+
+        if db_path and self.enabled:
+            try:
+                Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, chunks TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+                self._evict_disk()
+                self._db.commit()
+                logger.info(f"Response cache persisted to {db_path}")
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache disk tier disabled: {e}")
+                self._db = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> list[str] | None:
+        """Return the cached chunks for ``key``, promoting disk hits into memory."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            chunks = self._memory.get(key)
+            if chunks is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return chunks
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT chunks FROM responses WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Response cache read failed: {e}")
+                    row = None
+                if row is not None:
+                    chunks = json.loads(row[0])
+                    self._remember(key, chunks)
+                    self.disk_hits += 1
+                    return chunks
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, chunks: list[str]) -> None:
+        """Store a completed response in both tiers."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._remember(key, chunks)
+            self.stores += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, chunks, created_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(chunks, ensure_ascii=False), time.time()),
+                    )
+                    self._evict_disk()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Response cache write failed: {e}")
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "persistent": self._db is not None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "disk_evictions": self.disk_evictions,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _evict_disk(self) -> None:
+        """Delete the oldest rows beyond ``max_disk_entries`` (caller commits)."""
+        if self.max_disk_entries <= 0:
+            return
+        deleted = self._db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY created_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        ).rowcount
+        self.disk_evictions += max(deleted, 0)
+
+    def _remember(self, key: str, chunks: list[str]) -> None:
+        self._memory[key] = chunks
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
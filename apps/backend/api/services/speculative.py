@@ -0,0 +1,155 @@
+"""
+Speculative decoding for MedGemma generation.
+
+Decoding is memory-bound: one forward pass costs about the same whether
+it scores one position or ten. Speculative decoding drafts several tokens
+cheaply, then scores them all in one pass of the full model. It keeps the
+longest prefix of the draft that the model agrees with, plus the model's
+own next token. Every step yields at least one token, and usually more.
+
+Two drafters:
+
+    prompt_lookup  Finds the latest earlier occurrence of the context's
+                   last n-gram and proposes the tokens that followed it.
+                   Triage answers repeat much of the patient context
+                   ("HR: 110 bpm", medication names), so these drafts are
+                   often accepted. Costs nothing to run.
+    draft          A small causal LM with the same tokenizer proposes
+                   tokens greedily (MEDSTATION_DRAFT_MODEL_DIR).
+
+Greedy verification emits the same tokens as plain greedy decoding,
+apart from floating-point near-ties, where scoring several positions in
+one pass can round differently. With sampling, a draft token is accepted
+with the target model's probability for it, so outputs follow the same
+distribution. Speculative requests run in their own scheduler. Each
+active sequence takes one draft-and-verify step per iteration, and the
+steps are not batched across sequences.
+"""
+
+import logging
+from collections.abc import Sequence
+from typing import Any
+
+from api.services.batching import BatchScheduler, ScheduledSequence
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_MODES = ("prompt_lookup", "draft")
+
+
+class PromptLookupDrafter:
+    """
+    N-gram drafting from the sequence's own context (prompt + output so far).
+
+    Args:
+        max_ngram: Longest suffix n-gram to look up (tried first)
+        min_ngram: Shortest n-gram worth matching
+    """
+
+    def __init__(self, max_ngram: int = 3, min_ngram: int = 1):
+        self.max_ngram = max(1, max_ngram)
+        self.min_ngram = max(1, min(min_ngram, self.max_ngram))
+
+    def propose(self, context: Sequence[int], num_tokens: int) -> list[int]:
+        """Up to ``num_tokens`` tokens that followed the latest earlier match of the context's tail."""
+        if num_tokens <= 0:
+            return []
+        length = len(context)
+        for n in range(min(self.max_ngram, length - 1), self.min_ngram - 1, -1):
+            tail = list(context[length - n :])
+            # Latest occurrence that is followed by at least one token
+            for start in range(length - n - 1, -1, -1):
+                if context[start] == tail[0] and list(context[start : start + n]) == tail:
+                    return list(context[start + n : start + n + num_tokens])
+        return []
+
+
+def accept_greedy(draft: Sequence[int], predicted: Sequence[int]) -> tuple[int, list[int]]:
+    """
+    Verify a draft against the target model's greedy picks.
+
+    Args:
+        draft: Drafted tokens d_0..d_{n-1}
+        predicted: Target argmax after the last accepted token and after
+            each draft token (n + 1 entries)
+
+    Returns:
+        (number of draft tokens accepted, tokens to emit); the emitted
+        tokens are the accepted drafts followed by the target's own pick
+    """
+    accepted = 0
+    while accepted < len(draft) and draft[accepted] == predicted[accepted]:
+        accepted += 1
+    return accepted, list(draft[:accepted]) + [predicted[accepted]]
+
+
+def speculative_stats(seq: ScheduledSequence) -> dict[str, Any] | None:
+    """Acceptance metadata for a finished speculative sequence, or None."""
+    stats = seq.stats
+    if not stats.get("target_forwards"):
+        return None
+    drafted = stats.get("drafted", 0)
+    tokens = len(seq.token_ids)
+    return {
+        "mode": stats.get("mode"),
+        "drafted": drafted,
+        "accepted": stats.get("accepted", 0),
+        "acceptance_rate": round(stats.get("accepted", 0) / drafted, 3) if drafted else 0.0,
+        "target_forwards": stats["target_forwards"],
+        "tokens": tokens,
+        # Plain decoding needs one forward pass per token; this is the step-count speedup
+        "tokens_per_forward": round(tokens / stats["target_forwards"], 2),
+    }
+
+
+class SpeculativeScheduler(BatchScheduler):
+    """
+    Decode loop for speculative requests.
+
+    The engine must implement ``speculate(seq) -> list[int]``, which
+    returns one or more tokens per call. Admission, backpressure,
+    cancellation and detokenization work as in ``BatchScheduler``.
+    ``max_batch_size`` caps how many speculative sequences are
+    interleaved at once.
+    """
+
+    def __init__(self, engine, max_active: int = 4, max_buffered_chunks: int = 64):
+        super().__init__(
+            engine, max_batch_size=max_active, max_prefills_per_step=1, max_buffered_chunks=max_buffered_chunks
+        )
+        self._drafted = 0
+        self._accepted = 0
+
+    def stats(self) -> dict[str, Any]:
+        stats = super().stats()
+        stats["drafted"] = self._drafted
+        stats["accepted"] = self._accepted
+        stats["acceptance_rate"] = round(self._accepted / self._drafted, 3) if self._drafted else 0.0
+        return stats
+
+    def _decode_step(self) -> None:
+        for seq in list(self._active):
+            if seq.cancelled:
+                continue
+            drafted, accepted = seq.stats.get("drafted", 0), seq.stats.get("accepted", 0)
+            try:
+                tokens = self.engine.speculate(seq)
+            except Exception as e:
+                logger.error(f"Speculative step failed: {e}", exc_info=True)
+                seq._fail(e)
+                continue
+            self._decode_steps += 1
+            self._batch_size_sum += 1
+            self._drafted += seq.stats.get("drafted", 0) - drafted
+            self._accepted += seq.stats.get("accepted", 0) - accepted
+            for token in tokens:
+                self._emit(seq, token)
+                if seq.finished:
+                    break
+
+        # Per-sequence caches live on the sequence, so parking needs no detach
+        backlogged = [seq for seq in self._active if not seq.finished and seq._park_if_backlogged()]
+        if backlogged:
+            with self._cond:
+                self._parked.extend(backlogged)
+        self._active = [seq for seq in self._active if not seq.finished and not seq.parked]
@@ -0,0 +1,233 @@
+"""
+Per-request span tracing.
+
+The request-id middleware starts a ``Trace`` for every HTTP request and
+binds it to a context variable. Code further down (routes, the MedGemma
+service, the Ollama proxy) adds named spans to it without passing it
+around:
+
+    from api.services.tracing import span
+    with span("image_decode"):
+        image = await run_in_decode_pool(...)
+
+Spans have a fixed set of names: validate, image_decode, tokenize,
+queue, prefill, decode, replica, upstream and stream. Durations are
+reported back in the ``Server-Timing`` response header. Streaming
+responses also put them in their final NDJSON line, because the header
+is sent before generation finishes. If MEDSTATION_TRACE_LOG is set, each finished trace
+is appended to that file as one JSON line for offline analysis. Outside
+a request (CLI tools, tests) ``span`` is a no-op.
+
+Log records carry the request id via ``RequestIdFilter``. Outgoing
+Ollama calls forward it as ``X-Request-ID``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_TRACE_LOG = os.environ.get("MEDSTATION_TRACE_LOG", "")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+
+class Trace:
+    """
+    Spans recorded for one request.
+
+    Args:
+        request_id: Client-supplied or generated request id
+        method: HTTP method
+        path: Request path
+    """
+
+    def __init__(self, request_id: str, method: str = "", path: str = ""):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.route: str | None = None
+        self.status: int | None = None
+        self.started = time.perf_counter()
+        self.started_wall = time.time()
+        self.finished: float | None = None
+        self.spans: list[dict[str, Any]] = []
+
+    def add(self, name: str, start: float, end: float) -> None:
+        """Record a span from ``perf_counter`` timestamps."""
+        self.spans.append({"name": name, "start": start, "end": max(start, end)})
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def mark(self, name: str) -> None:
+        """Record a span from the start of the request until now."""
+        self.add(name, self.started, time.perf_counter())
+
+    def timings(self) -> dict[str, float]:
+        """Milliseconds per span name (repeated spans, e.g. workflow steps, are summed)."""
+        totals: dict[str, float] = {}
+        for s in self.spans:
+            totals[s["name"]] = totals.get(s["name"], 0.0) + (s["end"] - s["start"]) * 1000
+        totals["total"] = ((self.finished or time.perf_counter()) - self.started) * 1000
+        return {name: round(ms, 1) for name, ms in totals.items()}
+
+    def server_timing(self) -> str:
+        """``Server-Timing`` header value for the spans recorded so far."""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.timings().items())
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter()
+
+    def to_record(self) -> dict[str, Any]:
+        """JSON-serializable form for the span sink (offsets relative to the request start)."""
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started_at": datetime.fromtimestamp(self.started_wall, UTC).isoformat(),
+            "duration_ms": round(((self.finished or time.perf_counter()) - self.started) * 1000, 3),
+            "spans": [
+                {
+                    "name": s["name"],
+                    "start_ms": round((s["start"] - self.started) * 1000, 3),
+                    "duration_ms": round((s["end"] - s["start"]) * 1000, 3),
+                }
+                for s in self.spans
+            ],
+        }
+
+
+_current: ContextVar[Trace | None] = ContextVar("medstation_trace", default=None)
+
+
+def start_trace(request_id: str, method: str = "", path: str = "") -> Trace:
+    """Bind a new trace to the current context (the request's task)."""
+    trace = Trace(request_id, method, path)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _current.get()
+
+
+def current_request_id() -> str | None:
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block as a span of the current request's trace (no-op without one)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+
+def add_span(name: str, start: float, end: float | None = None) -> None:
+    """Record a span that started at ``start`` (``perf_counter``) on the current trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() if end is None else end)
+
+
+def trailer() -> dict[str, Any]:
+    """Request id and timings for the final line of an NDJSON stream (empty outside a request)."""
+    trace = _current.get()
+    if trace is None:
+        return {}
+    return {"request_id": trace.request_id, "timings": trace.timings()}
+
+
+def mark(name: str) -> None:
+    """Record a span from the start of the current request until now."""
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(name)
+
+
+def record_sequence(seq) -> None:
+    """Add queue, prefill and decode spans from a finished scheduler sequence."""
+    trace = _current.get()
+    if trace is None or seq.first_token_at is None:
+        return
+    prefill_started = seq.prefill_started_at or seq.submitted_at
+    trace.add("queue", seq.submitted_at, prefill_started)
+    trace.add("prefill", prefill_started, seq.first_token_at)
+    trace.add("decode", seq.first_token_at, seq.finished_at or time.perf_counter())
+
+
+def outgoing_headers() -> dict[str, str]:
+    """Headers that propagate the current request id to upstream services."""
+    request_id = current_request_id()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds ``request_id`` to log records ("-" outside a request)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id() or "-"
+        return True
+
+
+def install_log_filter() -> None:
+    """Attach ``RequestIdFilter`` to the root handlers so formats can use %(request_id)s."""
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+
+
+class SpanSink:
+    """Appends finished traces to a JSONL file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.written = 0
+
+    def write(self, trace: Trace) -> None:
+        line = json.dumps(trace.to_record()) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self.written += 1
+
+    async def write_async(self, trace: Trace) -> None:
+        try:
+            await asyncio.to_thread(self.write, trace)
+        except OSError as e:
+            logger.warning(f"Trace sink write failed: {e}")
+
+
+_sink: SpanSink | None = None
+
+
+def get_sink() -> SpanSink | None:
+    """The JSONL sink configured by MEDSTATION_TRACE_LOG, or None."""
+    global _sink
+    if _sink is None and _TRACE_LOG:
+        _sink = SpanSink(Path(_TRACE_LOG))
+    return _sink
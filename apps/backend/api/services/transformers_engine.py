@@ -0,0 +1,533 @@
+"""
+HuggingFace Transformers decode engine for the batching scheduler.
+
+Implements ``DecodeEngine`` on top of a loaded MedGemma model. Each new
+sequence is prefilled into its own ``DynamicCache``; sequences are then
+merged into one left-padded batch cache that every decode step extends by
+a single position. Rows are dropped as sequences finish and the batch is
+re-padded when new ones join.
+
+Prefill reuses KV states from the shared ``PrefixCache`` when a prompt
+starts with tokens seen before, and only runs the remaining suffix. Image
+features come from the ``VisionCache`` when the same image was encoded
+before, and are injected into the prompt embeddings directly.
+
+``SpeculativeEngine`` decodes one sequence at a time with draft-and-verify
+steps for the speculative scheduler (see speculative.py).
+
+Only imported after the model has loaded, so torch is a hard dependency.
+"""
+
+import logging
+from collections.abc import Sequence
+
+import torch
+import torch.nn.functional as F
+
+from api.services.batching import ScheduledSequence
+from api.services.prefix_cache import PrefixCache, common_prefix_length
+from api.services.speculative import PromptLookupDrafter, accept_greedy
+from api.services.vision_cache import VisionCache
+
+logger = logging.getLogger(__name__)
+
+KV = tuple[torch.Tensor, torch.Tensor]
+
+
+def cache_layers(cache) -> list[KV]:
+    """Per-layer (keys, values) tensors of a transformers cache, across cache API versions."""
+    if hasattr(cache, "layers"):  # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache, strict=True))
+
+
+def _kv_nbytes(layers: list[KV]) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+
+
+def _crop_prefix(layers: list[KV], length: int, n: int) -> list[KV]:
+    """
+    Keep the first ``n`` of ``length`` positions in every layer.
+
+    Layers that were truncated to a sliding window hold only the most recent
+    positions; they are cut by the same number of trailing positions, which
+    is only valid when ``n == length`` (callers check this).
+    """
+    drop = length - n
+    if drop == 0:
+        return layers
+    return [(k[:, :, : k.shape[-2] - drop, :], v[:, :, : v.shape[-2] - drop, :]) for k, v in layers]
+
+
+def _left_pad(t: torch.Tensor, length: int) -> torch.Tensor:
+    """Left-pad a (batch, heads, seq, dim) tensor with zeros along the sequence axis."""
+    pad = length - t.shape[-2]
+    if pad <= 0:
+        return t
+    return F.pad(t, (0, 0, pad, 0))
+
+
+def _left_pad_mask(mask: torch.Tensor, length: int) -> torch.Tensor:
+    pad = length - mask.shape[-1]
+    if pad <= 0:
+        return mask
+    return F.pad(mask, (pad, 0))
+
+
+class TransformersEngine:
+    """
+    Batched prefill/decode for ``AutoModelForImageTextToText`` models.
+
+    Args:
+        model: Loaded MedGemma model
+        processor: Matching processor (tokenizer is used for detokenization)
+        prefix_cache: Optional shared-prefix KV cache consulted on prefill
+        vision_cache: Optional image-feature cache keyed by image digest
+    """
+
+    def __init__(
+        self,
+        model,
+        processor,
+        prefix_cache: PrefixCache | None = None,
+        vision_cache: VisionCache | None = None,
+    ):
+        self.model = model
+        self.processor = processor
+        self.tokenizer = processor.tokenizer
+        self.device = model.device
+        self.prefix_cache = prefix_cache if prefix_cache is not None and prefix_cache.enabled else None
+        self.vision_cache = vision_cache if vision_cache is not None and vision_cache.enabled else None
+
+        # Image placeholder tokens are identical for every image, so KV reuse
+        # must stop before the first one
+        cfg = model.config
+        self._image_token_id = getattr(cfg, "image_token_id", None) or getattr(cfg, "image_token_index", None)
+        self._image_token_ids = {
+            t for t in (self._image_token_id, getattr(cfg, "boi_token_index", None)) if t is not None
+        }
+        self._injects_features = self._image_token_id is not None and hasattr(model, "get_image_features")
+
+        gen_cfg = model.generation_config
+        eos = gen_cfg.eos_token_id
+        if eos is None:
+            eos = self.tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+
+        # Match model.generate's sampling defaults for do_sample=True
+        self.top_k: int | None = getattr(gen_cfg, "top_k", None)
+        self.top_p: float | None = getattr(gen_cfg, "top_p", None)
+
+        self._rows: list[ScheduledSequence] = []
+        self._cache = None
+        self._mask: torch.Tensor | None = None
+
+    # -- DecodeEngine -------------------------------------------------------
+
+    def prefill(self, seq: ScheduledSequence) -> int:
+        inputs = dict(seq.inputs)
+        digest = inputs.pop("image_digest", None)
+        features = inputs.pop("image_features", None)
+        input_ids = inputs["input_ids"]
+        length = int(input_ids.shape[-1])
+        token_ids = input_ids[0].tolist()
+        cacheable = self._cacheable_length(token_ids, features is not None or "pixel_values" in inputs)
+
+        start, cache = 0, None
+        if self.prefix_cache is not None and cacheable:
+            # Always leave at least one token to run, for next-token logits
+            hit = self.prefix_cache.lookup(token_ids[: min(cacheable, length - 1)])
+            if hit is not None:
+                start, (layers, entry_len) = hit
+                cache = self.build_cache(_crop_prefix(layers, entry_len, start), start)
+
+        model_inputs = inputs
+        if cache is None:
+            cache = self.new_cache()
+        else:
+            model_inputs["input_ids"] = input_ids[:, start:]
+            if "token_type_ids" in model_inputs:
+                model_inputs["token_type_ids"] = model_inputs["token_type_ids"][:, start:]
+            model_inputs["cache_position"] = torch.arange(start, length, device=self.device)
+
+        with torch.inference_mode():
+            if self._injects_features and (features is not None or "pixel_values" in model_inputs):
+                pixel_values = model_inputs.pop("pixel_values", None)
+                if features is None:
+                    features = self._encode_image(pixel_values, digest)
+                model_inputs["inputs_embeds"] = self._embed_with_features(model_inputs.pop("input_ids"), features)
+            out = self.model(**model_inputs, past_key_values=cache, use_cache=True, logits_to_keep=1)
+
+        if self.prefix_cache is not None and cacheable >= self.prefix_cache.min_match:
+            self._store_prefix(token_ids[:cacheable], cache_layers(out.past_key_values), length)
+
+        seq.kv = out.past_key_values
+        seq.kv_mask = inputs["attention_mask"]
+        seq.position = length
+        seq.inputs = None  # pixel tensors are no longer needed
+        return self.sample(out.logits[:, -1, :], [seq])[0]
+
+    def decode(self, seqs: list[ScheduledSequence]) -> list[int]:
+        self._sync_rows(seqs)
+        rows = self._rows
+
+        input_ids = torch.tensor([[s.token_ids[-1]] for s in rows], device=self.device)
+        position_ids = torch.tensor([[s.position] for s in rows], device=self.device)
+        cache_position = torch.tensor([self._mask.shape[-1]], device=self.device)
+        self._mask = F.pad(self._mask, (0, 1), value=1)
+
+        with torch.inference_mode():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=self._mask,
+                position_ids=position_ids,
+                cache_position=cache_position,
+                past_key_values=self._cache,
+                use_cache=True,
+            )
+        self._cache = out.past_key_values
+        for s in rows:
+            s.position += 1
+
+        tokens = self.sample(out.logits[:, -1, :], rows)
+        by_row = {id(s): tok for s, tok in zip(rows, tokens, strict=True)}
+        return [by_row[id(s)] for s in seqs]
+
+    def detach(self, seqs: list[ScheduledSequence]) -> None:
+        leaving = {id(s) for s in seqs}
+        keep = []
+        for i, s in enumerate(self._rows):
+            if id(s) in leaving:
+                s.kv, s.kv_mask = self._gather_rows([i])
+            else:
+                keep.append(i)
+        if len(keep) != len(self._rows):
+            self._select_rows(keep)
+
+    def clear(self) -> None:
+        self._rows = []
+        self._cache = None
+        self._mask = None
+
+    def detokenize(self, token_ids: list[int]) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    # -- Image features ------------------------------------------------------
+
+    def _encode_image(self, pixel_values: torch.Tensor, digest: str | None) -> torch.Tensor:
+        """Run the vision tower + projector and remember the result for this image."""
+        out = self.model.get_image_features(pixel_values)
+        features = out if isinstance(out, torch.Tensor) else getattr(out, "pooler_output", None)
+        if features is None:
+            features = out[0]
+        if digest is not None and self.vision_cache is not None:
+            self.vision_cache.put(digest, features, features.numel() * features.element_size())
+        return features
+
+    def _embed_with_features(self, input_ids: torch.Tensor, features: torch.Tensor) -> torch.Tensor:
+        """Token embeddings with image placeholder positions replaced by image features."""
+        embedding = self.model.get_input_embeddings()
+        image_mask = input_ids == self._image_token_id
+        lookup_ids = input_ids
+        if self._image_token_id >= embedding.num_embeddings:
+            # Placeholder id lies outside the text vocabulary
+            lookup_ids = input_ids.masked_fill(image_mask, 0)
+        embeds = embedding(lookup_ids)
+        if not bool(image_mask.any()):
+            # Placeholders already covered by a reused prefix (cannot happen today, see _cacheable_length)
+            return embeds
+        features = features.to(embeds.device, embeds.dtype).reshape(-1, embeds.shape[-1])
+        return embeds.masked_scatter(image_mask.unsqueeze(-1).expand_as(embeds), features)
+
+    # -- Prefix reuse -------------------------------------------------------
+
+    def _cacheable_length(self, token_ids: list[int], has_image: bool) -> int:
+        """Length of the prompt prefix whose KV state depends on token ids alone."""
+        if not has_image:
+            return len(token_ids)
+        for i, t in enumerate(token_ids):
+            if t in self._image_token_ids:
+                return i
+        # Image present but its placeholder tokens weren't recognised
+        return 0
+
+    def _store_prefix(self, token_ids: list[int], layers: list[KV], length: int) -> None:
+        n = len(token_ids)
+        truncated = any(k.shape[-2] < length for k, _ in layers)
+        if n < length:
+            if truncated:
+                # Sliding-window layers dropped positions this prefix needs
+                return
+            # Copy so the entry doesn't pin the full prompt's tensors
+            layers = [(k[:, :, :n, :].clone(), v[:, :, :n, :].clone()) for k, v in layers]
+        self.prefix_cache.insert(token_ids, (layers, n), _kv_nbytes(layers), croppable=not truncated)
+
+    # -- Sampling -------------------------------------------------------------
+
+    def sample(self, logits: torch.Tensor, seqs: Sequence[ScheduledSequence]) -> list[int]:
+        """Pick the next token per row: greedy for temperature 0, else top-k/top-p sampling."""
+        logits = logits.float()
+        greedy = logits.argmax(dim=-1)
+        temps = torch.tensor([s.temperature for s in seqs], device=logits.device)
+        if not bool((temps > 0).any()):
+            return greedy.tolist()
+
+        scaled = self.warp(logits, temps)
+        sampled = torch.multinomial(scaled.softmax(dim=-1), num_samples=1).squeeze(-1)
+        return torch.where(temps > 0, sampled, greedy).tolist()
+
+    def warp(self, logits: torch.Tensor, temps: torch.Tensor) -> torch.Tensor:
+        """Apply per-row temperature, then top-k and top-p filtering (as logits)."""
+        scaled = logits / temps.clamp(min=1e-5).unsqueeze(-1)
+        if self.top_k:
+            kth = torch.topk(scaled, min(self.top_k, scaled.shape[-1]), dim=-1).values[:, -1:]
+            scaled = scaled.masked_fill(scaled < kth, float("-inf"))
+        if self.top_p is not None and self.top_p < 1.0:
+            sorted_logits, sorted_idx = torch.sort(scaled, descending=True, dim=-1)
+            sorted_probs = sorted_logits.softmax(dim=-1)
+            remove = (sorted_probs.cumsum(dim=-1) - sorted_probs) > self.top_p
+            sorted_logits = sorted_logits.masked_fill(remove, float("-inf"))
+            scaled = torch.full_like(scaled, float("-inf")).scatter(-1, sorted_idx, sorted_logits)
+        return scaled
+
+    # -- Batch cache management --------------------------------------------
+
+    def new_cache(self):
+        from transformers import DynamicCache
+
+        try:
+            return DynamicCache(config=self.model.config)
+        except TypeError:  # transformers < 4.56
+            return DynamicCache()
+
+    def build_cache(self, layers: list[KV], length: int):
+        """Create a cache holding the given per-layer tensors, ``length`` positions long."""
+        cache = self.new_cache()
+        for idx, (k, v) in enumerate(layers):
+            cache.update(k, v, idx)
+        for layer in getattr(cache, "layers", []):
+            # Sliding-window layers keep fewer positions than were seen
+            if hasattr(layer, "cumulative_length"):
+                layer.cumulative_length = length
+        return cache
+
+    def _sync_rows(self, seqs: list[ScheduledSequence]) -> None:
+        """Make the batch cache rows match ``seqs``: drop departed rows, merge new ones."""
+        wanted = {id(s) for s in seqs}
+        current = {id(s) for s in self._rows}
+        if wanted == current:
+            return
+
+        keep = [i for i, s in enumerate(self._rows) if id(s) in wanted]
+        if len(keep) != len(self._rows):
+            self._select_rows(keep)
+
+        joining = [s for s in seqs if id(s) not in current]
+        if joining:
+            self._merge(joining)
+
+    def _select_rows(self, keep: list[int]) -> None:
+        if not keep:
+            self.clear()
+            return
+
+        self._cache, self._mask = self._gather_rows(keep)
+        self._rows = [self._rows[i] for i in keep]
+
+    def _gather_rows(self, rows: list[int]):
+        """Copy the given batch rows into a new (cache, mask) pair."""
+        idx = torch.tensor(rows, device=self.device)
+        mask = self._mask.index_select(0, idx)
+        # Trim columns that are padding for every remaining row
+        used = mask.any(dim=0).nonzero()
+        first = int(used[0]) if len(used) else 0
+        mask = mask[:, first:]
+        length = mask.shape[-1]
+
+        layers = []
+        for k, v in cache_layers(self._cache):
+            n = min(k.shape[-2], length)
+            layers.append((k.index_select(0, idx)[:, :, -n:, :], v.index_select(0, idx)[:, :, -n:, :]))
+        return self.build_cache(layers, length), mask
+
+    def _merge(self, joining: list[ScheduledSequence]) -> None:
+        """
+        Append sequences to the batch, right-aligning every row.
+
+        Each layer is padded to the longest entry for that layer, so
+        sliding-window layers (which hold fewer positions) stay aligned with
+        the full-attention layers and the shared attention mask.
+        """
+        parts: list[tuple[list[KV], torch.Tensor]] = []
+        if self._cache is not None:
+            parts.append((cache_layers(self._cache), self._mask))
+        for s in joining:
+            parts.append((cache_layers(s.kv), s.kv_mask))
+
+        length = max(mask.shape[-1] for _, mask in parts)
+        merged: list[KV] = []
+        for i in range(len(parts[0][0])):
+            target = max(layers[i][0].shape[-2] for layers, _ in parts)
+            keys = torch.cat([_left_pad(layers[i][0], target) for layers, _ in parts], dim=0)
+            values = torch.cat([_left_pad(layers[i][1], target) for layers, _ in parts], dim=0)
+            merged.append((keys, values))
+
+        self._mask = torch.cat([_left_pad_mask(mask, length) for _, mask in parts], dim=0)
+        self._cache = self.build_cache(merged, length)
+        self._rows = self._rows + joining
+        for s in joining:
+            s.kv = s.kv_mask = None
+
+
+class SpeculativeEngine(TransformersEngine):
+    """
+    Draft-and-verify decoding, one sequence per call (see speculative.py).
+
+    Each sequence keeps its own single-row cache on ``seq.kv``. Every step
+    scores the last token plus the draft in one forward pass, then crops
+    the rejected draft positions off the cache. Sliding-window layers can't
+    be cropped once they have wrapped, so these caches keep every position
+    in every layer; the attention mask still limits those layers to the
+    window.
+
+    Args:
+        model, processor, prefix_cache, vision_cache: As ``TransformersEngine``
+        draft_model: Optional small causal LM sharing the tokenizer (``draft``
+            mode); sequences fall back to prompt lookup without one
+        num_draft_tokens: Tokens drafted per step
+        max_ngram: Longest n-gram prompt lookup matches
+    """
+
+    def __init__(
+        self,
+        model,
+        processor,
+        prefix_cache: PrefixCache | None = None,
+        vision_cache: VisionCache | None = None,
+        draft_model=None,
+        num_draft_tokens: int = 10,
+        max_ngram: int = 3,
+    ):
+        super().__init__(model, processor, prefix_cache=prefix_cache, vision_cache=vision_cache)
+        self.draft_model = draft_model
+        self.num_draft_tokens = max(1, num_draft_tokens)
+        self.lookup = PromptLookupDrafter(max_ngram=max_ngram)
+
+    def prefill(self, seq: ScheduledSequence) -> int:
+        mode = seq.inputs.pop("speculative", "prompt_lookup")
+        has_image = "pixel_values" in seq.inputs or "image_features" in seq.inputs
+        if mode == "draft" and (self.draft_model is None or has_image):
+            # The draft model is text-only
+            mode = "prompt_lookup"
+        prompt_ids = seq.inputs["input_ids"][0].tolist()
+
+        token = super().prefill(seq)
+        seq.draft = {"prompt": prompt_ids, "ids": [], "cache": None}
+        seq.stats.update(mode=mode, drafted=0, accepted=0, target_forwards=1)
+        return token
+
+    def speculate(self, seq: ScheduledSequence) -> list[int]:
+        """One draft-and-verify step; returns the tokens to emit (at least one)."""
+        context = seq.draft["prompt"] + seq.token_ids
+        budget = min(self.num_draft_tokens, seq.max_new_tokens - len(seq.token_ids) - 1)
+        draft = self._propose(seq, context, budget) if budget > 0 else []
+
+        length = seq.position
+        positions = torch.arange(length, length + len(draft) + 1, device=self.device)
+        input_ids = torch.tensor([[seq.token_ids[-1]] + draft], device=self.device)
+        with torch.inference_mode():
+            out = self.model(
+                input_ids=input_ids,
+                attention_mask=torch.ones(1, length + len(draft) + 1, dtype=torch.long, device=self.device),
+                position_ids=positions.unsqueeze(0),
+                cache_position=positions,
+                past_key_values=seq.kv,
+                use_cache=True,
+            )
+        logits = out.logits[0].float()
+
+        if seq.temperature > 0:
+            accepted, tokens = self._accept_sampled(logits, draft, seq.temperature)
+        else:
+            accepted, tokens = accept_greedy(draft, logits.argmax(dim=-1).tolist())
+
+        seq.kv = out.past_key_values
+        if accepted < len(draft):
+            seq.kv.crop(accepted - len(draft))
+        seq.position = length + 1 + accepted
+
+        seq.stats["drafted"] += len(draft)
+        seq.stats["accepted"] += accepted
+        seq.stats["target_forwards"] += 1
+        return tokens
+
+    def detach(self, seqs: list[ScheduledSequence]) -> None:
+        pass  # caches already live on the sequences
+
+    def new_cache(self):
+        from transformers import DynamicCache
+
+        # Without the model config every layer is a full-length layer
+        return DynamicCache()
+
+    def build_cache(self, layers: list[KV], length: int):
+        """As ``TransformersEngine.build_cache``, or None for prefix states missing positions."""
+        if any(k.shape[-2] < length for k, _ in layers):
+            # Stored by the batch engine after its sliding-window layers wrapped
+            return None
+        return super().build_cache(layers, length)
+
+    def _propose(self, seq: ScheduledSequence, context: list[int], num_tokens: int) -> list[int]:
+        if seq.stats["mode"] == "draft":
+            return self._draft_with_model(seq, context, num_tokens)
+        return self.lookup.propose(context, num_tokens)
+
+    def _draft_with_model(self, seq: ScheduledSequence, context: list[int], num_tokens: int) -> list[int]:
+        """Greedy tokens from the draft model, reusing its cache across steps."""
+        state = seq.draft
+        cache = state["cache"]
+        common = common_prefix_length(state["ids"], context) if cache is not None else 0
+        # Always feed at least the last context token, for next-token logits
+        common = min(common, len(context) - 1)
+        if cache is None:
+            cache = self.new_cache()
+        elif common < len(state["ids"]):
+            cache.crop(common - len(state["ids"]))
+
+        draft: list[int] = []
+        with torch.inference_mode():
+            feed = torch.tensor([context[common:]], device=self.device)
+            for _ in range(num_tokens):
+                out = self.draft_model(input_ids=feed, past_key_values=cache, use_cache=True)
+                cache = out.past_key_values
+                token = int(out.logits[0, -1].argmax())
+                draft.append(token)
+                if token in self.eos_token_ids:
+                    break
+                feed = torch.tensor([[token]], device=self.device)
+
+        # The draft cache holds the context and every drafted token but the last
+        state["cache"] = cache
+        state["ids"] = context + draft[:-1]
+        return draft
+
+    def _accept_sampled(self, logits: torch.Tensor, draft: list[int], temperature: float):
+        """
+        Speculative sampling for deterministic drafts.
+
+        Draft token d is kept with probability p(d). On rejection the
+        replacement is sampled from p with d removed, which makes each
+        emitted token distributed exactly as p.
+        """
+        temps = torch.full((logits.shape[0],), temperature, device=logits.device)
+        probs = self.warp(logits, temps).softmax(dim=-1)
+        for i, token in enumerate(draft):
+            p = probs[i]
+            if float(torch.rand(())) < float(p[token]):
+                continue
+            residual = p.clone()
+            residual[token] = 0
+            replacement = int(torch.multinomial(residual / residual.sum(), num_samples=1))
+            return i, draft[:i] + [replacement]
+        bonus = int(torch.multinomial(probs[len(draft)], num_samples=1))
+        return len(draft), draft + [bonus]
@@ -0,0 +1,431 @@
+"""
+Server-side 5-step agentic triage workflow.
+
+Symptom Analysis → Triage → Differential → Risk → Actions, using the same
+prompts, step DAG and triage parsing as spaces/app.py. Running the pipeline
+in the backend saves the native app one HTTP round trip per step, and lets
+steps share the patient-context KV state through the service's prefix
+cache. Steps whose inputs are ready run concurrently, so the batch
+scheduler decodes them together.
+
+The Hugging Face Space is uploaded and run on its own, without this
+package, so it keeps its own copy of the prompts, context formatting,
+triage parsing and safety rules. tests/test_workflow.py checks that both
+copies still agree.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections.abc import AsyncGenerator
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = "You are an expert medical AI assistant."
+
+# (title, prompt, inputs). Inputs are (step title, how it is passed):
+# "label" passes the parsed triage level, an int the first N characters of
+# the output, None the whole output.
+#   Symptom Analysis → {Triage, Differential} → {Risk, Actions}
+STEPS = [
+    (
+        "Symptom Analysis",
+        """Analyze the patient's symptoms. For each point, give 1-2 sentences max:
+1. Primary symptoms and characteristics
+2. Red flag symptoms requiring immediate attention
+3. Associated symptoms suggesting specific conditions
+4. Timeline and progression
+
+Be concise and evidence-based. Use bullet points.""",
+        (),
+    ),
+    (
+        "Triage Assessment",
+        """Your FIRST line must be exactly one of these (copy it verbatim):
+TRIAGE: Emergency
+TRIAGE: Urgent
+TRIAGE: Semi-Urgent
+TRIAGE: Non-Urgent
+TRIAGE: Self-Care
+
+Then justify in 2-3 sentences. Only classify as Emergency if immediately life-threatening RIGHT NOW.""",
+        (("Symptom Analysis", None),),
+    ),
+    (
+        "Differential Diagnosis",
+        """List top 3 most likely diagnoses. For each, one line:
+[Number]. [Condition] (high/medium/low likelihood) — [1 sentence reasoning]
+
+Be concise. No more than 3 conditions.""",
+        (("Symptom Analysis", 500),),
+    ),
+    (
+        "Risk Stratification",
+        """List key risk factors as bullet points (1 sentence each):
+- Patient-specific risk factors
+- Warning signs requiring immediate care
+- Complications to monitor
+
+Be concise. Max 5 bullet points.""",
+        (("Triage Assessment", "label"),),
+    ),
+    (
+        "Recommended Actions",
+        """List 3-5 actionable recommendations, numbered by priority:
+1. Most urgent action first
+2. When/where to seek care
+3. Key diagnostic tests
+4. Red flags requiring emergency care
+
+One sentence per recommendation.""",
+        (("Triage Assessment", "label"),),
+    ),
+]
+
+EMERGENCY_KEYWORDS = [
+    "cardiac arrest",
+    "not breathing",
+    "unconscious",
+    "unresponsive",
+    "severe bleeding",
+    "chest pain",
+    "stroke",
+    "seizure",
+    "anaphylaxis",
+    "suicidal",
+    "overdose",
+    "gunshot",
+    "stabbing",
+]
+
+DRUG_INTERACTIONS = {
+    frozenset(["warfarin", "aspirin"]): "Increased bleeding risk",
+    frozenset(["ssri", "maoi"]): "Serotonin syndrome risk",
+    frozenset(["ace inhibitor", "potassium"]): "Hyperkalemia risk",
+    frozenset(["metformin", "contrast"]): "Lactic acidosis risk",
+    frozenset(["lisinopril", "potassium"]): "Hyperkalemia risk",
+    frozenset(["sildenafil", "nitroglycerin"]): "Severe hypotension risk",
+    frozenset(["viagra", "nitrate"]): "Severe hypotension risk",
+}
+
+
+def format_context(
+    chief_complaint: str,
+    symptoms: str | None = None,
+    age: str | None = None,
+    sex: str | None = None,
+    hr: str | None = None,
+    bp: str | None = None,
+    temp: str | None = None,
+    rr: str | None = None,
+    spo2: str | None = None,
+    history: str | None = None,
+    medications: str | None = None,
+    allergies: str | None = None,
+) -> str:
+    """Format intake fields as the Patient Context block (mirrors spaces/app.py)."""
+    ctx = f"Chief Complaint: {chief_complaint}\nSeverity: Reported by patient"
+
+    if age:
+        note = f"\nAge: {age} years"
+        try:
+            age_i = int(age)
+            if age_i < 2:
+                note += " (Neonate/Infant)"
+            elif age_i < 18:
+                note += " (Pediatric)"
+            elif age_i > 65:
+                note += " (Geriatric)"
+        except ValueError:
+            pass
+        ctx += note
+
+    if sex:
+        ctx += f"\nBiological Sex: {sex}"
+
+    if symptoms:
+        ctx += f"\nSymptoms: {symptoms}"
+
+    vitals_parts = []
+    if hr:
+        vitals_parts.append(f"HR: {hr} bpm")
+    if bp:
+        vitals_parts.append(f"BP: {bp}")
+    if temp:
+        vitals_parts.append(f"Temp: {temp}°F")
+    if rr:
+        vitals_parts.append(f"RR: {rr}/min")
+    if spo2:
+        vitals_parts.append(f"SpO2: {spo2}%")
+    if vitals_parts:
+        ctx += "\nVital Signs:\n  " + "\n  ".join(vitals_parts)
+
+    if history:
+        ctx += f"\nMedical History: {history}"
+    if medications:
+        ctx += f"\nMedications: {medications}"
+    if allergies:
+        ctx += f"\nAllergies: {allergies}"
+
+    return ctx
+
+
+def extract_triage(text: str) -> str:
+    """Parse the triage level from the Triage Assessment output (defaults to Urgent)."""
+    for line in text.strip().splitlines()[:3]:
+        line_upper = line.strip().upper()
+        if "EMERGENCY" in line_upper:
+            return "Emergency"
+        if "URGENT" in line_upper and "NON" not in line_upper and "SEMI" not in line_upper:
+            return "Urgent"
+        if "SEMI" in line_upper:
+            return "Semi-Urgent"
+        if "NON" in line_upper:
+            return "Non-Urgent"
+        if "SELF" in line_upper:
+            return "Self-Care"
+    return "Urgent"
+
+
+# "2. **Migraine** (medium likelihood) — reasoning", as the Differential Diagnosis step asks for
+_DIFFERENTIAL_LINE = re.compile(
+    r"^\s*(\d+)[.)]\s*(.+?)(?:\s*\((high|medium|low)(?:\s+likelihood)?\))?\s*(?:[—–-]\s.*)?$",
+    re.IGNORECASE,
+)
+
+
+def extract_differential(text: str) -> list[dict[str, Any]]:
+    """Parse the Differential Diagnosis output into ``{"rank", "condition", "likelihood"}`` entries."""
+    diagnoses = []
+    for line in text.splitlines():
+        match = _DIFFERENTIAL_LINE.match(line)
+        if not match:
+            continue
+        condition = match.group(2).strip(" *[]")
+        if condition:
+            likelihood = match.group(3).lower() if match.group(3) else None
+            diagnoses.append({"rank": int(match.group(1)), "condition": condition, "likelihood": likelihood})
+    return diagnoses
+
+
+def run_safety_guard(
+    context: str,
+    triage: str,
+    medications: str | None = None,
+    hr: str | None = None,
+    spo2: str | None = None,
+    temp: str | None = None,
+) -> list[dict[str, str]]:
+    """Rule-based safety checks (mirrors the core of MedicalSafetyGuard.swift)."""
+    alerts = []
+
+    ctx_lower = context.lower()
+    for kw in EMERGENCY_KEYWORDS:
+        if kw in ctx_lower:
+            alerts.append(
+                {
+                    "type": "emergency_escalation",
+                    "message": f"Detected '{kw}' — immediate medical attention required",
+                }
+            )
+            break
+
+    try:
+        if hr and int(hr) > 150:
+            alerts.append(
+                {"type": "critical_vital", "message": f"Heart rate {hr} bpm exceeds critical threshold (>150)"}
+            )
+        if hr and int(hr) < 40:
+            alerts.append({"type": "critical_vital", "message": f"Heart rate {hr} bpm below critical threshold (<40)"})
+    except ValueError:
+        pass
+
+    try:
+        if spo2 and int(spo2) < 90:
+            alerts.append({"type": "critical_vital", "message": f"SpO2 {spo2}% — hypoxemia (<90%)"})
+    except ValueError:
+        pass
+
+    try:
+        if temp and float(temp) > 104:
+            alerts.append({"type": "critical_vital", "message": f"Temperature {temp}°F — hyperthermia (>104°F)"})
+    except ValueError:
+        pass
+
+    if medications:
+        meds_lower = medications.lower()
+        for pair, risk in DRUG_INTERACTIONS.items():
+            if all(drug in meds_lower for drug in pair):
+                alerts.append({"type": "drug_interaction", "message": f"{' + '.join(sorted(pair))} — {risk}"})
+
+    if triage in ("Non-Urgent", "Self-Care"):
+        for kw in ["chest pain", "shortness of breath", "severe headache", "hemoptysis"]:
+            if kw in ctx_lower:
+                alerts.append(
+                    {
+                        "type": "triage_escalation",
+                        "message": f"'{kw}' present but triage is {triage} — consider upgrading",
+                    }
+                )
+                break
+
+    return alerts
+
+
+def step_context(context: str, inputs, results: dict[str, str]) -> str:
+    """Patient context plus the outputs a step depends on (same as spaces/app.py)."""
+    ctx = context
+    for dep, mode in inputs:
+        if mode == "label":
+            ctx += f"\n\nTriage: {extract_triage(results[dep])}"
+        else:
+            text = results[dep] if mode is None else results[dep][:mode]
+            ctx += f"\n\n{dep}:\n{text}"
+    return ctx
+
+
+def ready_steps(results: dict[str, str]) -> list[tuple[int, str, str, tuple]]:
+    """(step number, title, prompt, inputs) for steps not yet run whose inputs are available."""
+    return [
+        (i, title, prompt, inputs)
+        for i, (title, prompt, inputs) in enumerate(STEPS, start=1)
+        if title not in results and all(dep in results for dep, _ in inputs)
+    ]
+
+
+_STEP_DONE = "done"
+_STEP_FAILED = "failed"
+
+
+async def _run_step(
+    svc,
+    step: int,
+    title: str,
+    prompt: str,
+    events: asyncio.Queue,
+    stream_tokens: bool,
+    gen_kwargs: dict[str, Any],
+) -> None:
+    """Run one step, reporting progress and its outcome through ``events``."""
+    await events.put({"event": "step_start", "step": step, "title": title})
+    step_start = time.perf_counter()
+    try:
+        if stream_tokens:
+            parts = []
+            async for token in svc.stream_generate(prompt=prompt, **gen_kwargs):
+                parts.append(token)
+                await events.put({"event": "token", "step": step, "token": token})
+            response = "".join(parts)
+        else:
+            response = await svc.generate(prompt=prompt, **gen_kwargs)
+    except Exception as e:
+        await events.put((_STEP_FAILED, step, title, e))
+        return
+    duration_ms = round((time.perf_counter() - step_start) * 1000, 1)
+    await events.put((_STEP_DONE, step, title, response, duration_ms))
+
+
+async def run_workflow(
+    svc,
+    context: str,
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    max_new_tokens: int = 512,
+    temperature: float = 0.3,
+    stream_tokens: bool = True,
+    safety_inputs: dict[str, Any] | None = None,
+) -> AsyncGenerator[dict[str, Any], None]:
+    """
+    Run the 5-step workflow, yielding progress events.
+
+    Steps whose inputs are ready run concurrently, so events from different
+    steps may interleave; every event carries its step number.
+
+    Events (one dict each):
+        {"event": "step_start", "step", "title"}
+        {"event": "token", "step", "token"}           (when stream_tokens)
+        {"event": "step_done", "step", "title", "content", "duration_ms"}
+        {"event": "error", "step", "title", "detail"}
+        {"event": "result", "triage", "steps", "safety_alerts", "step_durations_ms", ...}
+
+    Symptom Analysis must succeed; a later step failing ends the run with
+    a partial result, like MedicalWorkflowEngine.swift.
+
+    Args:
+        svc: MedGemma service (generate / stream_generate)
+        context: Formatted Patient Context block
+        safety_inputs: Optional medications/hr/spo2/temp for the safety guard
+    """
+    results: dict[str, str] = {}
+    durations: dict[str, float] = {}
+    incomplete_reason: str | None = None
+    workflow_start = time.perf_counter()
+    gen_kwargs = {"system_prompt": system_prompt, "max_new_tokens": max_new_tokens, "temperature": temperature}
+    events: asyncio.Queue = asyncio.Queue()
+    tasks: list[asyncio.Task] = []
+
+    try:
+        while incomplete_reason is None and len(results) < len(STEPS):
+            tasks = [
+                asyncio.create_task(
+                    _run_step(
+                        svc,
+                        step,
+                        title,
+                        f"Patient Context:\n{step_context(context, inputs, results)}\n\nTask:\n{prompt}",
+                        events,
+                        stream_tokens,
+                        gen_kwargs,
+                    )
+                )
+                for step, title, prompt, inputs in ready_steps(results)
+            ]
+
+            remaining = len(tasks)
+            while remaining:
+                item = await events.get()
+                if isinstance(item, dict):
+                    yield item
+                    continue
+
+                remaining -= 1
+                if item[0] == _STEP_FAILED:
+                    _, step, title, exc = item
+                    if step == 1:
+                        raise exc
+                    logger.error(f"Workflow step {step} ({title}) failed: {exc}", exc_info=exc)
+                    incomplete_reason = incomplete_reason or f"{title} failed: {exc}"
+                    yield {"event": "error", "step": step, "title": title, "detail": str(exc)}
+                    continue
+
+                _, step, title, response, duration_ms = item
+                results[title] = response
+                durations[title] = duration_ms
+                yield {
+                    "event": "step_done",
+                    "step": step,
+                    "title": title,
+                    "content": response,
+                    "duration_ms": duration_ms,
+                }
+    finally:
+        # Client went away or a step failed hard — don't leave siblings generating
+        for task in tasks:
+            task.cancel()
+
+    # Present steps in their declared order
+    results = {title: results[title] for title, _, _ in STEPS if title in results}
+    triage = extract_triage(results["Triage Assessment"]) if "Triage Assessment" in results else None
+
+    safety = safety_inputs or {}
+    yield {
+        "event": "result",
+        "triage": triage,
+        "steps": results,
+        "safety_alerts": run_safety_guard(context, triage or "Urgent", **safety),
+        "step_durations_ms": durations,
+        "total_ms": round((time.perf_counter() - workflow_start) * 1000, 1),
+        "partial": incomplete_reason is not None,
+        "incomplete_reason": incomplete_reason,
+    }
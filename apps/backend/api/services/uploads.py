@@ -0,0 +1,133 @@
+"""
+Bounded streaming reader for multipart image uploads.
+
+Starlette's form parser spools every file part to a temporary file before
+the handler sees it, so an oversized upload is only rejected after it has
+been received in full. This reader consumes the request stream directly:
+the image part is written into a single in-memory buffer that is checked
+against its byte limit on every chunk, and small text fields are capped
+separately.
+"""
+
+from collections.abc import AsyncIterator
+from io import BytesIO
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadTooLarge(ValueError):
+    """An upload or one of its parts exceeds the configured limit."""
+
+
+class InvalidUpload(ValueError):
+    """The request body is not a well-formed multipart upload."""
+
+
+async def read_multipart(
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+    file_field: str,
+    max_file_bytes: int,
+    max_field_bytes: int = 64 * 1024,
+    max_fields: int = 16,
+) -> tuple[dict[str, str], BytesIO | None]:
+    """
+    Parse a multipart/form-data body, keeping one file part in memory.
+
+    Args:
+        content_type: Request Content-Type header (carries the boundary)
+        chunks: Request body stream
+        file_field: Name of the part holding the file
+        max_file_bytes: Size limit for the file part
+        max_field_bytes: Size limit for each text field
+        max_fields: Maximum number of text fields
+
+    Returns:
+        (text fields, file buffer positioned at 0 or None if absent)
+
+    Raises:
+        UploadTooLarge: A part exceeds its limit
+        InvalidUpload: Missing boundary or malformed body
+    """
+    mime, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if mime != b"multipart/form-data" or not boundary:
+        raise InvalidUpload("Expected multipart/form-data with a boundary")
+
+    fields: dict[str, str] = {}
+    upload: BytesIO | None = None
+    state = {"header_name": b"", "header_value": b"", "headers": {}, "name": None, "target": None}
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["name"] = None
+        state["target"] = None
+
+    def on_header_field(data, start, end):
+        state["header_name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_name"].lower()] = state["header_value"]
+        state["header_name"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        nonlocal upload
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", errors="replace")
+        state["name"] = name
+        if name == file_field:
+            if upload is not None:
+                raise InvalidUpload(f"Multiple '{file_field}' parts")
+            upload = BytesIO()
+            state["target"] = upload
+        else:
+            if len(fields) >= max_fields:
+                raise UploadTooLarge(f"Too many form fields (max {max_fields})")
+            state["target"] = bytearray()
+
+    def on_part_data(data, start, end):
+        target = state["target"]
+        if target is upload:
+            if target.tell() + (end - start) > max_file_bytes:
+                raise UploadTooLarge(f"'{file_field}' exceeds {max_file_bytes} bytes")
+            target.write(data[start:end])
+        else:
+            if len(target) + (end - start) > max_field_bytes:
+                raise UploadTooLarge(f"Field '{state['name']}' exceeds {max_field_bytes} bytes")
+            target.extend(data[start:end])
+
+    def on_part_end():
+        target = state["target"]
+        if target is not upload and target is not None:
+            fields[state["name"]] = target.decode("utf-8", errors="replace")
+
+    parser = MultipartParser(
+        boundary,
+        callbacks={
+            "on_part_begin": on_part_begin,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+        },
+    )
+
+    try:
+        async for chunk in chunks:
+            if chunk:
+                parser.write(chunk)
+        parser.finalize()
+    except (UploadTooLarge, InvalidUpload):
+        raise
+    except Exception as e:
+        raise InvalidUpload(f"Malformed multipart body: {e}") from e
+
+    if upload is not None:
+        upload.seek(0)
+    return fields, upload
@@ -0,0 +1,77 @@
+"""
+Vision-encoder output cache for MedGemma multimodal requests.
+
+The native app re-attaches the same X-ray or wound photo to every
+follow-up question. Caching the projected image features by a content
+hash of the decoded image lets repeat queries skip both the processor's
+image preprocessing and the vision tower; the features are injected
+straight into the prompt embeddings instead.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any
+
+
+class VisionCache:
+    """
+    Size-bounded LRU of image features keyed by image digest.
+
+    Args:
+        max_bytes: Memory budget for cached feature tensors (0 disables)
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, Any] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, digest: str) -> Any | None:
+        """Cached features for an image, or None."""
+        with self._lock:
+            features = self._entries.get(digest)
+            if features is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return features
+
+    def put(self, digest: str, features: Any, nbytes: int) -> None:
+        if not self.enabled or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return
+            self._entries[digest] = features
+            self._sizes[digest] = nbytes
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                old, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(old)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
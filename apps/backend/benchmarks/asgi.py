@@ -0,0 +1,112 @@
+"""
+In-process HTTP transport that streams ASGI responses.
+
+``httpx.ASGITransport`` runs the app to completion and only then returns
+the response. That hides time to first token and any stall between
+chunks. This transport runs the app in a task and hands body chunks to
+the client as the app sends them. Server and client share one event
+loop, so a handler that blocks the loop delays every in-flight request.
+The benchmark wants to catch exactly that.
+"""
+
+import asyncio
+
+import httpx
+
+
+class _StreamedBody(httpx.AsyncByteStream):
+    def __init__(self, queue: asyncio.Queue, task: asyncio.Task, disconnected: asyncio.Event):
+        self._queue = queue
+        self._task = task
+        self._disconnected = disconnected
+
+    async def __aiter__(self):
+        while True:
+            chunk = await self._queue.get()
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+
+    async def aclose(self) -> None:
+        # Closing early is a client disconnect: the app sees http.disconnect
+        self._disconnected.set()
+        if not self._task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=1.0)
+            except Exception:
+                self._task.cancel()
+
+
+class StreamingASGITransport(httpx.AsyncBaseTransport):
+    """
+    Send requests to an ASGI app in this process, streaming its response body.
+
+    Args:
+        app: ASGI application
+        client: (host, port) reported to the app as the peer address
+    """
+
+    def __init__(self, app, client: tuple = ("127.0.0.1", 50000)):
+        self.app = app
+        self.client = client
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "scheme": request.url.scheme,
+            "path": request.url.path,
+            "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query,
+            "root_path": "",
+            "headers": [(k.lower(), v) for k, v in request.headers.raw],
+            "server": (request.url.host, request.url.port),
+            "client": self.client,
+        }
+
+        loop = asyncio.get_running_loop()
+        started: asyncio.Future = loop.create_future()
+        queue: asyncio.Queue = asyncio.Queue()
+        disconnected = asyncio.Event()
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                if not started.done():
+                    started.set_result(message)
+            elif message["type"] == "http.response.body":
+                await queue.put(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await queue.put(None)
+
+        async def run_app():
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                if not started.done():
+                    started.set_exception(e)
+            finally:
+                if not started.done():
+                    started.set_exception(RuntimeError("ASGI app returned without a response"))
+                await queue.put(None)
+
+        task = asyncio.create_task(run_app())
+        message = await started
+        return httpx.Response(
+            status_code=message["status"],
+            headers=[(k, v) for k, v in message.get("headers", [])],
+            stream=_StreamedBody(queue, task, disconnected),
+            request=request,
+        )
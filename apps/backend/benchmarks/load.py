@@ -0,0 +1,429 @@
+"""
+Load driver for the MedStation API.
+
+Runs closed-loop load: N concurrent clients, each sending its next
+request as soon as the previous one finishes. Scenarios:
+
+    medgemma         POST /medgemma/generate          (JSON)
+    medgemma_stream  POST /medgemma/generate          (NDJSON stream)
+    ollama           POST /ollama/generate via proxy  (JSON)
+    ollama_stream    POST /ollama/generate via proxy  (NDJSON stream)
+
+For each scenario and concurrency level it reports p50/p95/p99 latency,
+time to first token (streams only), request and token throughput, and
+event-loop lag. Event-loop lag is how late a 10 ms timer fires in the
+serving loop, so a handler that blocks the loop shows up there.
+
+By default the API runs in this process. MedGemma is replaced by the
+synthetic engine (synthetic.py), Ollama by the local stub
+(ollama_stub.py), and requests go through a streaming in-process
+transport (asgi.py). No model, GPU or Ollama is needed:
+
+    cd apps/backend
+    python -m benchmarks.load --concurrency 1,4,16 --requests 64 --out bench.json
+
+``--url`` drives a running server instead. That measures the real
+engine and network path, but event-loop lag is then not available.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PROMPT = "A 58-year-old man has crushing chest pain radiating to the left arm for 30 minutes. What is the triage level?"
+
+SCENARIOS = {
+    "medgemma": ("/api/v1/chat/medgemma/generate", False),
+    "medgemma_stream": ("/api/v1/chat/medgemma/generate", True),
+    "ollama": ("/api/v1/chat/ollama/generate", False),
+    "ollama_stream": ("/api/v1/chat/ollama/generate", True),
+}
+
+
+class RequestResult:
+    """Outcome and timings of one request."""
+
+    __slots__ = ("ok", "status", "latency_s", "ttft_s", "tokens")
+
+    def __init__(self, ok: bool, status: int, latency_s: float, ttft_s: float | None = None, tokens: int = 0):
+        self.ok = ok
+        self.status = status
+        self.latency_s = latency_s
+        self.ttft_s = ttft_s
+        self.tokens = tokens
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Linearly interpolated percentile (``q`` in 0..100) of a non-empty list."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _distribution_ms(values: list[float]) -> dict[str, float] | None:
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "mean": round(statistics.mean(values) * 1000, 2),
+        "max": round(max(values) * 1000, 2),
+    }
+
+
+def _payload(scenario: str, max_tokens: int, model: str) -> dict[str, Any]:
+    _, stream = SCENARIOS[scenario]
+    if scenario.startswith("ollama"):
+        return {"model": model, "prompt": PROMPT, "stream": stream, "options": {"num_predict": max_tokens}}
+    return {"prompt": PROMPT, "max_tokens": max_tokens, "temperature": 0.0, "stream": stream}
+
+
+def _stream_tokens(line: str) -> int:
+    """Tokens carried by one NDJSON line (MedGemma ``token`` or Ollama ``response``)."""
+    data = json.loads(line)
+    return int(bool(data.get("token") or data.get("response")))
+
+
+async def send_one(
+    client: httpx.AsyncClient, scenario: str, max_tokens: int, model: str, client_id: str | None = None
+) -> RequestResult:
+    """
+    Send one request and time it (TTFT is the first token-bearing line of a stream).
+
+    ``client_id`` is sent as X-Client-ID, so admission control shares
+    capacity fairly between simulated users.
+    """
+    path, stream = SCENARIOS[scenario]
+    payload = _payload(scenario, max_tokens, model)
+    headers = {"X-Client-ID": client_id} if client_id else None
+    started = time.perf_counter()
+    try:
+        if not stream:
+            resp = await client.post(path, json=payload, headers=headers)
+            latency = time.perf_counter() - started
+            text = resp.json().get("response", "") if resp.status_code == 200 else ""
+            return RequestResult(resp.status_code == 200, resp.status_code, latency, tokens=len(text.split()))
+
+        ttft, tokens = None, 0
+        async with client.stream("POST", path, json=payload, headers=headers) as resp:
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                if _stream_tokens(line):
+                    tokens += 1
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+            ok = resp.status_code == 200 and tokens > 0
+            return RequestResult(ok, resp.status_code, time.perf_counter() - started, ttft, tokens)
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"{scenario} request failed: {e}")
+        return RequestResult(False, 0, time.perf_counter() - started)
+
+
+class LoopLagMonitor:
+    """Samples how late a periodic timer fires on the running event loop."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            scheduled = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - scheduled - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> dict[str, float] | None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        if not self.samples:
+            return None
+        return {
+            "p99": round(percentile(self.samples, 99) * 1000, 2),
+            "max": round(max(self.samples) * 1000, 2),
+        }
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    scenario: str,
+    concurrency: int,
+    requests: int,
+    max_tokens: int = 64,
+    model: str = "medgemma:4b",
+    measure_loop: bool = True,
+) -> dict[str, Any]:
+    """Send ``requests`` requests from ``concurrency`` closed-loop clients and summarize them."""
+    remaining = requests
+    results: list[RequestResult] = []
+
+    async def _client(user: int):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            results.append(await send_one(client, scenario, max_tokens, model, client_id=f"bench-{user}"))
+
+    monitor = LoopLagMonitor() if measure_loop else None
+    if monitor is not None:
+        monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(user) for user in range(max(1, concurrency))))
+    wall = time.perf_counter() - started
+    loop_lag = await monitor.stop() if monitor is not None else None
+
+    ok = [r for r in results if r.ok]
+    tokens = sum(r.tokens for r in ok)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        # Turned away by admission control (429)
+        "rejected": sum(1 for r in results if r.status == 429),
+        "wall_s": round(wall, 3),
+        "latency_ms": _distribution_ms([r.latency_s for r in ok]),
+        "ttft_ms": _distribution_ms([r.ttft_s for r in ok if r.ttft_s is not None]),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else 0.0,
+        "tokens_per_s": round(tokens / wall, 1) if wall else 0.0,
+        "loop_lag_ms": loop_lag,
+    }
+
+
+class InProcessServer:
+    """
+    The API app with a synthetic MedGemma and a stubbed Ollama, for use as an async context manager.
+
+    Args:
+        engine: SyntheticEngine keyword arguments (latencies, output length)
+        stub: ollama_stub.build_app keyword arguments
+        max_batch_size: Batch scheduler size for the synthetic service
+    """
+
+    def __init__(
+        self, engine: dict[str, Any] | None = None, stub: dict[str, Any] | None = None, max_batch_size: int = 8
+    ):
+        self.engine = engine or {}
+        self.stub = stub or {}
+        self.max_batch_size = max_batch_size
+        self.service = None
+        self._previous = None
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        from api.app_factory import create_app
+        from api.router_registry import register_routers
+        from api.services import ollama
+        from api.services.medgemma import MedGemmaService
+        from benchmarks.asgi import StreamingASGITransport
+        from benchmarks.ollama_stub import build_app
+        from benchmarks.synthetic import SyntheticMedGemmaService
+
+        app = create_app()
+        register_routers(app)
+
+        self.service = SyntheticMedGemmaService(max_batch_size=self.max_batch_size, **self.engine)
+        self._previous = MedGemmaService._instance
+        MedGemmaService._instance = self.service
+
+        ollama._residency = None
+        await ollama.open_client(transport=StreamingASGITransport(build_app(**self.stub)))
+
+        self.client = httpx.AsyncClient(
+            transport=StreamingASGITransport(app), base_url="http://medstation.bench", timeout=None
+        )
+        return self.client
+
+    async def __aexit__(self, *exc) -> None:
+        from api.services import ollama
+        from api.services.medgemma import MedGemmaService
+
+        await self.client.aclose()
+        await ollama.close_client()
+        ollama._residency = None
+        if self.service is not None and self.service._scheduler is not None:
+            await asyncio.to_thread(self.service._scheduler.stop)
+        MedGemmaService._instance = self._previous
+
+
+async def run_suite(
+    scenarios: list[str],
+    concurrency: list[int],
+    requests: int,
+    max_tokens: int = 64,
+    url: str | None = None,
+    model: str = "medgemma:4b",
+    engine: dict[str, Any] | None = None,
+    stub: dict[str, Any] | None = None,
+    max_batch_size: int = 8,
+) -> dict[str, Any]:
+    """
+    Run every scenario at every concurrency level.
+
+    Args:
+        scenarios: Names from ``SCENARIOS``
+        concurrency: Concurrent client counts
+        requests: Requests per scenario and level
+        max_tokens: Generation length per request
+        url: Base URL of a running server (default: in-process synthetic server)
+        model: Ollama model name for the proxy scenarios
+        engine: SyntheticEngine settings (in-process only)
+        stub: Ollama stub settings (in-process only)
+        max_batch_size: Scheduler batch size (in-process only)
+
+    Returns:
+        ``{"config": ..., "results": [...]}`` with one result per scenario and level
+    """
+    config = {
+        "scenarios": scenarios,
+        "concurrency": concurrency,
+        "requests": requests,
+        "max_tokens": max_tokens,
+        "target": url or "in-process",
+        "engine": engine or {},
+        "stub": stub or {},
+        "max_batch_size": max_batch_size,
+    }
+
+    async def _run(client: httpx.AsyncClient, measure_loop: bool) -> list[dict[str, Any]]:
+        results = []
+        for scenario in scenarios:
+            # One untimed request so lazy setup (scheduler thread, pools) isn't measured
+            await send_one(client, scenario, max_tokens, model)
+            for level in concurrency:
+                logger.info(f"{scenario}: {requests} requests at concurrency {level}")
+                results.append(await run_level(client, scenario, level, requests, max_tokens, model, measure_loop))
+        return results
+
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+            results = await _run(client, measure_loop=False)
+    else:
+        async with InProcessServer(engine, stub, max_batch_size) as client:
+            results = await _run(client, measure_loop=True)
+    return {"config": config, "results": results}
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """Render results as a fixed-width table."""
+
+    def _ms(dist: dict[str, float] | None, key: str) -> str:
+        return "-" if dist is None else str(dist[key])
+
+    columns = [
+        "scenario",
+        "conc",
+        "req",
+        "err",
+        "p50 ms",
+        "p95 ms",
+        "p99 ms",
+        "ttft p50",
+        "ttft p99",
+        "req/s",
+        "tok/s",
+        "lag max",
+    ]
+    rows = [columns]
+    for r in report["results"]:
+        rows.append(
+            [
+                r["scenario"],
+                str(r["concurrency"]),
+                str(r["requests"]),
+                str(r["errors"]),
+                _ms(r["latency_ms"], "p50"),
+                _ms(r["latency_ms"], "p95"),
+                _ms(r["latency_ms"], "p99"),
+                _ms(r["ttft_ms"], "p50"),
+                _ms(r["ttft_ms"], "p99"),
+                str(r["throughput_rps"]),
+                str(r["tokens_per_s"]),
+                _ms(r["loop_lag_ms"], "max"),
+            ]
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    lines = ["  ".join(cell.rjust(width) for cell, width in zip(row, widths, strict=True)) for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the MedStation API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated ({', '.join(SCENARIOS)})")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="requests per scenario and level")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--url", default=None, help="drive a running server instead of the in-process one")
+    parser.add_argument("--model", default="medgemma:4b", help="Ollama model for the proxy scenarios")
+    parser.add_argument("--prefill-ms", type=float, default=50.0, help="synthetic prefill time")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="synthetic decode step time")
+    parser.add_argument("--batch-token-ms", type=float, default=2.0, help="added step time per extra batched sequence")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--out", type=Path, default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if not scenarios or unknown:
+        parser.error(f"--scenarios must be a list of {', '.join(SCENARIOS)}")
+    try:
+        concurrency = _int_list(args.concurrency)
+    except ValueError:
+        parser.error("--concurrency must be comma-separated integers")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s %(name)s: %(message)s")
+    engine = {
+        "prefill_s": args.prefill_ms / 1000,
+        "token_s": args.token_ms / 1000,
+        "batch_token_s": args.batch_token_ms / 1000,
+        "output_tokens": args.max_tokens,
+    }
+    stub = {"first_token_s": args.prefill_ms / 1000, "token_s": args.token_ms / 1000, "tokens": args.max_tokens}
+    report = asyncio.run(
+        run_suite(
+            scenarios,
+            concurrency,
+            args.requests,
+            max_tokens=args.max_tokens,
+            url=args.url,
+            model=args.model,
+            engine=engine,
+            stub=stub,
+            max_batch_size=args.max_batch_size,
+        )
+    )
+
+    print(format_report(report))
+    if args.out is not None:
+        args.out.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Local stand-in for the Ollama HTTP API.
+
+Serves the endpoints the proxy uses (/api/generate, /api/tags, /api/ps
+and /api/version) with a configurable first-token and per-token delay.
+This lets the proxy be benchmarked without Ollama or a GPU. The
+benchmark mounts it in-process through ``httpx.ASGITransport``. It also
+runs standalone behind any ASGI server:
+
+    uvicorn benchmarks.ollama_stub:app --port 11434
+"""
+
+import asyncio
+import json
+from collections.abc import AsyncIterator
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+MODEL = "medgemma:4b"
+
+
+def build_app(first_token_s: float = 0.05, token_s: float = 0.01, tokens: int = 64) -> Starlette:
+    """
+    Build the stub app.
+
+    Args:
+        first_token_s: Delay before the first token (simulated prompt eval)
+        token_s: Delay between tokens
+        tokens: Tokens per response (capped by ``options.num_predict``)
+    """
+
+    def _count(body: dict) -> int:
+        num_predict = (body.get("options") or {}).get("num_predict")
+        return min(tokens, num_predict) if isinstance(num_predict, int) and num_predict > 0 else tokens
+
+    async def _tokens(n: int) -> AsyncIterator[str]:
+        await asyncio.sleep(first_token_s)
+        for i in range(n):
+            if i:
+                await asyncio.sleep(token_s)
+            yield f"word{i} "
+
+    async def generate(request: Request):
+        body = await request.json()
+        model = body.get("model", MODEL)
+        n = _count(body)
+
+        if body.get("stream", True):
+
+            async def _lines():
+                async for token in _tokens(n):
+                    yield json.dumps({"model": model, "response": token, "done": False}) + "\n"
+                yield json.dumps({"model": model, "response": "", "done": True, "eval_count": n}) + "\n"
+
+            return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+        text = "".join([token async for token in _tokens(n)])
+        return JSONResponse({"model": model, "response": text, "done": True, "eval_count": n})
+
+    async def tags(request: Request):
+        return JSONResponse({"models": [{"name": MODEL, "model": MODEL, "size": 0}]})
+
+    async def ps(request: Request):
+        return JSONResponse({"models": [{"name": MODEL, "model": MODEL, "size_vram": 0}]})
+
+    async def version(request: Request):
+        return JSONResponse({"version": "0.0.0-stub"})
+
+    return Starlette(
+        routes=[
+            Route("/api/generate", generate, methods=["POST"]),
+            Route("/api/tags", tags),
+            Route("/api/ps", ps),
+            Route("/api/version", version),
+        ]
+    )
+
+
+app = build_app()
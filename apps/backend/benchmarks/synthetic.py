@@ -0,0 +1,134 @@
+"""
+Synthetic MedGemma for load testing without model weights.
+
+``SyntheticMedGemmaService`` is a ``MedGemmaService`` whose engine sleeps
+instead of running the model. Requests still go through the real
+service, batch scheduler, streaming and route code. Only the forward
+passes are simulated, so benchmark numbers show the serving overhead
+(event loop, serialization, scheduling) on any CPU box.
+
+Latency model (seconds, all configurable):
+
+    prefill  = prefill_s + prompt_token_s * prompt tokens
+    decode   = token_s + batch_token_s * (batch size - 1)   per step
+
+``batch_token_s`` is the marginal cost of each extra sequence in a
+batched step. Set it to ``token_s`` to model no batching gain.
+"""
+
+import threading
+from typing import Any
+
+from api.services.medgemma import MedGemmaService
+from api.services.response_cache import ResponseCache
+
+EOS = 0
+
+# Output vocabulary: token id i (1-based) detokenizes to _WORDS[(i - 1) % len]
+_WORDS = [
+    "Patient ",
+    "presents ",
+    "with ",
+    "acute ",
+    "chest ",
+    "pain; ",
+    "recommend ",
+    "ECG ",
+    "and ",
+    "troponin. ",
+    "Triage ",
+    "level: ",
+    "urgent. ",
+    "Monitor ",
+    "vitals ",
+    "closely. ",
+]
+
+
+class SyntheticEngine:
+    """
+    ``DecodeEngine`` that emits a fixed-length word sequence with simulated compute time.
+
+    Args:
+        prefill_s: Fixed prefill cost per sequence
+        prompt_token_s: Additional prefill cost per prompt token
+        token_s: Cost of one decode step for a single sequence
+        batch_token_s: Added cost per extra sequence in a batched step
+        output_tokens: Tokens generated per request (before max_new_tokens)
+    """
+
+    eos_token_ids = {EOS}
+
+    def __init__(
+        self,
+        prefill_s: float = 0.05,
+        prompt_token_s: float = 0.0,
+        token_s: float = 0.02,
+        batch_token_s: float = 0.002,
+        output_tokens: int = 64,
+    ):
+        self.prefill_s = prefill_s
+        self.prompt_token_s = prompt_token_s
+        self.token_s = token_s
+        self.batch_token_s = batch_token_s
+        self.output_tokens = max(1, output_tokens)
+        self.prefills = 0
+        self.decode_steps = 0
+        # Event.wait releases the GIL like a real forward pass would
+        self._clock = threading.Event()
+
+    def prefill(self, seq) -> int:
+        self._clock.wait(self.prefill_s + self.prompt_token_s * seq.inputs.get("prompt_tokens", 0))
+        self.prefills += 1
+        seq.position = 1
+        return 1
+
+    def decode(self, seqs: list[Any]) -> list[int]:
+        self._clock.wait(self.token_s + self.batch_token_s * (len(seqs) - 1))
+        self.decode_steps += 1
+        tokens = []
+        for seq in seqs:
+            seq.position += 1
+            tokens.append(EOS if seq.position > self.output_tokens else seq.position)
+        return tokens
+
+    def detach(self, seqs: list[Any]) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def detokenize(self, token_ids: list[int]) -> str:
+        return "".join(_WORDS[(t - 1) % len(_WORDS)] for t in token_ids if t != EOS)
+
+
+class SyntheticMedGemmaService(MedGemmaService):
+    """
+    MedGemma service backed by ``SyntheticEngine``.
+
+    "Loading" is instant. The response cache is off so every request
+    generates. Engine latencies are passed through as keyword arguments.
+    """
+
+    def __init__(self, max_batch_size: int = 8, **engine_kwargs):
+        super().__init__(variant="synthetic", response_cache=ResponseCache(max_entries=0))
+        self.max_batch_size = max_batch_size
+        self.engine = SyntheticEngine(**engine_kwargs)
+
+    async def load(self, model_dir=None) -> bool:
+        self.loaded = True
+        self.state = "ready"
+        self.precision = "synthetic"
+        return True
+
+    def image_input_size(self):
+        return None
+
+    def _prepare_inputs(self, messages: list, image_digest=None) -> dict[str, Any]:
+        text = " ".join(
+            part.get("text", "") for message in messages for part in message["content"] if part["type"] == "text"
+        )
+        return {"prompt_tokens": len(text.split())}
+
+    def _make_engine(self) -> SyntheticEngine:
+        return self.engine
@@ -5,12 +5,15 @@ These tests validate the API layer WITHOUT loading the MedGemma model
 (no torch/transformers required). The model service is mocked.
 """
 
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
 import pytest
-from unittest.mock import AsyncMock, patch
-from httpx import AsyncClient, ASGITransport
+from httpx import ASGITransport, AsyncClient
 
 from api.app_factory import create_app
 from api.router_registry import register_routers
+from api.services import ollama
 
 
 @pytest.fixture
@@ -36,6 +39,7 @@ def mock_medgemma_not_loaded():
     mock_svc.loaded = False
     mock_svc.load = AsyncMock(return_value=False)
     mock_svc.device = "cpu"
+    mock_svc.runtime_stats = MagicMock(return_value={})
 
     with patch("api.services.medgemma.get_medgemma", return_value=mock_svc):
         yield mock_svc
@@ -47,9 +51,11 @@ def mock_medgemma_loaded():
     mock_svc = AsyncMock()
     mock_svc.loaded = True
     mock_svc.device = "mps"
+    mock_svc.runtime_stats = MagicMock(return_value={})
+    mock_svc.image_input_size = MagicMock(return_value=None)
     mock_svc.generate = AsyncMock(return_value="Test medical response from MedGemma.")
 
-    async def mock_stream():
+    async def mock_stream(**kwargs):
         for token in ["Test ", "streaming ", "response."]:
             yield token
 
@@ -57,3 +63,23 @@ def mock_medgemma_loaded():
 
     with patch("api.services.medgemma.get_medgemma", return_value=mock_svc):
         yield mock_svc
+
+
+@pytest.fixture
+async def upstream():
+    """Route the shared Ollama client to a MockTransport and record requests."""
+    seen = []
+    handlers = {"/api/ps": lambda _: httpx.Response(200, json={"models": []})}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/api/ps":
+            seen.append(request)
+        if request.url.path not in handlers:
+            return httpx.Response(404, json={"error": "not found"})
+        return handlers[request.url.path](request)
+
+    ollama._residency = None
+    await ollama.open_client(transport=httpx.MockTransport(handler))
+    yield seen, handlers
+    await ollama.close_client()
+    ollama._residency = None
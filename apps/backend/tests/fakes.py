@@ -0,0 +1,58 @@
+"""
+Test doubles shared across test modules.
+
+``FakeEngine`` stands in for a model engine behind ``BatchScheduler`` (no
+torch), and ``ChunkStream`` for an upstream body sent in fixed chunks.
+"""
+
+import threading
+
+import httpx
+
+EOS = 0
+
+
+class FakeEngine:
+    """Replays a fixed token script per sequence and records batch sizes."""
+
+    eos_token_ids = {EOS}
+
+    def __init__(self, step_delay: float = 0.0, fail_on_decode: bool = False):
+        self.step_delay = step_delay
+        self.fail_on_decode = fail_on_decode
+        self.batch_sizes = []
+        self.detached = []
+        self.decode_started = threading.Event()
+
+    def prefill(self, seq):
+        seq.kv = list(seq.inputs["script"])
+        return seq.kv.pop(0)
+
+    def decode(self, seqs):
+        self.decode_started.set()
+        if self.fail_on_decode:
+            raise RuntimeError("boom")
+        self.batch_sizes.append(len(seqs))
+        if self.step_delay:
+            threading.Event().wait(self.step_delay)
+        return [s.kv.pop(0) if s.kv else EOS for s in seqs]
+
+    def detach(self, seqs):
+        self.detached.extend(seqs)
+
+    def clear(self):
+        pass
+
+    def detokenize(self, token_ids):
+        return "".join(chr(ord("a") + t - 1) for t in token_ids)
+
+
+class ChunkStream(httpx.AsyncByteStream):
+    """Upstream body delivered in fixed chunks, to check raw passthrough."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
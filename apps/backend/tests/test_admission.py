@@ -0,0 +1,187 @@
+"""
+Tests for MedGemma admission control: priority ordering, per-client fair
+sharing, bounded queueing and the 429 responses routes return.
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from api.services.admission import AdmissionController, AdmissionRejected, request_priority
+
+
+async def _queued(controller, client, priority="normal"):
+    """Start waiting for a slot; returns the pending acquire task."""
+    task = asyncio.create_task(controller.acquire(client, priority))
+    await asyncio.sleep(0)
+    return task
+
+
+class TestAdmissionController:
+    async def test_admits_up_to_max_active(self):
+        controller = AdmissionController(max_active=2, max_queue=4)
+        first = await controller.acquire("a")
+        await controller.acquire("b")
+        waiting = await _queued(controller, "c")
+        assert not waiting.done()
+        assert controller.stats()["queued"] == 1
+
+        first.release()
+        first.release()  # idempotent
+        ticket = await waiting
+        assert ticket.client == "c"
+        assert controller.stats()["active"] == 2
+
+    async def test_higher_priority_jumps_the_queue(self):
+        controller = AdmissionController(max_active=1, max_queue=4)
+        running = await controller.acquire("a")
+        low = await _queued(controller, "b", "low")
+        normal = await _queued(controller, "c", "normal")
+        emergency = await _queued(controller, "d", "emergency")
+
+        running.release()
+        assert (await emergency).client == "d"
+        assert not normal.done() and not low.done()
+
+    async def test_fair_share_between_clients(self):
+        controller = AdmissionController(max_active=2, max_queue=8)
+        busy = await controller.acquire("greedy")
+        await controller.acquire("greedy")
+        more_greedy = await _queued(controller, "greedy")
+        other = await _queued(controller, "polite")
+
+        # "greedy" queued first but already holds both slots
+        busy.release()
+        assert (await other).client == "polite"
+        assert not more_greedy.done()
+
+    async def test_full_queue_rejects_with_retry_after(self):
+        controller = AdmissionController(max_active=1, max_queue=1)
+        await controller.acquire("a")
+        await _queued(controller, "b")
+        with pytest.raises(AdmissionRejected) as exc:
+            await controller.acquire("c")
+        assert exc.value.reason == "queue_full"
+        assert exc.value.retry_after >= 1
+        assert controller.stats()["rejected"] == {"queue_full": 1}
+
+    async def test_emergency_displaces_lowest_priority_waiter(self):
+        controller = AdmissionController(max_active=1, max_queue=2)
+        running = await controller.acquire("a")
+        normal = await _queued(controller, "b", "normal")
+        low = await _queued(controller, "c", "low")
+        emergency = await _queued(controller, "d", "emergency")
+
+        with pytest.raises(AdmissionRejected, match="preempted"):
+            await low
+        running.release()
+        assert (await emergency).client == "d"
+        assert not normal.done()
+
+    async def test_per_client_queue_limit(self):
+        controller = AdmissionController(max_active=1, max_queue=8, max_queued_per_client=1)
+        await controller.acquire("a")
+        await _queued(controller, "b")
+        with pytest.raises(AdmissionRejected) as exc:
+            await controller.acquire("b")
+        assert exc.value.reason == "client_queue_full"
+
+    async def test_emergency_stays_within_client_share(self):
+        controller = AdmissionController(max_active=1, max_queue=8, max_queued_per_client=1)
+        await controller.acquire("a")
+        other = await _queued(controller, "c", "low")
+        own = await _queued(controller, "b", "normal")
+
+        # An emergency replaces the client's own waiter instead of adding to its share
+        emergency = await _queued(controller, "b", "emergency")
+        with pytest.raises(AdmissionRejected, match="preempted"):
+            await own
+        assert not emergency.done()
+        with pytest.raises(AdmissionRejected) as exc:
+            await controller.acquire("b", "emergency")
+        assert exc.value.reason == "client_queue_full"
+        assert not other.done()
+
+    async def test_low_priority_leaves_reserved_slots(self):
+        controller = AdmissionController(max_active=3, max_queue=8, reserved=1)
+        bulk = [await controller.acquire("bulk", "low") for _ in range(2)]
+        waiting = await _queued(controller, "bulk", "low")
+        assert not waiting.done()
+
+        # The reserved slot goes straight to an interactive request
+        interactive = await asyncio.wait_for(controller.acquire("clinician"), 0.1)
+        interactive.release()
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        bulk[0].release()
+        assert (await waiting).priority == "low"
+        assert controller.stats()["reserved"] == 1
+
+    def test_reserved_leaves_low_one_slot(self):
+        assert AdmissionController(max_active=2, reserved=4).reserved == 1
+
+    async def test_queue_timeout(self):
+        controller = AdmissionController(max_active=1, max_queue=4, queue_timeout=0.01)
+        await controller.acquire("a")
+        with pytest.raises(AdmissionRejected, match="queue timeout"):
+            await controller.acquire("b")
+        assert controller.stats()["queued"] == 0
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        controller = AdmissionController(max_active=1, max_queue=4)
+        running = await controller.acquire("a")
+        waiting = await _queued(controller, "b")
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        running.release()
+        assert controller.stats()["active"] == 0
+        assert controller.stats()["queued"] == 0
+
+    async def test_disabled_admits_everything(self):
+        controller = AdmissionController(max_active=0)
+        tickets = [await controller.acquire("a") for _ in range(100)]
+        assert len(tickets) == 100
+        assert controller.stats()["active"] == 0
+
+
+class TestRequestPriority:
+    def test_emergency_keywords_escalate(self):
+        assert request_priority(None, "Sudden CHEST PAIN radiating to the arm") == "emergency"
+        assert request_priority(None, "Mild rash for two days") == "normal"
+
+    def test_explicit_priority_wins(self):
+        assert request_priority("low", "chest pain") == "low"
+
+
+class TestAdmissionRoutes:
+    @pytest.fixture
+    def saturated(self):
+        controller = AdmissionController(max_active=1, max_queue=0)
+        with patch("api.services.admission.get_admission", return_value=controller):
+            yield controller
+
+    async def test_saturated_generate_returns_429(self, client, mock_medgemma_loaded, saturated):
+        held = await saturated.acquire("other")
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "Mild rash"})
+        assert resp.status_code == 429
+        assert int(resp.headers["Retry-After"]) >= 1
+        assert resp.json()["retry_after"] == int(resp.headers["Retry-After"])
+        mock_medgemma_loaded.generate.assert_not_called()
+
+        held.release()
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "Mild rash"})
+        assert resp.status_code == 200
+        assert saturated.stats()["active"] == 0
+
+    async def test_stream_holds_slot_until_done(self, client, mock_medgemma_loaded, saturated):
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "x", "stream": True})
+        assert resp.status_code == 200
+        assert saturated.stats()["active"] == 0
+        assert saturated.stats()["admitted"] == 1
+
+    async def test_status_reports_admission(self, client, mock_medgemma_loaded, saturated):
+        resp = await client.get("/api/v1/chat/medgemma/status")
+        assert resp.json()["admission"]["max_active"] == 1
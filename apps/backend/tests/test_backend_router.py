@@ -0,0 +1,265 @@
+"""
+Tests for latency-aware routing across MedGemma backends.
+
+Scripted in-memory backends stand in for the local model and Ollama hosts.
+"""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from api.services.admission import AdmissionController, AdmissionRejected
+from api.services.backend_router import (
+    Backend,
+    BackendError,
+    BackendRouter,
+    LocalMedGemmaBackend,
+    NoBackendAvailable,
+    OllamaBackend,
+    parse_ollama_hosts,
+)
+from api.services.batching import BatchScheduler
+from api.services.medgemma import MedGemmaService
+from api.services.response_cache import ResponseCache
+from tests.fakes import FakeEngine
+
+
+class ScriptedBackend(Backend):
+    """Yields ``chunks`` with an optional delay, or fails after ``fail_after`` chunks."""
+
+    kind = "fake"
+
+    def __init__(self, name, chunks=("ok",), delay=0.0, fail_after=None, capacity=1):
+        super().__init__(name, f"{name}-model", capacity)
+        self.chunks = list(chunks)
+        self.delay = delay
+        self.fail_after = fail_after
+        self.calls = 0
+        self.closed = 0
+
+    async def _stream(self, prompt, system_prompt, max_new_tokens, temperature):
+        self.calls += 1
+        try:
+            for i, chunk in enumerate(self.chunks):
+                if self.fail_after is not None and i >= self.fail_after:
+                    raise BackendError(f"{self.name} broke")
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                yield chunk
+        finally:
+            self.closed += 1
+
+
+async def _collect(router, max_new_tokens=16):
+    out = []
+    async for backend, chunk in router.stream("q", "sys", max_new_tokens, 0.0):
+        out.append((backend.name, chunk))
+    return out
+
+
+class TestPick:
+    def test_prefers_lower_measured_latency(self):
+        fast, slow = ScriptedBackend("fast"), ScriptedBackend("slow")
+        fast.record_success(ttft=0.1, tokens=101, decode_s=1.0)
+        slow.record_success(ttft=2.0, tokens=101, decode_s=10.0)
+        assert BackendRouter([slow, fast]).pick(100) is fast
+
+    def test_load_shifts_traffic(self):
+        a, b = ScriptedBackend("a"), ScriptedBackend("b")
+        for backend in (a, b):
+            backend.record_success(ttft=0.1, tokens=101, decode_s=1.0)
+        a.inflight = 3
+        assert BackendRouter([a, b]).pick(100) is b
+
+    def test_capacity_absorbs_load(self):
+        batched, single = ScriptedBackend("batched", capacity=8), ScriptedBackend("single")
+        for backend in (batched, single):
+            backend.record_success(ttft=0.1, tokens=101, decode_s=1.0)
+        batched.inflight = 3
+        single.inflight = 1
+        assert BackendRouter([single, batched]).pick(100) is batched
+
+    def test_cooling_down_backend_skipped(self):
+        a, b = ScriptedBackend("a"), ScriptedBackend("b")
+        a.record_failure()
+        assert not a.available()
+        assert BackendRouter([a, b]).pick(10) is b
+
+
+class TestFailover:
+    async def test_error_before_output_fails_over(self):
+        broken, healthy = ScriptedBackend("broken", fail_after=0), ScriptedBackend("healthy", chunks=["a", "b"])
+        broken.ttft_s = 0.01  # looks best, so it is tried first
+        router = BackendRouter([broken, healthy])
+        assert await _collect(router) == [("healthy", "a"), ("healthy", "b")]
+        assert router.failovers == 1
+        assert broken.failures == 1 and not broken.available()
+
+    async def test_stall_before_first_token_fails_over(self):
+        stalled, healthy = ScriptedBackend("stalled", delay=1.0), ScriptedBackend("healthy")
+        stalled.ttft_s = 0.01
+        router = BackendRouter([stalled, healthy], first_token_timeout=0.05)
+        assert await _collect(router) == [("healthy", "ok")]
+        assert stalled.closed == 1
+        assert stalled.inflight == 0
+
+    async def test_error_after_output_is_raised(self):
+        flaky = ScriptedBackend("flaky", chunks=["a", "b"], fail_after=1)
+        other = ScriptedBackend("other")
+        flaky.ttft_s = 0.01
+        router = BackendRouter([flaky, other])
+        with pytest.raises(BackendError):
+            await _collect(router)
+        assert other.calls == 0
+
+    async def test_all_failed_raises_no_backend(self):
+        router = BackendRouter([ScriptedBackend("a", fail_after=0), ScriptedBackend("b", fail_after=0)])
+        with pytest.raises(NoBackendAvailable, match="broke"):
+            await _collect(router)
+
+    async def test_success_records_latency(self):
+        backend = ScriptedBackend("a", chunks=["x"] * 5, delay=0.001)
+        await _collect(BackendRouter([backend]))
+        assert backend.ttft_s is not None
+        assert backend.tokens_per_s is not None
+        assert backend.inflight == 0
+
+
+class TestAdmission:
+    def _local(self, **kwargs):
+        backend = ScriptedBackend("local", **kwargs)
+        backend.needs_admission = True
+        return backend
+
+    async def test_local_backend_holds_ticket_while_streaming(self):
+        controller = AdmissionController(max_active=1, max_queue=0)
+        router = BackendRouter([self._local(chunks=["a", "b"])])
+        async for _ in router.stream("q", "sys", 16, 0.0, admit=lambda: controller.acquire("c")):
+            assert controller.stats()["active"] == 1
+        assert controller.stats()["active"] == 0
+
+    async def test_busy_local_fails_over_then_rejects(self):
+        controller = AdmissionController(max_active=1, max_queue=0)
+        held = await controller.acquire("other")
+        local, box = self._local(), ScriptedBackend("box")
+        local.ttft_s, box.ttft_s = 0.1, 5.0
+
+        router = BackendRouter([local, box])
+        out = [(b.name, c) async for b, c in router.stream("q", "sys", 16, 0.0, admit=lambda: controller.acquire("c"))]
+        assert out == [("box", "ok")]
+        assert local.calls == 0
+
+        with pytest.raises(AdmissionRejected):
+            async for _ in BackendRouter([local]).stream("q", "sys", 16, 0.0, admit=lambda: controller.acquire("c")):
+                pass
+        held.release()
+
+    async def test_ollama_backends_skip_admission(self):
+        async def refuse():
+            raise AssertionError("admission requested")
+
+        out = [c async for _, c in BackendRouter([ScriptedBackend("box")]).stream("q", "sys", 16, 0.0, admit=refuse)]
+        assert out == ["ok"]
+
+
+class TestOllamaBackend:
+    def test_parse_hosts(self):
+        assert parse_ollama_hosts("box1:11434, http://box2:11434=medgemma:27b,", "medgemma") == [
+            ("http://box1:11434", "medgemma"),
+            ("http://box2:11434", "medgemma:27b"),
+        ]
+
+    async def test_streams_response_field(self):
+        seen = []
+
+        def handler(request):
+            seen.append(json.loads(request.content))
+            lines = [{"response": "Chest"}, {"response": " pain"}, {"response": "", "done": True}]
+            return httpx.Response(200, content="".join(json.dumps(line) + "\n" for line in lines))
+
+        backend = OllamaBackend("http://box", "medgemma", transport=httpx.MockTransport(handler))
+        chunks = [c async for c in backend.stream("q", "sys", 32, 0.2)]
+        assert chunks == ["Chest", " pain"]
+        assert seen[0]["options"] == {"num_predict": 32, "temperature": 0.2}
+        assert seen[0]["system"] == "sys"
+        await backend.close()
+
+    async def test_http_error_raises(self):
+        backend = OllamaBackend(
+            "http://box",
+            "medgemma",
+            transport=httpx.MockTransport(lambda _: httpx.Response(404, json={"error": "model not found"})),
+        )
+        with pytest.raises(BackendError, match="404"):
+            [c async for c in backend.stream("q", "sys", 32, 0.2)]
+        await backend.close()
+
+
+class TestLocalBackend:
+    async def test_local_backend_uses_scheduler(self):
+        svc = MedGemmaService()
+        svc.loaded = True
+        svc.response_cache = ResponseCache(max_entries=0)
+        svc._prepare_inputs = lambda _messages, _digest=None: {"script": [1, 2, 0]}
+        svc._scheduler = BatchScheduler(FakeEngine())
+        backend = LocalMedGemmaBackend(svc)
+        assert backend.available()
+        assert "".join([c async for c in backend.stream("q", "sys", 10, 0.0)]) == "ab"
+        svc._scheduler.stop()
+
+    def test_unloaded_local_backend_unavailable(self):
+        svc = MedGemmaService()
+        assert not LocalMedGemmaBackend(svc).available()
+
+
+class TestRoutedRoutes:
+    async def test_generate_reports_backend(self, client):
+        router = BackendRouter([ScriptedBackend("box", chunks=["Call ", "911"])])
+        with patch("api.services.backend_router.get_router", return_value=router):
+            resp = await client.post("/api/v1/chat/generate", json={"prompt": "chest pain"})
+        assert resp.status_code == 200
+        assert resp.json() == {"response": "Call 911", "model": "box-model", "backend": "box"}
+
+    async def test_stream_ends_with_backend(self, client):
+        router = BackendRouter([ScriptedBackend("box", chunks=["a", "b"])])
+        with patch("api.services.backend_router.get_router", return_value=router):
+            resp = await client.post("/api/v1/chat/generate", json={"prompt": "x", "stream": True})
+        lines = [json.loads(line) for line in resp.text.strip().split("\n")]
+        assert lines == [{"token": "a"}, {"token": "b"}, {"done": True, "backend": "box"}]
+
+    async def test_no_backend_is_503(self, client):
+        with patch("api.services.backend_router.get_router", return_value=BackendRouter([])):
+            resp = await client.post("/api/v1/chat/generate", json={"prompt": "x"})
+        assert resp.status_code == 503
+
+    async def test_saturated_local_backend_returns_429(self, client):
+        controller = AdmissionController(max_active=1, max_queue=0)
+        local = ScriptedBackend("local", chunks=["a"])
+        local.needs_admission = True
+        router = BackendRouter([local])
+        held = await controller.acquire("other")
+        with (
+            patch("api.services.backend_router.get_router", return_value=router),
+            patch("api.services.admission.get_admission", return_value=controller),
+        ):
+            for stream in (False, True):
+                resp = await client.post("/api/v1/chat/generate", json={"prompt": "x", "stream": stream})
+                assert resp.status_code == 429
+                assert int(resp.headers["Retry-After"]) >= 1
+            assert local.calls == 0
+
+            held.release()
+            for stream in (False, True):
+                resp = await client.post("/api/v1/chat/generate", json={"prompt": "x", "stream": stream})
+                assert resp.status_code == 200
+        assert controller.stats()["active"] == 0
+        assert controller.stats()["admitted"] == 3
+
+    async def test_backends_status(self, client):
+        router = BackendRouter([ScriptedBackend("box")])
+        with patch("api.services.backend_router.get_router", return_value=router):
+            resp = await client.get("/api/v1/chat/backends")
+        assert resp.json()["backends"][0]["name"] == "box"
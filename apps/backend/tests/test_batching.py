@@ -0,0 +1,189 @@
+"""
+Tests for the continuous batching scheduler.
+
+Uses a scripted fake engine (no torch) to validate batching, per-request
+limits, streaming backpressure, cancellation and error propagation.
+"""
+
+import asyncio
+
+import pytest
+
+from api.services.batching import BatchScheduler, GenerationCancelled
+from tests.fakes import EOS, FakeEngine
+
+
+class TestBatchScheduler:
+    async def test_single_request_returns_text(self):
+        sched = BatchScheduler(FakeEngine())
+        seq = sched.submit({"script": [1, 2, 3, EOS]}, max_new_tokens=10, temperature=0.0)
+        assert await seq.result() == "abc"
+        sched.stop()
+
+    async def test_max_new_tokens_respected_per_request(self):
+        sched = BatchScheduler(FakeEngine())
+        short = sched.submit({"script": [1, 2, 3, 4, 5]}, max_new_tokens=2, temperature=0.0)
+        long = sched.submit({"script": [1, 2, 3, 4, 5]}, max_new_tokens=4, temperature=0.0)
+        assert await short.result() == "ab"
+        assert await long.result() == "abcd"
+        sched.stop()
+
+    async def test_concurrent_requests_share_decode_steps(self):
+        engine = FakeEngine(step_delay=0.01)
+        sched = BatchScheduler(engine, max_batch_size=8, max_prefills_per_step=8)
+        seqs = [sched.submit({"script": [1] * 20}, max_new_tokens=20, temperature=0.0) for _ in range(6)]
+        results = await asyncio.gather(*(s.result() for s in seqs))
+        assert all(r == "a" * 20 for r in results)
+        assert max(engine.batch_sizes) > 1
+        # Far fewer forward passes than 6 sequential requests would need
+        assert len(engine.batch_sizes) < 6 * 19
+        sched.stop()
+
+    async def test_late_arrival_joins_running_batch(self):
+        engine = FakeEngine(step_delay=0.01)
+        sched = BatchScheduler(engine, max_batch_size=4)
+        first = sched.submit({"script": [1] * 30}, max_new_tokens=30, temperature=0.0)
+        await asyncio.to_thread(engine.decode_started.wait, 5)
+        second = sched.submit({"script": [2] * 5}, max_new_tokens=5, temperature=0.0)
+        assert await second.result() == "bbbbb"
+        assert not first.finished
+        assert await first.result() == "a" * 30
+        assert 2 in engine.batch_sizes
+        sched.stop()
+
+    async def test_batch_size_limit(self):
+        engine = FakeEngine()
+        sched = BatchScheduler(engine, max_batch_size=2, max_prefills_per_step=4)
+        seqs = [sched.submit({"script": [1] * 5}, max_new_tokens=5, temperature=0.0) for _ in range(5)]
+        await asyncio.gather(*(s.result() for s in seqs))
+        assert max(engine.batch_sizes) <= 2
+        sched.stop()
+
+    async def test_stream_yields_deltas(self):
+        sched = BatchScheduler(FakeEngine())
+        seq = sched.submit({"script": [1, 2, 3, EOS]}, max_new_tokens=10, temperature=0.0, stream=True)
+        chunks = [c async for c in seq.stream_text()]
+        assert "".join(chunks) == "abc"
+        assert len(chunks) == 3
+        sched.stop()
+
+    async def test_decode_failure_propagates(self):
+        sched = BatchScheduler(FakeEngine(fail_on_decode=True))
+        seq = sched.submit({"script": [1, 2, 3]}, max_new_tokens=10, temperature=0.0)
+        with pytest.raises(RuntimeError, match="boom"):
+            await seq.result()
+        sched.stop()
+
+    async def test_stream_failure_propagates(self):
+        sched = BatchScheduler(FakeEngine(fail_on_decode=True))
+        seq = sched.submit({"script": [1, 2, 3]}, max_new_tokens=10, temperature=0.0, stream=True)
+        with pytest.raises(RuntimeError, match="boom"):
+            async for _ in seq.stream_text():
+                pass
+        sched.stop()
+
+    async def test_stats_reports_work(self):
+        sched = BatchScheduler(FakeEngine(), max_batch_size=3)
+        seq = sched.submit({"script": [1, 2, EOS]}, max_new_tokens=10, temperature=0.0)
+        await seq.result()
+        stats = sched.stats()
+        assert stats["max_batch_size"] == 3
+        assert stats["tokens_generated"] == 2
+        assert stats["queued"] == 0
+        sched.stop()
+
+    async def test_submit_after_stop_rejected(self):
+        sched = BatchScheduler(FakeEngine())
+        sched.stop()
+        with pytest.raises(RuntimeError):
+            sched.submit({"script": [1]}, max_new_tokens=1, temperature=0.0)
+
+
+async def _wait_for(predicate, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+class TestStreamBackpressure:
+    async def test_slow_consumer_parks_then_resumes(self):
+        engine = FakeEngine()
+        sched = BatchScheduler(engine, max_buffered_chunks=2)
+        seq = sched.submit({"script": [1] * 10 + [EOS]}, max_new_tokens=50, temperature=0.0, stream=True)
+
+        await _wait_for(lambda: sched.stats()["parked"] == 1)
+        assert engine.detached == [seq]
+        assert len(seq.token_ids) == 2  # generation paused at the buffer limit
+
+        chunks = [c async for c in seq.stream_text()]
+        assert "".join(chunks) == "a" * 10
+        assert sched.stats()["parked"] == 0
+        sched.stop()
+
+    async def test_parked_stream_frees_its_batch_slot(self):
+        sched = BatchScheduler(FakeEngine(), max_batch_size=1, max_buffered_chunks=1)
+        slow = sched.submit({"script": [1] * 5 + [EOS]}, max_new_tokens=50, temperature=0.0, stream=True)
+        await _wait_for(lambda: sched.stats()["parked"] == 1)
+
+        other = sched.submit({"script": [2, 3, EOS]}, max_new_tokens=50, temperature=0.0)
+        assert await asyncio.wait_for(other.result(), timeout=2.0) == "bc"
+
+        assert "".join([c async for c in slow.stream_text()]) == "aaaaa"
+        sched.stop()
+
+    async def test_stop_fails_parked_stream(self):
+        sched = BatchScheduler(FakeEngine(), max_buffered_chunks=1)
+        seq = sched.submit({"script": [1] * 5 + [EOS]}, max_new_tokens=50, temperature=0.0, stream=True)
+        await _wait_for(lambda: sched.stats()["parked"] == 1)
+        sched.stop()
+        with pytest.raises(RuntimeError, match="stopped"):
+            async for _ in seq.stream_text():
+                pass
+
+
+class TestCancellation:
+    async def test_cancel_frees_slot_within_a_step(self):
+        engine = FakeEngine(step_delay=0.01)
+        sched = BatchScheduler(engine, max_batch_size=1)
+        doomed = sched.submit({"script": [1] * 1000 + [EOS]}, max_new_tokens=5000, temperature=0.0)
+        await asyncio.to_thread(engine.decode_started.wait, 2.0)
+
+        waiting = sched.submit({"script": [2, 3, EOS]}, max_new_tokens=10, temperature=0.0)
+        doomed.cancel()
+        assert await asyncio.wait_for(waiting.result(), timeout=2.0) == "bc"
+        with pytest.raises(GenerationCancelled):
+            await doomed.result()
+        assert len(doomed.token_ids) < 1000
+        assert sched.stats()["cancelled"] == 1
+        await _wait_for(lambda: sched.stats()["active"] == 0)
+        sched.stop()
+
+    async def test_cancel_before_admission(self):
+        engine = FakeEngine(step_delay=0.01)
+        sched = BatchScheduler(engine, max_batch_size=1)
+        running = sched.submit({"script": [1] * 20 + [EOS]}, max_new_tokens=50, temperature=0.0)
+        queued = sched.submit({"script": [2, EOS]}, max_new_tokens=10, temperature=0.0)
+        queued.cancel()
+        await running.result()
+        assert queued.token_ids == []
+        assert sched.stats()["cancelled"] == 1
+        sched.stop()
+
+    async def test_cancel_parked_stream(self):
+        sched = BatchScheduler(FakeEngine(), max_buffered_chunks=1)
+        seq = sched.submit({"script": [1] * 5 + [EOS]}, max_new_tokens=50, temperature=0.0, stream=True)
+        await _wait_for(lambda: sched.stats()["parked"] == 1)
+        seq.cancel()
+        await _wait_for(lambda: sched.stats()["parked"] == 0)
+        assert sched.stats()["cancelled"] == 1
+        sched.stop()
+
+    async def test_cancel_after_finish_is_noop(self):
+        sched = BatchScheduler(FakeEngine())
+        seq = sched.submit({"script": [1, EOS]}, max_new_tokens=10, temperature=0.0)
+        assert await seq.result() == "a"
+        seq.cancel()
+        assert not seq.cancelled
+        sched.stop()
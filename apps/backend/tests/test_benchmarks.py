@@ -0,0 +1,69 @@
+"""
+Tests for the load-testing suite: synthetic engine, Ollama stub, the
+streaming in-process transport and the report format.
+
+Latencies are set to a few milliseconds so the suite runs in well under a
+second.
+"""
+
+import json
+
+import pytest
+
+from api.services.batching import BatchScheduler
+from benchmarks import load
+from benchmarks.load import SCENARIOS, format_report, percentile, run_suite
+from benchmarks.synthetic import SyntheticEngine
+
+FAST_ENGINE = {"prefill_s": 0.002, "token_s": 0.001, "batch_token_s": 0.0, "output_tokens": 6}
+FAST_STUB = {"first_token_s": 0.002, "token_s": 0.001, "tokens": 6}
+
+
+class TestSyntheticEngine:
+    async def test_generates_fixed_length_text(self):
+        sched = BatchScheduler(SyntheticEngine(**FAST_ENGINE))
+        seq = sched.submit({"prompt_tokens": 3}, max_new_tokens=32, temperature=0.0)
+        assert await seq.result() == "Patient presents with acute chest pain; "
+        sched.stop()
+
+    async def test_respects_max_new_tokens(self):
+        sched = BatchScheduler(SyntheticEngine(**FAST_ENGINE))
+        seq = sched.submit({"prompt_tokens": 3}, max_new_tokens=2, temperature=0.0)
+        assert await seq.result() == "Patient presents "
+        sched.stop()
+
+
+class TestLoadSuite:
+    def test_percentile(self):
+        assert percentile([5.0], 99) == 5.0
+        assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+        assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+
+    async def test_suite_reports_every_scenario_and_level(self):
+        report = await run_suite(list(SCENARIOS), [1, 3], requests=4, max_tokens=6, engine=FAST_ENGINE, stub=FAST_STUB)
+
+        assert len(report["results"]) == len(SCENARIOS) * 2
+        for result in report["results"]:
+            assert result["errors"] == 0, result
+            assert result["requests"] == 4
+            assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"]
+            assert result["tokens_per_s"] > 0
+            assert result["loop_lag_ms"] is not None
+            if result["scenario"].endswith("_stream"):
+                assert result["ttft_ms"]["p50"] <= result["latency_ms"]["p50"]
+            else:
+                assert result["ttft_ms"] is None
+
+        json.dumps(report)
+        assert "medgemma_stream" in format_report(report)
+
+    async def test_streams_arrive_incrementally(self):
+        # Long decode: the first token must arrive well before the stream ends
+        engine = {**FAST_ENGINE, "token_s": 0.01, "output_tokens": 20}
+        report = await run_suite(["medgemma_stream"], [1], requests=2, max_tokens=20, engine=engine, stub=FAST_STUB)
+        result = report["results"][0]
+        assert result["ttft_ms"]["max"] < result["latency_ms"]["p50"] / 2
+
+    def test_cli_rejects_unknown_scenario(self):
+        with pytest.raises(SystemExit):
+            load.main(["--scenarios", "medgemma,grpc"])
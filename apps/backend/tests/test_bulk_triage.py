@@ -0,0 +1,275 @@
+"""
+Tests for bulk triage jobs: intake parsing, batching across cases,
+checkpoint/resume, result files and the /medgemma/jobs routes.
+
+Parquet and DuckDB output need pyarrow and duckdb and are skipped
+without them; the JSONL output covers the same rows.
+"""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from api.services import bulk_triage
+from api.services.admission import AdmissionController
+from api.services.bulk_triage import BulkTriageJob, read_intakes, resolve_job_path, result_row, write_results
+
+
+class FakeWorkflowService:
+    """Answers each workflow step by its task; tracks how many generations overlap."""
+
+    def __init__(self, max_batch_size=4, fail_on=None):
+        self.loaded = True
+        self.max_batch_size = max_batch_size
+        self.fail_on = fail_on
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def generate(self, prompt, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.005)
+            if self.fail_on and self.fail_on in prompt:
+                raise RuntimeError("decode failed")
+            if "Your FIRST line" in prompt:
+                return "TRIAGE: Semi-Urgent\nStable vitals."
+            if "top 3 most likely diagnoses" in prompt:
+                return "1. Migraine (high likelihood) — classic aura\n2. Tension headache (low likelihood) — stress"
+            return "- finding"
+        finally:
+            self.in_flight -= 1
+
+
+def _write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    return path
+
+
+def _intakes(n):
+    return [{"case_id": f"c{i}", "chief_complaint": f"Headache {i}", "age": 30 + i, "hr": "80"} for i in range(n)]
+
+
+@pytest.fixture
+def fake_service():
+    svc = FakeWorkflowService()
+    with patch("api.services.medgemma.get_medgemma", return_value=svc):
+        yield svc
+
+
+@pytest.fixture
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_triage, "_JOBS_DIR", tmp_path)
+    return tmp_path
+
+
+class TestResolveJobPath:
+    def test_paths_inside_jobs_dir(self, tmp_path):
+        assert resolve_job_path("q3/intakes.csv", tmp_path) == tmp_path.resolve() / "q3" / "intakes.csv"
+        assert resolve_job_path(str(tmp_path / "intakes.csv"), tmp_path) == tmp_path.resolve() / "intakes.csv"
+
+    def test_rejects_escapes(self, tmp_path):
+        jobs = tmp_path / "jobs"
+        jobs.mkdir()
+        (jobs / "outside").symlink_to(tmp_path)
+        for path in ("../secrets.csv", "q3/../../secrets.csv", "/etc/passwd", str(tmp_path / "x.csv"), "outside/x.csv"):
+            with pytest.raises(ValueError, match="inside the jobs directory"):
+                resolve_job_path(path, jobs)
+
+
+class TestReadIntakes:
+    def test_csv(self, tmp_path):
+        path = tmp_path / "intakes.csv"
+        path.write_text("case_id,chief_complaint,age,medications\nA1,Chest pain,58,warfarin\n,Rash,,\n")
+        rows = read_intakes(path)
+        assert rows[0]["case_id"] == "A1"
+        assert rows[0]["age"] == "58"
+        assert rows[0]["medications"] == "warfarin"
+        assert rows[1]["case_id"] == "2"
+        assert rows[1]["age"] is None
+
+    def test_jsonl_values_become_text(self, tmp_path):
+        path = _write_jsonl(tmp_path / "intakes.jsonl", [{"chief_complaint": "Fever", "temp": 101.5, "hr": 120.0}])
+        row = read_intakes(path)[0]
+        assert (row["temp"], row["hr"]) == ("101.5", "120")
+
+    def test_rejects_bad_rows(self, tmp_path):
+        path = _write_jsonl(tmp_path / "a.jsonl", [{"symptoms": "cough"}])
+        with pytest.raises(ValueError, match="neither context nor chief_complaint"):
+            read_intakes(path)
+        path = _write_jsonl(tmp_path / "b.jsonl", [{"case_id": 1, "context": "x"}, {"case_id": 1, "context": "y"}])
+        with pytest.raises(ValueError, match="Duplicate case_id"):
+            read_intakes(path)
+        with pytest.raises(ValueError, match="Unsupported"):
+            read_intakes(tmp_path / "intakes.xlsx")
+
+
+class TestBulkTriageJob:
+    async def test_runs_cases_together_and_writes_rows(self, tmp_path, fake_service):
+        src = _write_jsonl(tmp_path / "intakes.jsonl", _intakes(6))
+        job = BulkTriageJob(src, tmp_path / "out.jsonl")
+        stats = await job.run()
+
+        assert stats["state"] == "completed"
+        assert (stats["done"], stats["failed"]) == (6, 0)
+        assert job.concurrency == 8
+        # Steps of different cases were generating at the same time
+        assert fake_service.peak_in_flight > 2
+
+        rows = [json.loads(line) for line in (tmp_path / "out.jsonl").read_text().splitlines()]
+        assert [row["case_id"] for row in rows] == [f"c{i}" for i in range(6)]
+        row = rows[0]
+        assert row["triage"] == "Semi-Urgent"
+        assert row["differential"][0] == {"rank": 1, "condition": "Migraine", "likelihood": "high"}
+        assert row["symptom_analysis"] == "- finding"
+        assert row["recommended_actions_ms"] >= 0
+        assert row["partial"] is False
+
+    async def test_interactive_requests_keep_reserved_slots(self, tmp_path, fake_service):
+        src = _write_jsonl(tmp_path / "intakes.jsonl", _intakes(6))
+        controller = AdmissionController(max_active=3, max_queue=16, reserved=1)
+        with patch("api.services.admission.get_admission", return_value=controller):
+            job = asyncio.create_task(BulkTriageJob(src, tmp_path / "out.jsonl", concurrency=8).run())
+            await asyncio.sleep(0.01)
+            assert controller.stats()["active"] == 2
+            ticket = await asyncio.wait_for(controller.acquire("clinician", "normal"), 0.1)
+            ticket.release()
+            stats = await job
+        assert (stats["state"], stats["done"]) == ("completed", 6)
+
+    async def test_resumes_from_checkpoint(self, tmp_path, fake_service):
+        src = _write_jsonl(tmp_path / "intakes.jsonl", _intakes(3))
+        await BulkTriageJob(src, tmp_path / "out.jsonl").run()
+        calls = fake_service.calls
+
+        _write_jsonl(src, _intakes(4))
+        stats = await BulkTriageJob(src, tmp_path / "out.jsonl").run()
+        assert (stats["resumed"], stats["done"]) == (3, 4)
+        assert fake_service.calls - calls == 5  # one new case, five steps
+        assert len((tmp_path / "out.jsonl").read_text().splitlines()) == 4
+
+    async def test_changed_settings_rerun_cases(self, tmp_path, fake_service):
+        src = _write_jsonl(tmp_path / "intakes.jsonl", _intakes(2))
+        await BulkTriageJob(src, tmp_path / "out.jsonl").run()
+        stats = await BulkTriageJob(src, tmp_path / "out.jsonl", max_new_tokens=64).run()
+        assert stats["resumed"] == 0
+
+    async def test_failed_cases_reported_and_retried(self, tmp_path, fake_service):
+        rows = _intakes(2)
+        rows[1]["chief_complaint"] = "Syncope"
+        src = _write_jsonl(tmp_path / "intakes.jsonl", rows)
+        fake_service.fail_on = "Syncope"
+        stats = await BulkTriageJob(src, tmp_path / "out.jsonl").run()
+        assert (stats["done"], stats["failed"]) == (1, 1)
+        failed = json.loads((tmp_path / "out.jsonl").read_text().splitlines()[1])
+        assert failed["error"] == "decode failed"
+        assert failed["triage"] is None
+
+        fake_service.fail_on = None
+        stats = await BulkTriageJob(src, tmp_path / "out.jsonl").run()
+        assert (stats["resumed"], stats["done"], stats["failed"]) == (1, 2, 0)
+
+    async def test_model_unavailable_fails_job(self, tmp_path, mock_medgemma_not_loaded):
+        src = _write_jsonl(tmp_path / "intakes.jsonl", _intakes(1))
+        stats = await BulkTriageJob(src, tmp_path / "out.jsonl").run()
+        assert stats["state"] == "failed"
+        assert "failed to load" in stats["error"]
+
+    def test_default_output_and_formats(self, tmp_path):
+        job = BulkTriageJob(tmp_path / "q3.csv")
+        assert job.output_path == tmp_path / "q3.triage.parquet"
+        with pytest.raises(ValueError, match="output"):
+            BulkTriageJob(tmp_path / "q3.csv", tmp_path / "q3.xlsx")
+
+
+class TestResultFiles:
+    def _rows(self):
+        result = {
+            "triage": "Emergency",
+            "steps": {"Differential Diagnosis": "1. Acute MI (high likelihood) — ST changes"},
+            "step_durations_ms": {"Differential Diagnosis": 12.5},
+            "safety_alerts": [{"type": "critical_vital", "message": "SpO2 85%"}],
+            "total_ms": 40.0,
+            "partial": False,
+        }
+        return [result_row("a", result), result_row("b", None, error="boom")]
+
+    def test_parquet(self, tmp_path):
+        pq = pytest.importorskip("pyarrow.parquet")
+        write_results(self._rows(), tmp_path / "out.parquet")
+        table = pq.read_table(tmp_path / "out.parquet").to_pylist()
+        assert table[0]["differential"][0]["condition"] == "Acute MI"
+        assert table[0]["differential_diagnosis_ms"] == 12.5
+        assert table[1]["partial"] is True
+
+    def test_duckdb(self, tmp_path):
+        duckdb = pytest.importorskip("duckdb")
+        pytest.importorskip("pyarrow")
+        write_results(self._rows(), tmp_path / "out.duckdb")
+        con = duckdb.connect(str(tmp_path / "out.duckdb"))
+        assert con.execute("SELECT triage, len(safety_alerts) FROM triage_results WHERE case_id = 'a'").fetchone() == (
+            "Emergency",
+            1,
+        )
+        con.close()
+
+
+class TestJobRoutes:
+    async def test_create_and_poll(self, client, jobs_dir, fake_service):
+        _write_jsonl(jobs_dir / "intakes.jsonl", _intakes(2))
+        resp = await client.post(
+            "/api/v1/chat/medgemma/jobs", json={"input_path": "intakes.jsonl", "output_path": "out.jsonl"}
+        )
+        assert resp.status_code == 202
+        job_id = resp.json()["id"]
+
+        for _ in range(200):
+            stats = (await client.get(f"/api/v1/chat/medgemma/jobs/{job_id}")).json()
+            if stats["state"] != "running":
+                break
+            await asyncio.sleep(0.01)
+        assert stats["state"] == "completed"
+        assert stats["done"] == 2
+        assert (jobs_dir / "out.jsonl").exists()
+        listed = (await client.get("/api/v1/chat/medgemma/jobs")).json()["jobs"]
+        assert job_id in [job["id"] for job in listed]
+
+    async def test_bad_requests(self, client, jobs_dir, fake_service):
+        resp = await client.post("/api/v1/chat/medgemma/jobs", json={"input_path": str(jobs_dir / "missing.csv")})
+        assert resp.status_code == 400
+        (jobs_dir / "intakes.txt").write_text("x")
+        resp = await client.post("/api/v1/chat/medgemma/jobs", json={"input_path": str(jobs_dir / "intakes.txt")})
+        assert resp.status_code == 400
+        assert (await client.get("/api/v1/chat/medgemma/jobs/nope")).status_code == 404
+
+    async def test_paths_outside_jobs_dir_rejected(self, client, tmp_path, monkeypatch, fake_service):
+        jobs = tmp_path / "jobs"
+        jobs.mkdir()
+        monkeypatch.setattr(bulk_triage, "_JOBS_DIR", jobs)
+        _write_jsonl(tmp_path / "intakes.jsonl", _intakes(1))
+        _write_jsonl(jobs / "intakes.jsonl", _intakes(1))
+        bodies = [
+            {"input_path": "../intakes.jsonl"},
+            {"input_path": str(tmp_path / "intakes.jsonl")},
+            {"input_path": "intakes.jsonl", "output_path": "../out.jsonl"},
+            {"input_path": "intakes.jsonl", "output_path": str(tmp_path / "out.jsonl")},
+        ]
+        for body in bodies:
+            resp = await client.post("/api/v1/chat/medgemma/jobs", json=body)
+            assert resp.status_code == 400
+            assert "inside the jobs directory" in resp.json()["error"]
+        assert not (tmp_path / "out.jsonl").exists()
+
+    async def test_cancel(self, client, jobs_dir, fake_service):
+        src = _write_jsonl(jobs_dir / "intakes.jsonl", _intakes(50))
+        body = {"input_path": str(src), "output_path": "out.jsonl", "concurrency": 1}
+        job_id = (await client.post("/api/v1/chat/medgemma/jobs", json=body)).json()["id"]
+        assert (await client.post("/api/v1/chat/medgemma/jobs", json=body)).status_code == 409
+
+        resp = await client.delete(f"/api/v1/chat/medgemma/jobs/{job_id}")
+        assert resp.json()["state"] == "cancelled"
+        assert not (jobs_dir / "out.jsonl").exists()
@@ -0,0 +1,87 @@
+"""
+Tests for cancelling MedGemma generation when the client goes away.
+"""
+
+import asyncio
+
+from api.routes.chat.medgemma import _cancel_on_disconnect
+from api.services.batching import BatchScheduler
+from api.services.medgemma import MedGemmaService
+from api.services.response_cache import ResponseCache
+from tests.fakes import FakeEngine
+
+LONG_SCRIPT = [1] * 1000 + [0]
+
+
+def _service(engine: FakeEngine) -> MedGemmaService:
+    svc = MedGemmaService()
+    svc.loaded = True
+    svc.response_cache = ResponseCache(max_entries=0)
+    svc._prepare_inputs = lambda _messages, _digest=None: {"script": list(LONG_SCRIPT)}
+    svc._scheduler = BatchScheduler(engine)
+    return svc
+
+
+async def _wait_for(predicate, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+class FakeRequest:
+    """Reports a disconnect after ``connected_polls`` checks."""
+
+    def __init__(self, connected_polls: int):
+        self.polls = 0
+        self.connected_polls = connected_polls
+
+    async def is_disconnected(self) -> bool:
+        self.polls += 1
+        return self.polls > self.connected_polls
+
+
+class TestServiceCancellation:
+    async def test_cancelled_generate_drops_sequence(self):
+        engine = FakeEngine(step_delay=0.01)
+        svc = _service(engine)
+        task = asyncio.create_task(svc.generate(prompt="q", max_new_tokens=5000))
+        await asyncio.to_thread(engine.decode_started.wait, 2.0)
+
+        task.cancel()
+        await _wait_for(lambda: svc._scheduler.stats()["cancelled"] == 1)
+        assert svc._scheduler.stats()["active"] == 0
+        svc._scheduler.stop()
+
+    async def test_closing_stream_early_drops_sequence(self):
+        svc = _service(FakeEngine(step_delay=0.01))
+        stream = svc.stream_generate(prompt="q", max_new_tokens=5000)
+        assert await stream.__anext__()
+        await stream.aclose()
+
+        await _wait_for(lambda: svc._scheduler.stats()["cancelled"] == 1)
+        assert svc._scheduler.stats()["active"] == 0
+        svc._scheduler.stop()
+
+
+class TestCancelOnDisconnect:
+    async def test_returns_result_while_connected(self):
+        async def work():
+            return "done"
+
+        assert await _cancel_on_disconnect(FakeRequest(connected_polls=100), work()) == "done"
+
+    async def test_disconnect_cancels_work(self):
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        result = await _cancel_on_disconnect(FakeRequest(connected_polls=1), work())
+        assert result is None
+        await asyncio.wait_for(cancelled.wait(), timeout=1.0)
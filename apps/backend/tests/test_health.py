@@ -2,8 +2,12 @@
 Tests for health check and app configuration.
 """
 
+import signal
+
 import pytest
 
+from api.app_factory import _install_shutdown_handlers
+
 
 class TestHealthEndpoint:
     """Verify the health endpoint responds correctly."""
@@ -63,3 +67,21 @@ class TestCORSConfiguration:
         allowed = resp.headers.get("access-control-allow-methods", "")
         assert "DELETE" not in allowed
         assert "PUT" not in allowed
+
+
+class TestShutdownSignals:
+    """SIGTERM/SIGINT reach the server's handlers so the lifespan shutdown runs."""
+
+    def test_signals_are_passed_to_server_handlers(self):
+        saved = {sig: signal.getsignal(sig) for sig in (signal.SIGTERM, signal.SIGINT)}
+        received = []
+        try:
+            for sig in saved:
+                signal.signal(sig, lambda signum, _: received.append(signum))
+            _install_shutdown_handlers()
+            for sig in saved:
+                signal.getsignal(sig)(sig, None)
+        finally:
+            for sig, handler in saved.items():
+                signal.signal(sig, handler)
+        assert received == [signal.SIGTERM, signal.SIGINT]
@@ -0,0 +1,180 @@
+"""
+Tests for MedGemma image ingestion: multipart uploads and reduced decoding.
+"""
+
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from api.services.imaging import ImageTooLarge, decode_image
+from api.services.uploads import InvalidUpload, UploadTooLarge, read_multipart
+
+UPLOAD_URL = "/api/v1/chat/medgemma/generate/upload"
+
+
+def _png(size=(16, 16)) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", size, (120, 60, 30)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _jpeg(size, mode="RGB") -> bytes:
+    buf = BytesIO()
+    Image.new(mode, size, 90).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def _multipart(fields: dict, image: bytes = None, boundary: str = "XBOUNDARYX"):
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    if image is not None:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="x.png"\r\n'
+            f"Content-Type: image/png\r\n\r\n".encode()
+            + image
+            + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return f"multipart/form-data; boundary={boundary}", b"".join(parts)
+
+
+async def _chunks(body: bytes, size: int = 7):
+    for i in range(0, len(body), size):
+        yield body[i : i + size]
+
+
+class TestReadMultipart:
+    async def test_fields_and_file_across_small_chunks(self):
+        png = _png()
+        content_type, body = _multipart({"request": '{"prompt": "x"}'}, png)
+        fields, upload = await read_multipart(content_type, _chunks(body), "image", max_file_bytes=len(png))
+        assert fields == {"request": '{"prompt": "x"}'}
+        assert upload.read() == png
+
+    async def test_file_over_limit_raises(self):
+        png = _png()
+        content_type, body = _multipart({}, png)
+        with pytest.raises(UploadTooLarge):
+            await read_multipart(content_type, _chunks(body), "image", max_file_bytes=len(png) - 1)
+
+    async def test_field_over_limit_raises(self):
+        content_type, body = _multipart({"request": "x" * 100})
+        with pytest.raises(UploadTooLarge):
+            await read_multipart(content_type, _chunks(body), "image", max_file_bytes=10, max_field_bytes=50)
+
+    async def test_not_multipart_raises(self):
+        with pytest.raises(InvalidUpload):
+            await read_multipart("application/json", _chunks(b"{}"), "image", max_file_bytes=10)
+
+
+class TestDecodeImage:
+    def test_decodes_to_rgb(self):
+        image = decode_image(BytesIO(_png((4, 3))))
+        assert image.mode == "RGB"
+        assert image.size == (4, 3)
+
+    def test_pixel_limit(self):
+        with pytest.raises(ImageTooLarge):
+            decode_image(BytesIO(_png((100, 100))), max_pixels=100 * 99)
+
+    def test_jpeg_reduced_to_target_keeping_aspect(self):
+        image = decode_image(BytesIO(_jpeg((2000, 1000))), target_size=100)
+        assert image.size == (200, 100)
+        assert image.mode == "RGB"
+
+    def test_grayscale_jpeg_converted_after_reduction(self):
+        image = decode_image(BytesIO(_jpeg((800, 800), mode="L")), target_size=100)
+        assert image.size == (100, 100)
+        assert image.mode == "RGB"
+
+    def test_png_reduced_to_target(self):
+        image = decode_image(BytesIO(_png((300, 600))), target_size=100)
+        assert image.size == (100, 200)
+
+    def test_small_image_not_upscaled(self):
+        image = decode_image(BytesIO(_png((50, 80))), target_size=100)
+        assert image.size == (50, 80)
+
+    async def test_base64_decoded_in_pool(self):
+        import base64
+        import threading
+
+        from api.services.imaging import decode_base64_image, run_in_decode_pool
+
+        def decode(data):
+            return threading.current_thread().name, decode_base64_image(data)
+
+        name, image = await run_in_decode_pool(decode, base64.b64encode(_png()).decode())
+        assert name.startswith("image-decode")
+        assert image.size == (16, 16)
+
+
+class TestUploadRoute:
+    async def test_upload_generates(self, client, mock_medgemma_loaded):
+        content_type, body = _multipart({"request": json.dumps({"prompt": "Describe this X-ray"})}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 200
+        assert resp.json()["response"] == "Test medical response from MedGemma."
+        image = mock_medgemma_loaded.generate.call_args.kwargs["image"]
+        assert image.size == (16, 16)
+
+    async def test_upload_downscaled_to_model_size(self, client, mock_medgemma_loaded):
+        mock_medgemma_loaded.image_input_size.return_value = 8
+        content_type, body = _multipart({"request": json.dumps({"prompt": "x"})}, _jpeg((64, 32)))
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 200
+        assert mock_medgemma_loaded.generate.call_args.kwargs["image"].size == (16, 8)
+
+    async def test_base64_downscaled_to_model_size(self, client, mock_medgemma_loaded):
+        import base64
+
+        mock_medgemma_loaded.image_input_size.return_value = 8
+        resp = await client.post(
+            "/api/v1/chat/medgemma/generate",
+            json={"prompt": "x", "image_base64": base64.b64encode(_png((32, 32))).decode()},
+        )
+        assert resp.status_code == 200
+        assert mock_medgemma_loaded.generate.call_args.kwargs["image"].size == (8, 8)
+
+    async def test_upload_streams(self, client, mock_medgemma_loaded):
+        content_type, body = _multipart({"request": json.dumps({"prompt": "x", "stream": True})}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        lines = [json.loads(line) for line in resp.text.strip().split("\n")]
+        assert lines[-1]["done"] is True
+        assert lines[-1]["request_id"] == resp.headers["x-request-id"]
+
+    async def test_missing_request_part_is_422(self, client, mock_medgemma_loaded):
+        content_type, body = _multipart({}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 422
+
+    async def test_invalid_request_fields_are_422(self, client, mock_medgemma_loaded):
+        content_type, body = _multipart({"request": json.dumps({"prompt": ""})}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 422
+
+    async def test_oversized_image_is_413(self, client, mock_medgemma_loaded, monkeypatch):
+        monkeypatch.setattr("api.services.imaging.MAX_IMAGE_BYTES", 32)
+        content_type, body = _multipart({"request": json.dumps({"prompt": "x"})}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 413
+        mock_medgemma_loaded.generate.assert_not_called()
+
+    async def test_too_many_pixels_is_413(self, client, mock_medgemma_loaded, monkeypatch):
+        monkeypatch.setattr("api.services.imaging.MAX_IMAGE_PIXELS", 100)
+        content_type, body = _multipart({"request": json.dumps({"prompt": "x"})}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 413
+
+    async def test_corrupt_image_is_400(self, client, mock_medgemma_loaded):
+        content_type, body = _multipart({"request": json.dumps({"prompt": "x"})}, b"not an image")
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 400
+
+    async def test_not_loaded_is_503(self, client, mock_medgemma_not_loaded):
+        content_type, body = _multipart({"request": json.dumps({"prompt": "x"})}, _png())
+        resp = await client.post(UPLOAD_URL, content=body, headers={"content-type": content_type})
+        assert resp.status_code == 503
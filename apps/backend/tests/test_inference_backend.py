@@ -0,0 +1,313 @@
+"""
+Tests for inference backend selection and the ONNX Runtime and GGUF backends.
+
+The route tests run against real services of every backend, with the
+decode engine replaced by the scripted fake from test_batching, so they
+check everything above the engine. ONNX engine tests need onnxruntime
+and are skipped without it; the GGUF engine runs on a fake ``Llama``.
+"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from api.services import inference_backend
+from api.services.batching import BatchScheduler
+from api.services.gguf_engine import GgufEngine, find_gguf, gemma_prompt
+from api.services.gguf_medgemma import GgufMedGemmaService
+from api.services.inference_backend import INFERENCE_BACKENDS, backend_class
+from api.services.medgemma import MedGemmaService
+from api.services.model_manager import ModelManager
+from api.services.onnx_medgemma import OnnxMedGemmaService
+from tests.fakes import EOS, FakeEngine
+
+
+def _service(name: str, **kwargs) -> MedGemmaService:
+    svc = backend_class(name)(**kwargs)
+    svc.loaded = True
+    svc._prepare_inputs = lambda _messages, _digest=None: {"script": [1, 2, 3, EOS]}
+    svc._make_engine = lambda: FakeEngine()
+    return svc
+
+
+@pytest.fixture(params=INFERENCE_BACKENDS)
+def backend_service(request):
+    """A loaded service of each backend, returned by ``get_medgemma``."""
+    svc = _service(request.param)
+    with patch("api.services.medgemma.get_medgemma", return_value=svc):
+        yield svc
+
+
+class TestBackendSelection:
+    def test_backend_classes(self):
+        assert backend_class("transformers") is MedGemmaService
+        assert backend_class("onnx") is OnnxMedGemmaService
+        assert backend_class("gguf") is GgufMedGemmaService
+
+    def test_unknown_backend_rejected(self):
+        with pytest.raises(ValueError, match="Unknown inference backend"):
+            backend_class("tensorrt")
+
+    def test_singleton_uses_configured_backend(self, monkeypatch):
+        monkeypatch.setattr(inference_backend, "_INFERENCE_BACKEND", "onnx")
+        monkeypatch.setattr(MedGemmaService, "_instance", None)
+        svc = MedGemmaService.get()
+        assert isinstance(svc, OnnxMedGemmaService)
+        assert svc.runtime_stats()["backend"] == "onnx"
+
+    def test_variants_use_configured_backend(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(inference_backend, "_INFERENCE_BACKEND", "onnx")
+        monkeypatch.setattr(MedGemmaService, "_instance", None)
+        manager = ModelManager({"ft": tmp_path})
+        svc = manager.get("ft")
+        assert isinstance(svc, OnnxMedGemmaService)
+        assert svc.response_cache is manager.get().response_cache
+
+    def test_gguf_variant_uses_llama_cpp(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(MedGemmaService, "_instance", None)
+        manager = ModelManager({"q4": tmp_path / "medgemma-4b-it-Q4_K_M.gguf", "ft": tmp_path})
+        assert isinstance(manager.get("q4"), GgufMedGemmaService)
+        assert manager.get("q4").max_batch_size == 1
+        assert type(manager.get("ft")) is MedGemmaService
+
+
+class TestRoutesOnEitherBackend:
+    async def test_generate(self, client, backend_service):
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "Chest pain"})
+        assert resp.status_code == 200
+        assert resp.json()["response"] == "abc"
+
+    async def test_stream(self, client, backend_service):
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "Chest pain", "stream": True})
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        assert "".join(line.get("token", "") for line in lines) == "abc"
+        assert lines[-1]["done"] is True
+
+    async def test_greedy_repeat_served_from_cache(self, client, backend_service):
+        body = {"prompt": "Chest pain", "temperature": 0.0}
+        await client.post("/api/v1/chat/medgemma/generate", json=body)
+        resp = await client.post("/api/v1/chat/medgemma/generate", json=body)
+        assert resp.json() == {"response": "abc", "model": "medgemma-1.5-4b-it", "cached": True}
+
+    async def test_status_reports_backend(self, client, backend_service):
+        resp = await client.get("/api/v1/chat/medgemma/status")
+        assert resp.json()["backend"] == backend_service.backend
+
+
+class TestOnnxService:
+    async def test_speculative_requests_decode_normally(self):
+        svc = _service("onnx")
+        metadata = {}
+        assert await svc.generate(prompt="x", speculative="prompt_lookup", metadata=metadata) == "abc"
+        assert "speculative" not in metadata
+        assert svc.runtime_stats()["speculative"] is None
+
+    async def test_unknown_speculative_mode_still_rejected(self):
+        with pytest.raises(ValueError):
+            await _service("onnx").generate(prompt="x", speculative="medusa")
+
+    def test_no_replicas(self):
+        assert OnnxMedGemmaService().start_replicas(2) is False
+
+    def test_responses_cached_apart_from_transformers(self):
+        svc = OnnxMedGemmaService()
+        svc.precision = "onnx-q4"
+        assert svc._cache_model_id() == "google/medgemma-1.5-4b-it@onnx-q4"
+
+
+class _FakeBinding:
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.inputs = {}
+        self.outputs = []
+
+    def bind_cpu_input(self, name, value):
+        self.inputs[name] = value
+
+    def bind_ortvalue_input(self, name, value):
+        self.inputs[name] = value
+
+    def bind_output(self, name, device):
+        self.outputs.append(name)
+
+
+class _FakeDecoder:
+    """Appends one cache position per token; the next token is the cache length."""
+
+    def __init__(self, np, ort):
+        self.np, self.ort = np, ort
+        self.runs = []
+
+    def io_binding(self):
+        return _FakeBinding(self)
+
+    def run_with_iobinding(self, binding):
+        np = self.np
+        tokens = binding.inputs["inputs_embeds"].shape[1]
+        past = binding.inputs["past_key_values.0.key"].numpy()
+        present = np.zeros((1, 1, past.shape[2] + tokens, 2), dtype=np.float32)
+        logits = np.zeros((1, tokens, 16), dtype=np.float32)
+        logits[0, -1, present.shape[2] % 16] = 1.0
+        self.runs.append(binding.inputs)
+        binding.results = [self.ort.OrtValue.ortvalue_from_numpy(logits)] + [
+            self.ort.OrtValue.ortvalue_from_numpy(present) for _ in binding.outputs[1:]
+        ]
+        binding.get_outputs = lambda: binding.results
+
+
+class TestOnnxEngine:
+    def _engine(self):
+        np = pytest.importorskip("numpy")
+        ort = pytest.importorskip("onnxruntime")
+        from types import SimpleNamespace
+
+        from api.services.onnx_engine import OnnxEngine
+
+        model = SimpleNamespace(
+            embed=SimpleNamespace(run=lambda _, feeds: [np.ones(feeds["input_ids"].shape + (2,), np.float32)]),
+            vision=None,
+            decoder=_FakeDecoder(np, ort),
+            input_names={
+                "inputs_embeds",
+                "attention_mask",
+                "position_ids",
+                "past_key_values.0.key",
+                "past_key_values.0.value",
+            },
+            past_names=["past_key_values.0.key", "past_key_values.0.value"],
+            present_names=["present.0.key", "present.0.value"],
+            embeds_dtype=np.float32,
+            image_token_id=None,
+            generation_config={"eos_token_id": [1]},
+            empty_past=lambda: [ort.OrtValue.ortvalue_from_numpy(np.zeros((1, 1, 0, 2), np.float32))] * 2,
+        )
+        processor = SimpleNamespace(tokenizer=SimpleNamespace(eos_token_id=1))
+        return np, OnnxEngine(model, processor)
+
+    def test_kv_cache_carried_between_steps(self):
+        np, engine = self._engine()
+        seq = SimpleSeq({"input_ids": np.array([[5, 6, 7]])})
+        assert engine.prefill(seq) == 3
+        seq.token_ids = [3]
+        assert engine.decode([seq]) == [4]
+        assert seq.position == 4
+        step = engine.model.decoder.runs[-1]
+        assert step["past_key_values.0.key"].numpy().shape[2] == 3
+        assert step["attention_mask"].shape == (1, 4)
+        assert step["position_ids"].tolist() == [[3]]
+
+    def test_greedy_and_sampled_tokens(self):
+        np, engine = self._engine()
+        logits = np.array([0.0, 5.0, 1.0])
+        assert engine.sample(logits, 0.0) == 1
+        engine.top_k = 1
+        assert engine.sample(logits, 1.0) == 1
+
+
+class SimpleSeq:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.temperature = 0.0
+        self.token_ids = []
+        self.kv = None
+        self.position = 0
+        self.stats = {}
+
+
+class FakeLlama:
+    """
+    Stand-in for ``llama_cpp.Llama`` with a real token history.
+
+    The next token is the last evaluated token + 1, until 6; then end of turn.
+    Token t detokenizes to the t-th letter.
+    """
+
+    END_OF_TURN = 99
+
+    def __init__(self):
+        self.input_ids = [0] * 64
+        self.n_tokens = 0
+        self.evals = []
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return [self.END_OF_TURN] if text == b"<end_of_turn>" else [2, 3]
+
+    def token_eos(self):
+        return 1
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        self.input_ids[self.n_tokens : self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+        self.evals.append(list(tokens))
+
+    def sample(self, **kwargs):
+        last = self.input_ids[self.n_tokens - 1]
+        return last + 1 if last < 6 else self.END_OF_TURN
+
+    def save_state(self):
+        return list(self.input_ids), self.n_tokens
+
+    def load_state(self, state):
+        self.input_ids, self.n_tokens = list(state[0]), state[1]
+
+    def detokenize(self, token_ids):
+        return "".join(chr(ord("a") + t - 1) for t in token_ids).encode()
+
+
+class TestGgufEngine:
+    async def test_generates_until_end_of_turn(self):
+        sched = BatchScheduler(GgufEngine(FakeLlama()), max_batch_size=1)
+        seq = sched.submit({"input_ids": [2, 3]}, max_new_tokens=16, temperature=0.0)
+        assert await seq.result() == "def"
+        sched.stop()
+
+    def test_reuses_shared_prompt_prefix(self):
+        llama = FakeLlama()
+        engine = GgufEngine(llama)
+        engine.prefill(SimpleSeq({"input_ids": [2, 3, 4]}))
+        engine.clear()
+        seq = SimpleSeq({"input_ids": [2, 3, 5]})
+        assert engine.prefill(seq) == 6
+        assert llama.evals[-1] == [5]
+        assert seq.stats["reused_prefix_tokens"] == 2
+
+    def test_parked_sequence_resumes_from_saved_state(self):
+        llama = FakeLlama()
+        engine = GgufEngine(llama)
+        parked = SimpleSeq({"input_ids": [2, 3]})
+        parked.token_ids = [engine.prefill(parked)]
+        engine.detach([parked])
+        assert parked.kv is not None
+
+        other = SimpleSeq({"input_ids": [5]})
+        engine.prefill(other)
+        assert engine.decode([parked]) == [5]
+        assert llama.input_ids[: llama.n_tokens] == [2, 3, 4]
+
+    def test_gemma_chat_template(self):
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": "You are a triage nurse."}]},
+            {"role": "user", "content": [{"type": "text", "text": "Chest pain "}]},
+        ]
+        assert gemma_prompt(messages) == (
+            "<start_of_turn>user\nYou are a triage nurse.\n\nChest pain<end_of_turn>\n<start_of_turn>model\n"
+        )
+
+    def test_find_gguf_skips_projector(self, tmp_path):
+        (tmp_path / "mmproj-medgemma-f16.gguf").write_bytes(b"")
+        (tmp_path / "medgemma-4b-it-Q8_0.gguf").write_bytes(b"")
+        assert find_gguf(tmp_path).name == "medgemma-4b-it-Q8_0.gguf"
+        with pytest.raises(FileNotFoundError):
+            find_gguf(tmp_path / "empty")
+
+    async def test_image_requests_rejected(self):
+        svc = GgufMedGemmaService()
+        svc.loaded = True
+        svc.model = FakeLlama()
+        assert svc._prepare_inputs(svc._build_messages("x", "sys")) == {"input_ids": [2, 3]}
+        with pytest.raises(ValueError, match="GGUF"):
+            svc._prepare_inputs(svc._build_messages("x", "sys"), image_digest="abc")
@@ -6,6 +6,7 @@ WITHOUT loading the actual model.
 """
 
 import pytest
+
 from api.services.medgemma import MedGemmaService, ModelNotLoadedError
 
 
@@ -71,6 +72,60 @@ class TestSingleton:
         assert svc.model is None
 
 
+class TestStartup:
+    """Load-phase timings, warmup and the eager background load."""
+
+    def _service(self):
+        from tests.fakes import FakeEngine
+
+        svc = MedGemmaService()
+        svc.loaded = True
+        svc._prepare_inputs = lambda _messages, _digest=None: {"script": [1, 2, 0]}
+        svc._make_engine = lambda: FakeEngine()
+        return svc
+
+    async def test_warmup_runs_a_generation(self):
+        svc = self._service()
+        await svc.warmup(max_new_tokens=4)
+        assert svc.state == "ready"
+        assert svc.load_timings["warmup"] >= 0
+        assert svc.runtime_stats()["scheduler"]["tokens_generated"] > 0
+        # Sampled warmup output is never cached
+        assert svc.response_cache.stats()["stores"] == 0
+
+    async def test_warmup_skipped_when_not_loaded(self):
+        svc = MedGemmaService()
+        await svc.warmup()
+        assert svc.state == "idle"
+        assert "warmup" not in svc.load_timings
+
+    async def test_missing_model_marks_failed(self, tmp_path):
+        svc = MedGemmaService()
+        assert await svc.load(model_dir=str(tmp_path / "missing")) is False
+        assert svc.state == "failed"
+        assert svc.runtime_stats()["state"] == "failed"
+
+    async def test_background_load_loads_and_warms(self, monkeypatch):
+        import api.services.medgemma as medgemma
+
+        svc = self._service()
+        svc.loaded = False
+
+        async def _load(model_dir=None):
+            svc.loaded = True
+            svc.state = "ready"
+            return True
+
+        svc.load = _load
+        task = svc.start_background_load()
+        assert task is not None
+        assert await task is True
+        assert "warmup" in svc.load_timings
+
+        monkeypatch.setattr(medgemma, "_EAGER_LOAD", False)
+        assert MedGemmaService().start_background_load() is None
+
+
 # Helper
 async def _async_false():
     return False
@@ -0,0 +1,131 @@
+"""
+Tests for the Prometheus metrics registry, per-request observations and
+the /metrics endpoint.
+"""
+
+import contextlib
+
+import httpx
+
+from api.services import metrics
+from api.services.batching import BatchScheduler
+from api.services.metrics import Counter, Histogram, Registry, observe_sequence
+from tests.fakes import EOS, ChunkStream, FakeEngine
+
+
+def _value(text: str, sample: str) -> float:
+    """Value of the first exposition line starting with ``sample``."""
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{sample} not in exposition")
+
+
+class TestRegistry:
+    def test_counter_with_labels(self):
+        registry = Registry()
+        counter = registry.counter("demo_requests", "Demo requests", ("outcome",))
+        counter.labels(outcome="ok").inc()
+        counter.labels(outcome="ok").inc(2)
+        counter.labels(outcome='bad "quote"').inc()
+
+        text = registry.render()
+        assert "# TYPE demo_requests_total counter" in text
+        assert 'demo_requests_total{outcome="ok"} 3' in text
+        assert 'demo_requests_total{outcome="bad \\"quote\\""} 1' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        hist = registry.histogram("demo_seconds", "Demo latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            hist.observe(value)
+
+        text = registry.render()
+        assert 'demo_seconds_bucket{le="0.1"} 1' in text
+        assert 'demo_seconds_bucket{le="1"} 3' in text
+        assert 'demo_seconds_bucket{le="+Inf"} 4' in text
+        assert "demo_seconds_count 4" in text
+        assert _value(text, "demo_seconds_sum") == 4.25
+
+    def test_failing_collector_is_skipped(self):
+        registry = Registry()
+        registry.register(Counter("demo", "Demo"))
+
+        def _broken():
+            raise RuntimeError("boom")
+
+        registry.add_collector(_broken)
+        assert "demo_total 0" in registry.render()
+
+    def test_boundary_value_lands_in_its_bucket(self):
+        hist = Histogram("demo", "Demo", buckets=(1.0, 2.0))
+        hist.observe(1.0)
+        assert hist.samples()[0] == ("demo_bucket", {"le": "1"}, 1)
+
+
+class TestObservations:
+    async def test_completed_sequence(self):
+        sched = BatchScheduler(FakeEngine())
+        seq = sched.submit({"script": [1, 2, 3, EOS]}, max_new_tokens=10, temperature=0.0)
+        await seq.result()
+        sched.stop()
+
+        before = metrics.render()
+        observe_sequence(seq, "test")
+        after = metrics.render()
+
+        sample = 'medstation_medgemma_requests_total{mode="test",outcome="completed"}'
+        assert _value(after, sample) == (_value(before, sample) if sample in before else 0) + 1
+        assert seq.prefill_started_at is not None
+        assert _value(after, 'medstation_medgemma_time_to_first_token_seconds_count{mode="test"}') >= 1
+        assert _value(after, 'medstation_medgemma_generated_tokens_total{mode="test"}') >= 3
+
+    async def test_failed_sequence(self):
+        class Failing(FakeEngine):
+            def prefill(self, seq):
+                raise RuntimeError("boom")
+
+        sched = BatchScheduler(Failing())
+        seq = sched.submit({"script": [1, EOS]}, max_new_tokens=10, temperature=0.0)
+        with contextlib.suppress(RuntimeError):
+            await seq.result()
+        sched.stop()
+
+        observe_sequence(seq, "test_failed")
+        text = metrics.render()
+        assert _value(text, 'medstation_medgemma_requests_total{mode="test_failed",outcome="failed"}') == 1
+        assert 'medstation_medgemma_prefill_seconds_count{mode="test_failed"}' not in text
+
+
+class TestMetricsEndpoint:
+    async def test_exposition(self, client):
+        await client.get("/health")
+        resp = await client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE medstation_medgemma_requests_total counter" in resp.text
+        assert 'medstation_http_request_duration_seconds_count{method="GET",route="/health",status="200"}' in resp.text
+
+    async def test_http_route_uses_template(self, client):
+        await client.get("/api/v1/chat/ollama/status")
+        await client.get("/no/such/path")
+        text = (await client.get("/metrics")).text
+        assert 'route="/api/v1/chat/ollama/status"' in text
+        assert 'route="unmatched",status="404"' in text
+        assert "/no/such/path" not in text
+
+    async def test_ollama_upstream_timings(self, client, upstream):
+        _, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, stream=ChunkStream([b'{"done":true}\n']))
+        before = metrics.render()
+
+        resp = await client.post("/api/v1/chat/ollama/generate", json={"model": "m", "prompt": "hi", "stream": True})
+        assert resp.status_code == 200
+        after = metrics.render()
+
+        sample = 'medstation_ollama_request_seconds_count{endpoint="generate",outcome="ok"}'
+        assert _value(after, sample) == (_value(before, sample) if sample in before else 0) + 1
+        assert (
+            _value(after, "medstation_ollama_stream_seconds_count")
+            == _value(before, "medstation_ollama_stream_seconds_count") + 1
+        )
@@ -0,0 +1,159 @@
+"""
+Tests for the model lifecycle manager.
+
+Variants are services whose weight loading is replaced by a stub that
+records calls and reports a fixed size, so sharing, eviction and idle
+unloading run without torch.
+"""
+
+import asyncio
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from api.services.medgemma import MedGemmaService
+from api.services.model_manager import ModelManager, UnknownModelError, parse_variants
+from api.services.response_cache import ResponseCache
+
+
+class StubService(MedGemmaService):
+    """A variant whose load takes ``delay`` seconds and occupies ``size`` bytes."""
+
+    def __init__(self, name: str, size: int = 100, delay: float = 0.0):
+        super().__init__(model_dir=Path("/models") / name, variant=name, response_cache=ResponseCache(max_entries=0))
+        self.size = size
+        self.delay = delay
+        self.load_calls = 0
+
+    async def _load(self, model_dir=None):
+        self.load_calls += 1
+        self.state = "loading"
+        if self.manager is not None:
+            await self.manager.make_room(self, self.size)
+        await asyncio.sleep(self.delay)
+        self.weight_bytes = self.size
+        self.model = f"{self.variant}-weights"
+        self.loaded = True
+        self.state = "ready"
+        self.last_used = time.monotonic()
+        return True
+
+
+@pytest.fixture
+def manager():
+    def _make(names=("a", "b", "c"), memory_budget=0, idle_ttl=0.0, delay=0.0):
+        return ModelManager(
+            variants={name: Path("/models") / name for name in names},
+            memory_budget=memory_budget,
+            idle_ttl=idle_ttl,
+            service_factory=lambda name, _path: StubService(name, delay=delay),
+        )
+
+    return _make
+
+
+class TestSharedLoad:
+    async def test_concurrent_callers_share_one_load(self, manager):
+        svc = manager(delay=0.05).get("a")
+        results = await asyncio.gather(*[svc.load() for _ in range(5)])
+        assert results == [True] * 5
+        assert svc.load_calls == 1
+
+    async def test_cancelled_waiter_does_not_cancel_load(self, manager):
+        svc = manager(delay=0.05).get("a")
+        waiter = asyncio.create_task(svc.load())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        assert await svc.load() is True
+        assert svc.load_calls == 1
+
+    async def test_reload_after_unload(self, manager):
+        svc = manager().get("a")
+        await svc.load()
+        assert await svc.unload() is True
+        assert svc.state == "unloaded"
+        assert await svc.load() is True
+        assert svc.load_calls == 2
+
+    async def test_reload_while_unloading_keeps_new_model(self, manager):
+        svc = manager().get("a")
+        await svc.load()
+        svc._scheduler = SimpleNamespace(stop=lambda: time.sleep(0.05))
+
+        unloading = asyncio.create_task(svc.unload())
+        await asyncio.sleep(0.01)  # unload is waiting for the scheduler to stop
+        assert await svc.load() is True
+        assert await unloading is True
+        assert (svc.loaded, svc.state, svc.model) == (True, "ready", "a-weights")
+
+
+class TestMemoryBudget:
+    async def test_least_recently_used_idle_variant_is_evicted(self, manager):
+        mgr = manager(memory_budget=250)
+        a, b, c = mgr.get("a"), mgr.get("b"), mgr.get("c")
+        await a.load()
+        await b.load()
+        a.last_used = time.monotonic() + 1  # a was used after b
+
+        await c.load()
+        assert a.loaded and c.loaded
+        assert not b.loaded
+        assert mgr.evictions == 1
+        assert mgr.loaded_bytes() == 200
+
+    async def test_busy_variant_is_never_evicted(self, manager):
+        mgr = manager(memory_budget=150)
+        a, b = mgr.get("a"), mgr.get("b")
+        await a.load()
+        a.inflight = 1
+
+        await b.load()
+        assert a.loaded and b.loaded
+        assert mgr.evictions == 0
+
+    async def test_unload_refused_while_serving(self, manager):
+        svc = manager().get("a")
+        await svc.load()
+        svc.inflight = 1
+        assert await svc.unload() is False
+        assert svc.loaded
+
+
+class TestIdleUnload:
+    async def test_idle_variants_are_unloaded_after_ttl(self, manager):
+        mgr = manager(idle_ttl=10.0)
+        a, b = mgr.get("a"), mgr.get("b")
+        await a.load()
+        await b.load()
+        b.last_used = a.last_used + 8
+
+        assert await mgr.unload_idle(now=a.last_used + 11) == ["a"]
+        assert not a.loaded and b.loaded
+        assert mgr.stats()["variants"]["a"]["state"] == "unloaded"
+
+    async def test_disabled_without_ttl(self, manager):
+        mgr = manager()
+        await mgr.get("a").load()
+        assert await mgr.unload_idle(now=time.monotonic() + 3600) == []
+        assert mgr.start() is None
+
+
+class TestVariants:
+    def test_unknown_variant(self, manager):
+        with pytest.raises(UnknownModelError, match="nope"):
+            manager().get("nope")
+
+    def test_parse_variants(self):
+        variants = parse_variants(" medgemma-int8 , ft=/data/ft-2026-09,rel=snapshots/x", models_dir=Path("/m"))
+        assert variants == {
+            "medgemma-int8": Path("/m/medgemma-int8"),
+            "ft": Path("/data/ft-2026-09"),
+            "rel": Path("/m/snapshots/x"),
+        }
+
+    async def test_route_rejects_unknown_model(self, client):
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "hi", "model": "nope"})
+        assert resp.status_code == 404
+        assert "nope" in resp.json()["error"]
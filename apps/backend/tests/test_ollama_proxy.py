@@ -0,0 +1,220 @@
+"""
+Tests for the Ollama proxy routes and residency manager against a mocked
+upstream (no Ollama needed; see the ``upstream`` fixture in conftest.py).
+"""
+
+import gzip
+import json
+
+import httpx
+
+from api.services import ollama
+from tests.fakes import ChunkStream
+
+
+class TestOllamaClient:
+    def test_host_without_scheme_is_normalized(self):
+        assert ollama._ollama_base("gpu-box:11434") == "http://gpu-box:11434"
+        assert ollama._ollama_base("https://gpu-box/") == "https://gpu-box"
+
+    async def test_client_is_reused(self, upstream):
+        assert ollama.get_client() is ollama.get_client()
+
+
+class TestGenerateProxy:
+    async def test_non_stream_forwards_body_and_response_bytes(self, client, upstream):
+        seen, handlers = upstream
+        upstream_body = b'{"model":"medgemma","response":"ok","done":true}'
+        handlers["/api/generate"] = lambda _: httpx.Response(
+            200, content=upstream_body, headers={"content-type": "application/json"}
+        )
+
+        request_body = b'{"model": "medgemma", "prompt": "hi", "stream": false, "keep_alive": "10m"}'
+        resp = await client.post(
+            "/api/v1/chat/ollama/generate", content=request_body, headers={"content-type": "application/json"}
+        )
+        assert resp.status_code == 200
+        assert resp.content == upstream_body
+        assert seen[0].content == request_body
+
+    async def test_compressed_upstream_reaches_client_intact(self, client, upstream):
+        _, handlers = upstream
+        upstream_body = b'{"response":"ok","done":true}'
+        handlers["/api/generate"] = lambda _: httpx.Response(
+            200,
+            stream=ChunkStream([gzip.compress(upstream_body)]),
+            headers={"content-type": "application/json", "content-encoding": "gzip"},
+        )
+        for stream in (False, True):
+            resp = await client.post(
+                "/api/v1/chat/ollama/generate", json={"model": "m", "prompt": "hi", "stream": stream}
+            )
+            assert resp.status_code == 200
+            assert resp.content == upstream_body
+
+    async def test_missing_stream_flag_defaults_to_non_stream(self, client, upstream):
+        seen, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+        await client.post("/api/v1/chat/ollama/generate", json={"model": "m", "prompt": "hi"})
+        assert json.loads(seen[0].content)["stream"] is False
+
+    async def test_stream_passes_chunks_through(self, client, upstream):
+        _, handlers = upstream
+        chunks = [b'{"response":"Chest', b' pain"}\n{"response":"."}\n', b'{"done":true}\n']
+        handlers["/api/generate"] = lambda _: httpx.Response(200, stream=ChunkStream(chunks))
+
+        resp = await client.post("/api/v1/chat/ollama/generate", json={"model": "m", "prompt": "hi", "stream": True})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        assert resp.content == b"".join(chunks)
+
+    async def test_upstream_error_status_is_forwarded(self, client, upstream):
+        _, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(404, json={"error": "model not found"})
+        resp = await client.post("/api/v1/chat/ollama/generate", json={"model": "x", "prompt": "hi", "stream": False})
+        assert resp.status_code == 404
+        assert resp.json() == {"error": "model not found"}
+
+    async def test_unreachable_upstream_is_502(self, client, upstream):
+        _, handlers = upstream
+
+        def refuse(request):
+            raise httpx.ConnectError("connection refused", request=request)
+
+        handlers["/api/generate"] = refuse
+        resp = await client.post("/api/v1/chat/ollama/generate", json={"model": "m", "prompt": "hi"})
+        assert resp.status_code == 502
+
+    async def test_invalid_json_is_400(self, client, upstream):
+        resp = await client.post(
+            "/api/v1/chat/ollama/generate", content=b"not json", headers={"content-type": "application/json"}
+        )
+        assert resp.status_code == 400
+
+    async def test_non_object_json_is_400(self, client, upstream):
+        seen, _ = upstream
+        for body in (b"[]", b'"x"', b"1", b"null"):
+            resp = await client.post(
+                "/api/v1/chat/ollama/generate", content=body, headers={"content-type": "application/json"}
+            )
+            assert resp.status_code == 400
+            assert resp.json() == {"error": "Request body must be a JSON object"}
+        assert seen == []
+
+
+class TestModelsProxy:
+    async def test_models_returns_array(self, client, upstream):
+        _, handlers = upstream
+        handlers["/api/tags"] = lambda _: httpx.Response(200, json={"models": [{"name": "medgemma"}]})
+        resp = await client.get("/api/v1/chat/ollama/models")
+        assert resp.json() == [{"name": "medgemma"}]
+
+    async def test_models_unreachable_returns_empty(self, client, upstream):
+        _, handlers = upstream
+
+        def refuse(request):
+            raise httpx.ConnectError("connection refused", request=request)
+
+        handlers["/api/tags"] = refuse
+        resp = await client.get("/api/v1/chat/ollama/models")
+        assert resp.status_code == 200
+        assert resp.json() == []
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestResidency:
+    async def test_tags_cached_within_ttl(self, upstream):
+        seen, handlers = upstream
+        handlers["/api/tags"] = lambda _: httpx.Response(200, json={"models": [{"name": "medgemma:4b"}]})
+        clock = FakeClock()
+        residency = ollama.OllamaResidency(tags_ttl=30, clock=clock)
+
+        assert await residency.tags() == [{"name": "medgemma:4b"}]
+        await residency.tags()
+        assert len(seen) == 1
+        clock.now += 31
+        await residency.tags()
+        assert len(seen) == 2
+
+    async def test_resident_models_from_ps(self, upstream):
+        _, handlers = upstream
+        handlers["/api/ps"] = lambda _: httpx.Response(
+            200, json={"models": [{"name": "medgemma:4b"}, {"name": "llama3"}]}
+        )
+        residency = ollama.OllamaResidency()
+        assert await residency.is_resident("medgemma:4b") is True
+        assert await residency.is_resident("llama3:latest") is True
+        assert await residency.is_resident("other") is False
+
+    def test_keep_alive_follows_usage(self):
+        clock = FakeClock()
+        residency = ollama.OllamaResidency(preload=["medgemma:4b"], clock=clock)
+        assert residency.keep_alive_for("medgemma:4b") == -1
+        assert residency.keep_alive_for("rare") == "5m"
+        for _ in range(5):
+            residency.record_use("busy")
+        assert residency.keep_alive_for("busy") == "30m"
+        for _ in range(15):
+            residency.record_use("busy")
+        assert residency.keep_alive_for("busy") == "2h"
+        clock.now += 3601
+        assert residency.keep_alive_for("busy") == "5m"
+
+    async def test_preload_loads_and_pins(self, upstream):
+        seen, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+        residency = ollama.OllamaResidency(preload=["medgemma:4b", "backup"])
+        await residency.start_preload()
+        bodies = [json.loads(r.content) for r in seen]
+        assert [b["model"] for b in bodies] == ["medgemma:4b", "backup:latest"]
+        assert all(b["keep_alive"] == -1 and "prompt" not in b for b in bodies)
+        assert residency.stats()["resident"] == ["backup:latest", "medgemma:4b"]
+
+    async def test_preload_failure_is_logged_not_raised(self, upstream):
+        _, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(500, json={"error": "oom"})
+        residency = ollama.OllamaResidency(preload=["medgemma:4b"])
+        await residency.start_preload()
+        assert residency.stats()["resident"] == []
+
+
+class TestResidencyInProxy:
+    async def test_generate_sets_keep_alive_and_flags_cold_start(self, client, upstream):
+        seen, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+
+        resp = await client.post("/api/v1/chat/ollama/generate", json={"model": "medgemma:4b", "prompt": "hi"})
+        assert resp.headers["x-ollama-cold-start"] == "true"
+        assert json.loads(seen[0].content)["keep_alive"] == "5m"
+
+        status = (await client.get("/api/v1/chat/ollama/status")).json()
+        assert status["reachable"] is True
+        assert status["cold_starts"] == 1
+        assert status["usage_last_hour"] == {"medgemma:4b": 1}
+
+    async def test_pinned_model_sent_numeric_keep_alive(self, client, upstream, monkeypatch):
+        seen, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+        monkeypatch.setattr(ollama, "_PRELOAD_MODELS", ["medgemma:4b"])
+        await client.post("/api/v1/chat/ollama/generate", json={"model": "medgemma:4b", "prompt": "hi"})
+        assert json.loads(seen[0].content)["keep_alive"] == -1
+
+    async def test_warm_model_not_flagged(self, client, upstream):
+        _, handlers = upstream
+        handlers["/api/ps"] = lambda _: httpx.Response(200, json={"models": [{"name": "medgemma:4b"}]})
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+        resp = await client.post("/api/v1/chat/ollama/generate", json={"model": "medgemma:4b", "prompt": "hi"})
+        assert "x-ollama-cold-start" not in resp.headers
+
+    async def test_client_keep_alive_respected(self, client, upstream):
+        seen, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+        await client.post("/api/v1/chat/ollama/generate", json={"model": "m", "prompt": "hi", "keep_alive": 0})
+        assert json.loads(seen[0].content)["keep_alive"] == 0
@@ -0,0 +1,87 @@
+"""
+Tests for CPU precision selection and the precision comparison report.
+"""
+
+import json
+
+import pytest
+
+from api.services import precision_report, quantization
+from api.services.precision_report import agreement, compare, format_report
+from api.services.quantization import resolve_cpu_precision
+
+
+class StubModeService:
+    """Answers every prompt with a fixed text per mode."""
+
+    def __init__(self, mode: str, answer: str):
+        self.cpu_precision = mode
+        self.precision = None
+        self.weight_bytes = 0
+        self.answer = answer
+        self.loaded = False
+
+    async def load(self):
+        self.loaded = True
+        self.precision = self.cpu_precision
+        self.weight_bytes = {"fp32": 16 << 30, "int8": 5 << 30}[self.cpu_precision]
+        return True
+
+    async def unload(self):
+        self.loaded = False
+        return True
+
+    async def generate(self, **kwargs):
+        return self.answer
+
+    async def stream_generate(self, **kwargs):
+        for word in self.answer.split(" "):
+            yield word + " "
+
+
+class TestPrecisionSelection:
+    def test_known_modes(self, monkeypatch):
+        monkeypatch.setattr(quantization, "cpu_supports_bf16", lambda: True)
+        assert resolve_cpu_precision("FP32") == "fp32"
+        assert resolve_cpu_precision("int8") == "int8"
+        assert resolve_cpu_precision("bf16") == "bf16"
+
+    def test_bf16_falls_back_without_native_support(self, monkeypatch):
+        monkeypatch.setattr(quantization, "cpu_supports_bf16", lambda: False)
+        assert resolve_cpu_precision("bf16") == "fp32"
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError, match="int4"):
+            resolve_cpu_precision("int4")
+
+
+class TestPrecisionReport:
+    def test_agreement(self):
+        assert agreement("call 911 now", "call 911 now") == 1.0
+        assert agreement("call 911 now", "") == 0.0
+        assert 0.5 < agreement("call 911 right now", "call 911 now") < 1.0
+
+    async def test_compare_against_baseline(self):
+        answers = {"fp32": "Emergency: call 911 now", "int8": "Emergency: call 911 immediately"}
+        report = await compare(
+            ["fp32", "int8"],
+            prompts=["a", "b"],
+            max_new_tokens=16,
+            service_factory=lambda mode: StubModeService(mode, answers[mode]),
+        )
+
+        fp32, int8 = report["modes"]
+        assert report["baseline"] == "fp32"
+        assert fp32["agreement"] == 1.0 and fp32["exact_match"] == 1.0
+        assert int8["exact_match"] == 0.0
+        assert 0.5 < int8["agreement"] < 1.0
+        assert (fp32["weight_mb"], int8["weight_mb"]) == (16384, 5120)
+        assert int8["outputs"] == ["Emergency: call 911 immediately "] * 2
+
+        table = format_report(report)
+        assert "int8" in table and "agreement" in table
+        json.dumps(report)
+
+    def test_cli_rejects_unknown_modes(self):
+        with pytest.raises(SystemExit):
+            precision_report.main(["--modes", "fp32,int4"])
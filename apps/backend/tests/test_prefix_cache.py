@@ -0,0 +1,84 @@
+"""
+Tests for the shared-prefix KV cache.
+
+KV states are opaque to PrefixCache, so plain strings stand in for tensors.
+"""
+
+from api.services.prefix_cache import PrefixCache, common_prefix_length
+
+SYSTEM = list(range(100, 130))  # 30 shared "system prompt" tokens
+
+
+class TestCommonPrefix:
+    def test_identical(self):
+        assert common_prefix_length([1, 2, 3], [1, 2, 3]) == 3
+
+    def test_diverging(self):
+        assert common_prefix_length([1, 2, 3], [1, 2, 4]) == 2
+
+    def test_empty(self):
+        assert common_prefix_length([], [1]) == 0
+
+
+class TestPrefixLookup:
+    def test_miss_on_empty_cache(self):
+        cache = PrefixCache(max_bytes=1000)
+        assert cache.lookup(SYSTEM + [1, 2]) is None
+        assert cache.misses == 1
+
+    def test_shared_system_prompt_hits(self):
+        cache = PrefixCache(max_bytes=1000)
+        cache.insert(SYSTEM + [1, 2, 3], "kv-a", nbytes=10)
+        hit = cache.lookup(SYSTEM + [7, 8])
+        assert hit == (len(SYSTEM), "kv-a")
+        assert cache.tokens_reused == len(SYSTEM)
+
+    def test_longest_match_wins(self):
+        cache = PrefixCache(max_bytes=1000)
+        cache.insert(SYSTEM + [1], "short", nbytes=10)
+        cache.insert(SYSTEM + [2, 3, 4], "long", nbytes=10)
+        assert cache.lookup(SYSTEM + [2, 3, 9]) == (len(SYSTEM) + 2, "long")
+
+    def test_short_match_is_a_miss(self):
+        cache = PrefixCache(max_bytes=1000, min_match=16)
+        cache.insert(SYSTEM, "kv", nbytes=10)
+        assert cache.lookup(SYSTEM[:5] + [0] * 20) is None
+
+    def test_non_croppable_entry_needs_full_match(self):
+        cache = PrefixCache(max_bytes=1000)
+        cache.insert(SYSTEM + [1, 2], "kv", nbytes=10, croppable=False)
+        assert cache.lookup(SYSTEM + [9]) is None
+        assert cache.lookup(SYSTEM + [1, 2, 3]) == (len(SYSTEM) + 2, "kv")
+
+
+class TestPrefixEviction:
+    def test_lru_eviction_respects_budget(self):
+        cache = PrefixCache(max_bytes=25)
+        a, b, c = [1] * 20, [2] * 20, [3] * 20
+        cache.insert(a, "a", nbytes=10)
+        cache.insert(b, "b", nbytes=10)
+        cache.lookup(a)  # touch "a" so "b" is least recently used
+        cache.insert(c, "c", nbytes=10)
+        stats = cache.stats()
+        assert stats["entries"] == 2
+        assert stats["bytes"] <= 25
+        assert cache.lookup(b) is None
+        assert cache.lookup(a) == (20, "a")
+
+    def test_longer_entry_replaces_its_prefixes(self):
+        cache = PrefixCache(max_bytes=1000)
+        cache.insert(SYSTEM, "prefix", nbytes=10)
+        cache.insert(SYSTEM + [1, 2], "full", nbytes=12)
+        assert cache.stats()["entries"] == 1
+        assert cache.stats()["bytes"] == 12
+
+    def test_oversized_entry_not_stored(self):
+        cache = PrefixCache(max_bytes=5)
+        cache.insert(SYSTEM, "kv", nbytes=10)
+        assert cache.stats()["entries"] == 0
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = PrefixCache(max_bytes=0)
+        assert not cache.enabled
+        cache.insert(SYSTEM, "kv", nbytes=1)
+        assert cache.stats()["entries"] == 0
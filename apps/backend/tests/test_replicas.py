@@ -0,0 +1,95 @@
+"""
+Tests for forked MedGemma replicas.
+
+Workers inherit a service whose engine is the scripted FakeEngine, so the
+fork, IPC dispatch and cancellation paths run without torch.
+"""
+
+import asyncio
+import multiprocessing
+import os
+
+import pytest
+
+from api.services.medgemma import MedGemmaService
+from api.services.replicas import ReplicaError
+from api.services.response_cache import ResponseCache
+from tests.fakes import FakeEngine
+
+pytestmark = pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="replicas need fork")
+
+
+def _service(script, step_delay=0.0) -> MedGemmaService:
+    svc = MedGemmaService()
+    svc.loaded = True
+    svc.device = "cpu"
+    svc.response_cache = ResponseCache(max_entries=8)
+    svc._prepare_inputs = lambda _messages, _digest=None: {"script": list(script)}
+    svc._make_engine = lambda: FakeEngine(step_delay=step_delay)
+    return svc
+
+
+@pytest.fixture
+def replicated():
+    services = []
+
+    def _start(script, workers=2, step_delay=0.0):
+        svc = _service(script, step_delay)
+        assert svc.start_replicas(workers)
+        services.append(svc)
+        return svc
+
+    yield _start
+    for svc in services:
+        svc.stop_replicas()
+
+
+class TestReplicas:
+    async def test_generate_runs_in_workers(self, replicated):
+        svc = replicated([1, 2, 3, 0])
+        results = await asyncio.gather(*[svc.generate(prompt=f"q{i}") for i in range(4)])
+        assert results == ["abc"] * 4
+
+        workers = svc.runtime_stats()["replicas"]["workers"]
+        assert len(workers) == 2
+        assert all(w["pid"] != os.getpid() for w in workers)
+        assert sum(w["served"] for w in workers) == 4
+        # Requests were spread across both workers
+        assert all(w["served"] > 0 for w in workers)
+        # No scheduler was started in the API process
+        assert svc.runtime_stats()["scheduler"] is None
+
+    async def test_stream_and_response_cache_in_parent(self, replicated):
+        svc = replicated([1, 2, 0])
+        chunks = [c async for c in svc.stream_generate(prompt="q", temperature=0.0)]
+        assert "".join(chunks) == "ab"
+        assert svc.response_cache.stats()["stores"] == 1
+        assert await svc.generate(prompt="q", temperature=0.0) == "ab"
+        assert svc.response_cache.stats()["memory_hits"] == 1
+
+    async def test_abandoned_stream_frees_worker(self, replicated):
+        svc = replicated([1] * 500 + [0], workers=1, step_delay=0.01)
+        stream = svc.stream_generate(prompt="long", max_new_tokens=1000)
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        assert svc.runtime_stats()["replicas"]["workers"][0]["inflight"] == 0
+
+        svc._prepare_inputs = None  # parent must not prepare inputs itself
+        text = await asyncio.wait_for(svc.generate(prompt="again", max_new_tokens=2), timeout=5.0)
+        assert text == "aa"
+
+    async def test_dead_worker_fails_its_requests(self, replicated):
+        svc = replicated([1] * 500 + [0], workers=1, step_delay=0.01)
+        task = asyncio.create_task(svc.generate(prompt="q", max_new_tokens=1000))
+        await asyncio.sleep(0.2)
+        svc._replicas._replicas[0].process.kill()
+        with pytest.raises(ReplicaError):
+            await asyncio.wait_for(task, timeout=5.0)
+        with pytest.raises(ReplicaError, match="No MedGemma replicas"):
+            await svc.generate(prompt="q")
+
+    def test_not_started_off_cpu(self):
+        svc = _service([1, 0])
+        svc.device = "mps"
+        assert not svc.start_replicas(2)
+        assert svc.runtime_stats()["replicas"] is None
@@ -0,0 +1,128 @@
+"""
+Tests for the greedy response cache and its use in MedGemmaService.
+"""
+
+from api.services.batching import BatchScheduler
+from api.services.medgemma import MedGemmaService
+from api.services.response_cache import ResponseCache, cache_key, split_chunks
+from tests.fakes import FakeEngine
+
+
+class TestCacheKey:
+    def test_key_is_stable(self):
+        assert cache_key("m", "sys", "p", None, 10) == cache_key("m", "sys", "p", None, 10)
+
+    def test_key_covers_every_field(self):
+        base = cache_key("m", "sys", "p", "img", 10)
+        assert cache_key("m2", "sys", "p", "img", 10) != base
+        assert cache_key("m", "sys2", "p", "img", 10) != base
+        assert cache_key("m", "sys", "p2", "img", 10) != base
+        assert cache_key("m", "sys", "p", "img2", 10) != base
+        assert cache_key("m", "sys", "p", "img", 11) != base
+
+    def test_split_chunks_round_trips(self):
+        text = "Chest pain,  consider ACS.\n\nCall 911 "
+        assert "".join(split_chunks(text)) == text
+        assert len(split_chunks(text)) > 1
+
+
+class TestResponseCache:
+    def test_memory_hit_and_miss_counters(self):
+        cache = ResponseCache(max_entries=4)
+        assert cache.get("k") is None
+        cache.put("k", ["a", "b"])
+        assert cache.get("k") == ["a", "b"]
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["memory_hits"] == 1
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put("a", ["1"])
+        cache.put("b", ["2"])
+        cache.get("a")
+        cache.put("c", ["3"])
+        assert cache.get("b") is None
+        assert cache.get("a") == ["1"]
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        db = str(tmp_path / "cache" / "responses.sqlite")
+        first = ResponseCache(max_entries=4, db_path=db)
+        first.put("k", ["persisted ", "answer"])
+        first.close()
+
+        second = ResponseCache(max_entries=4, db_path=db)
+        assert second.get("k") == ["persisted ", "answer"]
+        assert second.stats()["disk_hits"] == 1
+        # Promoted into memory on the first disk hit
+        assert second.get("k") == ["persisted ", "answer"]
+        assert second.stats()["memory_hits"] == 1
+        second.close()
+
+    def test_disk_tier_evicts_oldest_rows(self, tmp_path):
+        db = str(tmp_path / "responses.sqlite")
+        cache = ResponseCache(max_entries=1, db_path=db, max_disk_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, [key])
+        assert cache.stats()["disk_evictions"] == 1
+        cache.close()
+
+        reopened = ResponseCache(max_entries=4, db_path=db, max_disk_entries=2)
+        assert reopened.get("a") is None
+        assert reopened.get("b") == ["b"]
+        assert reopened.get("c") == ["c"]
+        reopened.close()
+
+        # A smaller limit trims an existing file when it is opened
+        trimmed = ResponseCache(max_entries=4, db_path=db, max_disk_entries=1)
+        assert trimmed.get("b") is None
+        assert trimmed.get("c") == ["c"]
+        trimmed.close()
+
+    def test_disabled_cache(self):
+        cache = ResponseCache(max_entries=0)
+        cache.put("k", ["a"])
+        assert cache.get("k") is None
+
+
+def _service_with_fake_engine() -> MedGemmaService:
+    svc = MedGemmaService()
+    svc.loaded = True
+    svc.response_cache = ResponseCache(max_entries=8)
+    svc._prepare_inputs = lambda _messages, _digest=None: {"script": [1, 2, 3, 0]}
+    svc._scheduler = BatchScheduler(FakeEngine())
+    return svc
+
+
+class TestServiceResponseCache:
+    async def test_greedy_generate_is_cached(self):
+        svc = _service_with_fake_engine()
+        assert await svc.generate(prompt="protocol question", temperature=0.0) == "abc"
+        # Second call must not touch the model
+        svc._prepare_inputs = None
+        assert await svc.generate(prompt="protocol question", temperature=0.0) == "abc"
+        assert svc.response_cache.stats()["memory_hits"] == 1
+        svc._scheduler.stop()
+
+    async def test_sampled_generate_is_not_cached(self):
+        svc = _service_with_fake_engine()
+        await svc.generate(prompt="q", temperature=0.3)
+        assert svc.response_cache.stats()["stores"] == 0
+        svc._scheduler.stop()
+
+    async def test_stream_replays_cached_chunks(self):
+        svc = _service_with_fake_engine()
+        first = [c async for c in svc.stream_generate(prompt="q", temperature=0.0)]
+        svc._prepare_inputs = None
+        replay = [c async for c in svc.stream_generate(prompt="q", temperature=0.0)]
+        assert replay == first
+        assert "".join(replay) == "abc"
+        svc._scheduler.stop()
+
+    async def test_generate_hit_serves_stream(self):
+        svc = _service_with_fake_engine()
+        text = await svc.generate(prompt="q", temperature=0.0)
+        svc._prepare_inputs = None
+        replay = [c async for c in svc.stream_generate(prompt="q", temperature=0.0)]
+        assert "".join(replay) == text
+        svc._scheduler.stop()
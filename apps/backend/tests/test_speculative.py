@@ -0,0 +1,178 @@
+"""
+Tests for speculative decoding: n-gram drafting, greedy verification,
+the speculative scheduler and the service's metadata plumbing.
+
+The scheduler runs a scripted engine (no torch) that "accepts" drafts by
+returning several script tokens per step.
+"""
+
+import pytest
+
+from api.services.batching import ScheduledSequence
+from api.services.medgemma import MedGemmaService
+from api.services.response_cache import ResponseCache
+from api.services.speculative import (
+    PromptLookupDrafter,
+    SpeculativeScheduler,
+    accept_greedy,
+    speculative_stats,
+)
+from tests.fakes import EOS, FakeEngine
+
+
+class FakeSpeculativeEngine(FakeEngine):
+    """Emits up to ``per_step`` script tokens per step; the first is the target's own pick."""
+
+    def __init__(self, per_step: int = 3, **kwargs):
+        super().__init__(**kwargs)
+        self.per_step = per_step
+        self.modes = []
+
+    def prefill(self, seq):
+        self.modes.append(seq.inputs.pop("speculative", None))
+        token = super().prefill(seq)
+        seq.stats.update(mode=self.modes[-1], drafted=0, accepted=0, target_forwards=1)
+        return token
+
+    def speculate(self, seq):
+        tokens = [seq.kv.pop(0) if seq.kv else EOS for _ in range(self.per_step)]
+        seq.stats["drafted"] += self.per_step
+        seq.stats["accepted"] += self.per_step - 1
+        seq.stats["target_forwards"] += 1
+        return tokens
+
+
+class TestPromptLookup:
+    def test_proposes_tokens_after_latest_match(self):
+        drafter = PromptLookupDrafter(max_ngram=2)
+        # Tail "7 8" occurred earlier, followed by 9 10 11
+        context = [1, 7, 8, 9, 10, 11, 5, 7, 8]
+        assert drafter.propose(context, 2) == [9, 10]
+        assert drafter.propose(context, 10) == [9, 10, 11, 5, 7, 8]
+
+    def test_prefers_longest_ngram(self):
+        drafter = PromptLookupDrafter(max_ngram=3)
+        # "8" alone last matched before 3; "7 8" matched before 4
+        context = [7, 8, 4, 2, 8, 3, 7, 8]
+        assert drafter.propose(context, 1) == [4]
+
+    def test_no_match(self):
+        drafter = PromptLookupDrafter(max_ngram=3)
+        assert drafter.propose([1, 2, 3, 4], 5) == []
+        assert drafter.propose([1], 5) == []
+        assert drafter.propose([1, 1], 0) == []
+
+
+class TestGreedyVerification:
+    def test_full_acceptance_adds_bonus_token(self):
+        assert accept_greedy([5, 6, 7], [5, 6, 7, 8]) == (3, [5, 6, 7, 8])
+
+    def test_stops_at_first_mismatch_with_target_token(self):
+        assert accept_greedy([5, 6, 7], [5, 9, 7, 8]) == (1, [5, 9])
+
+    def test_empty_draft_is_plain_decoding(self):
+        assert accept_greedy([], [4]) == (0, [4])
+
+
+class TestSpeculativeScheduler:
+    async def test_output_matches_script_in_fewer_steps(self):
+        sched = SpeculativeScheduler(FakeSpeculativeEngine(per_step=3))
+        seq = sched.submit({"script": [1, 2, 3, 4, 5, 6, 7, EOS]}, max_new_tokens=20, temperature=0.0)
+        assert await seq.result() == "abcdefg"
+
+        stats = speculative_stats(seq)
+        # Prefill emits one token, then three steps cover the other six plus EOS
+        assert stats["target_forwards"] == 4
+        assert stats["tokens"] == 7
+        assert stats["tokens_per_forward"] == 1.75
+        assert stats["acceptance_rate"] == round(6 / 9, 3)
+        assert sched.stats()["drafted"] == 9
+        sched.stop()
+
+    async def test_respects_max_new_tokens_mid_step(self):
+        sched = SpeculativeScheduler(FakeSpeculativeEngine(per_step=4))
+        seq = sched.submit({"script": [1, 2, 3, 4, 5, 6, EOS]}, max_new_tokens=3, temperature=0.0)
+        assert await seq.result() == "abc"
+        sched.stop()
+
+    async def test_streams_chunks(self):
+        sched = SpeculativeScheduler(FakeSpeculativeEngine(per_step=2))
+        seq = sched.submit({"script": [1, 2, 3, EOS]}, max_new_tokens=10, temperature=0.0, stream=True)
+        chunks = [chunk async for chunk in seq.stream_text()]
+        assert "".join(chunks) == "abc"
+        sched.stop()
+
+    def test_stats_absent_for_plain_sequences(self):
+        seq = ScheduledSequence.__new__(ScheduledSequence)
+        seq.stats, seq.token_ids = {}, [1, 2]
+        assert speculative_stats(seq) is None
+
+
+class TestServiceSpeculation:
+    def _service(self, script):
+        svc = MedGemmaService(response_cache=ResponseCache(max_entries=8))
+        svc.loaded = True
+        svc._prepare_inputs = lambda _messages, _digest=None: {"script": list(script)}
+        svc._make_engine = lambda: FakeEngine()
+        svc.engine = FakeSpeculativeEngine()
+        svc._make_speculative_engine = lambda: svc.engine
+        return svc
+
+    async def test_generate_reports_acceptance(self):
+        svc = self._service([1, 2, 3, 4, EOS])
+        metadata = {}
+        text = await svc.generate(prompt="q", temperature=0.0, speculative="prompt_lookup", metadata=metadata)
+        assert text == "abcd"
+        assert metadata["speculative"]["mode"] == "prompt_lookup"
+        assert metadata["speculative"]["tokens"] == 4
+        assert svc.runtime_stats()["speculative"]["tokens_generated"] == 4
+        assert svc.runtime_stats()["scheduler"] is None
+
+        # Same greedy request again: answered from the response cache
+        metadata = {}
+        assert await svc.generate(prompt="q", temperature=0.0, speculative="prompt_lookup", metadata=metadata) == "abcd"
+        assert metadata == {"cached": True}
+
+    async def test_stream_fills_metadata_when_exhausted(self):
+        svc = self._service([1, 2, 3, EOS])
+        metadata = {}
+        chunks = [c async for c in svc.stream_generate(prompt="q", speculative="prompt_lookup", metadata=metadata)]
+        assert "".join(chunks) == "abc"
+        assert metadata["speculative"]["target_forwards"] >= 1
+
+    async def test_draft_mode_without_draft_model_still_runs(self):
+        svc = self._service([1, 2, EOS])
+        assert await svc.generate(prompt="q", speculative="draft") == "ab"
+        assert svc.engine.modes == ["draft"]
+
+    async def test_off_uses_batch_scheduler(self):
+        svc = self._service([1, 2, EOS])
+        svc.speculative = "prompt_lookup"
+        metadata = {}
+        assert await svc.generate(prompt="q", speculative="off", metadata=metadata) == "ab"
+        assert "speculative" not in metadata
+        assert svc.runtime_stats()["speculative"] is None
+
+    async def test_unknown_mode(self):
+        svc = self._service([1, EOS])
+        with pytest.raises(ValueError, match="medusa"):
+            await svc.generate(prompt="q", speculative="medusa")
+
+
+class TestRouteMetadata:
+    async def test_generate_returns_speculative_stats(self, client, mock_medgemma_loaded):
+        async def _generate(**kwargs):
+            kwargs["metadata"]["speculative"] = {"acceptance_rate": 0.8}
+            return "ok"
+
+        mock_medgemma_loaded.generate.side_effect = _generate
+        resp = await client.post(
+            "/api/v1/chat/medgemma/generate", json={"prompt": "hi", "speculative": "prompt_lookup"}
+        )
+        assert resp.status_code == 200
+        assert resp.json()["speculative"] == {"acceptance_rate": 0.8}
+        assert mock_medgemma_loaded.generate.call_args.kwargs["speculative"] == "prompt_lookup"
+
+    async def test_invalid_mode_rejected(self, client, mock_medgemma_loaded):
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "hi", "speculative": "medusa"})
+        assert resp.status_code == 422
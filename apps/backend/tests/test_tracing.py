@@ -0,0 +1,140 @@
+"""
+Tests for per-request tracing: request-id propagation, Server-Timing,
+NDJSON trailers, service spans and the JSONL span sink.
+"""
+
+import json
+import logging
+
+import httpx
+import pytest
+
+from api.services import tracing
+from api.services.batching import BatchScheduler
+from api.services.tracing import RequestIdFilter, SpanSink, Trace, record_sequence, span, start_trace
+from tests.fakes import EOS, FakeEngine
+
+
+@pytest.fixture(autouse=True)
+def _isolated_trace():
+    """Traces started by a test must not leak into later tests."""
+    token = tracing._current.set(None)
+    yield
+    tracing._current.reset(token)
+
+
+def _server_timing(header: str) -> dict:
+    """Parse ``name;dur=ms`` entries."""
+    entries = {}
+    for part in header.split(","):
+        name, dur = part.strip().split(";dur=")
+        entries[name] = float(dur)
+    return entries
+
+
+class TestTrace:
+    def test_timings_sum_repeated_spans(self):
+        trace = Trace("r1")
+        trace.add("decode", 1.0, 1.5)
+        trace.add("decode", 2.0, 2.25)
+        trace.add("queue", 3.0, 2.0)  # clock skew never yields negative spans
+        timings = trace.timings()
+        assert timings["decode"] == 750.0
+        assert timings["queue"] == 0.0
+        assert "total" in timings
+        assert "decode;dur=750.0" in trace.server_timing()
+
+    def test_span_is_noop_outside_a_request(self):
+        with span("tokenize"):
+            pass
+        assert tracing.current_trace() is None
+        assert tracing.trailer() == {}
+        assert tracing.outgoing_headers() == {}
+
+    async def test_sequence_spans(self):
+        trace = start_trace("r2")
+        sched = BatchScheduler(FakeEngine())
+        seq = sched.submit({"script": [1, 2, EOS]}, max_new_tokens=10, temperature=0.0)
+        await seq.result()
+        sched.stop()
+
+        record_sequence(seq)
+        assert [s["name"] for s in trace.spans] == ["queue", "prefill", "decode"]
+        record = trace.to_record()
+        assert record["request_id"] == "r2"
+        assert all(s["duration_ms"] >= 0 for s in record["spans"])
+
+    def test_log_filter_adds_request_id(self):
+        record = logging.LogRecord("x", logging.INFO, __file__, 1, "msg", None, None)
+        RequestIdFilter().filter(record)
+        assert record.request_id == "-"
+
+        start_trace("abc")
+        RequestIdFilter().filter(record)
+        assert record.request_id == "abc"
+
+    def test_sink_appends_json_lines(self, tmp_path):
+        sink = SpanSink(tmp_path / "traces" / "spans.jsonl")
+        for request_id in ("a", "b"):
+            trace = Trace(request_id, "POST", "/x")
+            trace.add("tokenize", trace.started, trace.started + 0.002)
+            trace.finish()
+            sink.write(trace)
+
+        lines = [json.loads(line) for line in sink.path.read_text().splitlines()]
+        assert [line["request_id"] for line in lines] == ["a", "b"]
+        assert lines[0]["spans"][0] == {"name": "tokenize", "start_ms": 0.0, "duration_ms": 2.0}
+
+
+class TestRequestTracing:
+    async def test_request_id_echoed_and_generated(self, client):
+        resp = await client.get("/health", headers={"X-Request-ID": "client-1"})
+        assert resp.headers["x-request-id"] == "client-1"
+        assert "total;dur=" in resp.headers["server-timing"]
+
+        resp = await client.get("/health")
+        assert len(resp.headers["x-request-id"]) == 36
+
+    async def test_generate_reports_validate_span(self, client, mock_medgemma_loaded):
+        resp = await client.post("/api/v1/chat/medgemma/generate", json={"prompt": "hi"})
+        assert resp.status_code == 200
+        timings = _server_timing(resp.headers["server-timing"])
+        assert "validate" in timings and "total" in timings
+
+    async def test_stream_trailer_carries_timings(self, client, mock_medgemma_loaded):
+        resp = await client.post(
+            "/api/v1/chat/medgemma/generate",
+            json={"prompt": "hi", "stream": True},
+            headers={"X-Request-ID": "stream-1"},
+        )
+        last = json.loads(resp.text.strip().split("\n")[-1])
+        assert last["done"] is True
+        assert last["request_id"] == "stream-1"
+        assert "validate" in last["timings"]
+
+    async def test_sink_records_finished_requests(self, client, mock_medgemma_loaded, tmp_path, monkeypatch):
+        sink = SpanSink(tmp_path / "spans.jsonl")
+        monkeypatch.setattr(tracing, "_sink", sink)
+
+        await client.post(
+            "/api/v1/chat/medgemma/generate",
+            json={"prompt": "hi", "stream": True},
+            headers={"X-Request-ID": "sink-1"},
+        )
+        record = json.loads(sink.path.read_text().splitlines()[-1])
+        assert record["request_id"] == "sink-1"
+        assert record["route"] == "/api/v1/chat/medgemma/generate"
+        assert record["status"] == 200
+        assert {"validate", "stream"} <= {s["name"] for s in record["spans"]}
+
+    async def test_request_id_forwarded_to_ollama(self, client, upstream):
+        seen, handlers = upstream
+        handlers["/api/generate"] = lambda _: httpx.Response(200, json={"done": True})
+
+        resp = await client.post(
+            "/api/v1/chat/ollama/generate",
+            json={"model": "m", "prompt": "hi"},
+            headers={"X-Request-ID": "fwd-1"},
+        )
+        assert seen[-1].headers["x-request-id"] == "fwd-1"
+        assert "upstream" in _server_timing(resp.headers["server-timing"])
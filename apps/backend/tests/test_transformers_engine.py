@@ -0,0 +1,266 @@
+"""
+Tests for the Transformers decode engine on a tiny random Gemma 3 model.
+
+The scheduler tests use a fake engine; these run the real tensor paths:
+left-padded batch merges as sequences join, park and leave, prefix-cache
+reuse, image-feature injection and speculative draft-and-verify steps.
+Each one must produce the same tokens and logits as the model run on its
+own. Prompts cross the sliding window
+so the truncated sliding-attention layers are covered too. Skipped
+without torch and transformers.
+"""
+
+import random
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from api.services.prefix_cache import PrefixCache  # noqa: E402
+from api.services.transformers_engine import SpeculativeEngine, TransformersEngine  # noqa: E402
+from api.services.vision_cache import VisionCache  # noqa: E402
+
+EOS = 1
+BOI, EOI, IMAGE = 120, 121, 122
+SLIDING_WINDOW = 16
+
+
+TEXT_CONFIG = {
+    "vocab_size": 128,
+    "hidden_size": 64,
+    "intermediate_size": 128,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 2,
+    "num_key_value_heads": 1,
+    "head_dim": 32,
+    "sliding_window": SLIDING_WINDOW,
+    # Layer 0 slides, layer 1 attends globally (both spellings, across versions)
+    "sliding_window_pattern": 2,
+    "layer_types": ["sliding_attention", "full_attention"],
+    "max_position_embeddings": 512,
+    "pad_token_id": 0,
+    "eos_token_id": EOS,
+    "bos_token_id": 2,
+}
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.Gemma3Config(
+        text_config=dict(TEXT_CONFIG),
+        vision_config={
+            "hidden_size": 32,
+            "intermediate_size": 64,
+            "num_hidden_layers": 1,
+            "num_attention_heads": 2,
+            "image_size": 28,
+            "patch_size": 14,
+        },
+        mm_tokens_per_image=4,
+        boi_token_index=BOI,
+        eoi_token_index=EOI,
+        image_token_index=IMAGE,
+    )
+    model = transformers.Gemma3ForConditionalGeneration(config).eval()
+    # Generate exactly max_new_tokens, so references never stop early
+    model.generation_config.eos_token_id = None
+    model.generation_config.pad_token_id = 0
+    return model
+
+
+@pytest.fixture(scope="module")
+def draft_model():
+    """A differently seeded text-only model, so most of its drafts are rejected."""
+    torch.manual_seed(1)
+    return transformers.Gemma3ForCausalLM(transformers.Gemma3TextConfig(**TEXT_CONFIG)).eval()
+
+
+class _Seq:
+    """The ``ScheduledSequence`` fields the engine reads and writes."""
+
+    def __init__(self, inputs, temperature=0.0, max_new_tokens=64):
+        self.inputs = inputs
+        self.temperature = temperature
+        self.max_new_tokens = max_new_tokens
+        self.token_ids = []
+        self.kv = None
+        self.kv_mask = None
+        self.position = 0
+        self.draft = None
+        self.stats = {}
+
+
+def _engine(model, engine_cls=TransformersEngine, **kwargs) -> TransformersEngine:
+    tokenizer = SimpleNamespace(eos_token_id=EOS, decode=lambda _ids, **_kwargs: "")
+    return engine_cls(model, SimpleNamespace(tokenizer=tokenizer), **kwargs)
+
+
+def _prompt(length, seed):
+    rng = random.Random(seed)
+    return [2] + [rng.randrange(3, 100) for _ in range(length - 1)]
+
+
+def _text_inputs(prompt):
+    ids = torch.tensor([prompt])
+    return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+
+
+def _generate(model, prompt, n):
+    """Greedy continuation from ``model.generate``, the reference for the engine."""
+    with torch.no_grad():
+        out = model.generate(**_text_inputs(prompt), max_new_tokens=n, do_sample=False)
+    return out[0, len(prompt) :].tolist()
+
+
+def _prefill_logits(engine, seq):
+    """Prefill ``seq``; returns its first token and the next-token logits the engine sampled from."""
+    captured = []
+    sample = engine.sample
+    engine.sample = lambda logits, seqs: captured.append(logits.float().clone()) or sample(logits, seqs)
+    try:
+        token = engine.prefill(seq)
+    finally:
+        del engine.sample
+    seq.token_ids.append(token)
+    return captured[0]
+
+
+def _decode(engine, seq, n):
+    for _ in range(n):
+        seq.token_ids += engine.decode([seq])
+
+
+def _speculate(engine, seq):
+    """Prefill, then draft-and-verify until ``seq.max_new_tokens``, as the speculative scheduler does."""
+    seq.token_ids.append(engine.prefill(seq))
+    while len(seq.token_ids) < seq.max_new_tokens:
+        seq.token_ids += engine.speculate(seq)
+
+
+class TestBatchedDecode:
+    def test_staggered_batch_matches_generate(self, model):
+        """Sequences join, park, resume and finish at different steps; each decodes as if alone."""
+        prompts = [_prompt(5, 1), _prompt(21, 2), _prompt(11, 3)]
+        starts = [0, 2, 4]
+        parked = {1: range(6, 8)}  # second sequence sits out steps 6 and 7
+        budget = 14
+        engine = _engine(model)
+        seqs = [_Seq(_text_inputs(p)) for p in prompts]
+
+        step = 0
+        while any(len(s.token_ids) < budget for s in seqs):
+            for s, start in zip(seqs, starts, strict=True):
+                if step == start:
+                    s.token_ids.append(engine.prefill(s))
+            leaving = [seqs[i] for i, steps in parked.items() if steps.start == step]
+            if leaving:
+                engine.detach(leaving)
+            resting = [seqs[i] for i, steps in parked.items() if step in steps]
+            active = [
+                s
+                for s, start in zip(seqs, starts, strict=True)
+                if start <= step and len(s.token_ids) < budget and s not in resting
+            ]
+            if active:
+                for s, token in zip(active, engine.decode(active), strict=True):
+                    s.token_ids.append(token)
+            step += 1
+
+        for prompt, s in zip(prompts, seqs, strict=True):
+            assert s.token_ids == _generate(model, prompt, budget)
+
+    def test_single_sequence_past_sliding_window(self, model):
+        prompt = _prompt(12, 4)
+        engine = _engine(model)
+        seq = _Seq(_text_inputs(prompt))
+        seq.token_ids.append(engine.prefill(seq))
+        _decode(engine, seq, 2 * SLIDING_WINDOW)
+        assert seq.token_ids == _generate(model, prompt, 2 * SLIDING_WINDOW + 1)
+
+
+class TestPrefillReuse:
+    def _cold(self, model, prompt):
+        return _prefill_logits(_engine(model), _Seq(_text_inputs(prompt)))
+
+    def test_cropped_prefix_hit_matches_cold_prefill(self, model):
+        shared = _prompt(10, 5)
+        first, second = shared + [40, 41, 42], shared + [50, 51, 52, 53]
+        cache = PrefixCache(64 << 20, min_match=4)
+        engine = _engine(model, prefix_cache=cache)
+        _prefill_logits(engine, _Seq(_text_inputs(first)))
+
+        seq = _Seq(_text_inputs(second))
+        hit = _prefill_logits(engine, seq)
+        assert cache.stats()["tokens_reused"] == len(shared)
+        torch.testing.assert_close(hit, self._cold(model, second), rtol=1e-4, atol=1e-4)
+
+        _decode(engine, seq, 6)
+        assert seq.token_ids == _generate(model, second, 7)
+
+    def test_full_prefix_hit_past_sliding_window(self, model):
+        """An entry whose sliding-window layers were truncated still serves prompts that extend it."""
+        first = _prompt(SLIDING_WINDOW + 4, 6)
+        second = first + [60, 61, 62]
+        cache = PrefixCache(64 << 20, min_match=4)
+        engine = _engine(model, prefix_cache=cache)
+        _prefill_logits(engine, _Seq(_text_inputs(first)))
+
+        seq = _Seq(_text_inputs(second))
+        hit = _prefill_logits(engine, seq)
+        assert cache.stats()["tokens_reused"] == len(first)
+        torch.testing.assert_close(hit, self._cold(model, second), rtol=1e-4, atol=1e-4)
+
+        _decode(engine, seq, 6)
+        assert seq.token_ids == _generate(model, second, 7)
+
+    def test_vision_cache_hit_matches_cold_prefill(self, model):
+        ids = torch.tensor([[2, 5, 6, BOI] + [IMAGE] * 4 + [EOI, 7, 8]])
+        inputs = {"input_ids": ids, "attention_mask": torch.ones_like(ids), "token_type_ids": (ids == IMAGE).long()}
+        pixel_values = torch.randn(1, 3, 28, 28, generator=torch.Generator().manual_seed(0))
+        with torch.no_grad():
+            native = model(**inputs, pixel_values=pixel_values).logits[:, -1].float()
+
+        vision_cache = VisionCache(64 << 20)
+        engine = _engine(model, vision_cache=vision_cache)
+        cold = _prefill_logits(engine, _Seq({**inputs, "pixel_values": pixel_values, "image_digest": "img"}))
+        features = vision_cache.get("img")
+        assert features is not None
+        hit = _prefill_logits(engine, _Seq({**inputs, "image_features": features, "image_digest": "img"}))
+
+        torch.testing.assert_close(cold, native, rtol=1e-4, atol=1e-4)
+        torch.testing.assert_close(hit, cold, rtol=1e-5, atol=1e-5)
+
+
+class TestSpeculativeDecode:
+    def _seq(self, prompt, mode, n):
+        return _Seq({**_text_inputs(prompt), "speculative": mode}, max_new_tokens=n)
+
+    def test_prompt_lookup_past_sliding_window(self, model):
+        prompt = [2] + [5, 6, 7, 8, 9] * 4
+        n = 2 * SLIDING_WINDOW
+        seq = self._seq(prompt, "prompt_lookup", n)
+        _speculate(_engine(model, SpeculativeEngine, num_draft_tokens=4), seq)
+        assert seq.token_ids == _generate(model, prompt, n)
+
+    @pytest.mark.parametrize("prompt_len", [5, SLIDING_WINDOW + 4])
+    def test_draft_model_past_sliding_window(self, model, draft_model, prompt_len):
+        """Rejected drafts are cropped off both caches after the sliding window has wrapped."""
+        prompt = _prompt(prompt_len, 7)
+        n = 2 * SLIDING_WINDOW
+        seq = self._seq(prompt, "draft", n)
+        _speculate(_engine(model, SpeculativeEngine, draft_model=draft_model, num_draft_tokens=4), seq)
+        assert seq.token_ids == _generate(model, prompt, n)
+        assert 0 <= seq.stats["accepted"] < seq.stats["drafted"]
+
+    def test_skips_prefix_truncated_by_batch_engine(self, model):
+        first = _prompt(SLIDING_WINDOW + 4, 8)
+        second = first + [60, 61, 62]
+        cache = PrefixCache(64 << 20, min_match=4)
+        _prefill_logits(_engine(model, prefix_cache=cache), _Seq(_text_inputs(first)))
+
+        seq = self._seq(second, "prompt_lookup", SLIDING_WINDOW)
+        _speculate(_engine(model, SpeculativeEngine, prefix_cache=cache), seq)
+        assert seq.token_ids == _generate(model, second, SLIDING_WINDOW)
@@ -0,0 +1,60 @@
+"""
+Tests for the vision-encoder feature cache.
+
+Feature tensors are opaque to VisionCache, so plain strings stand in for them.
+"""
+
+from PIL import Image
+
+from api.services.imaging import image_digest
+from api.services.vision_cache import VisionCache
+
+
+class TestImageDigest:
+    def test_same_pixels_same_digest(self):
+        a = Image.new("RGB", (8, 8), (10, 20, 30))
+        b = Image.new("RGB", (8, 8), (10, 20, 30))
+        assert image_digest(a) == image_digest(b)
+
+    def test_different_pixels_or_size_differ(self):
+        base = image_digest(Image.new("RGB", (8, 8), (10, 20, 30)))
+        assert image_digest(Image.new("RGB", (8, 8), (10, 20, 31))) != base
+        assert image_digest(Image.new("RGB", (8, 4), (10, 20, 30))) != base
+
+
+class TestVisionCache:
+    def test_hit_and_miss_counters(self):
+        cache = VisionCache(max_bytes=100)
+        assert cache.get("img") is None
+        cache.put("img", "features", nbytes=10)
+        assert cache.get("img") == "features"
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["bytes"] == 10
+
+    def test_lru_eviction_respects_budget(self):
+        cache = VisionCache(max_bytes=25)
+        cache.put("a", "fa", nbytes=10)
+        cache.put("b", "fb", nbytes=10)
+        cache.get("a")  # touch "a" so "b" is least recently used
+        cache.put("c", "fc", nbytes=10)
+        assert cache.stats()["entries"] == 2
+        assert cache.get("b") is None
+        assert cache.get("a") == "fa"
+
+    def test_reinsert_does_not_double_count(self):
+        cache = VisionCache(max_bytes=100)
+        cache.put("a", "fa", nbytes=10)
+        cache.put("a", "fa", nbytes=10)
+        assert cache.stats()["bytes"] == 10
+
+    def test_oversized_and_disabled(self):
+        cache = VisionCache(max_bytes=5)
+        cache.put("a", "fa", nbytes=10)
+        assert cache.stats()["entries"] == 0
+
+        disabled = VisionCache(max_bytes=0)
+        assert not disabled.enabled
+        disabled.put("a", "fa", nbytes=1)
+        assert disabled.stats()["entries"] == 0
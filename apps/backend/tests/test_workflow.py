@@ -0,0 +1,239 @@
+"""
+Tests for the server-side triage workflow (service helpers + NDJSON route).
+"""
+
+import ast
+import asyncio
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from api.services.triage_workflow import (
+    DRUG_INTERACTIONS,
+    EMERGENCY_KEYWORDS,
+    STEPS,
+    extract_differential,
+    extract_triage,
+    format_context,
+    ready_steps,
+    run_safety_guard,
+    step_context,
+)
+
+
+def _events(resp):
+    return [json.loads(line) for line in resp.text.splitlines() if line]
+
+
+# The Hugging Face Space is deployed on its own, so it keeps its own copy of these helpers
+_SPACE_APP = Path(__file__).resolve().parents[3] / "spaces" / "app.py"
+_SPACE_HELPERS = {
+    "_format_context",
+    "_extract_triage",
+    "_run_safety_guard",
+    "STEPS",
+    "EMERGENCY_KEYWORDS",
+    "DRUG_INTERACTIONS",
+}
+
+
+def _load_space_helpers():
+    """The Space's workflow helpers, executed on their own so gradio isn't needed."""
+    if not _SPACE_APP.is_file():
+        pytest.skip("spaces/app.py not present")
+    tree = ast.parse(_SPACE_APP.read_text(encoding="utf-8"))
+    nodes = [
+        node
+        for node in tree.body
+        if (isinstance(node, ast.FunctionDef) and node.name in _SPACE_HELPERS)
+        or (isinstance(node, ast.Assign) and any(getattr(t, "id", None) in _SPACE_HELPERS for t in node.targets))
+    ]
+    namespace = {}
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), str(_SPACE_APP), "exec"), namespace)
+    return SimpleNamespace(**namespace)
+
+
+class TestWorkflowHelpers:
+    def test_extract_triage_levels(self):
+        assert extract_triage("TRIAGE: Emergency\nreason") == "Emergency"
+        assert extract_triage("TRIAGE: Semi-Urgent") == "Semi-Urgent"
+        assert extract_triage("TRIAGE: Non-Urgent") == "Non-Urgent"
+        assert extract_triage("TRIAGE: Self-Care") == "Self-Care"
+        assert extract_triage("no label here") == "Urgent"
+
+    def test_extract_differential(self):
+        text = "Top 3:\n1. **Acute MI** (high likelihood) — ST changes\n2. Tension-type headache — stress\n- note"
+        assert extract_differential(text) == [
+            {"rank": 1, "condition": "Acute MI", "likelihood": "high"},
+            {"rank": 2, "condition": "Tension-type headache", "likelihood": None},
+        ]
+
+    def test_format_context_includes_vitals(self):
+        ctx = format_context("Chest pain", age="70", hr="110", spo2="94")
+        assert ctx.startswith("Chief Complaint: Chest pain")
+        assert "(Geriatric)" in ctx
+        assert "HR: 110 bpm" in ctx
+        assert "SpO2: 94%" in ctx
+
+    def test_dag_levels(self):
+        first = [title for _, title, _, _ in ready_steps({})]
+        assert first == ["Symptom Analysis"]
+        second = [title for _, title, _, _ in ready_steps({"Symptom Analysis": "sa"})]
+        assert second == ["Triage Assessment", "Differential Diagnosis"]
+        third = [
+            title
+            for _, title, _, _ in ready_steps(
+                {
+                    "Symptom Analysis": "sa",
+                    "Triage Assessment": "TRIAGE: Urgent",
+                    "Differential Diagnosis": "dx",
+                }
+            )
+        ]
+        assert third == ["Risk Stratification", "Recommended Actions"]
+
+    def test_step_context_passes_declared_inputs(self):
+        results = {"Symptom Analysis": "x" * 600, "Triage Assessment": "TRIAGE: Emergency\nbecause"}
+        _, _, dx_inputs = STEPS[2]
+        ctx = step_context("CTX", dx_inputs, results)
+        assert ctx == "CTX\n\nSymptom Analysis:\n" + "x" * 500
+        _, _, risk_inputs = STEPS[3]
+        assert step_context("CTX", risk_inputs, results) == "CTX\n\nTriage: Emergency"
+
+    def test_safety_guard_flags_emergency_and_interaction(self):
+        alerts = run_safety_guard("chest pain", "Urgent", medications="Warfarin, Aspirin")
+        types = {a["type"] for a in alerts}
+        assert "emergency_escalation" in types
+        assert "drug_interaction" in types
+
+    def test_safety_guard_flags_under_triage(self):
+        alerts = run_safety_guard("shortness of breath", "Self-Care")
+        assert any(a["type"] == "triage_escalation" for a in alerts)
+
+
+class TestMatchesSpace:
+    """The backend and the Space must parse and screen cases the same way."""
+
+    # Space alert prefixes, by backend alert type
+    _SPACE_ALERTS = {
+        "EMERGENCY ESCALATION": "emergency_escalation",
+        "CRITICAL VITAL": "critical_vital",
+        "DRUG INTERACTION": "drug_interaction",
+        "TRIAGE ESCALATION": "triage_escalation",
+    }
+
+    @pytest.fixture(scope="class")
+    def space(self):
+        return _load_space_helpers()
+
+    def test_prompts_and_rules(self, space):
+        assert space.STEPS == STEPS
+        assert space.EMERGENCY_KEYWORDS == EMERGENCY_KEYWORDS
+        assert space.DRUG_INTERACTIONS == DRUG_INTERACTIONS
+
+    def test_format_context(self, space):
+        cases = [
+            ("Chest pain", "Sweating", "58", "Male", "112", "150/95", "99.1", "22", "94", "HTN", "Aspirin", "None"),
+            ("Rash", "", "1", "", "", "", "", "", "", "", "", ""),
+            ("Cough", None, "seventy", None, None, None, "101.5", None, None, None, None, None),
+        ]
+        for args in cases:
+            assert format_context(*args) == space._format_context(*args)
+
+    def test_extract_triage(self, space):
+        for text in ("TRIAGE: Emergency", "TRIAGE: Semi-Urgent", "triage: non-urgent", "Self-care advised", "?"):
+            assert extract_triage(text) == space._extract_triage(text)
+
+    def test_safety_guard(self, space):
+        cases = [
+            ("Chest pain at rest", "Self-Care", "warfarin, aspirin", "160", "85", "105"),
+            ("Mild rash", "Non-Urgent", "", "30", "abc", ""),
+            ("Severe headache", "Self-Care", "sildenafil and nitroglycerin", "", "", "x"),
+        ]
+        for context, triage, meds, hr, spo2, temp in cases:
+            ours = [a["type"] for a in run_safety_guard(context, triage, meds, hr, spo2, temp)]
+            theirs = [
+                next(kind for prefix, kind in self._SPACE_ALERTS.items() if prefix in alert)
+                for alert in space._run_safety_guard(context, triage, meds, hr, spo2, temp)
+            ]
+            assert ours == theirs
+
+
+class TestWorkflowRoute:
+    async def test_requires_context_or_complaint(self, client, mock_medgemma_loaded):
+        resp = await client.post("/api/v1/chat/medgemma/workflow", json={})
+        assert resp.status_code == 422
+
+    async def test_returns_503_when_model_unavailable(self, client, mock_medgemma_not_loaded):
+        resp = await client.post("/api/v1/chat/medgemma/workflow", json={"chief_complaint": "headache"})
+        assert resp.status_code == 503
+
+    async def test_streams_all_steps_and_result(self, client, mock_medgemma_loaded):
+        resp = await client.post("/api/v1/chat/medgemma/workflow", json={"chief_complaint": "headache"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        events = _events(resp)
+        done = [e["title"] for e in events if e["event"] == "step_done"]
+        assert sorted(done) == sorted(title for title, _, _ in STEPS)
+        assert list(events[-1]["steps"]) == [title for title, _, _ in STEPS]
+        assert any(e["event"] == "token" for e in events)
+        assert events[-1]["event"] == "result"
+        assert events[-1]["partial"] is False
+
+    async def test_token_events_can_be_disabled(self, client, mock_medgemma_loaded):
+        resp = await client.post(
+            "/api/v1/chat/medgemma/workflow",
+            json={"context": "Chief Complaint: cough", "stream_tokens": False},
+        )
+        events = _events(resp)
+        assert not any(e["event"] == "token" for e in events)
+        assert mock_medgemma_loaded.generate.await_count == len(STEPS)
+
+    async def test_triage_parsed_into_result(self, client, mock_medgemma_loaded):
+        mock_medgemma_loaded.generate.return_value = "TRIAGE: Emergency\nLife-threatening."
+        resp = await client.post(
+            "/api/v1/chat/medgemma/workflow",
+            json={"chief_complaint": "chest pain", "stream_tokens": False},
+        )
+        result = _events(resp)[-1]
+        assert result["triage"] == "Emergency"
+        assert any(a["type"] == "emergency_escalation" for a in result["safety_alerts"])
+
+    async def test_independent_steps_run_concurrently(self, client, mock_medgemma_loaded):
+        in_flight = 0
+        peak = 0
+
+        async def slow_generate(prompt, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return "TRIAGE: Urgent"
+
+        mock_medgemma_loaded.generate.side_effect = slow_generate
+        resp = await client.post(
+            "/api/v1/chat/medgemma/workflow",
+            json={"chief_complaint": "cough", "stream_tokens": False},
+        )
+        assert _events(resp)[-1]["partial"] is False
+        assert peak == 2
+
+    async def test_later_step_failure_returns_partial_result(self, client, mock_medgemma_loaded):
+        async def failing_triage(prompt, **kwargs):
+            if "TRIAGE: Emergency" in prompt:
+                raise RuntimeError("out of memory")
+            return "analysis"
+
+        mock_medgemma_loaded.generate.side_effect = failing_triage
+        resp = await client.post(
+            "/api/v1/chat/medgemma/workflow",
+            json={"chief_complaint": "cough", "stream_tokens": False},
+        )
+        events = _events(resp)
+        assert any(e["event"] == "error" for e in events)
+        assert events[-1]["partial"] is True
+        assert "Triage Assessment" not in events[-1]["steps"]
+        assert "Risk Stratification" not in events[-1]["steps"]
@@ -56,6 +56,8 @@ def _try_load_model():
 
         print(f"Loading processor for {MODEL_ID}...")
         _processor = AutoProcessor.from_pretrained(MODEL_ID)
+        # Batched generation left-pads so every prompt ends at the same position
+        _processor.tokenizer.padding_side = "left"
 
         print(f"Loading model {MODEL_ID}...")
         _model = AutoModelForImageTextToText.from_pretrained(
@@ -103,6 +105,39 @@ def _generate(prompt: str, system_prompt: str = "You are an expert medical AI as
     return _processor.decode(output[0][input_len:], skip_special_tokens=True)
 
 
+def _generate_batch(prompts: list, system_prompt: str = "You are an expert medical AI assistant.",
+                    max_tokens: int = 512, temperature: float = 0.3) -> list:
+    """Generate responses for independent prompts in a single batched model.generate call."""
+    if len(prompts) == 1:
+        return [_generate(prompts[0], system_prompt, max_tokens, temperature)]
+
+    import torch
+
+    conversations = [
+        [
+            {"role": "system", "content": [{"type": "text", "text": system_prompt}]},
+            {"role": "user", "content": [{"type": "text", "text": prompt}]},
+        ]
+        for prompt in prompts
+    ]
+
+    inputs = _processor.apply_chat_template(
+        conversations, add_generation_prompt=True, padding=True,
+        tokenize=True, return_dict=True, return_tensors="pt",
+    ).to(_model.device, dtype=_model.dtype)
+
+    input_len = inputs["input_ids"].shape[-1]
+
+    with torch.inference_mode():
+        output = _model.generate(
+            **inputs, max_new_tokens=max_tokens,
+            do_sample=temperature > 0,
+            temperature=temperature if temperature > 0 else None,
+        )
+
+    return [_processor.decode(row[input_len:], skip_special_tokens=True) for row in output]
+
+
 # ---------------------------------------------------------------------------
 # Patient context formatting (mirrors MedicalWorkflowEngine.swift)
 # ---------------------------------------------------------------------------
@@ -157,6 +192,12 @@ def _format_context(chief_complaint, symptoms, age, sex, hr, bp, temp, rr, spo2,
 
 # ---------------------------------------------------------------------------
 # 5-step agentic workflow (mirrors MedicalWorkflowEngine.swift prompts)
+#
+# Declared as a DAG: each step lists the earlier outputs it needs as
+# (step title, how it is passed) — "label" passes the parsed triage level,
+# an int passes the first N characters, None passes the whole output.
+# Steps whose inputs are ready run together in one batched generate call:
+#   Symptom Analysis → {Triage, Differential} → {Risk, Actions}
 # ---------------------------------------------------------------------------
 
 STEPS = [
@@ -166,7 +207,7 @@ STEPS = [
 3. Associated symptoms suggesting specific conditions
 4. Timeline and progression
 
-Be concise and evidence-based. Use bullet points."""),
+Be concise and evidence-based. Use bullet points.""", ()),
 
     ("Triage Assessment", """Your FIRST line must be exactly one of these (copy it verbatim):
 TRIAGE: Emergency
@@ -175,19 +216,22 @@ TRIAGE: Semi-Urgent
 TRIAGE: Non-Urgent
 TRIAGE: Self-Care
 
-Then justify in 2-3 sentences. Only classify as Emergency if immediately life-threatening RIGHT NOW."""),
+Then justify in 2-3 sentences. Only classify as Emergency if immediately life-threatening RIGHT NOW.""",
+     (("Symptom Analysis", None),)),
 
     ("Differential Diagnosis", """List top 3 most likely diagnoses. For each, one line:
 [Number]. [Condition] (high/medium/low likelihood) — [1 sentence reasoning]
 
-Be concise. No more than 3 conditions."""),
+Be concise. No more than 3 conditions.""",
+     (("Symptom Analysis", 500),)),
 
     ("Risk Stratification", """List key risk factors as bullet points (1 sentence each):
 - Patient-specific risk factors
 - Warning signs requiring immediate care
 - Complications to monitor
 
-Be concise. Max 5 bullet points."""),
+Be concise. Max 5 bullet points.""",
+     (("Triage Assessment", "label"),)),
 
     ("Recommended Actions", """List 3-5 actionable recommendations, numbered by priority:
 1. Most urgent action first
@@ -195,7 +239,8 @@ Be concise. Max 5 bullet points."""),
 3. Key diagnostic tests
 4. Red flags requiring emergency care
 
-One sentence per recommendation."""),
+One sentence per recommendation.""",
+     (("Triage Assessment", "label"),)),
 ]
 
 
@@ -215,6 +260,26 @@ def _extract_triage(text: str) -> str:
     return "Urgent"
 
 
+def _step_context(context: str, inputs, results: dict) -> str:
+    """Patient context plus the outputs a step depends on."""
+    ctx = context
+    for dep, mode in inputs:
+        if mode == "label":
+            ctx += f"\n\nTriage: {_extract_triage(results[dep])}"
+        else:
+            text = results[dep] if mode is None else results[dep][:mode]
+            ctx += f"\n\n{dep}:\n{text}"
+    return ctx
+
+
+def _ready_steps(results: dict) -> list:
+    """Steps not yet run whose inputs are all available."""
+    return [
+        (title, prompt, inputs) for title, prompt, inputs in STEPS
+        if title not in results and all(dep in results for dep, _ in inputs)
+    ]
+
+
 TRIAGE_COLORS = {
     "Emergency": "red",
     "Urgent": "orange",
@@ -363,7 +428,7 @@ def _run_workflow_inner(chief_complaint, symptoms, age, sex, hr, bp, temp, rr, s
             using_demo = True
             results = dict(DEMO_RESULTS)
             # Simulate progress for demo
-            for i, (title, _) in enumerate(STEPS):
+            for i, (title, _, _) in enumerate(STEPS):
                 progress((i + 1) / len(STEPS), desc=f"Step {i + 1}/5: {title}")
                 time.sleep(0.3)
         else:
@@ -384,27 +449,23 @@ def _run_workflow_inner(chief_complaint, symptoms, age, sex, hr, bp, temp, rr, s
                 "",
             )
     else:
-        # LIVE MODE — run actual inference
+        # LIVE MODE — run actual inference, one batched call per DAG level
         results = {}
-        cumulative = context
-
-        for i, (title, prompt) in enumerate(STEPS):
-            progress((i + 1) / len(STEPS), desc=f"Step {i + 1}/5: {title}")
-
-            full_prompt = f"Patient Context:\n{cumulative}\n\nTask:\n{prompt}"
-            response = _generate(full_prompt, max_tokens=512, temperature=0.3)
-            results[title] = response
-
-            if title == "Symptom Analysis":
-                cumulative = context + f"\n\nSymptom Analysis:\n{response}"
-            elif title == "Triage Assessment":
-                triage = _extract_triage(response)
-                cumulative = context + f"\n\nTriage: {triage}\n\nSymptom Analysis:\n{results['Symptom Analysis'][:500]}"
-            elif title == "Differential Diagnosis":
-                dx_summary = response[:300]
-                cumulative = context + f"\n\nDifferential: {dx_summary}"
-            elif title == "Risk Stratification":
-                cumulative = context + f"\n\nTriage: {triage}\n\nRisk Factors:\n{response[:300]}"
+
+        while len(results) < len(STEPS):
+            ready = _ready_steps(results)
+            titles = [title for title, _, _ in ready]
+            progress(len(results) / len(STEPS), desc=f"Steps {len(results) + 1}-{len(results) + len(ready)}/5: {', '.join(titles)}")
+
+            prompts = [
+                f"Patient Context:\n{_step_context(context, inputs, results)}\n\nTask:\n{prompt}"
+                for _, prompt, inputs in ready
+            ]
+            responses = _generate_batch(prompts, max_tokens=512, temperature=0.3)
+            results.update(zip(titles, responses))
+
+        # Present steps in their declared order
+        results = {title: results[title] for title, _, _ in STEPS}
 
     # Extract triage level
     triage = _extract_triage(results["Triage Assessment"])